@@ -1,19 +1,20 @@
 """
 Módulo de procesamiento OCR con soporte asíncrono para archivos grandes
+
+Las librerías pesadas (cv2, pytesseract, pandas, python-docx y los backends
+PDF) se importan al primer uso para no penalizar el arranque del servidor.
 """
 
-import cv2
-import pytesseract
 import os
-import docx
-import PyPDF2
-import pandas as pd
+import importlib.util
+from datetime import datetime
 from pathlib import Path
 import xml.etree.ElementTree as ET
 import json
+import zipfile
 import asyncio
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
-from typing import Dict, Optional
+from typing import Dict, Iterable, Optional, Tuple
 import time
 import logging
 
@@ -22,8 +23,193 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Configuración de procesamiento
-LARGE_FILE_THRESHOLD = 5 * 1024 * 1024  # 5MB - archivos considerados "grandes"
 MAX_WORKERS = 4  # Número máximo de workers para procesamiento paralelo
+PROCESS_WORKERS = 2  # Procesos para extracciones pesadas de CPU
+
+# Umbrales del planificador (segundos estimados de extracción)
+INLINE_COST_THRESHOLD = 0.05  # Por debajo: extractores sin CPU se ejecutan directo, sin executor
+PROCESS_COST_THRESHOLD = 2.0  # Por encima: extractores de CPU van al pool de procesos
+MIN_PAGES_PER_CHUNK = 10  # Páginas mínimas por bloque al paralelizar un PDF
+
+# Backend de extracción de texto PDF: "auto", "pypdfium2", "pdfminer" o "pypdf2"
+PDF_BACKEND = os.getenv("PDF_BACKEND", "auto").lower()
+# Orden de preferencia en modo "auto" (más rápido primero, ver `python benchmarks.py pdf`)
+PDF_BACKEND_PREFERENCE = ['pypdfium2', 'pdfminer', 'pypdf2']
+
+# ===============================
+# BACKENDS DE TEXTO PDF
+# ===============================
+
+class PDFTextBackend:
+    """Interfaz base para los backends de extracción de texto PDF"""
+    
+    name = ''
+    module = ''
+    
+    def is_available(self) -> bool:
+        """Indica si la librería del backend está instalada"""
+        return importlib.util.find_spec(self.module) is not None
+    
+    def open(self, pdf_path: str, page_range: Optional[range] = None) -> Tuple[object, Iterable, Optional[int]]:
+        """
+        Abre el PDF y devuelve (documento, páginas, total de páginas o None)
+        
+        Con page_range solo se recorren esas páginas (índices desde 0).
+        """
+        raise NotImplementedError
+    
+    def count_pages(self, pdf_path: str) -> int:
+        """Cuenta las páginas del PDF"""
+        raise NotImplementedError
+    
+    def page_text(self, page) -> str:
+        """Extrae el texto de una página"""
+        raise NotImplementedError
+    
+    def close(self, document):
+        """Libera los recursos del documento"""
+        pass
+
+
+class PyPDF2Backend(PDFTextBackend):
+    """Backend puro Python con PyPDF2 (el más lento, siempre disponible)"""
+    
+    name = 'pypdf2'
+    module = 'PyPDF2'
+    
+    def open(self, pdf_path, page_range=None):
+        import PyPDF2
+        file = open(pdf_path, 'rb')
+        try:
+            reader = PyPDF2.PdfReader(file)
+            if page_range is None:
+                page_range = range(len(reader.pages))
+        except Exception:
+            # PDF dañado: no se devuelve el documento, así que nadie más lo cerraría
+            file.close()
+            raise
+        return file, (reader.pages[i] for i in page_range), len(page_range)
+    
+    def count_pages(self, pdf_path):
+        import PyPDF2
+        with open(pdf_path, 'rb') as file:
+            return len(PyPDF2.PdfReader(file).pages)
+    
+    def page_text(self, page):
+        return page.extract_text() or ""
+    
+    def close(self, document):
+        document.close()
+
+
+class PdfminerBackend(PDFTextBackend):
+    """Backend con pdfminer.six (mejor orden de lectura, velocidad media)"""
+    
+    name = 'pdfminer'
+    module = 'pdfminer'
+    
+    def open(self, pdf_path, page_range=None):
+        from pdfminer.high_level import extract_pages
+        # extract_pages es perezoso: el total de páginas no se conoce de antemano
+        if page_range is None:
+            return None, extract_pages(pdf_path), None
+        return None, extract_pages(pdf_path, page_numbers=set(page_range)), len(page_range)
+    
+    def count_pages(self, pdf_path):
+        from pdfminer.pdfpage import PDFPage
+        with open(pdf_path, 'rb') as file:
+            return sum(1 for _ in PDFPage.get_pages(file))
+    
+    def page_text(self, page):
+        from pdfminer.layout import LTTextContainer
+        return "".join(
+            element.get_text() for element in page if isinstance(element, LTTextContainer)
+        )
+
+
+class Pypdfium2Backend(PDFTextBackend):
+    """Backend nativo con pypdfium2 (PDFium, el más rápido)"""
+    
+    name = 'pypdfium2'
+    module = 'pypdfium2'
+    
+    def open(self, pdf_path, page_range=None):
+        import pypdfium2 as pdfium
+        pdf = pdfium.PdfDocument(pdf_path)
+        if page_range is None:
+            page_range = range(len(pdf))
+        return pdf, (pdf[i] for i in page_range), len(page_range)
+    
+    def count_pages(self, pdf_path):
+        import pypdfium2 as pdfium
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    
+    def page_text(self, page):
+        textpage = page.get_textpage()
+        try:
+            return textpage.get_text_range().replace("\r\n", "\n")
+        finally:
+            textpage.close()
+            page.close()
+    
+    def close(self, document):
+        document.close()
+
+
+PDF_BACKENDS = {
+    backend.name: backend
+    for backend in (Pypdfium2Backend(), PdfminerBackend(), PyPDF2Backend())
+}
+
+
+def get_pdf_backend(name: Optional[str] = None) -> PDFTextBackend:
+    """
+    Obtiene el backend PDF configurado
+    
+    Con "auto" (o si el backend pedido no está instalado) se usa el primero
+    disponible según PDF_BACKEND_PREFERENCE.
+    """
+    name = (name or PDF_BACKEND).lower()
+    
+    if name != 'auto':
+        backend = PDF_BACKENDS.get(name)
+        if backend is None:
+            raise ValueError(f"Backend PDF desconocido: {name}")
+        if backend.is_available():
+            return backend
+        logger.warning(f"⚠️ Backend PDF '{name}' no instalado, usando selección automática")
+    
+    for candidate in PDF_BACKEND_PREFERENCE:
+        if PDF_BACKENDS[candidate].is_available():
+            return PDF_BACKENDS[candidate]
+    
+    raise RuntimeError("No hay ningún backend PDF instalado (pypdfium2, pdfminer.six o PyPDF2)")
+
+
+# Executors compartidos por todas las conversiones (se crean al primer uso)
+_thread_executor: Optional[ThreadPoolExecutor] = None
+_process_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_thread_executor() -> ThreadPoolExecutor:
+    """Pool de hilos para extracciones de I/O o que liberan el GIL"""
+    global _thread_executor
+    if _thread_executor is None:
+        _thread_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    return _thread_executor
+
+
+def get_process_executor() -> ProcessPoolExecutor:
+    """Pool de procesos para extracciones pesadas de CPU"""
+    global _process_executor
+    if _process_executor is None:
+        _process_executor = ProcessPoolExecutor(max_workers=PROCESS_WORKERS)
+    return _process_executor
+
 
 class DocumentConverter:
     """Módulo de conversión de documentos con soporte asíncrono"""
@@ -31,51 +217,26 @@ class DocumentConverter:
     def __init__(self):
         # Configurar Tesseract si es necesario
         # pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-        
-        # Extensiones soportadas
-        self.image_extensions = {'.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.gif', '.webp'}
-        self.document_extensions = {'.pdf', '.docx', '.doc', '.txt', '.csv', '.xlsx', '.xls', '.json', '.xml', '.odt'}
-        
-        # Executor para procesamiento asíncrono
-        self.thread_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
-        self.process_executor = ProcessPoolExecutor(max_workers=2)
+        pass
+    
+    @property
+    def thread_executor(self) -> ThreadPoolExecutor:
+        return get_thread_executor()
+    
+    @property
+    def process_executor(self) -> ProcessPoolExecutor:
+        return get_process_executor()
     
     def detect_file_type(self, file_path):
         """Detecta el tipo de archivo basado en su extensión"""
-        extension = Path(file_path).suffix.lower()
-        
-        if extension in self.image_extensions:
-            return 'image'
-        elif extension == '.pdf':
-            return 'pdf'
-        elif extension in {'.docx', '.doc'}:
-            return 'word'
-        elif extension == '.txt':
-            return 'text'
-        elif extension in {'.csv'}:
-            return 'csv'
-        elif extension in {'.xlsx', '.xls'}:
-            return 'excel'
-        elif extension == '.json':
-            return 'json'
-        elif extension == '.xml':
-            return 'xml'
-        elif extension == '.odt':
-            return 'odt'
-        else:
-            return 'unknown'
-    
-    def is_large_file(self, file_path: str) -> bool:
-        """Determina si un archivo es grande y necesita procesamiento asíncrono"""
-        try:
-            file_size = os.path.getsize(file_path)
-            return file_size > LARGE_FILE_THRESHOLD
-        except:
-            return False
+        return detect_file_type(file_path)
     
     def extract_text_from_image(self, image_path):
         """Extrae texto de imágenes usando OCR"""
         try:
+            import cv2
+            import pytesseract
+            
             img = cv2.imread(image_path)
             if img is None:
                 raise ValueError(f"No se pudo cargar la imagen: {image_path}")
@@ -103,37 +264,40 @@ class DocumentConverter:
     
     async def extract_text_from_pdf_async(self, pdf_path):
         """Extrae texto de PDFs grandes de forma asíncrona"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            self.thread_executor,
-            self._extract_text_from_pdf_sync,
-            pdf_path
-        )
+        return await extract_text_scheduled(pdf_path, 'pdf')
     
-    def _extract_text_from_pdf_sync(self, pdf_path):
-        """Versión síncrona de extracción de PDF"""
+    def _extract_pdf_pages(self, pdf_path, backend: PDFTextBackend, page_range: Optional[range] = None) -> str:
+        """Extrae el texto crudo de un rango de páginas con marcadores por página"""
+        text = ""
+        document, pages, total_pages = backend.open(pdf_path, page_range)
+        first_page = page_range.start if page_range is not None else 0
+        
         try:
-            text = ""
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                total_pages = len(pdf_reader.pages)
-                
-                logger.info(f"Procesando PDF con {total_pages} páginas...")
-                
-                for page_num, page in enumerate(pdf_reader.pages):
-                    try:
-                        page_text = page.extract_text()
-                        if page_text.strip():
-                            text += f"\n--- Página {page_num + 1} ---\n"
-                            text += page_text + "\n"
-                        
-                        # Log de progreso cada 10 páginas
-                        if (page_num + 1) % 10 == 0:
-                            logger.info(f"Procesadas {page_num + 1}/{total_pages} páginas")
-                            
-                    except Exception as e:
-                        text += f"\n--- Error en página {page_num + 1}: {str(e)} ---\n"
+            logger.info(f"Procesando PDF con {total_pages or '?'} páginas (backend: {backend.name})...")
             
+            for offset, page in enumerate(pages):
+                page_num = first_page + offset
+                try:
+                    page_text = backend.page_text(page)
+                    if page_text.strip():
+                        text += f"\n--- Página {page_num + 1} ---\n"
+                        text += page_text + "\n"
+                    
+                    # Log de progreso cada 10 páginas
+                    if (offset + 1) % 10 == 0:
+                        logger.info(f"Procesadas {offset + 1}/{total_pages or '?'} páginas")
+                        
+                except Exception as e:
+                    text += f"\n--- Error en página {page_num + 1}: {str(e)} ---\n"
+        finally:
+            backend.close(document)
+        
+        return text
+    
+    def _extract_text_from_pdf_sync(self, pdf_path, backend: Optional[PDFTextBackend] = None):
+        """Versión síncrona de extracción de PDF"""
+        try:
+            text = self._extract_pdf_pages(pdf_path, backend or get_pdf_backend())
             text = text.encode('utf-8', errors='ignore').decode('utf-8')
             return text.strip() if text.strip() else "No se pudo extraer texto del PDF"
         except Exception as e:
@@ -146,6 +310,8 @@ class DocumentConverter:
     def extract_text_from_word(self, word_path):
         """Extrae texto de documentos Word (.docx)"""
         try:
+            import docx
+            
             doc = docx.Document(word_path)
             text = ""
             
@@ -167,9 +333,30 @@ class DocumentConverter:
         except Exception as e:
             return f"Error al procesar documento Word: {str(e)}"
     
+    def extract_text_from_odt(self, odt_path):
+        """Extrae texto de documentos OpenDocument (.odt)"""
+        try:
+            with zipfile.ZipFile(odt_path) as odt_file:
+                root = ET.fromstring(odt_file.read('content.xml'))
+            
+            text_ns = '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}'
+            text = ""
+            
+            # Párrafos y encabezados (incluye los que están dentro de tablas)
+            for element in root.iter():
+                if element.tag in (f'{text_ns}p', f'{text_ns}h'):
+                    text += "".join(element.itertext()) + "\n"
+            
+            text = text.encode('utf-8', errors='ignore').decode('utf-8')
+            return text.strip()
+        except Exception as e:
+            return f"Error al procesar documento ODT: {str(e)}"
+    
     def extract_text_from_csv(self, csv_path):
         """Extrae texto de archivos CSV"""
         try:
+            import pandas as pd
+            
             encodings = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']
             df = None
             
@@ -198,6 +385,8 @@ class DocumentConverter:
     def extract_text_from_excel(self, excel_path):
         """Extrae texto de archivos Excel"""
         try:
+            import pandas as pd
+            
             excel_file = pd.ExcelFile(excel_path)
             text = f"Archivo Excel: {os.path.basename(excel_path)}\n"
             text += f"Hojas: {len(excel_file.sheet_names)}\n\n"
@@ -281,16 +470,168 @@ class DocumentConverter:
         except Exception as e:
             return f"Error al procesar archivo de texto: {str(e)}"
 
+# ===============================
+# REGISTRO DE EXTRACTORES
+# ===============================
+
+class Extractor:
+    """
+    Extractor de texto registrado para un tipo de archivo
+    
+    Declara sus capacidades para que el planificador elija dónde ejecutarlo:
+    - cpu_bound: el trabajo es de CPU (candidato al pool de procesos)
+    - streamable: produce el texto de forma incremental (página a página)
+    - page_parallel: puede repartirse por rangos de páginas entre workers
+    - seconds_per_mb: costo estimado de extracción
+    """
+    
+    def __init__(self, file_type: str, extensions: Iterable[str], method: str,
+                 cpu_bound: bool = False, streamable: bool = False,
+                 page_parallel: bool = False, seconds_per_mb: float = 0.1):
+        self.file_type = file_type
+        self.extensions = set(extensions)
+        self.method = method
+        self.cpu_bound = cpu_bound
+        self.streamable = streamable
+        self.page_parallel = page_parallel
+        self.seconds_per_mb = seconds_per_mb
+    
+    def estimate_cost(self, file_size: int) -> float:
+        """Segundos estimados para extraer un archivo de file_size bytes"""
+        return self.seconds_per_mb * file_size / (1024 * 1024)
+    
+    def extract(self, converter: DocumentConverter, file_path: str) -> str:
+        """Ejecuta la extracción en el hilo actual"""
+        return getattr(converter, self.method)(file_path)
+
+
+EXTRACTORS: Dict[str, Extractor] = {}
+EXTRACTORS_BY_EXTENSION: Dict[str, Extractor] = {}
+
+
+def register_extractor(extractor: Extractor):
+    """Registra un extractor para su tipo y extensiones"""
+    EXTRACTORS[extractor.file_type] = extractor
+    for extension in extractor.extensions:
+        EXTRACTORS_BY_EXTENSION[extension] = extractor
+
+
+register_extractor(Extractor('image', {'.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.gif', '.webp'},
+                             'extract_text_from_image', cpu_bound=True, seconds_per_mb=3.0))
+register_extractor(Extractor('pdf', {'.pdf'}, 'extract_text_from_pdf',
+                             cpu_bound=True, streamable=True, page_parallel=True, seconds_per_mb=0.4))
+register_extractor(Extractor('word', {'.docx', '.doc'}, 'extract_text_from_word', seconds_per_mb=0.2))
+register_extractor(Extractor('odt', {'.odt'}, 'extract_text_from_odt', seconds_per_mb=0.2))
+register_extractor(Extractor('text', {'.txt'}, 'extract_text_from_text',
+                             streamable=True, seconds_per_mb=0.005))
+register_extractor(Extractor('csv', {'.csv'}, 'extract_text_from_csv', cpu_bound=True, seconds_per_mb=0.3))
+register_extractor(Extractor('excel', {'.xlsx', '.xls'}, 'extract_text_from_excel',
+                             cpu_bound=True, seconds_per_mb=0.8))
+register_extractor(Extractor('json', {'.json'}, 'extract_text_from_json', seconds_per_mb=0.05))
+register_extractor(Extractor('xml', {'.xml'}, 'extract_text_from_xml', seconds_per_mb=0.1))
+
+
+def detect_file_type(file_path) -> str:
+    """Detecta el tipo de archivo basado en su extensión"""
+    extractor = EXTRACTORS_BY_EXTENSION.get(Path(file_path).suffix.lower())
+    return extractor.file_type if extractor else 'unknown'
+
+# ===============================
+# PLANIFICADOR DE EXTRACCIÓN
+# ===============================
+
+def _run_extractor(file_type: str, file_path: str) -> str:
+    """Punto de entrada de los workers (debe ser picklable para el pool de procesos)"""
+    return EXTRACTORS[file_type].extract(DocumentConverter(), file_path)
+
+
+def _extract_pdf_chunk(pdf_path: str, backend_name: str, start: int, stop: int) -> str:
+    """Extrae un bloque de páginas de un PDF en un worker"""
+    return DocumentConverter()._extract_pdf_pages(pdf_path, get_pdf_backend(backend_name), range(start, stop))
+
+
+async def _extract_pages_parallel(file_path: str) -> str:
+    """Reparte las páginas de un PDF entre los workers del pool de procesos"""
+    loop = asyncio.get_running_loop()
+    
+    try:
+        backend = get_pdf_backend()
+        total_pages = backend.count_pages(file_path)
+        if total_pages == 0:
+            return "No se pudo extraer texto del PDF"
+        chunks = max(1, min(PROCESS_WORKERS, total_pages // MIN_PAGES_PER_CHUNK))
+        chunk_size = -(-total_pages // chunks)
+        
+        logger.info(f"PDF de {total_pages} páginas repartido en {chunks} bloque(s)")
+        
+        parts = await asyncio.gather(*(
+            loop.run_in_executor(
+                get_process_executor(), _extract_pdf_chunk,
+                file_path, backend.name, start, min(start + chunk_size, total_pages)
+            )
+            for start in range(0, total_pages, chunk_size)
+        ))
+        
+        text = "".join(parts).encode('utf-8', errors='ignore').decode('utf-8')
+        return text.strip() if text.strip() else "No se pudo extraer texto del PDF"
+    except Exception as e:
+        return f"Error al procesar PDF: {str(e)}"
+
+
+async def extract_text_scheduled(file_path: str, file_type: str) -> str:
+    """
+    Extrae el texto eligiendo el executor según las capacidades del extractor
+    
+    - Costo estimado bajo y sin trabajo de CPU (p. ej. .txt): directo en el
+      hilo actual (sin overhead de executor)
+    - I/O o costo moderado: pool de hilos
+    - CPU pesado: pool de procesos, repartiendo páginas si el extractor lo permite
+    """
+    extractor = EXTRACTORS[file_type]
+    cost = extractor.estimate_cost(os.path.getsize(file_path))
+    loop = asyncio.get_running_loop()
+    
+    if not extractor.cpu_bound and cost < INLINE_COST_THRESHOLD:
+        logger.info(f"Extracción directa ({file_type}, ~{cost:.2f}s): {file_path}")
+        return extractor.extract(DocumentConverter(), file_path)
+    
+    if not extractor.cpu_bound or cost < PROCESS_COST_THRESHOLD:
+        logger.info(f"Extracción en pool de hilos ({file_type}, ~{cost:.2f}s): {file_path}")
+        return await loop.run_in_executor(get_thread_executor(), _run_extractor, file_type, file_path)
+    
+    if extractor.page_parallel:
+        logger.info(f"Extracción paralela por páginas ({file_type}, ~{cost:.2f}s): {file_path}")
+        return await _extract_pages_parallel(file_path)
+    
+    logger.info(f"Extracción en pool de procesos ({file_type}, ~{cost:.2f}s): {file_path}")
+    return await loop.run_in_executor(get_process_executor(), _run_extractor, file_type, file_path)
+
 # ===============================
 # FUNCIONES PRINCIPALES
 # ===============================
 
+def _default_output_path(file_path) -> str:
+    """Nombre por defecto del .txt de salida"""
+    base_name = Path(file_path).stem
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{base_name}_converted_{timestamp}.txt"
+
+
+def _write_output_file(output_path, file_path, file_type, extracted_text):
+    """Genera el archivo .txt con encabezado de conversión"""
+    with open(output_path, 'w', encoding='utf-8-sig', errors='replace') as f:
+        f.write(f"=== DOCUMENTO CONVERTIDO ===\n")
+        f.write(f"Archivo original: {file_path}\n")
+        f.write(f"Tipo de archivo: {file_type}\n")
+        f.write(f"Fecha de conversión: {datetime.now()}\n")
+        f.write("="*50 + "\n\n")
+        f.write(extracted_text)
+
+
 async def process_file_to_txt_async(file_path, output_path=None):
     """
-    Versión asíncrona para archivos grandes
+    Versión asíncrona: el planificador elige executor según el tipo de archivo
     """
-    converter = DocumentConverter()
-    
     response = {
         'success': False,
         'output_file': None,
@@ -307,7 +648,7 @@ async def process_file_to_txt_async(file_path, output_path=None):
             response['error'] = f"El archivo '{file_path}' no existe"
             return response
         
-        file_type = converter.detect_file_type(file_path)
+        file_type = detect_file_type(file_path)
         response['file_type'] = file_type
         
         if file_type == 'unknown':
@@ -315,35 +656,9 @@ async def process_file_to_txt_async(file_path, output_path=None):
             return response
         
         if output_path is None:
-            base_name = Path(file_path).stem
-            timestamp = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")
-            output_path = f"{base_name}_converted_{timestamp}.txt"
+            output_path = _default_output_path(file_path)
         
-        # Procesar según tipo y tamaño
-        is_large = converter.is_large_file(file_path)
-        logger.info(f"Procesando archivo {'grande' if is_large else 'normal'}: {file_path}")
-        
-        # Procesamiento asíncrono para PDFs grandes
-        if file_type == 'pdf' and is_large:
-            extracted_text = await converter.extract_text_from_pdf_async(file_path)
-        else:
-            # Procesamiento síncrono para el resto
-            if file_type == 'image':
-                extracted_text = converter.extract_text_from_image(file_path)
-            elif file_type == 'pdf':
-                extracted_text = converter.extract_text_from_pdf(file_path)
-            elif file_type == 'word':
-                extracted_text = converter.extract_text_from_word(file_path)
-            elif file_type == 'text':
-                extracted_text = converter.extract_text_from_text(file_path)
-            elif file_type == 'csv':
-                extracted_text = converter.extract_text_from_csv(file_path)
-            elif file_type == 'excel':
-                extracted_text = converter.extract_text_from_excel(file_path)
-            elif file_type == 'json':
-                extracted_text = converter.extract_text_from_json(file_path)
-            elif file_type == 'xml':
-                extracted_text = converter.extract_text_from_xml(file_path)
+        extracted_text = await extract_text_scheduled(file_path, file_type)
         
         if not extracted_text or extracted_text.strip() == "":
             response['error'] = f"No se pudo extraer texto del archivo {file_type}"
@@ -351,14 +666,7 @@ async def process_file_to_txt_async(file_path, output_path=None):
         
         response['extracted_text'] = extracted_text
         
-        # Generar archivo .txt
-        with open(output_path, 'w', encoding='utf-8-sig', errors='replace') as f:
-            f.write(f"=== DOCUMENTO CONVERTIDO ===\n")
-            f.write(f"Archivo original: {file_path}\n")
-            f.write(f"Tipo de archivo: {file_type}\n")
-            f.write(f"Fecha de conversión: {pd.Timestamp.now()}\n")
-            f.write("="*50 + "\n\n")
-            f.write(extracted_text)
+        _write_output_file(output_path, file_path, file_type, extracted_text)
         
         if os.path.exists(output_path):
             response['success'] = True
@@ -376,22 +684,8 @@ async def process_file_to_txt_async(file_path, output_path=None):
 
 def process_file_to_txt(file_path, output_path=None):
     """
-    Versión síncrona mejorada (compatible con el código existente)
+    Versión síncrona (compatible con el código existente)
     """
-    converter = DocumentConverter()
-    
-    # Si el archivo es grande, usar versión asíncrona
-    if converter.is_large_file(file_path):
-        logger.info(f"Archivo grande detectado, usando procesamiento optimizado")
-        # Ejecutar versión asíncrona en un loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            return loop.run_until_complete(process_file_to_txt_async(file_path, output_path))
-        finally:
-            loop.close()
-    
-    # Para archivos pequeños, usar procesamiento normal
     response = {
         'success': False,
         'output_file': None,
@@ -405,7 +699,7 @@ def process_file_to_txt(file_path, output_path=None):
             response['error'] = f"El archivo '{file_path}' no existe"
             return response
         
-        file_type = converter.detect_file_type(file_path)
+        file_type = detect_file_type(file_path)
         response['file_type'] = file_type
         
         if file_type == 'unknown':
@@ -413,29 +707,9 @@ def process_file_to_txt(file_path, output_path=None):
             return response
         
         if output_path is None:
-            base_name = Path(file_path).stem
-            timestamp = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")
-            output_path = f"{base_name}_converted_{timestamp}.txt"
-        
-        # Procesar archivo según su tipo
-        extracted_text = ""
+            output_path = _default_output_path(file_path)
         
-        if file_type == 'image':
-            extracted_text = converter.extract_text_from_image(file_path)
-        elif file_type == 'pdf':
-            extracted_text = converter.extract_text_from_pdf(file_path)
-        elif file_type == 'word':
-            extracted_text = converter.extract_text_from_word(file_path)
-        elif file_type == 'text':
-            extracted_text = converter.extract_text_from_text(file_path)
-        elif file_type == 'csv':
-            extracted_text = converter.extract_text_from_csv(file_path)
-        elif file_type == 'excel':
-            extracted_text = converter.extract_text_from_excel(file_path)
-        elif file_type == 'json':
-            extracted_text = converter.extract_text_from_json(file_path)
-        elif file_type == 'xml':
-            extracted_text = converter.extract_text_from_xml(file_path)
+        extracted_text = EXTRACTORS[file_type].extract(DocumentConverter(), file_path)
         
         if not extracted_text or extracted_text.strip() == "":
             response['error'] = f"No se pudo extraer texto del archivo {file_type}"
@@ -443,14 +717,7 @@ def process_file_to_txt(file_path, output_path=None):
         
         response['extracted_text'] = extracted_text
         
-        # Generar archivo .txt
-        with open(output_path, 'w', encoding='utf-8-sig', errors='replace') as f:
-            f.write(f"=== DOCUMENTO CONVERTIDO ===\n")
-            f.write(f"Archivo original: {file_path}\n")
-            f.write(f"Tipo de archivo: {file_type}\n")
-            f.write(f"Fecha de conversión: {pd.Timestamp.now()}\n")
-            f.write("="*50 + "\n\n")
-            f.write(extracted_text)
+        _write_output_file(output_path, file_path, file_type, extracted_text)
         
         if os.path.exists(output_path):
             response['success'] = True
@@ -467,8 +734,6 @@ def get_text_only(file_path):
     """
     Función que solo retorna el texto extraído (sin generar archivo)
     """
-    converter = DocumentConverter()
-    
     response = {
         'success': False,
         'text': '',
@@ -481,35 +746,45 @@ def get_text_only(file_path):
             response['error'] = f"El archivo '{file_path}' no existe"
             return response
         
-        file_type = converter.detect_file_type(file_path)
+        file_type = detect_file_type(file_path)
         response['file_type'] = file_type
         
         if file_type == 'unknown':
             response['error'] = f"Tipo de archivo no soportado: {Path(file_path).suffix}"
             return response
         
-        # Extraer solo el texto
-        if file_type == 'image':
-            text = converter.extract_text_from_image(file_path)
-        elif file_type == 'pdf':
-            text = converter.extract_text_from_pdf(file_path)
-        elif file_type == 'word':
-            text = converter.extract_text_from_word(file_path)
-        elif file_type == 'text':
-            text = converter.extract_text_from_text(file_path)
-        elif file_type == 'csv':
-            text = converter.extract_text_from_csv(file_path)
-        elif file_type == 'excel':
-            text = converter.extract_text_from_excel(file_path)
-        elif file_type == 'json':
-            text = converter.extract_text_from_json(file_path)
-        elif file_type == 'xml':
-            text = converter.extract_text_from_xml(file_path)
-        else:
-            response['error'] = f"Tipo de archivo no implementado: {file_type}"
+        response['text'] = EXTRACTORS[file_type].extract(DocumentConverter(), file_path)
+        response['success'] = True
+        
+    except Exception as e:
+        response['error'] = f"Error durante extracción: {str(e)}"
+    
+    return response
+
+async def get_text_only_async(file_path):
+    """
+    Versión asíncrona de get_text_only que usa el planificador de extracción
+    """
+    response = {
+        'success': False,
+        'text': '',
+        'file_type': None,
+        'error': None
+    }
+    
+    try:
+        if not os.path.exists(file_path):
+            response['error'] = f"El archivo '{file_path}' no existe"
+            return response
+        
+        file_type = detect_file_type(file_path)
+        response['file_type'] = file_type
+        
+        if file_type == 'unknown':
+            response['error'] = f"Tipo de archivo no soportado: {Path(file_path).suffix}"
             return response
         
-        response['text'] = text
+        response['text'] = await extract_text_scheduled(file_path, file_type)
         response['success'] = True
         
     except Exception as e:
@@ -521,13 +796,11 @@ def check_supported_file(file_path):
     """
     Verifica si un archivo es soportado sin procesarlo
     """
-    converter = DocumentConverter()
-    
     extension = Path(file_path).suffix.lower()
-    file_type = converter.detect_file_type(file_path)
+    file_type = detect_file_type(file_path)
     
     return {
         'supported': file_type != 'unknown',
         'file_type': file_type,
         'extension': extension
-    }
\ No newline at end of file
+    }
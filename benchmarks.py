@@ -0,0 +1,1595 @@
+"""
+Script de benchmarks de rendimiento para ProfeGo
+Uso: python benchmarks.py <comando> [argumentos]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import statistics
+import subprocess
+from collections import Counter
+from pathlib import Path
+
+from proveedores_llm import ProveedorSimulado, RespuestaLLM, plan_representativo
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+# Carpeta con currículos de muestra (PDF) usada si no se pasan rutas
+SAMPLES_DIR = os.getenv("BENCH_SAMPLES_DIR", "muestras")
+
+# Límites para CI: si se configuran, el benchmark de arranque falla al excederlos
+MAX_IMPORT_SECONDS = float(os.getenv("BENCH_MAX_IMPORT_SECONDS", "0") or 0)
+MAX_RSS_MB = float(os.getenv("BENCH_MAX_RSS_MB", "0") or 0)
+
+# Sin biblioteca de actividades: las actividades guardadas por una corrida
+# acortarían las respuestas de la siguiente (bench_biblioteca la activa)
+os.environ.setdefault("BIBLIOTECA_ACTIVIDADES", "0")
+
+# ============================================================================
+# UTILIDADES
+# ============================================================================
+def _palabras(texto: str) -> Counter:
+    """Bolsa de palabras normalizada (sin marcadores de página)"""
+    texto = re.sub(r'--- (Página \d+|Error en página \d+:.*?) ---', ' ', texto)
+    return Counter(re.findall(r'\w+', texto.lower()))
+
+
+def fidelidad_texto(texto: str, referencia: str) -> float:
+    """
+    F1 entre las bolsas de palabras del texto y la referencia (0.0 - 1.0)
+
+    Es insensible al orden de lectura, así que mide cuánto texto se recupera
+    y cuánto ruido se agrega, no la maquetación.
+    """
+    obtenidas = _palabras(texto)
+    esperadas = _palabras(referencia)
+
+    if not obtenidas or not esperadas:
+        return 0.0
+
+    comunes = sum((obtenidas & esperadas).values())
+    precision = comunes / sum(obtenidas.values())
+    recall = comunes / sum(esperadas.values())
+
+    if precision + recall == 0:
+        return 0.0
+    return 2 * precision * recall / (precision + recall)
+
+
+def _rutas_muestra(args, extension: str):
+    """Obtiene las rutas de los argumentos o de la carpeta de muestras"""
+    rutas = [Path(a) for a in args] if args else sorted(Path(SAMPLES_DIR).glob(f"*{extension}"))
+
+    if not rutas:
+        print(f"\n⚠️  No se encontraron archivos {extension} en '{SAMPLES_DIR}'")
+        print(f"💡 Pasa rutas como argumentos o configura BENCH_SAMPLES_DIR")
+
+    return rutas
+
+# ============================================================================
+# BENCHMARK 1: Backends de texto PDF
+# ============================================================================
+def bench_pdf_backends(args=None):
+    """
+    Compara los backends PDF instalados: páginas/seg y fidelidad del texto
+
+    La referencia de fidelidad es un archivo .txt con el mismo nombre del PDF
+    si existe; si no, la salida de pdfminer (o del primer backend disponible).
+    """
+    from PruebaOcr import DocumentConverter, PDF_BACKENDS, PDF_BACKEND_PREFERENCE, logger
+    import logging
+
+    logger.setLevel(logging.WARNING)
+
+    print("\n" + "="*60)
+    print("BENCHMARK: Backends de texto PDF")
+    print("="*60)
+
+    rutas = _rutas_muestra(args, ".pdf")
+    if not rutas:
+        return False
+
+    backends = [PDF_BACKENDS[n] for n in PDF_BACKEND_PREFERENCE if PDF_BACKENDS[n].is_available()]
+    no_instalados = [n for n in PDF_BACKEND_PREFERENCE if not PDF_BACKENDS[n].is_available()]
+    if no_instalados:
+        print(f"\n⚠️  Backends no instalados: {', '.join(no_instalados)}")
+
+    converter = DocumentConverter()
+    totales = {b.name: {'paginas': 0, 'segundos': 0.0, 'fidelidad': []} for b in backends}
+
+    for ruta in rutas:
+        print(f"\n📄 {ruta.name}")
+        salidas = {}
+
+        for backend in backends:
+            inicio = time.perf_counter()
+            texto = converter._extract_text_from_pdf_sync(str(ruta), backend)
+            segundos = time.perf_counter() - inicio
+            paginas = len(re.findall(r'--- (?:Página|Error en página) \d+', texto))
+
+            salidas[backend.name] = texto
+            totales[backend.name]['paginas'] += paginas
+            totales[backend.name]['segundos'] += segundos
+
+        referencia_txt = ruta.with_suffix(".txt")
+        if referencia_txt.exists():
+            referencia = referencia_txt.read_text(encoding='utf-8', errors='ignore')
+            origen = referencia_txt.name
+        else:
+            origen = 'pdfminer' if 'pdfminer' in salidas else backends[0].name
+            referencia = salidas[origen]
+
+        for backend in backends:
+            fidelidad = fidelidad_texto(salidas[backend.name], referencia)
+            totales[backend.name]['fidelidad'].append(fidelidad)
+            print(f"   {backend.name:<10} {len(salidas[backend.name]):>9} chars   "
+                  f"fidelidad {fidelidad:.3f} (ref: {origen})")
+
+    print("\n" + "="*60)
+    print("📊 RESUMEN")
+    print("="*60)
+    print(f"{'Backend':<12}{'Páginas':>10}{'Segundos':>12}{'Págs/seg':>12}{'Fidelidad':>12}")
+
+    for nombre, datos in totales.items():
+        velocidad = datos['paginas'] / datos['segundos'] if datos['segundos'] else 0.0
+        fidelidad = sum(datos['fidelidad']) / len(datos['fidelidad'])
+        print(f"{nombre:<12}{datos['paginas']:>10}{datos['segundos']:>12.2f}"
+              f"{velocidad:>12.1f}{fidelidad:>12.3f}")
+
+    print("\n💡 Configura PDF_BACKEND con el más rápido cuya fidelidad sea aceptable")
+    return True
+
+# ============================================================================
+# BENCHMARK 2: Tiempo de arranque (importación de main.py) y memoria
+# ============================================================================
+def bench_startup(args=None):
+    """
+    Mide el tiempo de importación de main.py y el RSS máximo del proceso
+
+    Cada repetición corre en un proceso nuevo con `python -X importtime`.
+    Con BENCH_MAX_IMPORT_SECONDS / BENCH_MAX_RSS_MB sirve como gate de CI.
+    """
+    repeticiones = int(args[0]) if args else 5
+    directorio = os.path.dirname(os.path.abspath(__file__))
+
+    print("\n" + "="*60)
+    print(f"BENCHMARK: Arranque en frío ({repeticiones} repeticiones)")
+    print("="*60)
+
+    tiempos = []
+    rss_mb = []
+    modulos = {}
+
+    for _ in range(repeticiones):
+        proceso = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c",
+             "import resource, main; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"],
+            cwd=directorio, capture_output=True, text=True
+        )
+
+        if proceso.returncode != 0:
+            print(f"\n❌ Error importando main.py:\n{proceso.stderr[-2000:]}")
+            return False
+
+        # ru_maxrss está en KB en Linux y en bytes en macOS
+        rss = int(proceso.stdout.strip().splitlines()[-1])
+        rss_mb.append(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024)
+
+        for linea in proceso.stderr.splitlines():
+            partes = linea.split("|")
+            if not linea.startswith("import time:") or len(partes) != 3 or "self" in linea:
+                continue
+            propio = int(partes[0].split(":")[1])
+            acumulado = int(partes[1])
+            nombre = partes[2].strip()
+            modulos[nombre] = max(modulos.get(nombre, 0), propio)
+            if nombre == "main":
+                tiempos.append(acumulado / 1_000_000)
+
+    tiempo = statistics.median(tiempos)
+    memoria = statistics.median(rss_mb)
+
+    print("\n🐢 Módulos con mayor tiempo propio de importación:")
+    for nombre, micro in sorted(modulos.items(), key=lambda x: x[1], reverse=True)[:10]:
+        print(f"   {micro / 1000:>8.1f} ms  {nombre}")
+
+    print("\n" + "="*60)
+    print(f"⏱️  Importación de main.py (mediana): {tiempo:.3f} s")
+    print(f"💾 RSS máximo (mediana): {memoria:.1f} MB")
+    print("="*60)
+    print(json.dumps({"import_seconds": round(tiempo, 4), "rss_mb": round(memoria, 1)}))
+
+    exitoso = True
+    if MAX_IMPORT_SECONDS and tiempo > MAX_IMPORT_SECONDS:
+        print(f"\n❌ El arranque excede el límite de {MAX_IMPORT_SECONDS} s")
+        exitoso = False
+    if MAX_RSS_MB and memoria > MAX_RSS_MB:
+        print(f"\n❌ La memoria excede el límite de {MAX_RSS_MB} MB")
+        exitoso = False
+
+    return exitoso
+
+# ============================================================================
+# BENCHMARK 3: Carga - la API sigue respondiendo mientras se generan planes
+# ============================================================================
+PLAN_TEXT_MUESTRA = (
+    "Programa de Educación Preescolar. Campo formativo Lenguajes. "
+    "Aprendizaje esperado: narra historias que le son familiares y "
+    "expresa ideas sobre su entorno. "
+) * 20
+
+PLAN_JSON_MUESTRA = json.dumps({
+    "nombre_plan": "Plan de carga",
+    "campo_formativo_principal": "Lenguajes",
+    "ejes_articuladores_generales": ["Inclusión"],
+    "modulos": [{
+        "numero": 1, "nombre": "Módulo 1", "campo_formativo": "Lenguajes",
+        "ejes_articuladores": ["Inclusión"], "aprendizaje_esperado": "Narra historias",
+        "tiempo_estimado": "1 semana",
+        "actividad_inicio": {"nombre": "Inicio", "descripcion": "...", "duracion": "10 min", "materiales": []},
+        "actividades_desarrollo": [],
+        "actividad_cierre": {"nombre": "Cierre", "descripcion": "...", "duracion": "10 min"}
+    }]
+}, ensure_ascii=False)
+
+
+class _ProveedorBloqueante(ProveedorSimulado):
+    """Proveedor simulado que bloquea el event loop (como la llamada síncrona anterior)"""
+
+    def __init__(self, latencia: float):
+        super().__init__()
+        self.latencia = latencia
+
+    async def generar(self, prompt, **kwargs):
+        time.sleep(self.latencia)
+        return RespuestaLLM(PLAN_JSON_MUESTRA, "STOP")
+
+
+def bench_carga(args=None):
+    """
+    Genera varios planes a la vez y mide la latencia de GET / en paralelo
+
+    Uso: python benchmarks.py carga [planes] [latencia_seg] [bloqueante]
+    Con "bloqueante" el proveedor simulado usa time.sleep para comparar con el
+    comportamiento anterior (llamada síncrona dentro de la corrutina).
+    """
+    import asyncio
+    import logging
+    import httpx
+    import main
+    from gemini_service import plan_generator
+
+    args = args or []
+    planes = int(args[0]) if len(args) > 0 else 4
+    latencia = float(args[1]) if len(args) > 1 else 2.0
+    bloqueante = len(args) > 2 and args[2] == "bloqueante"
+
+    logging.getLogger("gemini_service").setLevel(logging.ERROR)
+    proveedor = _ProveedorBloqueante(latencia) if bloqueante else ProveedorSimulado(
+        primer_token_ms=latencia * 1000, ms_por_token=0, planes_base=[json.loads(PLAN_JSON_MUESTRA)]
+    )
+    for nivel in plan_generator.niveles.values():
+        nivel.proveedor = proveedor
+    # Sin credenciales de GCS cada consulta a la caché persistente se quedaría esperando
+    plan_generator.cache.configurar_almacenamiento(None)
+
+    print("\n" + "="*60)
+    print(f"BENCHMARK: {planes} planes simultáneos, latencia simulada {latencia}s"
+          f"{' (modo bloqueante)' if bloqueante else ''}")
+    print("="*60)
+
+    async def sondear(cliente, hasta):
+        latencias = []
+        while time.perf_counter() < hasta:
+            inicio = time.perf_counter()
+            await cliente.get("/")
+            latencias.append(time.perf_counter() - inicio)
+            await asyncio.sleep(0.05)
+        return latencias
+
+    async def ejecutar():
+        transporte = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench") as cliente:
+            inicio = time.perf_counter()
+            # Textos distintos para que la caché y la coalescencia no los unan
+            generaciones = asyncio.gather(*(
+                plan_generator.generar_plan(f"{PLAN_TEXT_MUESTRA} Grupo {i}.") for i in range(planes)
+            ))
+            latencias = await sondear(cliente, inicio + latencia * 1.5)
+            resultados = await generaciones
+            return latencias, resultados, time.perf_counter() - inicio
+
+    latencias, resultados, total = asyncio.run(ejecutar())
+    exitosos = sum(1 for r in resultados if r.get('success'))
+    latencias.sort()
+
+    print(f"\n✅ Planes generados: {exitosos}/{planes} en {total:.2f} s")
+    print(f"📡 Peticiones a GET / durante la generación: {len(latencias)}")
+    if latencias:
+        p50 = latencias[len(latencias) // 2]
+        p99 = latencias[min(len(latencias) - 1, int(len(latencias) * 0.99))]
+        print(f"   p50: {p50 * 1000:.1f} ms   p99: {p99 * 1000:.1f} ms   máx: {latencias[-1] * 1000:.1f} ms")
+
+    return exitosos == planes
+
+# ============================================================================
+# BENCHMARK 4: Recuperación BM25 - tamaño del prompt frente al texto completo
+# ============================================================================
+# Latencia modelada de Gemini por cada 1,000 tokens de entrada (prefill)
+PREFILL_MS_POR_MIL = float(os.getenv("BENCH_PREFILL_MS_POR_MIL", "40"))
+
+
+def _curriculo_sintetico(paginas_por_seccion: int = 12) -> str:
+    """
+    Programa sintético con preámbulo legal, índice y contenidos de tres grados
+
+    Las páginas de segundo grado llevan la marca [OBJETIVO] para medir cuántas
+    conserva la recuperación.
+    """
+    from recuperacion_curricular import CAMPOS_FORMATIVOS
+
+    paginas = []
+    for i in range(paginas_por_seccion):
+        paginas.append(
+            "ACUERDO número 08/08/23 por el que se establecen los programas de estudio. "
+            "Con fundamento en los artículos 3o. de la Constitución Política y la Ley General "
+            f"de Educación, considerando que el Diario Oficial publicó el decreto {i}. " * 12
+        )
+    paginas.append("ÍNDICE " + " ".join(f"Capítulo {i} ........ {i * 7}" for i in range(1, 60)))
+
+    for grado in ("Primer", "Segundo", "Tercer"):
+        for campo in CAMPOS_FORMATIVOS[:4]:
+            for i in range(paginas_por_seccion // 4):
+                marca = " [OBJETIVO]" if grado == "Segundo" else ""
+                paginas.append(
+                    f"{grado} grado de preescolar. Campo formativo {campo}.{marca} " + (
+                        "Contenido: los niños exploran, narran y juegan. Proceso de desarrollo de "
+                        f"aprendizaje {i}: reconoce, compara y comunica ideas con sus pares. " * 8
+                    )
+                )
+
+    return "".join(f"\n--- Página {n} ---\n{texto}" for n, texto in enumerate(paginas, 1))
+
+
+def bench_recuperacion(args=None):
+    """
+    Compara el prompt con el texto completo contra el de secciones recuperadas
+
+    Uso: python benchmarks.py recuperacion [archivos...]
+    Sin archivos usa los .pdf/.txt de la carpeta de muestras o, si no hay, un
+    programa sintético. La latencia de Gemini se modela con PREFILL_MS_POR_MIL.
+    """
+    import logging
+    from gemini_service import plan_generator
+    from gobernador_cuota import estimar_tokens
+    from recuperacion_curricular import seleccionar_secciones
+    from PruebaOcr import get_text_only
+
+    logging.getLogger("recuperacion_curricular").setLevel(logging.WARNING)
+    presupuesto = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "40000"))
+
+    rutas = [Path(a) for a in args] if args else sorted(
+        p for p in Path(SAMPLES_DIR).glob("*") if p.suffix.lower() in (".pdf", ".txt")
+    )
+    documentos = []
+    for ruta in rutas:
+        resultado = get_text_only(str(ruta))
+        if resultado.get('success') and resultado.get('text'):
+            documentos.append((ruta.name, resultado['text']))
+    if not documentos:
+        print(f"\nℹ️  Sin muestras en '{SAMPLES_DIR}': se usa un programa sintético")
+        documentos.append(("sintetico", _curriculo_sintetico()))
+        presupuesto = min(presupuesto, estimar_tokens(documentos[0][1]) // 3)
+
+    print("\n" + "="*60)
+    print(f"BENCHMARK: recuperación BM25 (presupuesto {presupuesto} tokens)")
+    print("="*60)
+
+    for nombre, texto in documentos:
+        inicio = time.perf_counter()
+        seleccionado, info = seleccionar_secciones(texto, presupuesto)
+        tiempo_recuperacion = time.perf_counter() - inicio
+
+        tokens_completo = estimar_tokens(plan_generator._build_prompt(texto))
+        tokens_recuperado = estimar_tokens(plan_generator._build_prompt(seleccionado))
+        latencia_completo = tokens_completo / 1000 * PREFILL_MS_POR_MIL
+        latencia_recuperado = tokens_recuperado / 1000 * PREFILL_MS_POR_MIL + tiempo_recuperacion * 1000
+
+        print(f"\n📄 {nombre}")
+        print(f"   Prompt completo:    {tokens_completo:>9,} tokens   ~{latencia_completo:,.0f} ms de prefill")
+        print(f"   Prompt recuperado:  {tokens_recuperado:>9,} tokens   ~{latencia_recuperado:,.0f} ms "
+              f"(incluye {tiempo_recuperacion * 1000:.1f} ms de BM25)")
+        if info['aplicada']:
+            print(f"   Secciones: {info['secciones_seleccionadas']}/{info['secciones_totales']}   "
+                  f"reducción: {100 * (1 - tokens_recuperado / tokens_completo):.1f}%")
+
+        if "[OBJETIVO]" in texto:
+            objetivo_total = texto.count("[OBJETIVO]")
+            objetivo_kept = seleccionado.count("[OBJETIVO]")
+            print(f"   Páginas de segundo grado conservadas: {objetivo_kept}/{objetivo_total}")
+
+    return True
+
+# ============================================================================
+# BENCHMARK 5: Esquema de salida compacto vs completo
+# ============================================================================
+# Velocidad de decodificación modelada de Gemini (ms por token de salida)
+DECODE_MS_POR_TOKEN = float(os.getenv("BENCH_DECODE_MS_POR_TOKEN", "5"))
+
+
+def bench_esquema(args=None):
+    """
+    Compara los tokens de salida del esquema completo contra el compacto
+
+    Uso: python benchmarks.py esquema [modulos]
+    La latencia de generación se modela con DECODE_MS_POR_TOKEN; también se
+    verifica que la expansión reproduzca exactamente el plan completo.
+    """
+    from esquema_plan import FORMATO_SALIDA_COMPACTO, FORMATO_SALIDA_COMPLETO, compactar_plan, expandir_plan
+    from gobernador_cuota import estimar_tokens
+
+    modulos = int(args[0]) if args else 6
+    plan = plan_representativo(modulos)
+    compacto = compactar_plan(plan)
+
+    salida_completa = json.dumps(plan, ensure_ascii=False)
+    salida_compacta = json.dumps(compacto, ensure_ascii=False)
+    tokens_completo = estimar_tokens(salida_completa)
+    tokens_compacto = estimar_tokens(salida_compacta)
+
+    inicio = time.perf_counter()
+    expandido = expandir_plan(json.loads(salida_compacta))
+    tiempo_expansion = (time.perf_counter() - inicio) * 1000
+
+    print("\n" + "="*60)
+    print(f"BENCHMARK: esquema de salida ({modulos} módulos)")
+    print("="*60)
+    print(f"\n   {'Esquema':<10} {'Caracteres':>11} {'Tokens':>8} {'Generación (modelo)':>21}")
+    for nombre, texto, tokens in (("completo", salida_completa, tokens_completo),
+                                  ("compacto", salida_compacta, tokens_compacto)):
+        print(f"   {nombre:<10} {len(texto):>11,} {tokens:>8,} {tokens * DECODE_MS_POR_TOKEN / 1000:>19.1f} s")
+
+    print(f"\n   Ahorro de salida: {100 * (1 - tokens_compacto / tokens_completo):.1f}% "
+          f"({tokens_completo - tokens_compacto:,} tokens)")
+    print(f"   Instrucciones de formato en el prompt: {estimar_tokens(FORMATO_SALIDA_COMPLETO):,} → "
+          f"{estimar_tokens(FORMATO_SALIDA_COMPACTO):,} tokens")
+    print(f"   Expansión a la estructura completa: {tiempo_expansion:.2f} ms")
+
+    exacto = expandido == plan
+    print(f"   Expansión idéntica al plan completo: {'✅' if exacto else '❌'}")
+    return exacto
+
+# ============================================================================
+# BENCHMARK 6: Validación del plan contra el esquema
+# ============================================================================
+# Carpeta con respuestas de Gemini grabadas (JSON crudo, una por archivo)
+RESPUESTAS_DIR = os.getenv("BENCH_RESPUESTAS_DIR", os.path.join(SAMPLES_DIR, "respuestas"))
+
+
+def _respuestas_grabadas() -> list:
+    """
+    Respuestas grabadas de Gemini como (nombre, texto)
+
+    Sin grabaciones se generan respuestas representativas: planes de 3, 6 y 9
+    módulos y uno incompleto (campos faltantes, tipos y valores incorrectos).
+    """
+    rutas = sorted(Path(RESPUESTAS_DIR).glob("*.json"))
+    if rutas:
+        return [(ruta.name, ruta.read_text(encoding="utf-8")) for ruta in rutas]
+
+    respuestas = [
+        (f"plan_{n}_modulos", json.dumps(plan_representativo(n), ensure_ascii=False, indent=2))
+        for n in (3, 6, 9)
+    ]
+    incompleto = plan_representativo(6)
+    for modulo in incompleto["modulos"]:
+        del modulo["consejos_maestra"]
+        modulo["ejes_articuladores"] = []
+        modulo["actividades_desarrollo"] = modulo["actividades_desarrollo"][:1]
+    incompleto["modulos"][0]["actividad_inicio"] = "Juego libre"
+    incompleto["recursos_educativos"]["cuentos_recomendados"] = [{"titulo": "Cuento", "tipo": "REAL"}]
+    del incompleto["vinculacion_curricular"]
+    respuestas.append(("plan_incompleto", json.dumps(incompleto, ensure_ascii=False, indent=2)))
+    return respuestas
+
+
+def bench_validacion(args=None):
+    """
+    Mide el validador precompilado sobre respuestas grabadas
+
+    Uso: python benchmarks.py validacion [repeticiones]
+    """
+    from esquema_plan import validar_plan
+
+    repeticiones = int(args[0]) if args else 2000
+
+    print("\n" + "="*60)
+    print(f"BENCHMARK: validación del plan ({repeticiones} repeticiones)")
+    print("="*60)
+    print(f"\n   {'Respuesta':<28} {'µs/plan':>9} {'Errores':>8} {'Advert.':>8}")
+
+    for nombre, texto in _respuestas_grabadas():
+        try:
+            plan = json.loads(texto)
+        except json.JSONDecodeError:
+            print(f"   {nombre:<28} {'(JSON inválido)':>9}")
+            continue
+
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            resultado = validar_plan(plan)
+        micros = (time.perf_counter() - inicio) / repeticiones * 1e6
+
+        print(f"   {nombre:<28} {micros:>9.1f} {resultado['total_errores']:>8} {resultado['total_advertencias']:>8}")
+        for hallazgo in resultado['hallazgos'][:3]:
+            print(f"      · [{hallazgo['nivel']}] {hallazgo['mensaje']}")
+
+    return True
+
+# ============================================================================
+# BENCHMARK 7: Lectura tolerante del JSON de Gemini
+# ============================================================================
+def _cadena_regex(texto: str) -> str:
+    """Limpieza anterior (_clean_json_response): seis re.sub sobre la respuesta completa"""
+    texto = texto.strip()
+    if texto.startswith("```"):
+        lineas = texto.split('\n')
+        if lineas[0].startswith("```"):
+            lineas = lineas[1:]
+        if lineas and lineas[-1].strip() == "```":
+            lineas = lineas[:-1]
+        texto = '\n'.join(lineas)
+    texto = texto.strip()
+    inicio, fin = texto.find('{'), texto.rfind('}')
+    if inicio != -1 and fin != -1:
+        texto = texto[inicio:fin + 1]
+    texto = re.sub(r',(\s*[}\]])', r'\1', texto)
+    texto = re.sub(r'"\s*\n\s*"', '",\n"', texto)
+    texto = re.sub(r'}\s*\n\s*{', '},\n{', texto)
+    texto = re.sub(r']\s*\n\s*\[', '],\n[', texto)
+    def unir_lineas(m):
+        contenido = re.sub(r'\s+', ' ', m.group(1) + ' ' + m.group(2))
+        return f': "{contenido}"'
+    texto = re.sub(r':\s*"([^"]*?)\n([^"]*?)"', unir_lineas, texto, flags=re.DOTALL)
+    return re.sub(r'\n\s*\n', '\n', texto)
+
+
+def _mutaciones():
+    """Defectos observados en respuestas de Gemini, como funciones texto -> texto"""
+    def salto_en_string(texto, azar):
+        # Un salto de línea real en el espacio de algunas descripciones
+        partes = texto.split('"descripcion": "')
+        for k in range(1, len(partes)):
+            if azar.random() < 0.5:
+                partes[k] = partes[k].replace(" ", "\n", 1)
+        return '"descripcion": "'.join(partes)
+
+    def coma_final(texto, azar):
+        return re.sub(r'("|\d|\]|\})(\n\s*[}\]])', lambda m: m.group(1) + "," + m.group(2)
+                      if azar.random() < 0.3 else m.group(0), texto)
+
+    def coma_faltante(texto, azar):
+        return re.sub(r'(["\d\]}]),\n', lambda m: m.group(1) + "\n" if azar.random() < 0.2 else m.group(0), texto)
+
+    def markdown(texto, azar):
+        return f"Aquí está el plan solicitado:\n```json\n{texto}\n```\n"
+
+    def comilla_interna(texto, azar):
+        return texto.replace("La caja misteriosa", 'La caja "misteriosa"', 1)
+
+    def strings_con_signos(texto, azar):
+        # JSON válido cuyos textos contienen secuencias que la cadena regex reescribe
+        return texto.replace(
+            "Prepare los objetos con anticipación",
+            'Prepare \\"objetos\\" [arena, agua, ] y {tierra, }\\n con anticipación', 1
+        )
+
+    def truncado(texto, azar):
+        return texto[:int(len(texto) * azar.uniform(0.6, 0.98))]
+
+    return {
+        "salto_en_string": salto_en_string,
+        "coma_final": coma_final,
+        "coma_faltante": coma_faltante,
+        "markdown": markdown,
+        "comilla_interna": comilla_interna,
+        "strings_con_signos": strings_con_signos,
+        "truncado": truncado,
+    }
+
+
+def _normalizar_espacios(valor):
+    """Compara textos sin distinguir saltos de línea de espacios (la cadena regex los une)"""
+    if isinstance(valor, str):
+        return " ".join(valor.split())
+    if isinstance(valor, list):
+        return [_normalizar_espacios(v) for v in valor]
+    if isinstance(valor, dict):
+        return {k: _normalizar_espacios(v) for k, v in valor.items()}
+    return valor
+
+
+def bench_json(args=None):
+    """
+    Compara la lectura tolerante (json_lenient) con la cadena de regex anterior
+
+    Uso: python benchmarks.py json [muestras_fuzz]
+    Aplica defectos típicos (solos y combinados al azar, semilla fija) a las
+    respuestas grabadas y mide cuántas se leen bien y cuánto tarda cada una.
+    """
+    import random
+    from json_lenient import cargar_json
+
+    muestras_fuzz = int(args[0]) if args else 300
+    mutaciones = _mutaciones()
+    respuestas = [(n, t) for n, t in _respuestas_grabadas() if n != "plan_incompleto"]
+
+    def leer_regex(texto):
+        return json.loads(_cadena_regex(texto))
+
+    def leer_lenient(texto):
+        return cargar_json(texto)[0]
+
+    lectores = (("regex", leer_regex), ("lenient", leer_lenient))
+
+    def evaluar(texto, esperado):
+        """Por lector: 'ok' (igual al original), 'distinto' (parsea pero alterado) o 'falla'"""
+        resultado = {}
+        for nombre, leer in lectores:
+            try:
+                obtenido = leer(texto)
+            except (json.JSONDecodeError, ValueError):
+                resultado[nombre] = "falla"
+                continue
+            if esperado is None or _normalizar_espacios(obtenido) == _normalizar_espacios(esperado):
+                resultado[nombre] = "ok"
+            else:
+                resultado[nombre] = "distinto"
+        return resultado
+
+    print("\n" + "="*60)
+    print("BENCHMARK: lectura tolerante del JSON de Gemini")
+    print("="*60)
+
+    # 1) Cada defecto por separado
+    print(f"\n   {'Defecto':<22} {'regex':>10} {'lenient':>10}")
+    azar = random.Random(7)
+    for nombre_mutacion, mutar in mutaciones.items():
+        conteo = {"regex": Counter(), "lenient": Counter()}
+        for _, texto in respuestas:
+            esperado = json.loads(texto)
+            if nombre_mutacion == "strings_con_signos":
+                esperado = json.loads(mutar(texto, azar))
+            elif nombre_mutacion == "comilla_interna":
+                esperado = json.loads(texto.replace("La caja misteriosa", 'La caja \\"misteriosa\\"', 1))
+            elif nombre_mutacion == "truncado":
+                esperado = None
+            for lector, veredicto in evaluar(mutar(texto, azar), esperado).items():
+                conteo[lector][veredicto] += 1
+        total = len(respuestas)
+        print(f"   {nombre_mutacion:<22} {conteo['regex']['ok']:>5}/{total:<4} {conteo['lenient']['ok']:>5}/{total:<4}")
+
+    # 2) Fuzz: combinaciones al azar de defectos recuperables
+    recuperables = [m for m in mutaciones if m not in ("truncado", "strings_con_signos", "comilla_interna")]
+    conteo = {"regex": Counter(), "lenient": Counter()}
+    azar = random.Random(42)
+    for _ in range(muestras_fuzz):
+        _, texto = azar.choice(respuestas)
+        esperado = json.loads(texto)
+        for nombre_mutacion in azar.sample(recuperables, azar.randint(1, len(recuperables))):
+            texto = mutaciones[nombre_mutacion](texto, azar)
+        for lector, veredicto in evaluar(texto, esperado).items():
+            conteo[lector][veredicto] += 1
+    print(f"\n   Fuzz ({muestras_fuzz} respuestas con defectos combinados):")
+    for lector in ("regex", "lenient"):
+        c = conteo[lector]
+        print(f"   {lector:<8} correctas {c['ok']:>4}   alteradas {c['distinto']:>4}   fallidas {c['falla']:>4}")
+
+    # 3) Tiempo en respuestas grandes (~60 KB), válidas y con defectos
+    _, base = max(respuestas, key=lambda r: len(r[1]))
+    plan = json.loads(base)
+    while len(json.dumps(plan, ensure_ascii=False, indent=2)) < 60_000:
+        plan["modulos"] += plan["modulos"][:3]
+    grande = json.dumps(plan, ensure_ascii=False, indent=2)
+    azar = random.Random(3)
+    casos = {
+        "válida": grande,
+        "saltos en strings": mutaciones["salto_en_string"](grande, azar),
+        "comas final/faltante": mutaciones["coma_faltante"](mutaciones["coma_final"](grande, azar), azar),
+        "truncada": grande[:len(grande) * 9 // 10],
+    }
+    print(f"\n   {'Respuesta ' + str(len(grande) // 1024) + ' KB':<24} {'regex ms':>10} {'lenient ms':>11}")
+    for nombre_caso, texto in casos.items():
+        tiempos = {}
+        for lector, leer in lectores:
+            inicio = time.perf_counter()
+            repeticiones = 5
+            for _ in range(repeticiones):
+                try:
+                    leer(texto)
+                except (json.JSONDecodeError, ValueError):
+                    pass
+            tiempos[lector] = (time.perf_counter() - inicio) / repeticiones * 1000
+        print(f"   {nombre_caso:<24} {tiempos['regex']:>10.2f} {tiempos['lenient']:>11.2f}")
+
+    # 4) Patrón 5 de la cadena regex en un string sin cerrar con muchas líneas
+    #    (respuesta cortada a media descripción): retroceso cuadrático
+    for lineas in (1000, 2000, 4000):
+        patologico = '{"a": "' + "linea: texto\n" * lineas
+        tiempos = {}
+        for lector, leer in lectores:
+            inicio = time.perf_counter()
+            try:
+                leer(patologico)
+            except (json.JSONDecodeError, ValueError):
+                pass
+            tiempos[lector] = (time.perf_counter() - inicio) * 1000
+        print(f"   {'string sin cerrar ' + str(len(patologico) // 1024) + ' KB':<24} "
+              f"{tiempos['regex']:>10.2f} {tiempos['lenient']:>11.2f}")
+
+    return True
+
+# ============================================================================
+# BENCHMARK 8: Generación en dos fases (esqueleto + módulos concurrentes)
+# ============================================================================
+# Tiempo hasta el primer token modelado para cada llamada a Gemini
+PRIMER_TOKEN_MS = float(os.getenv("BENCH_PRIMER_TOKEN_MS", "1500"))
+
+
+def bench_dos_fases(args=None):
+    """
+    Compara el tiempo de un plan generado en una llamada contra dos fases
+
+    Uso: python benchmarks.py dos_fases [modulos] [escala]
+    Los tiempos se reportan en la escala del modelo (segundos reales de Gemini
+    modelados con PRIMER_TOKEN_MS y DECODE_MS_POR_TOKEN).
+    """
+    import asyncio
+    import logging
+    import gemini_service
+    from gemini_service import plan_generator
+
+    args = args or []
+    modulos = int(args[0]) if len(args) > 0 else 6
+    escala = float(args[1]) if len(args) > 1 else 0.05
+
+    logging.getLogger("gemini_service").setLevel(logging.ERROR)
+    plan_generator.cache.configurar_almacenamiento(None)
+    proveedor = ProveedorSimulado(
+        primer_token_ms=PRIMER_TOKEN_MS, ms_por_token=DECODE_MS_POR_TOKEN, escala=escala,
+        planes_base=[plan_representativo(modulos)]
+    )
+    for nivel in plan_generator.niveles.values():
+        nivel.proveedor = proveedor
+
+    print("\n" + "="*60)
+    print(f"BENCHMARK: plan de {modulos} módulos, una llamada vs dos fases "
+          f"(concurrencia {gemini_service.GEMINI_MAX_CONCURRENCY})")
+    print("="*60)
+
+    exitoso = True
+    for nombre, dos_fases in (("una llamada", False), ("dos fases", True)):
+        gemini_service.GEMINI_TWO_PHASE = dos_fases
+        proveedor.llamadas = 0
+        inicio = time.perf_counter()
+        resultado = asyncio.run(plan_generator.generar_plan(PLAN_TEXT_MUESTRA, forzar_regeneracion=True))
+        total = (time.perf_counter() - inicio) / escala
+        exitoso = exitoso and resultado.get('success') and len(resultado['plan']['modulos']) == modulos
+        print(f"   {nombre:<12} {total:>6.1f} s   llamadas: {proveedor.llamadas}   "
+              f"módulos: {len(resultado.get('plan', {}).get('modulos', []))}")
+
+    modulo = json.dumps(plan_representativo(modulos)["modulos"][0], ensure_ascii=False)
+    from gobernador_cuota import estimar_tokens
+    un_modulo = (PRIMER_TOKEN_MS + estimar_tokens(modulo) * DECODE_MS_POR_TOKEN) / 1000
+    print(f"\n   Referencia: generar un solo módulo ≈ {un_modulo:.1f} s")
+    return exitoso
+
+# ============================================================================
+# BENCHMARK 9: Rendimiento de /api/plans/generate sin red (proveedor simulado)
+# ============================================================================
+class _AlmacenamientoMemoria:
+    """Sustituto en memoria de GCSStorageManagerV2 con lo que usa la generación de planes"""
+
+    def __init__(self):
+        self.archivos = {}
+        self.cache = {}
+
+    def subir_archivo_desde_bytes(self, contenido, email, nombre_archivo, es_procesado=False):
+        ruta = f"{email}/{'processed' if es_procesado else 'uploads'}/{nombre_archivo}"
+        self.archivos[ruta] = contenido
+        return {'success': True, 'filename': nombre_archivo, 'path': ruta, 'size': len(contenido)}
+
+    def leer_cache(self, nombre_cache, clave):
+        return self.cache.get((nombre_cache, clave))
+
+    def guardar_cache(self, nombre_cache, clave, contenido):
+        self.cache[(nombre_cache, clave)] = contenido
+        return True
+
+
+def bench_rendimiento(args=None):
+    """
+    Planes por minuto de POST /api/plans/generate de punta a punta, sin red
+
+    Uso: python benchmarks.py rendimiento [planes] [escala] [truncar] [errores]
+    Gemini se sustituye por ProveedorSimulado (respuestas de RESPUESTAS_DIR o
+    el plan representativo) y GCS por un almacenamiento en memoria; todo lo
+    demás (extracción, compactación, recuperación, cuota, reintentos, parseo y
+    validación) es el código real. `truncar` y `errores` son las fracciones de
+    respuestas cortadas y de llamadas fallidas. Los tiempos se reportan en la
+    escala del modelo; la cuota sigue GEMINI_RPM/GEMINI_TPM.
+    """
+    import asyncio
+    import logging
+    import httpx
+    import main
+    from gemini_service import GEMINI_MAX_CONCURRENCY, GEMINI_RPM, plan_generator
+
+    args = args or []
+    planes = int(args[0]) if len(args) > 0 else 8
+    escala = float(args[1]) if len(args) > 1 else 0.1
+    truncar = float(args[2]) if len(args) > 2 else 0.0
+    errores = float(args[3]) if len(args) > 3 else 0.0
+
+    for nombre in ("main", "gemini_service", "resiliencia", "proveedores_llm", "PruebaOcr"):
+        logging.getLogger(nombre).setLevel(logging.ERROR)
+    main.limiter.enabled = False
+    main.gcs_storage = _AlmacenamientoMemoria()
+    main.app.dependency_overrides[main.get_current_user] = lambda: {"email": "bench@profego.mx"}
+    plan_generator.cache.configurar_almacenamiento(None)
+    proveedor = ProveedorSimulado(RESPUESTAS_DIR, escala=escala, truncar=truncar, errores=errores)
+    for nivel in plan_generator.niveles.values():
+        nivel.proveedor = proveedor
+        # Las esperas entre reintentos y por cuota también van en la escala del modelo
+        nivel.resiliencia.backoff_base *= escala
+        nivel.resiliencia.backoff_maximo *= escala
+        nivel.gobernador.espera_maxima *= escala
+        for cubeta in (nivel.gobernador.solicitudes, nivel.gobernador.tokens):
+            cubeta.por_segundo /= escala
+
+    print("\n" + "="*60)
+    print(f"BENCHMARK: {planes} solicitudes a /api/plans/generate (proveedor simulado, "
+          f"truncar {truncar:.0%}, errores {errores:.0%})")
+    print(f"   Concurrencia Gemini: {GEMINI_MAX_CONCURRENCY}   RPM: {GEMINI_RPM}")
+    print("="*60)
+
+    async def ejecutar():
+        transporte = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=None) as cliente:
+            async def solicitud(i):
+                inicio = time.perf_counter()
+                # Textos distintos para que la caché y la coalescencia no los unan
+                contenido = f"{PLAN_TEXT_MUESTRA} Grupo {i}.".encode("utf-8")
+                respuesta = await cliente.post(
+                    "/api/plans/generate", files={"plan_file": (f"plan_{i}.txt", contenido, "text/plain")}
+                )
+                return respuesta.status_code, time.perf_counter() - inicio
+
+            inicio = time.perf_counter()
+            resultados = await asyncio.gather(*(solicitud(i) for i in range(planes)))
+            return resultados, time.perf_counter() - inicio
+
+    resultados, total = asyncio.run(ejecutar())
+    latencias = sorted(t / escala for _, t in resultados)
+    codigos = Counter(codigo for codigo, _ in resultados)
+    exitosos = codigos.get(200, 0)
+    total_modelo = total / escala
+
+    print(f"\n✅ Planes generados: {exitosos}/{planes} en {total_modelo:.1f} s "
+          f"({exitosos / total_modelo * 60:.1f} planes/min)")
+    print(f"   Códigos HTTP: {dict(codigos)}")
+    p50 = latencias[len(latencias) // 2]
+    p99 = latencias[min(len(latencias) - 1, int(len(latencias) * 0.99))]
+    print(f"   Latencia p50: {p50:.1f} s   p99: {p99:.1f} s   máx: {latencias[-1]:.1f} s")
+    print(f"   Proveedor: {proveedor.estado()}")
+    for nivel in plan_generator.niveles.values():
+        print(f"   Nivel {nivel.nombre} ({nivel.modelo}): {nivel.llamadas} llamadas   "
+              f"reintentos: {nivel.resiliencia.estado()['reintentos']}   "
+              f"espera por cuota (promedio): {nivel.gobernador.estado()['espera_promedio_s'] / escala:.1f} s")
+
+    return exitosos == planes
+
+# ============================================================================
+# BENCHMARK 10: Enrutamiento por tamaño entre el modelo rápido y el completo
+# ============================================================================
+# Latencias del nivel rápido (flash-lite responde antes y decodifica más rápido)
+PRIMER_TOKEN_MS_RAPIDO = float(os.getenv("BENCH_PRIMER_TOKEN_MS_RAPIDO", "600"))
+DECODE_MS_POR_TOKEN_RAPIDO = float(os.getenv("BENCH_DECODE_MS_POR_TOKEN_RAPIDO", "2"))
+
+
+def bench_enrutamiento(args=None):
+    """
+    Qué nivel atiende entradas chicas y grandes, y el respaldo cuando un nivel falla
+
+    Uso: python benchmarks.py enrutamiento [escala]
+    Cada nivel usa su propio ProveedorSimulado con latencias distintas; los
+    tiempos se reportan en la escala del modelo.
+    """
+    import asyncio
+    import logging
+    import gemini_service
+    from gemini_service import NIVEL_COMPLETO, NIVEL_RAPIDO, plan_generator
+
+    args = args or []
+    escala = float(args[0]) if len(args) > 0 else 0.05
+
+    for nombre in ("gemini_service", "resiliencia", "recuperacion_curricular"):
+        logging.getLogger(nombre).setLevel(logging.ERROR)
+    plan_generator.cache.configurar_almacenamiento(None)
+    if NIVEL_RAPIDO not in plan_generator.niveles:
+        print("❌ El nivel rápido está desactivado (GEMINI_FAST_MODEL vacío)")
+        return False
+    rapido = plan_generator.niveles[NIVEL_RAPIDO]
+    completo = plan_generator.niveles[NIVEL_COMPLETO]
+    for nivel in (rapido, completo):
+        nivel.resiliencia.backoff_base *= escala
+        nivel.resiliencia.backoff_maximo *= escala
+
+    def proveedores(errores_completo=0.0):
+        base = [plan_representativo()]
+        rapido.proveedor = ProveedorSimulado(
+            primer_token_ms=PRIMER_TOKEN_MS_RAPIDO, ms_por_token=DECODE_MS_POR_TOKEN_RAPIDO,
+            escala=escala, planes_base=base
+        )
+        completo.proveedor = ProveedorSimulado(
+            primer_token_ms=PRIMER_TOKEN_MS, ms_por_token=DECODE_MS_POR_TOKEN,
+            escala=escala, errores=errores_completo, planes_base=base
+        )
+
+    chico = PLAN_TEXT_MUESTRA
+    # Un programa largo: el prompt supera GEMINI_FAST_MAX_INPUT_TOKENS aun tras la recuperación
+    grande = "\n\n".join(f"{PLAN_TEXT_MUESTRA} Unidad {i}." for i in range(200))
+    escenarios = [
+        ("entrada chica", chico, 0.0, True),
+        ("entrada chica, solo completo", chico, 0.0, False),
+        ("entrada grande", grande, 0.0, True),
+        ("grande, completo caído", grande, 1.0, True),
+    ]
+
+    print("\n" + "="*60)
+    print(f"BENCHMARK: enrutamiento {rapido.modelo} / {completo.modelo} "
+          f"(límite {gemini_service.GEMINI_FAST_MAX_INPUT_TOKENS:,} tokens de entrada)")
+    print("="*60)
+    print(f"   {'Escenario':<30} {'Tiempo':>8} {'Nivel':>9} {'max_output':>11} {'Respaldos':>10}")
+
+    exitoso = True
+    for nombre, texto, errores_completo, con_rapido in escenarios:
+        proveedores(errores_completo)
+        if not con_rapido:
+            del plan_generator.niveles[NIVEL_RAPIDO]
+        tokens_salida = []
+        original = plan_generator._config_llamada
+
+        def config_registrada(modulos, generation_config):
+            config = original(modulos, generation_config)
+            tokens_salida.append(config.get('max_output_tokens'))
+            return config
+
+        plan_generator._config_llamada = config_registrada
+        try:
+            inicio = time.perf_counter()
+            resultado = asyncio.run(plan_generator.generar_plan(texto, forzar_regeneracion=True))
+            total = (time.perf_counter() - inicio) / escala
+        finally:
+            plan_generator._config_llamada = original
+            plan_generator.niveles[NIVEL_RAPIDO] = rapido
+        exitoso = exitoso and resultado.get('success')
+        plan = resultado.get('plan', {})
+        print(f"   {nombre:<30} {total:>7.1f}s {plan.get('nivel_modelo', 'error'):>9} "
+              f"{tokens_salida[-1] if tokens_salida else '-':>11} "
+              f"{(resultado.get('enrutamiento') or {}).get('respaldos', 0):>10}")
+
+    return exitoso
+
+# ============================================================================
+# BENCHMARK 11: Caché de contexto de las instrucciones fijas del prompt
+# ============================================================================
+# Gemini 2.5 factura los tokens leídos de la caché al 25% del precio normal
+FACTOR_FACTURACION_CACHE = 0.25
+
+
+def bench_cache_contexto(args=None):
+    """
+    Tiempo al primer token y tokens de entrada facturados con y sin caché de contexto
+
+    Uso: python benchmarks.py cache_contexto [llamadas] [escala]
+    Usa ProveedorSimulado (el primer token se adelanta ms_por_token_entrada
+    por token cacheado). La última corrida usa un TTL corto para mostrar que
+    la caché se vuelve a crear al vencer.
+    """
+    import asyncio
+    import logging
+    from gemini_service import NIVEL_COMPLETO, plan_generator
+    from gobernador_cuota import GobernadorCuota, estimar_tokens
+
+    args = args or []
+    llamadas = int(args[0]) if len(args) > 0 else 6
+    escala = float(args[1]) if len(args) > 1 else 0.05
+
+    for nombre in ("gemini_service", "proveedores_llm"):
+        logging.getLogger(nombre).setLevel(logging.ERROR)
+    instrucciones = plan_generator.instrucciones_fijas()
+    prompts = [plan_generator._build_prompt(f"{PLAN_TEXT_MUESTRA} Grupo {i}.") for i in range(llamadas)]
+    nivel = plan_generator.niveles[NIVEL_COMPLETO]
+    # Todas las llamadas al mismo nivel para comparar con la misma latencia
+    niveles = plan_generator.niveles
+    plan_generator.niveles = {NIVEL_COMPLETO: nivel}
+
+    print("\n" + "="*60)
+    print(f"BENCHMARK: caché de contexto ({llamadas} llamadas, instrucciones de "
+          f"~{estimar_tokens(instrucciones):,} tokens, prompt de ~{estimar_tokens(prompts[0]):,})")
+    print("="*60)
+    print(f"   {'Modo':<22} {'1er token':>10} {'Entrada':>9} {'Cacheados':>10} {'Facturados':>11} {'Cachés':>7}")
+
+    async def medir(proveedor, pausa_a_la_mitad=0.0):
+        primeros = []
+        for i, prompt in enumerate(prompts):
+            if pausa_a_la_mitad and i == len(prompts) // 2:
+                await asyncio.sleep(pausa_a_la_mitad)
+            inicio = time.perf_counter()
+            fragmentos = plan_generator._generar_contenido_stream(prompt)
+            await fragmentos.__anext__()
+            primeros.append((time.perf_counter() - inicio) / escala)
+            # Cerrarlo libera el turno de concurrencia
+            await fragmentos.aclose()
+        return primeros
+
+    exitoso = True
+    ttl_corto = 2.0
+    entrada = sum(estimar_tokens(p) for p in prompts)
+    try:
+        for modo, ttl in (("sin caché", None), ("con caché", 3600.0), (f"TTL {ttl_corto:.0f}s real", ttl_corto)):
+            proveedor = ProveedorSimulado(
+                primer_token_ms=PRIMER_TOKEN_MS, ms_por_token=DECODE_MS_POR_TOKEN, escala=escala
+            )
+            if ttl:
+                proveedor.usar_instrucciones_fijas(instrucciones, ttl)
+            nivel.proveedor = proveedor
+            # Sin límite de cuota: solo interesa la latencia del modelo
+            nivel.gobernador = GobernadorCuota(rpm=10**6, tpm=10**9, espera_maxima=0, fila_maxima=llamadas)
+            # Con el TTL corto, la pausa a la mitad deja vencer la caché
+            primeros = asyncio.run(medir(proveedor, ttl * 1.1 if ttl == ttl_corto else 0.0))
+            cache = proveedor.cache_contexto
+            cacheados = cache.tokens_cacheados if cache else 0
+            facturados = entrada - cacheados * (1 - FACTOR_FACTURACION_CACHE)
+            print(f"   {modo:<22} {statistics.mean(primeros):>9.2f}s {entrada:>9,} {cacheados:>10,} "
+                  f"{facturados:>11,.0f} {cache.creadas if cache else 0:>7}")
+            exitoso = exitoso and len(primeros) == llamadas and (not ttl or cacheados > 0)
+    finally:
+        plan_generator.niveles = niveles
+    return exitoso
+
+# ============================================================================
+# BENCHMARK 12: Documentos directos (multimodal) frente a OCR local
+# ============================================================================
+def bench_documentos(args=None):
+    """
+    Tiempo de cada etapa (extracción, compactación, generación) y tokens de
+    entrada con OCR local y con los documentos enviados directo al modelo
+
+    Uso: python benchmarks.py documentos [archivos PDF/JPG/PNG...]
+    Sin argumentos usa los PDF e imágenes de la carpeta de muestras. La
+    extracción se mide real; la generación usa ProveedorSimulado (los
+    documentos retrasan el primer token según sus tokens) y se reporta en
+    la escala del modelo.
+    """
+    import asyncio
+    import logging
+    import main
+    from documentos_directos import TIPOS_MIME
+    from gemini_service import plan_generator
+    from gobernador_cuota import GobernadorCuota
+
+    rutas = _rutas_muestra(args, "") if args else [
+        r for r in sorted(Path(SAMPLES_DIR).glob("*")) if r.suffix.lower() in TIPOS_MIME
+    ]
+    if not rutas:
+        print(f"\n⚠️  No se encontraron PDF ni imágenes en '{SAMPLES_DIR}'")
+        return False
+
+    escala = 0.05
+    for nombre in ("main", "gemini_service", "proveedores_llm", "PruebaOcr", "documentos_directos", "plan_cache"):
+        logging.getLogger(nombre).setLevel(logging.ERROR)
+    plan_generator.cache.configurar_almacenamiento(None)
+    originales = [(n.proveedor, n.gobernador) for n in plan_generator.niveles.values()]
+
+    print("\n" + "="*60)
+    print("BENCHMARK: documentos directos vs OCR local")
+    print("="*60)
+    print(f"   {'Archivo':<24} {'Modo':<8} {'Vía':<8} {'Extracción':>11} {'Compact.':>9} "
+          f"{'Generación':>11} {'Entrada':>9} {'Éxito':>6}")
+
+    async def medir(ruta: Path, modo: str):
+        # Sin límite de cuota: solo interesa la latencia de cada etapa
+        for nivel in plan_generator.niveles.values():
+            nivel.gobernador = GobernadorCuota(rpm=10**6, tpm=10**9, espera_maxima=0, fila_maxima=100)
+        contenido = ruta.read_bytes()
+        inicio = time.perf_counter()
+        try:
+            plan_text, diagnostico_text, documentos = await main._extraer_textos_plan(
+                ruta.name, contenido, None, None, modo
+            )
+        except main.HTTPException as e:
+            return {'via': '-', 'extraccion': time.perf_counter() - inicio, 'error': e.detail}
+        extraccion = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        plan_text, diagnostico_text, _ = await main._compactar_textos_plan(plan_text, diagnostico_text)
+        compactacion = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        resultado = await plan_generator.generar_plan(plan_text, diagnostico_text, forzar_regeneracion=True)
+        return {
+            'via': documentos['plan']['via'],
+            'extraccion': extraccion,
+            'compactacion': compactacion,
+            'generacion': (time.perf_counter() - inicio) / escala,
+            'tokens': (resultado.get('entrada') or {}).get('tokens_entrada', 0),
+            'success': resultado['success'],
+            'error': resultado.get('error'),
+        }
+
+    exitoso = True
+    try:
+        for nivel in plan_generator.niveles.values():
+            nivel.proveedor = ProveedorSimulado(
+                primer_token_ms=PRIMER_TOKEN_MS, ms_por_token=DECODE_MS_POR_TOKEN,
+                ms_por_token_entrada=PREFILL_MS_POR_MIL / 1000, escala=escala,
+                planes_base=[plan_representativo()]
+            )
+        for ruta in rutas:
+            for modo in ("ocr", "directo"):
+                r = asyncio.run(medir(ruta, modo))
+                if 'success' not in r:
+                    print(f"   {ruta.name[:24]:<24} {modo:<8} {'-':<8} {r['extraccion']:>10.2f}s   ❌ {r['error']}")
+                    exitoso = exitoso and modo == "ocr"
+                    continue
+                print(f"   {ruta.name[:24]:<24} {modo:<8} {r['via']:<8} {r['extraccion']:>10.2f}s "
+                      f"{r['compactacion']:>8.2f}s {r['generacion']:>10.2f}s {r['tokens']:>9,} "
+                      f"{'✅' if r['success'] else '❌':>5}")
+                if not r['success']:
+                    print(f"      {r['error']}")
+                exitoso = exitoso and (r['success'] or modo == "ocr")
+    finally:
+        for nivel, (proveedor, gobernador) in zip(plan_generator.niveles.values(), originales):
+            nivel.proveedor, nivel.gobernador = proveedor, gobernador
+
+    print("\n💡 Con la vía directa el OCR desaparece, pero cada página de PDF cuesta ~258 tokens de entrada")
+    return exitoso
+
+# ============================================================================
+# BENCHMARK 13: Biblioteca de actividades (referencias en lugar de actividades)
+# ============================================================================
+def bench_biblioteca(args=None):
+    """
+    Tiempo de generación y tokens de salida de un plan sin biblioteca y de
+    planes posteriores que citan actividades de la biblioteca por ID
+
+    Uso: python benchmarks.py biblioteca [planes] [escala]
+    El primer plan llena una biblioteca temporal (en memoria); los siguientes,
+    con otro texto curricular, la reciben en el prompt. Usa ProveedorSimulado,
+    que cita por ID las actividades ofrecidas; los tiempos se reportan en la
+    escala del modelo.
+    """
+    import asyncio
+    import logging
+    import gemini_service
+    from biblioteca_actividades import BibliotecaActividades
+    from gemini_service import plan_generator
+    from gobernador_cuota import GobernadorCuota
+
+    args = args or []
+    planes = int(args[0]) if len(args) > 0 else 3
+    escala = float(args[1]) if len(args) > 1 else 0.05
+
+    for nombre in ("gemini_service", "proveedores_llm", "plan_cache", "biblioteca_actividades"):
+        logging.getLogger(nombre).setLevel(logging.ERROR)
+    plan_generator.cache.configurar_almacenamiento(None)
+    originales = [(n.proveedor, n.gobernador) for n in plan_generator.niveles.values()]
+    biblioteca_original = plan_generator.biblioteca
+
+    print("\n" + "="*60)
+    print(f"BENCHMARK: biblioteca de actividades ({planes} planes)")
+    print("="*60)
+    print(f"   {'Plan':<6} {'Ofrecidas':>10} {'Generación':>11} {'Salida':>9} {'Referencias':>12} "
+          f"{'Ahorrados':>10} {'Válido':>7}")
+
+    async def medir(numero: int):
+        proveedor = ProveedorSimulado(
+            primer_token_ms=PRIMER_TOKEN_MS, ms_por_token=DECODE_MS_POR_TOKEN, escala=escala,
+            planes_base=[plan_representativo()]
+        )
+        for nivel in plan_generator.niveles.values():
+            nivel.proveedor = proveedor
+            # Sin límite de cuota: solo interesa la latencia del modelo
+            nivel.gobernador = GobernadorCuota(rpm=10**6, tpm=10**9, espera_maxima=0, fila_maxima=100)
+        plan_text = f"{PLAN_TEXT_MUESTRA} Grupo {numero}: énfasis distinto en cada plan."
+        ofrecidas = len(plan_generator.biblioteca.seleccionar(plan_text))
+        inicio = time.perf_counter()
+        resultado = await plan_generator.generar_plan(plan_text, forzar_regeneracion=True)
+        return {
+            'ofrecidas': ofrecidas,
+            'generacion': (time.perf_counter() - inicio) / escala,
+            'salida': proveedor.tokens_salida,
+            'biblioteca': resultado.get('biblioteca') or {},
+            'valido': resultado['success'] and resultado['validacion']['valido'],
+        }
+
+    exitoso = True
+    tiempos, salidas = [], []
+    activada = gemini_service.BIBLIOTECA_ACTIVIDADES
+    try:
+        gemini_service.BIBLIOTECA_ACTIVIDADES = True
+        plan_generator.biblioteca = BibliotecaActividades(None)
+        for numero in range(1, planes + 1):
+            r = asyncio.run(medir(numero))
+            uso = r['biblioteca']
+            print(f"   {numero:<6} {r['ofrecidas']:>10} {r['generacion']:>10.2f}s {r['salida']:>9,} "
+                  f"{uso.get('referencias', 0):>12} {uso.get('tokens_ahorrados', 0):>10,} "
+                  f"{'✅' if r['valido'] else '❌':>6}")
+            tiempos.append(r['generacion'])
+            salidas.append(r['salida'])
+            exitoso = exitoso and r['valido'] and (numero == 1 or uso.get('referencias', 0) > 0)
+    finally:
+        gemini_service.BIBLIOTECA_ACTIVIDADES = activada
+        plan_generator.biblioteca = biblioteca_original
+        for nivel, (proveedor, gobernador) in zip(plan_generator.niveles.values(), originales):
+            nivel.proveedor, nivel.gobernador = proveedor, gobernador
+
+    if len(tiempos) > 1:
+        print(f"\n💡 Con biblioteca: {1 - statistics.mean(tiempos[1:]) / tiempos[0]:.0%} menos tiempo de generación "
+              f"y {1 - statistics.mean(salidas[1:]) / salidas[0]:.0%} menos tokens de salida")
+    return exitoso
+
+# ============================================================================
+# BENCHMARK 14: Generación por lotes (un plan de estudios, N diagnósticos)
+# ============================================================================
+def bench_lote(args=None):
+    """
+    Planes por minuto de POST /api/plans/generate-batch según los trabajadores de la cola
+
+    Uso: python benchmarks.py lote [grupos] [escala] [trabajadores...]
+    Como el benchmark de rendimiento: Gemini se sustituye por
+    ProveedorSimulado y GCS por un almacenamiento en memoria, y los tiempos
+    se reportan en la escala del modelo. Cada corrida envía un lote y
+    consulta GET /api/plans/batches/{lote_id} hasta que termina.
+    """
+    import asyncio
+    import logging
+    import httpx
+    import main
+    from gemini_service import GEMINI_MAX_CONCURRENCY, plan_generator
+    from gobernador_cuota import GobernadorCuota
+    from lotes_planes import GestorLotes
+
+    args = args or []
+    grupos = int(args[0]) if len(args) > 0 else 8
+    escala = float(args[1]) if len(args) > 1 else 0.05
+    configuraciones = [int(a) for a in args[2:]] or [1, 2, 4]
+
+    for nombre in ("main", "gemini_service", "proveedores_llm", "PruebaOcr", "plan_cache", "lotes_planes", "httpx"):
+        logging.getLogger(nombre).setLevel(logging.ERROR)
+    main.limiter.enabled = False
+    main.gcs_storage = _AlmacenamientoMemoria()
+    main.app.dependency_overrides[main.get_current_user] = lambda: {"email": "bench@profego.mx"}
+    plan_generator.cache.configurar_almacenamiento(None)
+
+    print("\n" + "="*60)
+    print(f"BENCHMARK: lote de {grupos} grupos (proveedor simulado, concurrencia Gemini {GEMINI_MAX_CONCURRENCY})")
+    print("="*60)
+    print(f"   {'Trabajadores':<13} {'Total':>8} {'1er plan':>9} {'Planes/min':>11} {'Completados':>12}")
+
+    async def medir(cliente, trabajadores: int, corrida: int):
+        main.gestor_lotes = GestorLotes(trabajadores=trabajadores)
+        proveedor = ProveedorSimulado(
+            primer_token_ms=PRIMER_TOKEN_MS, ms_por_token=DECODE_MS_POR_TOKEN, escala=escala,
+            planes_base=[plan_representativo()]
+        )
+        for nivel in plan_generator.niveles.values():
+            nivel.proveedor = proveedor
+            # Sin límite de cuota: solo interesa la latencia del modelo
+            nivel.gobernador = GobernadorCuota(rpm=10**6, tpm=10**9, espera_maxima=0, fila_maxima=100)
+        # Diagnósticos distintos en cada corrida para que la caché no los una
+        diagnosticos = [
+            ("diagnostico_files", (f"grupo_{i}.txt", f"Diagnóstico del grupo {i} (corrida {corrida}): "
+                                   f"{'intereses y necesidades del grupo. ' * 10}".encode("utf-8"), "text/plain"))
+            for i in range(grupos)
+        ]
+        inicio = time.perf_counter()
+        respuesta = await cliente.post(
+            "/api/plans/generate-batch",
+            files=[("plan_file", ("plan.txt", PLAN_TEXT_MUESTRA.encode("utf-8"), "text/plain"))] + diagnosticos
+        )
+        if respuesta.status_code != 202:
+            return {'error': f"HTTP {respuesta.status_code}: {respuesta.text[:200]}"}
+        lote_id = respuesta.json()['lote_id']
+        primero = None
+        while True:
+            estado = (await cliente.get(f"/api/plans/batches/{lote_id}")).json()
+            if primero is None and estado['conteo']['completado']:
+                primero = time.perf_counter() - inicio
+            if estado['estado'] == 'terminado':
+                break
+            await asyncio.sleep(0.01)
+        total = (time.perf_counter() - inicio) / escala
+        return {
+            'total': total,
+            'primero': (primero or 0) / escala,
+            'completados': estado['conteo']['completado'],
+        }
+
+    async def ejecutar():
+        transporte = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=None) as cliente:
+            return [await medir(cliente, t, corrida) for corrida, t in enumerate(configuraciones)]
+
+    exitoso = True
+    for trabajadores, r in zip(configuraciones, asyncio.run(ejecutar())):
+        if 'error' in r:
+            print(f"   {trabajadores:<13} ❌ {r['error']}")
+            exitoso = False
+            continue
+        print(f"   {trabajadores:<13} {r['total']:>7.1f}s {r['primero']:>8.1f}s "
+              f"{r['completados'] / r['total'] * 60:>11.1f} {r['completados']:>8}/{grupos}")
+        exitoso = exitoso and r['completados'] == grupos
+
+    print("\n💡 Más trabajadores que GEMINI_MAX_CONCURRENCY solo agregan espera en el semáforo de Gemini")
+    return exitoso
+
+# ============================================================================
+# BENCHMARK 15: Almacén de trabajos de generación en segundo plano
+# ============================================================================
+def bench_trabajos(args=None):
+    """
+    Ciclo de vida de los trabajos en AlmacenTrabajos y costo de la cola SQLite
+
+    Uso: python benchmarks.py trabajos [trabajos]
+    Usa un TRABAJOS_DIR temporal con vencimiento de latido corto. Verifica
+    la toma, la liberación (apagado), la retoma, el vencimiento del latido
+    hasta el error tras max_intentos y la deduplicación por huella; que
+    ColaTrabajos registre como error una cancelación interna sin perder al
+    trabajador y devuelva a la cola el trabajo en curso al detenerse; luego
+    mide crear/tomar/terminar con N trabajos.
+    """
+    import asyncio
+    import logging
+    import tempfile
+    from trabajos_planes import COMPLETADO, EN_COLA, EN_PROCESO, ERROR, AlmacenTrabajos, ColaTrabajos
+
+    args = args or []
+    trabajos = int(args[0]) if len(args) > 0 else 200
+    vencimiento = 0.05
+    logging.getLogger("trabajos_planes").setLevel(logging.CRITICAL)
+
+    print("\n" + "="*60)
+    print(f"BENCHMARK: almacén de trabajos (vencimiento {vencimiento} s, máximo 2 interrupciones)")
+    print("="*60)
+
+    exitoso = True
+
+    def verificar(descripcion: str, condicion: bool) -> None:
+        nonlocal exitoso
+        exitoso = exitoso and bool(condicion)
+        print(f"   {'✅' if condicion else '❌'} {descripcion}")
+
+    parametros = {"modo_documentos": "ocr"}
+    archivos = {"plan": PLAN_TEXT_MUESTRA.encode("utf-8")}
+
+    with tempfile.TemporaryDirectory() as directorio:
+        almacen = AlmacenTrabajos(directorio, vencimiento_segundos=vencimiento, max_intentos=2)
+
+        trabajo, nuevo = almacen.crear("bench@profego.mx", parametros, archivos)
+        trabajo_id = trabajo["id"]
+        verificar("Crear encola el trabajo", nuevo and trabajo["estado"] == EN_COLA)
+        repetido, nuevo = almacen.crear("bench@profego.mx", parametros, archivos)
+        verificar("Mismas entradas mientras está activo: mismo trabajo", not nuevo and repetido["id"] == trabajo_id)
+        tomado = almacen.tomar("a")
+        verificar("Tomar asigna el trabajo en proceso",
+                  tomado["id"] == trabajo_id and tomado["estado"] == EN_PROCESO and tomado["propietario"] == "a")
+        verificar("Con latido vigente nadie más lo toma", almacen.tomar("b") is None)
+
+        almacen.liberar(trabajo_id, "a")
+        liberado = almacen.obtener(trabajo_id)
+        verificar("Liberar lo devuelve a la cola sin contar intento",
+                  liberado["estado"] == EN_COLA and liberado["intentos"] == 0)
+        retomado = almacen.tomar("b")
+        verificar("Otro trabajador lo retoma", retomado["id"] == trabajo_id and retomado["propietario"] == "b")
+        verificar("El propietario anterior ya no puede actualizarlo", not almacen.avanzar(trabajo_id, "a", "ocr", 10))
+
+        time.sleep(vencimiento * 2)
+        vencido = almacen.tomar("c")
+        verificar("Latido vencido: vuelve a la cola y se retoma (1 interrupción)",
+                  vencido["id"] == trabajo_id and vencido["propietario"] == "c" and vencido["intentos"] == 1)
+        time.sleep(vencimiento * 2)
+        verificar("Segundo vencimiento: no se vuelve a tomar", almacen.tomar("d") is None)
+        fallido = almacen.obtener(trabajo_id)
+        verificar(f"Error tras max_intentos ({fallido['error']})",
+                  fallido["estado"] == ERROR and fallido["intentos"] == 2)
+
+        _, nuevo = almacen.crear("bench@profego.mx", parametros, archivos)
+        verificar("Mismas entradas tras terminar: trabajo nuevo", nuevo)
+        _, nuevo = almacen.crear("otro@profego.mx", parametros, archivos)
+        verificar("Mismas entradas de otro usuario: trabajo nuevo", nuevo)
+
+    async def procesar(trabajo, archivos, avance):
+        if trabajo["parametros"].get("cancelar"):
+            raise asyncio.CancelledError()
+        if trabajo["parametros"].get("lento"):
+            await asyncio.sleep(60)
+        return {"success": True, "plan_id": trabajo["id"]}
+
+    async def esperar_estado(almacen, trabajo_id, estados):
+        for _ in range(200):
+            trabajo = await asyncio.to_thread(almacen.obtener, trabajo_id)
+            if trabajo["estado"] in estados:
+                return trabajo
+            await asyncio.sleep(0.01)
+        return trabajo
+
+    async def ciclo_cola(directorio):
+        almacen = AlmacenTrabajos(directorio)
+        cola = ColaTrabajos(almacen, trabajadores=1, sondeo_segundos=0.01)
+        cola.iniciar(procesar)
+        cancelado, _ = almacen.crear("bench@profego.mx", {"cancelar": True}, archivos)
+        cancelado = await esperar_estado(almacen, cancelado["id"], (COMPLETADO, ERROR))
+        verificar(f"Cancelación interna: error del trabajo ({cancelado['error']})", cancelado["estado"] == ERROR)
+        normal, _ = almacen.crear("bench@profego.mx", {"normal": True}, archivos)
+        normal = await esperar_estado(almacen, normal["id"], (COMPLETADO, ERROR))
+        verificar("El trabajador sigue tomando trabajos", normal["estado"] == COMPLETADO)
+        lento, _ = almacen.crear("bench@profego.mx", {"lento": True}, archivos)
+        await esperar_estado(almacen, lento["id"], (EN_PROCESO,))
+        await cola.detener()
+        lento = almacen.obtener(lento["id"])
+        verificar("Detener devuelve el trabajo en curso a la cola",
+                  lento["estado"] == EN_COLA and lento["intentos"] == 0 and lento["propietario"] is None)
+
+    with tempfile.TemporaryDirectory() as directorio:
+        asyncio.run(ciclo_cola(directorio))
+
+    with tempfile.TemporaryDirectory() as directorio:
+        almacen = AlmacenTrabajos(directorio)
+        inicio = time.perf_counter()
+        for i in range(trabajos):
+            almacen.crear("bench@profego.mx", {"grupo": i}, archivos)
+        crear = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        terminados = 0
+        while (trabajo := almacen.tomar("bench")) is not None:
+            terminados += almacen.terminar(trabajo["id"], "bench", {"success": True, "plan_id": trabajo["id"]})
+        procesar = time.perf_counter() - inicio
+        estado = almacen.estado()
+        verificar(f"{trabajos} trabajos completados", terminados == trabajos and estado[COMPLETADO] == trabajos)
+
+    print(f"\n   Crear:            {crear / trabajos * 1000:>6.2f} ms por trabajo")
+    print(f"   Tomar + terminar: {procesar / trabajos * 1000:>6.2f} ms por trabajo")
+    print(f"   Estado final: {estado}")
+    return exitoso
+
+# ============================================================================
+# BENCHMARK 16: Coalescencia de generaciones idénticas en streaming
+# ============================================================================
+def bench_coalescencia(args=None):
+    """
+    Streams idénticos simultáneos comparten una sola llamada al modelo
+
+    Uso: python benchmarks.py coalescencia [streams] [escala]
+    Con ProveedorSimulado lanza a la vez varios generar_plan_stream idénticos
+    (y uno que se une a mitad de la generación y un generar_plan): todos
+    deben recibir todos los módulos con una sola llamada. Después verifica
+    que forzar_regeneracion no se una al vuelo en curso y que cerrar todos
+    los streams cancele la generación.
+    """
+    import asyncio
+    import logging
+    from gemini_service import plan_generator
+
+    args = args or []
+    streams = int(args[0]) if len(args) > 0 else 4
+    escala = float(args[1]) if len(args) > 1 else 0.02
+    modulos = 6
+
+    for nombre in ("gemini_service", "proveedores_llm", "plan_cache", "single_flight"):
+        logging.getLogger(nombre).setLevel(logging.ERROR)
+    plan_generator.cache.configurar_almacenamiento(None)
+    proveedor = ProveedorSimulado(
+        primer_token_ms=PRIMER_TOKEN_MS, ms_por_token=DECODE_MS_POR_TOKEN, escala=escala,
+        planes_base=[plan_representativo(modulos)]
+    )
+    for nivel in plan_generator.niveles.values():
+        nivel.proveedor = proveedor
+
+    print("\n" + "="*60)
+    print(f"BENCHMARK: coalescencia de {streams} streams idénticos (proveedor simulado)")
+    print("="*60)
+
+    exitoso = True
+
+    def verificar(descripcion: str, condicion: bool) -> None:
+        nonlocal exitoso
+        exitoso = exitoso and bool(condicion)
+        print(f"   {'✅' if condicion else '❌'} {descripcion}")
+
+    async def consumir(texto: str, forzar: bool = False, retraso: float = 0):
+        await asyncio.sleep(retraso)
+        recibidos = 0
+        async for evento in plan_generator.generar_plan_stream(texto, forzar_regeneracion=forzar):
+            if evento['evento'] == 'modulo':
+                recibidos += 1
+            else:
+                return recibidos, evento['resultado']
+
+    async def ejecutar():
+        texto = f"{PLAN_TEXT_MUESTRA} Coalescencia {time.time()}."
+        proveedor.llamadas = 0
+        inicio = time.perf_counter()
+        # El tardío se une cuando el vuelo ya emitió módulos (primer token + algunos módulos)
+        tardio = PRIMER_TOKEN_MS / 1000 * escala * 2
+        resultados = await asyncio.gather(
+            *(consumir(texto) for _ in range(streams)),
+            consumir(texto, retraso=tardio),
+            plan_generator.generar_plan(texto)
+        )
+        total = (time.perf_counter() - inicio) / escala
+        *en_stream, normal = resultados
+        verificar(f"{streams} streams simultáneos y uno tardío reciben los {modulos} módulos",
+                  all(r == modulos and p.get('success') for r, p in en_stream))
+        verificar("generar_plan unido al stream recibe el plan completo",
+                  normal.get('success') and len(normal['plan']['modulos']) == modulos)
+        verificar(f"Una sola llamada al modelo ({proveedor.llamadas}) en {total:.1f} s", proveedor.llamadas == 1)
+
+        texto = f"{PLAN_TEXT_MUESTRA} Forzado {time.time()}."
+        proveedor.llamadas = 0
+        await asyncio.gather(consumir(texto), consumir(texto, forzar=True, retraso=0.001))
+        verificar("forzar_regeneracion genera aparte del vuelo en curso", proveedor.llamadas == 2)
+
+        texto = f"{PLAN_TEXT_MUESTRA} Cancelado {time.time()}."
+        flujos = [plan_generator.generar_plan_stream(texto) for _ in range(2)]
+        esperas = [asyncio.ensure_future(f.__anext__()) for f in flujos]
+        # Antes del primer token: ambos ya esperan el vuelo y aún no hay módulos
+        await asyncio.sleep(PRIMER_TOKEN_MS / 1000 * escala / 2)
+        canceladas = plan_generator.vuelos.canceladas
+        for espera in esperas:
+            espera.cancel()
+        await asyncio.gather(*esperas, return_exceptions=True)
+        for flujo in flujos:
+            await flujo.aclose()
+        verificar("Cerrar todos los streams cancela la generación",
+                  plan_generator.vuelos.canceladas == canceladas + 1)
+        verificar("No quedan vuelos registrados", plan_generator.vuelos.estado()['en_curso'] == 0)
+
+    asyncio.run(ejecutar())
+    return exitoso
+
+# ============================================================================
+# PUNTO DE ENTRADA
+# ============================================================================
+if __name__ == "__main__":
+    comandos = {
+        "pdf": bench_pdf_backends,
+        "startup": bench_startup,
+        "carga": bench_carga,
+        "recuperacion": bench_recuperacion,
+        "esquema": bench_esquema,
+        "validacion": bench_validacion,
+        "json": bench_json,
+        "dos_fases": bench_dos_fases,
+        "rendimiento": bench_rendimiento,
+        "enrutamiento": bench_enrutamiento,
+        "cache_contexto": bench_cache_contexto,
+        "documentos": bench_documentos,
+        "biblioteca": bench_biblioteca,
+        "lote": bench_lote,
+        "trabajos": bench_trabajos,
+        "coalescencia": bench_coalescencia,
+    }
+
+    if len(sys.argv) > 1 and sys.argv[1].lower() in comandos:
+        resultado = comandos[sys.argv[1].lower()](sys.argv[2:])
+        sys.exit(0 if resultado else 1)
+    else:
+        print("\nComandos disponibles:")
+        for cmd in comandos.keys():
+            print(f"   - python benchmarks.py {cmd}")
+        sys.exit(1)
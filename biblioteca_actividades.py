@@ -0,0 +1,306 @@
+"""
+Biblioteca local de actividades ya generadas
+Las actividades de los planes válidos se guardan indexadas por campo
+formativo, ejes articuladores y aprendizaje esperado; el prompt ofrece las
+más afines con un ID y el modelo puede escribir {"ref": ID} en lugar de la
+actividad completa, que se expande después (menos tokens de salida)
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from esquema_plan import CLAVE_REFERENCIA
+from gobernador_cuota import estimar_tokens
+from recuperacion_curricular import tokenizar
+
+logger = logging.getLogger(__name__)
+
+BIBLIOTECA_ACTIVIDADES = os.getenv("BIBLIOTECA_ACTIVIDADES", "1") == "1"
+BIBLIOTECA_ACTIVIDADES_PATH = os.getenv("BIBLIOTECA_ACTIVIDADES_PATH", "cache/biblioteca_actividades.json")
+BIBLIOTECA_MAX_ENTRADAS = int(os.getenv("BIBLIOTECA_MAX_ENTRADAS", "2000"))
+# Actividades que se ofrecen en el prompt de un plan completo y de un módulo
+BIBLIOTECA_EN_PROMPT = int(os.getenv("BIBLIOTECA_EN_PROMPT", "12"))
+BIBLIOTECA_EN_PROMPT_MODULO = int(os.getenv("BIBLIOTECA_EN_PROMPT_MODULO", "6"))
+
+# Momento de la actividad -> campo del módulo y campos que debe tener para guardarse
+MOMENTOS = {
+    "inicio": ("actividad_inicio", ("nombre", "descripcion", "duracion", "materiales")),
+    "desarrollo": ("actividades_desarrollo", ("nombre", "tipo", "descripcion", "duracion", "materiales")),
+    "cierre": ("actividad_cierre", ("nombre", "descripcion", "duracion")),
+}
+
+# Largo del extracto de la descripción que se muestra en el prompt
+CARACTERES_EXTRACTO = 90
+TOKENS_REFERENCIA = estimar_tokens('{"ref": "A000000"}')
+
+
+def _id_actividad(actividad: Dict) -> str:
+    """ID estable: la misma actividad (nombre y descripción) siempre tiene el mismo"""
+    contenido = f"{actividad.get('nombre', '')}|{actividad.get('descripcion', '')}".lower()
+    return "A" + hashlib.sha1(contenido.encode("utf-8")).hexdigest()[:6]
+
+
+def _actividades_del_modulo(modulo: Dict) -> Iterable:
+    """(momento, actividad) de cada actividad de un módulo en formato completo"""
+    for momento, (campo, _) in MOMENTOS.items():
+        valor = modulo.get(campo)
+        for actividad in (valor if isinstance(valor, list) else [valor]):
+            if isinstance(actividad, dict):
+                yield momento, actividad
+
+
+class BibliotecaActividades:
+    """
+    Actividades reutilizables en memoria, persistidas en un archivo JSON local
+
+    El índice agrupa las entradas por campo formativo; dentro de un campo se
+    ordenan por coincidencia de ejes, palabras del aprendizaje esperado y
+    veces que se han reutilizado. Con más de max_entradas se descartan las
+    menos usadas.
+    """
+
+    def __init__(self, ruta: Optional[str], max_entradas: int = BIBLIOTECA_MAX_ENTRADAS):
+        self.ruta = Path(ruta) if ruta else None
+        self.max_entradas = max_entradas
+        self._entradas: Dict[str, Dict] = {}
+        self._por_campo: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        self._cargada = False
+        self._cambios = False
+        self.referencias_expandidas = 0
+        self.referencias_desconocidas = 0
+        self.tokens_ahorrados = 0
+
+    # ------------------------------------------------------------------
+    # Persistencia
+    # ------------------------------------------------------------------
+    def _cargar(self) -> None:
+        """Lee el archivo en el primer uso (no al importar: arranque en frío)"""
+        if self._cargada:
+            return
+        with self._lock:
+            if self._cargada:
+                return
+            self._cargada = True
+            if self.ruta is None or not self.ruta.exists():
+                return
+            try:
+                datos = json.loads(self.ruta.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"⚠️ Biblioteca de actividades ilegible ({self.ruta}); se empieza vacía: {e}")
+                return
+            for entrada in datos.get("entradas", []):
+                self._indexar(entrada)
+            logger.info(f"📚 Biblioteca de actividades: {len(self._entradas)} entradas ({self.ruta})")
+
+    def guardar(self) -> None:
+        """Escribe el archivo si hubo cambios (reemplazo atómico)"""
+        if self.ruta is None:
+            return
+        with self._lock:
+            if not self._cambios:
+                return
+            entradas = [{k: v for k, v in e.items() if not k.startswith("_")} for e in self._entradas.values()]
+            contenido = json.dumps({"entradas": entradas}, ensure_ascii=False)
+            self._cambios = False
+        try:
+            self.ruta.parent.mkdir(parents=True, exist_ok=True)
+            temporal = self.ruta.with_suffix(".tmp")
+            temporal.write_text(contenido, encoding="utf-8")
+            os.replace(temporal, self.ruta)
+        except OSError as e:
+            logger.warning(f"⚠️ No se pudo guardar la biblioteca de actividades: {e}")
+
+    # ------------------------------------------------------------------
+    # Índice
+    # ------------------------------------------------------------------
+    def _indexar(self, entrada: Dict) -> None:
+        entrada["_terminos"] = set(tokenizar(entrada.get("aprendizaje_esperado", "")))
+        self._entradas[entrada["id"]] = entrada
+        self._por_campo.setdefault(entrada.get("campo_formativo", ""), set()).add(entrada["id"])
+
+    def _descartar_sobrantes(self) -> None:
+        sobrantes = len(self._entradas) - self.max_entradas
+        if sobrantes <= 0:
+            return
+        for entrada in sorted(self._entradas.values(), key=lambda e: (e["usos"], e["creada"]))[:sobrantes]:
+            del self._entradas[entrada["id"]]
+            self._por_campo.get(entrada.get("campo_formativo", ""), set()).discard(entrada["id"])
+
+    def agregar_plan(self, plan: Dict) -> int:
+        """
+        Guarda las actividades completas de un plan válido (formato completo)
+
+        Returns:
+            Cantidad de actividades nuevas
+        """
+        self._cargar()
+        nuevas = 0
+        with self._lock:
+            for modulo in plan.get("modulos") or []:
+                if not isinstance(modulo, dict):
+                    continue
+                for momento, actividad in _actividades_del_modulo(modulo):
+                    if not all(actividad.get(c) for c in MOMENTOS[momento][1]):
+                        continue
+                    id_actividad = _id_actividad(actividad)
+                    if id_actividad in self._entradas:
+                        continue
+                    self._indexar({
+                        "id": id_actividad,
+                        "momento": momento,
+                        "campo_formativo": modulo.get("campo_formativo", ""),
+                        "ejes_articuladores": list(modulo.get("ejes_articuladores") or []),
+                        "aprendizaje_esperado": modulo.get("aprendizaje_esperado", ""),
+                        "actividad": {k: v for k, v in actividad.items() if k != CLAVE_REFERENCIA},
+                        "usos": 0,
+                        "creada": time.time(),
+                    })
+                    nuevas += 1
+            if nuevas:
+                self._descartar_sobrantes()
+                self._cambios = True
+        if nuevas:
+            logger.info(f"📚 {nuevas} actividades nuevas en la biblioteca ({len(self._entradas)} en total)")
+        # También persiste los usos registrados al expandir referencias
+        self.guardar()
+        return nuevas
+
+    def seleccionar(
+        self,
+        consulta: str,
+        campo_formativo: Optional[str] = None,
+        ejes: Optional[List[str]] = None,
+        limite: int = BIBLIOTECA_EN_PROMPT
+    ) -> List[Dict]:
+        """
+        Entradas más afines a una consulta (texto del plan o aprendizaje esperado)
+
+        Con campo_formativo solo se buscan las de ese campo.
+        """
+        self._cargar()
+        terminos = set(tokenizar(consulta))
+        ejes = set(ejes or [])
+        with self._lock:
+            if campo_formativo is not None:
+                candidatas = [self._entradas[i] for i in self._por_campo.get(campo_formativo, ())]
+            else:
+                candidatas = list(self._entradas.values())
+
+        def puntaje(entrada: Dict) -> float:
+            propios = entrada["_terminos"]
+            afinidad = len(propios & terminos) / len(propios) if propios else 0.0
+            return (2 * afinidad + len(ejes.intersection(entrada["ejes_articuladores"]))
+                    + 0.1 * math.log1p(entrada["usos"]))
+
+        elegidas = sorted(candidatas, key=puntaje, reverse=True)[:limite]
+        # El prompt lista inicio, desarrollo y cierre en ese orden
+        orden = list(MOMENTOS)
+        return sorted(elegidas, key=lambda e: orden.index(e["momento"]))
+
+    @staticmethod
+    def seccion_prompt(entradas: List[Dict]) -> str:
+        """Sección del prompt que ofrece las entradas para reutilizarlas por ID"""
+        if not entradas:
+            return ""
+        lineas = []
+        for entrada in entradas:
+            actividad = entrada["actividad"]
+            extracto = " ".join(str(actividad.get("descripcion", "")).split())[:CARACTERES_EXTRACTO]
+            lineas.append(
+                f'- {entrada["id"]} [{entrada["momento"]}] {actividad.get("nombre", "")} — '
+                f'{entrada["campo_formativo"]}: "{extracto}..."'
+            )
+        return f"""
+
+# BIBLIOTECA DE ACTIVIDADES PROBADAS
+Estas actividades ya se usaron con éxito en otros planes. Si una encaja con un módulo
+(mismo momento, campo formativo y aprendizaje), en lugar de escribir el objeto completo de
+la actividad escribe solo {{"{CLAVE_REFERENCIA}": "ID"}}. No uses la misma actividad en dos
+módulos y escribe completas las actividades nuevas.
+{chr(10).join(lineas)}
+"""
+
+    # ------------------------------------------------------------------
+    # Expansión de referencias
+    # ------------------------------------------------------------------
+    def _expandir_actividad(self, actividad: Dict, contar: bool, uso: Dict) -> Dict:
+        id_actividad = actividad.get(CLAVE_REFERENCIA)
+        entrada = self._entradas.get(id_actividad) if isinstance(id_actividad, str) else None
+        if entrada is None:
+            if contar:
+                uso["desconocidas"] += 1
+                logger.warning(f"⚠️ Referencia a una actividad que no está en la biblioteca: {id_actividad}")
+            return actividad
+        # Lo que el modelo haya escrito junto a la referencia (p. ej. la duración) manda
+        expandida = {**copy.deepcopy(entrada["actividad"]),
+                     **{k: v for k, v in actividad.items() if k != CLAVE_REFERENCIA}}
+        if contar:
+            entrada["usos"] += 1
+            uso["referencias"] += 1
+            uso["tokens_ahorrados"] += max(
+                estimar_tokens(json.dumps(expandida, ensure_ascii=False)) - TOKENS_REFERENCIA, 0
+            )
+        return expandida
+
+    def expandir_modulo(self, modulo: Dict, contar: bool = True) -> Dict:
+        """
+        Reemplaza las referencias {"ref": ID} del módulo por las actividades (en el lugar)
+
+        Con contar=False no se registran usos (módulos emitidos en streaming,
+        que se vuelven a expandir al procesar la respuesta completa).
+
+        Returns:
+            {'referencias', 'tokens_ahorrados', 'desconocidas'} de este módulo
+        """
+        uso = {"referencias": 0, "tokens_ahorrados": 0, "desconocidas": 0}
+        if not isinstance(modulo, dict):
+            return uso
+        self._cargar()
+        with self._lock:
+            for momento, (campo, _) in MOMENTOS.items():
+                valor = modulo.get(campo)
+                if isinstance(valor, list):
+                    modulo[campo] = [
+                        self._expandir_actividad(a, contar, uso) if isinstance(a, dict) and CLAVE_REFERENCIA in a else a
+                        for a in valor
+                    ]
+                elif isinstance(valor, dict) and CLAVE_REFERENCIA in valor:
+                    modulo[campo] = self._expandir_actividad(valor, contar, uso)
+            if contar and uso["referencias"]:
+                self._cambios = True
+            self.referencias_expandidas += uso["referencias"]
+            self.referencias_desconocidas += uso["desconocidas"]
+            self.tokens_ahorrados += uso["tokens_ahorrados"]
+        return uso
+
+    def expandir_plan(self, plan: Dict) -> Dict:
+        """Expande las referencias de todos los módulos; devuelve el total del plan"""
+        total = {"referencias": 0, "tokens_ahorrados": 0, "desconocidas": 0}
+        for modulo in plan.get("modulos") or []:
+            for clave, valor in self.expandir_modulo(modulo).items():
+                total[clave] += valor
+        if total["referencias"]:
+            logger.info(
+                f"📚 {total['referencias']} actividades tomadas de la biblioteca "
+                f"(~{total['tokens_ahorrados']} tokens de salida ahorrados)"
+            )
+        return total
+
+    def estado(self) -> Dict:
+        """Métricas de la biblioteca (para /health)"""
+        return {
+            "entradas": len(self._entradas),
+            "archivo": str(self.ruta) if self.ruta else None,
+            "referencias_expandidas": self.referencias_expandidas,
+            "referencias_desconocidas": self.referencias_desconocidas,
+            "tokens_ahorrados": self.tokens_ahorrados,
+        }
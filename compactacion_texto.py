@@ -0,0 +1,145 @@
+"""
+Compactación determinista del texto extraído antes de enviarlo a Gemini
+Quita encabezados/pies de página repetidos, marcadores de página, líneas de
+ruido de OCR, espacios sobrantes y párrafos duplicados
+"""
+
+import logging
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from fragmentos import PATRON_PAGINA
+from gobernador_cuota import estimar_tokens
+
+logger = logging.getLogger(__name__)
+
+# Separador de páginas en el texto compactado (1 carácter en vez del marcador)
+SEPARADOR_PAGINA = "\f"
+
+# Líneas revisadas al inicio y al final de cada página para detectar encabezados/pies
+LINEAS_BORDE = 3
+# Fracción mínima de páginas en que debe aparecer una línea para considerarse repetida
+FRACCION_REPETIDA = 0.5
+MIN_PAGINAS_REPETIDAS = 3
+
+# Los encabezados/pies son líneas cortas; las largas nunca se tratan como tales
+MAX_CARACTERES_ENCABEZADO = 100
+# Hasta esta longitud los números de una línea se consideran folios
+MAX_CARACTERES_FOLIO = 40
+
+# Párrafos más cortos no se deduplican (títulos como "Materiales:" se repiten legítimamente)
+MIN_CARACTERES_DEDUP = 40
+
+
+def _firma_linea(linea: str) -> str:
+    """
+    Normaliza una línea para comparar encabezados
+
+    En líneas cortas los números se ignoran para que los folios ("Página 3 de 10")
+    coincidan; en las largas se conservan, porque ahí suelen distinguir contenido.
+    """
+    firma = re.sub(r"\s+", " ", linea.strip().lower())
+    if len(firma) <= MAX_CARACTERES_FOLIO:
+        firma = re.sub(r"\d+", "#", firma)
+    return firma
+
+
+def _es_ruido(linea: str) -> bool:
+    """
+    True para líneas de poca información típicas del OCR
+
+    Ejemplos: '|| ~~ ..', 'ﬁ ¦ ´', caracteres sueltos. Se conservan números
+    y viñetas cortas ('1.', 'a)') porque estructuran listas.
+    """
+    texto = linea.strip()
+    if not texto:
+        return False
+    if re.fullmatch(r"[\dA-Za-z][.)]?|\d+", texto):
+        return False
+    alfanumericos = sum(c.isalnum() for c in texto)
+    if alfanumericos / len(texto) < 0.4:
+        return True
+    # Sin ninguna palabra de 2+ letras: basura del reconocimiento
+    return not re.search(r"[^\W\d_]{2,}", texto)
+
+
+def _indices_borde(lineas: List[str]) -> List[int]:
+    """Índices de las primeras y últimas líneas no vacías (posibles encabezados/pies)"""
+    no_vacias = [i for i, l in enumerate(lineas)
+                 if l.strip() and len(l.strip()) <= MAX_CARACTERES_ENCABEZADO]
+    return no_vacias[:LINEAS_BORDE] + no_vacias[-LINEAS_BORDE:]
+
+
+def _lineas_repetidas(paginas: List[List[str]]) -> set:
+    """Firmas de líneas que aparecen en el borde de muchas páginas"""
+    if len(paginas) < MIN_PAGINAS_REPETIDAS:
+        return set()
+
+    conteo: Counter = Counter()
+    for lineas in paginas:
+        conteo.update({_firma_linea(lineas[i]) for i in _indices_borde(lineas)})
+
+    minimo = max(MIN_PAGINAS_REPETIDAS, int(len(paginas) * FRACCION_REPETIDA))
+    return {firma for firma, n in conteo.items() if n >= minimo and firma}
+
+
+def compactar_texto(texto: str) -> Tuple[str, Dict]:
+    """
+    Compacta el texto extraído de forma determinista
+
+    Returns:
+        (texto_compactado, info) con caracteres/tokens antes y después y
+        cuántos elementos quitó cada paso
+    """
+    info = {
+        "caracteres_originales": len(texto or ""),
+        "tokens_originales": estimar_tokens(texto or ""),
+        "encabezados_eliminados": 0,
+        "lineas_ruido": 0,
+        "parrafos_duplicados": 0,
+    }
+    if not texto:
+        info.update({"caracteres_compactados": 0, "tokens_compactados": 0, "ahorro_pct": 0.0})
+        return "", info
+
+    paginas = [pagina.split("\n") for pagina in PATRON_PAGINA.split(texto.replace("\r\n", "\n"))]
+    repetidas = _lineas_repetidas(paginas)
+    vistos = set()
+    paginas_compactadas = []
+
+    for lineas in paginas:
+        borde = set(_indices_borde(lineas)) if repetidas else set()
+        conservadas = []
+        for i, linea in enumerate(lineas):
+            # Espacios: tabulaciones y columnas rellenadas (p. ej. to_string de hojas de cálculo)
+            linea = re.sub(r"[ \t\u00a0]+", " ", linea).strip()
+            if i in borde and _firma_linea(linea) in repetidas:
+                info["encabezados_eliminados"] += 1
+                continue
+            if _es_ruido(linea):
+                info["lineas_ruido"] += 1
+                continue
+            conservadas.append(linea)
+
+        parrafos = []
+        for parrafo in re.split(r"\n{2,}", "\n".join(conservadas)):
+            parrafo = parrafo.strip()
+            if not parrafo:
+                continue
+            if len(parrafo) >= MIN_CARACTERES_DEDUP:
+                clave = re.sub(r"\s+", " ", parrafo.lower())
+                if clave in vistos:
+                    info["parrafos_duplicados"] += 1
+                    continue
+                vistos.add(clave)
+            parrafos.append(parrafo)
+
+        if parrafos:
+            paginas_compactadas.append("\n\n".join(parrafos))
+
+    compactado = SEPARADOR_PAGINA.join(paginas_compactadas)
+    info["caracteres_compactados"] = len(compactado)
+    info["tokens_compactados"] = estimar_tokens(compactado)
+    info["ahorro_pct"] = round(100 * (1 - len(compactado) / len(texto)), 1)
+    return compactado, info
@@ -0,0 +1,91 @@
+"""
+Modo de documentos directos: los PDF y las imágenes se envían a Gemini tal
+cual (prompt multimodal) en lugar de extraer su texto con OCR local
+La vía de cada archivo se decide por su tipo y tamaño (elegir_via)
+"""
+
+import logging
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+from proveedores_llm import DocumentoAdjunto
+
+logger = logging.getLogger(__name__)
+
+# ocr: siempre se extrae el texto (comportamiento anterior)
+# directo: los PDF e imágenes van al modelo sin OCR
+# auto: las imágenes van directo; los PDF, solo si no tienen capa de texto
+MODOS_DOCUMENTO = ("ocr", "directo", "auto")
+GEMINI_DOCUMENT_MODE = os.getenv("GEMINI_DOCUMENT_MODE", "ocr")
+
+# Límites de Gemini para documentos (50MB y 1000 páginas por PDF); más
+# páginas que GEMINI_DIRECT_MAX_PAGES se extraen con OCR, que luego recorta
+# el plan a sus secciones relevantes en vez de enviarlo completo
+DIRECTO_MAX_BYTES = int(float(os.getenv("GEMINI_DIRECT_MAX_MB", "50")) * 1024 * 1024)
+DIRECTO_MAX_PAGINAS = int(os.getenv("GEMINI_DIRECT_MAX_PAGES", "100"))
+
+# Con menos caracteres extraídos por página, el PDF se considera escaneado
+MIN_CARACTERES_POR_PAGINA = int(os.getenv("GEMINI_DIRECT_MIN_CHARS_PER_PAGE", "200"))
+
+VIA_TEXTO = "texto"
+VIA_DIRECTO = "directo"
+# Modo auto con un PDF: se extrae el texto y, si parece escaneado, va directo
+VIA_SEGUN_TEXTO = "segun_texto"
+
+TIPOS_MIME = {
+    '.pdf': 'application/pdf',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+}
+
+if GEMINI_DOCUMENT_MODE not in MODOS_DOCUMENTO:
+    logger.warning(f"⚠️ GEMINI_DOCUMENT_MODE desconocido '{GEMINI_DOCUMENT_MODE}'; se usa ocr")
+    GEMINI_DOCUMENT_MODE = "ocr"
+
+
+def contar_paginas(ruta: str) -> Optional[int]:
+    """Páginas de un PDF con el backend de extracción disponible (None si no se pudo)"""
+    try:
+        from PruebaOcr import get_pdf_backend
+        return get_pdf_backend().count_pages(ruta)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudieron contar las páginas de {Path(ruta).name}: {e}")
+        return None
+
+
+def elegir_via(nombre: str, ruta: str, tamano: int, modo: str) -> Tuple[str, Optional[int]]:
+    """
+    Vía de un archivo: VIA_TEXTO, VIA_DIRECTO o VIA_SEGUN_TEXTO
+
+    Solo PDF, JPG y PNG pueden ir directo, y solo dentro de
+    DIRECTO_MAX_BYTES y DIRECTO_MAX_PAGINAS; lo demás se extrae como texto.
+
+    Returns:
+        (via, paginas) con paginas None si no es PDF o no se pudo contar
+    """
+    mime = TIPOS_MIME.get(Path(nombre).suffix.lower())
+    if modo == "ocr" or mime is None:
+        return VIA_TEXTO, None
+    if tamano > DIRECTO_MAX_BYTES:
+        logger.info(f"📄 {nombre} excede {DIRECTO_MAX_BYTES // 1024 // 1024}MB; se extrae su texto")
+        return VIA_TEXTO, None
+
+    paginas = contar_paginas(ruta) if mime == "application/pdf" else None
+    if paginas and paginas > DIRECTO_MAX_PAGINAS:
+        logger.info(f"📄 {nombre} tiene {paginas} páginas (máximo {DIRECTO_MAX_PAGINAS} directo); se extrae su texto")
+        return VIA_TEXTO, paginas
+    if modo == "directo" or mime.startswith("image/"):
+        return VIA_DIRECTO, paginas
+    return VIA_SEGUN_TEXTO, paginas
+
+
+def parece_escaneado(texto: Optional[str], paginas: Optional[int]) -> bool:
+    """True si el texto extraído de un PDF es demasiado poco para sus páginas"""
+    return len((texto or "").strip()) < MIN_CARACTERES_POR_PAGINA * (paginas or 1)
+
+
+def crear_adjunto(nombre: str, contenido: bytes, paginas: Optional[int] = None) -> DocumentoAdjunto:
+    """Documento adjunto listo para el prompt multimodal"""
+    return DocumentoAdjunto(contenido, TIPOS_MIME[Path(nombre).suffix.lower()], nombre, paginas)
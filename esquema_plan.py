@@ -0,0 +1,691 @@
+"""
+Esquema del plan de estudio generado por Gemini
+El esquema se declara una sola vez (ESQUEMA_PLAN) y de él se derivan el
+formato compacto de transmisión (claves cortas y códigos para valores fijos),
+el response_schema que se envía a Gemini y el validador precompilado
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class Codigos:
+    """Valores fijos transmitidos como códigos cortos (se aceptan también los valores completos)"""
+
+    def __init__(self, codigos: Dict[str, str]):
+        self.codigos = codigos
+        self.inversos = {v: k for k, v in codigos.items()}
+
+    def expandir(self, valor: Any) -> Any:
+        if isinstance(valor, list):
+            return [self.expandir(v) for v in valor]
+        if isinstance(valor, str):
+            return self.codigos.get(valor.strip(), valor)
+        return valor
+
+    def compactar(self, valor: Any) -> Any:
+        if isinstance(valor, list):
+            return [self.compactar(v) for v in valor]
+        if isinstance(valor, str):
+            return self.inversos.get(valor, valor)
+        return valor
+
+
+TIPO_RECURSO = Codigos({"R": "RECURSO REAL", "P": "PROPUESTA CREATIVA"})
+ACCESO = Codigos({"G": "GRATUITO", "C": "REQUIERE COMPRA"})
+
+CAMPOS_FORMATIVOS = Codigos({
+    "LC": "Lenguaje y Comunicación",
+    "PM": "Pensamiento Matemático",
+    "EM": "Exploración y Comprensión del Mundo Natural y Social",
+    "SP": "Saberes y Pensamiento Científico",
+    "EN": "Ética, Naturaleza y Sociedades",
+    "HC": "De lo Humano y lo Comunitario",
+    "AR": "Artes",
+    "EF": "Educación Física",
+})
+
+EJES_ARTICULADORES = Codigos({
+    "IN": "Inclusión",
+    "PC": "Pensamiento Crítico",
+    "IC": "Interculturalidad Crítica",
+    "IG": "Igualdad de Género",
+    "VS": "Vida Saludable",
+    "LE": "Apropiación de las Culturas a través de la Lectura y la Escritura",
+    "AE": "Artes y Experiencias Estéticas",
+})
+
+# Niveles de exigencia de un campo en la validación
+ERROR = "error"
+ADVERTENCIA = "advertencia"
+
+TEXTO = "string"
+ENTERO = "integer"
+LISTA = "array"
+OBJETO = "object"
+
+_TIPOS_PYTHON = {TEXTO: str, ENTERO: int, LISTA: list, OBJETO: dict}
+_NOMBRES_TIPO = {TEXTO: "un texto", ENTERO: "un número", LISTA: "un arreglo", OBJETO: "un objeto"}
+
+
+class Campo:
+    """
+    Declaración de un campo del plan
+
+    Una sola declaración alimenta la expansión del formato compacto, el
+    response_schema que se envía a Gemini y el validador precompilado.
+
+    Args:
+        nombre: clave completa (la que usa el resto de la aplicación)
+        corta: clave en el formato compacto
+        tipo: TEXTO, ENTERO, LISTA u OBJETO
+        campos: sub-campos de un objeto o de los elementos de una lista de objetos
+        requerido: ERROR, ADVERTENCIA o None (opcional)
+        vacio: nivel con que se reporta un valor vacío ("" o [])
+        minimo: (cantidad, nivel) de elementos recomendados en una lista
+        codigos: valores fijos codificados en el formato compacto
+        enum: valores permitidos (se validan y se fijan en el response_schema)
+    """
+
+    __slots__ = ("nombre", "corta", "tipo", "campos", "requerido", "vacio", "minimo", "codigos", "enum")
+
+    def __init__(
+        self,
+        nombre: str,
+        corta: str,
+        tipo: str = TEXTO,
+        campos: Optional[List["Campo"]] = None,
+        requerido: Optional[str] = None,
+        vacio: Optional[str] = None,
+        minimo: Optional[Tuple[int, str]] = None,
+        codigos: Optional[Codigos] = None,
+        enum: Optional[List[str]] = None,
+    ):
+        self.nombre = nombre
+        self.corta = corta
+        self.tipo = tipo
+        self.campos = campos
+        self.requerido = requerido
+        self.vacio = vacio
+        self.minimo = minimo
+        self.codigos = codigos
+        self.enum = enum
+
+
+def _actividad(requeridos: List[str], nivel: str) -> List[Campo]:
+    """Campos de una actividad; cada momento (inicio/desarrollo/cierre) exige distintos"""
+    campos = [
+        Campo("nombre", "n"),
+        Campo("tipo", "tp"),
+        Campo("descripcion", "d"),
+        Campo("organizacion", "o"),
+        Campo("duracion", "t"),
+        Campo("materiales", "mt", LISTA),
+        Campo("aspectos_a_observar", "ob"),
+        Campo("preguntas_guia", "pg", LISTA),
+    ]
+    for campo in campos:
+        if campo.nombre in requeridos:
+            campo.requerido = nivel
+    _LISTAS_ACTIVIDAD.add(id(campos))
+    return campos
+
+
+# Listas de campos de actividades: con referencias, el response_schema les
+# agrega "ref" (ID de la biblioteca de actividades) y no exige sus campos
+_LISTAS_ACTIVIDAD = set()
+CLAVE_REFERENCIA = "ref"
+
+
+ESQUEMA_MODULO = [
+    Campo("numero", "i", ENTERO, requerido=ERROR),
+    Campo("nombre", "n", requerido=ERROR),
+    Campo("campo_formativo", "cf", requerido=ERROR, vacio=ADVERTENCIA, codigos=CAMPOS_FORMATIVOS),
+    Campo("ejes_articuladores", "ej", LISTA, requerido=ERROR, vacio=ADVERTENCIA, codigos=EJES_ARTICULADORES),
+    Campo("aprendizaje_esperado", "ae", requerido=ERROR),
+    Campo("tiempo_estimado", "t", requerido=ERROR),
+    Campo("actividad_inicio", "ai", OBJETO, requerido=ERROR,
+          campos=_actividad(["nombre", "descripcion", "duracion", "materiales"], ERROR)),
+    Campo("actividades_desarrollo", "ad", LISTA, requerido=ERROR, minimo=(2, ADVERTENCIA),
+          campos=_actividad(["nombre", "tipo", "descripcion", "duracion", "materiales"], ADVERTENCIA)),
+    Campo("actividad_cierre", "ac", OBJETO, requerido=ERROR,
+          campos=_actividad(["nombre", "descripcion", "duracion"], ADVERTENCIA)),
+    Campo("consejos_maestra", "cm", requerido=ADVERTENCIA),
+    Campo("variaciones", "va", requerido=ADVERTENCIA),
+    Campo("vinculo_familia", "vf", requerido=ADVERTENCIA),
+    Campo("evaluacion", "ev", requerido=ADVERTENCIA),
+]
+
+
+def _recurso(requeridos: List[str], tipo_codificado: bool = True) -> List[Campo]:
+    """Campos de un recurso educativo (cuento, canción o material digital)"""
+    campos = [
+        Campo("titulo", "ti"),
+        Campo("nombre", "n"),
+        Campo("autor", "au"),
+        Campo("tipo", "tp", codigos=TIPO_RECURSO if tipo_codificado else None,
+              enum=list(TIPO_RECURSO.inversos) if tipo_codificado else None),
+        Campo("acceso", "ac", codigos=ACCESO, enum=list(ACCESO.inversos)),
+        Campo("disponibilidad", "di"),
+        Campo("descripcion_breve", "d"),
+        Campo("uso_sugerido", "us"),
+    ]
+    for campo in campos:
+        if campo.nombre in requeridos:
+            campo.requerido = ADVERTENCIA
+    return campos
+
+
+ESQUEMA_PLAN = [
+    Campo("nombre_plan", "n", requerido=ERROR, vacio=ERROR),
+    Campo("grado", "g"),
+    Campo("edad_aprox", "ed"),
+    Campo("duracion_total", "dt"),
+    Campo("campo_formativo_principal", "cf", requerido=ADVERTENCIA, codigos=CAMPOS_FORMATIVOS),
+    Campo("ejes_articuladores_generales", "ej", LISTA, requerido=ADVERTENCIA, codigos=EJES_ARTICULADORES),
+    Campo("num_modulos", "nm", ENTERO),
+    Campo("modulos", "m", LISTA, requerido=ERROR, minimo=(1, ERROR), campos=ESQUEMA_MODULO),
+    Campo("recursos_educativos", "re", OBJETO, requerido=ADVERTENCIA, campos=[
+        Campo("materiales_generales", "mg", LISTA),
+        Campo("cuentos_recomendados", "cu", LISTA, campos=_recurso(["titulo", "tipo", "acceso"])),
+        Campo("canciones_recomendadas", "ca", LISTA, campos=_recurso(["titulo", "acceso"])),
+        Campo("materiales_digitales", "md", LISTA, campos=_recurso(["nombre", "acceso"], tipo_codificado=False)),
+    ]),
+    Campo("recomendaciones_ambiente", "ra"),
+    Campo("vinculacion_curricular", "vc", OBJETO, requerido=ADVERTENCIA, campos=[
+        Campo("campo_formativo_principal", "cf", requerido=ADVERTENCIA, codigos=CAMPOS_FORMATIVOS),
+        Campo("campos_secundarios", "cs", LISTA, codigos=CAMPOS_FORMATIVOS),
+        Campo("ejes_transversales", "et", LISTA, requerido=ADVERTENCIA, codigos=EJES_ARTICULADORES),
+        Campo("aprendizajes_clave", "ak", LISTA, requerido=ADVERTENCIA),
+    ]),
+]
+
+# Clave corta del arreglo de módulos (para el parser en streaming)
+CLAVE_MODULOS_COMPACTA = "m"
+
+
+# ----------------------------------------------------------------------------
+# Formato compacto <-> estructura completa
+# ----------------------------------------------------------------------------
+def _expandir_objeto(valor: Any, por_corta: Dict[str, Campo]) -> Any:
+    if not isinstance(valor, dict):
+        return valor
+    completo = {}
+    for clave, v in valor.items():
+        campo = por_corta.get(clave)
+        if campo is None:
+            # Clave desconocida o ya en formato completo: se conserva tal cual
+            completo[clave] = v
+        else:
+            completo[campo.nombre] = _expandir_valor(v, campo)
+    return completo
+
+
+def _expandir_valor(valor: Any, campo: Campo) -> Any:
+    if campo.codigos is not None:
+        return campo.codigos.expandir(valor)
+    if campo.campos is None:
+        return valor
+    por_corta = _INDICE_CORTAS[id(campo.campos)]
+    if isinstance(valor, list):
+        return [_expandir_objeto(v, por_corta) for v in valor]
+    return _expandir_objeto(valor, por_corta)
+
+
+def _compactar_objeto(valor: Any, por_nombre: Dict[str, Campo]) -> Any:
+    if not isinstance(valor, dict):
+        return valor
+    compacto = {}
+    for clave, v in valor.items():
+        campo = por_nombre.get(clave)
+        if campo is None:
+            compacto[clave] = v
+        else:
+            compacto[campo.corta] = _compactar_valor(v, campo)
+    return compacto
+
+
+def _compactar_valor(valor: Any, campo: Campo) -> Any:
+    if campo.codigos is not None:
+        return campo.codigos.compactar(valor)
+    if campo.campos is None:
+        return valor
+    por_nombre = _INDICE_NOMBRES[id(campo.campos)]
+    if isinstance(valor, list):
+        return [_compactar_objeto(v, por_nombre) for v in valor]
+    return _compactar_objeto(valor, por_nombre)
+
+
+def _indexar(campos: List[Campo], cortas: Dict, nombres: Dict) -> None:
+    cortas[id(campos)] = {c.corta: c for c in campos}
+    nombres[id(campos)] = {c.nombre: c for c in campos}
+    for campo in campos:
+        if campo.campos is not None:
+            _indexar(campo.campos, cortas, nombres)
+
+
+_INDICE_CORTAS: Dict[int, Dict[str, Campo]] = {}
+_INDICE_NOMBRES: Dict[int, Dict[str, Campo]] = {}
+_indexar(ESQUEMA_PLAN, _INDICE_CORTAS, _INDICE_NOMBRES)
+
+
+def expandir_plan(plan_compacto: Dict) -> Dict:
+    """Convierte un plan en formato compacto a la estructura completa"""
+    return _expandir_objeto(plan_compacto, _INDICE_CORTAS[id(ESQUEMA_PLAN)])
+
+
+def expandir_modulo(modulo_compacto: Dict) -> Dict:
+    """Convierte un módulo en formato compacto (usado en streaming)"""
+    return _expandir_objeto(modulo_compacto, _INDICE_CORTAS[id(ESQUEMA_MODULO)])
+
+
+def compactar_plan(plan: Dict) -> Dict:
+    """Convierte un plan completo al formato compacto (mediciones y pruebas)"""
+    return _compactar_objeto(plan, _INDICE_NOMBRES[id(ESQUEMA_PLAN)])
+
+
+def compactar_modulo(modulo: Dict) -> Dict:
+    """Convierte un módulo completo al formato compacto"""
+    return _compactar_objeto(modulo, _INDICE_NOMBRES[id(ESQUEMA_MODULO)])
+
+
+# ----------------------------------------------------------------------------
+# response_schema para Gemini
+# ----------------------------------------------------------------------------
+def _esquema_campo(campo: Campo, compacto: bool, referencias: bool = False) -> Dict:
+    if campo.tipo == OBJETO:
+        return _esquema_objeto(campo.campos, compacto, referencias)
+    if campo.tipo == LISTA:
+        elementos = _esquema_objeto(campo.campos, compacto, referencias) if campo.campos else {"type": TEXTO}
+        return {"type": LISTA, "items": elementos}
+    esquema = {"type": campo.tipo}
+    if campo.enum:
+        valores = [campo.codigos.inversos[v] for v in campo.enum] if compacto and campo.codigos else campo.enum
+        esquema.update({"format": "enum", "enum": valores})
+    return esquema
+
+
+def _esquema_objeto(campos: List[Campo], compacto: bool, referencias: bool = False) -> Dict:
+    clave = (lambda c: c.corta) if compacto else (lambda c: c.nombre)
+    esquema = {
+        "type": OBJETO,
+        "properties": {clave(c): _esquema_campo(c, compacto, referencias) for c in campos},
+        "required": [clave(c) for c in campos if c.requerido],
+    }
+    if referencias and id(campos) in _LISTAS_ACTIVIDAD:
+        # Una referencia reemplaza la actividad: sus campos se validan ya expandida
+        esquema["properties"][CLAVE_REFERENCIA] = {"type": TEXTO}
+        esquema["required"] = []
+    return esquema
+
+
+def esquema_respuesta(compacto: bool = False, solo: Optional[List[str]] = None, referencias: bool = False) -> Dict:
+    """
+    response_schema (subconjunto OpenAPI) del plan, en formato completo o compacto
+
+    Los campos con nivel ERROR o ADVERTENCIA se declaran requeridos, así
+    Gemini los genera siempre. Con `solo` (nombres completos) se limita a
+    esos campos del nivel superior, todos requeridos (continuaciones). Con
+    `referencias`, cada actividad puede ser solo {"ref": ID} de la
+    biblioteca de actividades.
+    """
+    if solo is None:
+        return _esquema_objeto(ESQUEMA_PLAN, compacto, referencias)
+    esquema = _esquema_objeto([c for c in ESQUEMA_PLAN if c.nombre in solo], compacto, referencias)
+    esquema["required"] = list(esquema["properties"])
+    return esquema
+
+
+# Campos de cada módulo en el esqueleto del plan (generación en dos fases)
+CAMPOS_GUION_MODULO = [
+    "numero", "nombre", "campo_formativo", "ejes_articuladores", "aprendizaje_esperado", "tiempo_estimado",
+]
+
+
+def esquema_esqueleto(compacto: bool = False) -> Dict:
+    """response_schema del plan con solo el guion de cada módulo (fase 1 de la generación en dos fases)"""
+    esquema = _esquema_objeto(ESQUEMA_PLAN, compacto)
+    guion = _esquema_objeto([c for c in ESQUEMA_MODULO if c.nombre in CAMPOS_GUION_MODULO], compacto)
+    esquema["properties"][clave_salida("modulos", compacto)]["items"] = guion
+    return esquema
+
+
+def esqueleto_de_plan(plan: Dict) -> Dict:
+    """
+    Reduce un plan ya generado (formato completo) a su esqueleto
+
+    Conserva los campos del esquema en el nivel superior (sin metadatos como
+    plan_id o usuario) y solo el guion de cada módulo, para regenerar un
+    módulo sin reenviar el detalle de los demás.
+    """
+    esqueleto = {c.nombre: plan[c.nombre] for c in ESQUEMA_PLAN if c.nombre in plan}
+    esqueleto["modulos"] = [
+        {c: modulo[c] for c in CAMPOS_GUION_MODULO if c in modulo}
+        for modulo in plan.get("modulos", [])
+    ]
+    return esqueleto
+
+
+def esquema_modulo(compacto: bool = False, referencias: bool = False) -> Dict:
+    """response_schema de un módulo completo (fase 2 de la generación en dos fases)"""
+    return _esquema_objeto(ESQUEMA_MODULO, compacto, referencias)
+
+
+def clave_salida(nombre: str, compacto: bool) -> str:
+    """Clave con que aparece un campo del nivel superior en la respuesta de Gemini"""
+    return _INDICE_NOMBRES[id(ESQUEMA_PLAN)][nombre].corta if compacto else nombre
+
+
+def clave_salida_modulo(nombre: str, compacto: bool) -> str:
+    """Clave con que aparece un campo de un módulo en la respuesta de Gemini"""
+    return _INDICE_NOMBRES[id(ESQUEMA_MODULO)][nombre].corta if compacto else nombre
+
+
+# ----------------------------------------------------------------------------
+# Validador precompilado
+# ----------------------------------------------------------------------------
+_FALTA = object()
+
+
+def _ruta_texto(ruta: Optional[tuple]) -> str:
+    """Convierte la ruta (padre, nombre, índice) en texto: 'modulos[2].actividad_inicio'"""
+    partes = []
+    while ruta is not None:
+        ruta, nombre, indice = ruta
+        partes.append(nombre if indice is None else f"{nombre}[{indice}]")
+    return ".".join(reversed(partes))
+
+
+def _hallazgo(nivel: str, ruta: Optional[tuple], codigo: str, mensaje: str) -> Dict:
+    texto = _ruta_texto(ruta) or "plan"
+    return {"nivel": nivel, "ruta": texto, "codigo": codigo, "mensaje": f"{texto}: {mensaje}"}
+
+
+def _codigo_campo(campo: Campo, compilar: Callable[[List[Campo]], str], constantes: Dict) -> List[str]:
+    """Líneas de Python que validan un campo (se insertan en la función del objeto)"""
+    nombre = repr(campo.nombre)
+    tipo = _TIPOS_PYTHON[campo.tipo].__name__
+    ruta = f"(ruta, {nombre}, None)"
+    # Un tipo estructural incorrecto es tan grave como la ausencia del campo
+    nivel_tipo = (campo.requerido or ADVERTENCIA) if campo.tipo in (LISTA, OBJETO) else ADVERTENCIA
+    mensaje_tipo = repr(f"debe ser {_NOMBRES_TIPO[campo.tipo]}")
+
+    # type() y no isinstance(): el JSON no produce subclases y así se excluye bool de los enteros
+    lineas = [f"valor = obtener({nombre}, FALTA)", f"if type(valor) is not {tipo}:"]
+    if campo.requerido:
+        lineas += [
+            "    if valor is FALTA:",
+            f"        hallazgos.append(hallazgo({campo.requerido!r}, {ruta}, 'faltante', 'campo faltante'))",
+            "    else:",
+            f"        hallazgos.append(hallazgo({nivel_tipo!r}, {ruta}, 'tipo', {mensaje_tipo}))",
+        ]
+    else:
+        lineas += [
+            "    if valor is not FALTA:",
+            f"        hallazgos.append(hallazgo({nivel_tipo!r}, {ruta}, 'tipo', {mensaje_tipo}))",
+        ]
+
+    cuerpo = []
+    if campo.vacio:
+        cuerpo += ["if not valor:", f"    hallazgos.append(hallazgo({campo.vacio!r}, {ruta}, 'vacio', 'está vacío'))"]
+    if campo.minimo:
+        minimo, nivel = campo.minimo
+        cuerpo += [
+            f"{'elif' if campo.vacio else 'if'} len(valor) < {minimo}:",
+            f"    hallazgos.append(hallazgo({nivel!r}, {ruta}, 'minimo', 'se esperan al menos {minimo} elementos'))",
+        ]
+    if campo.enum:
+        constante = f"ENUM_{len(constantes)}"
+        constantes[constante] = frozenset(campo.enum)
+        mensaje = repr("debe ser " + " o ".join(f"'{v}'" for v in campo.enum))
+        cuerpo += [
+            f"if valor not in {constante}:",
+            f"    hallazgos.append(hallazgo('advertencia', {ruta}, 'enum', {mensaje}))",
+        ]
+    if campo.campos:
+        interno = compilar(campo.campos)
+        if campo.tipo == LISTA:
+            # Índices desde 1, como se numeran módulos y actividades
+            cuerpo += [
+                "for indice, elemento in enumerate(valor, 1):",
+                "    if type(elemento) is dict:",
+                f"        {interno}(elemento, (ruta, {nombre}, indice), hallazgos)",
+                "    else:",
+                f"        hallazgos.append(hallazgo({nivel_tipo!r}, (ruta, {nombre}, indice), 'tipo', 'debe ser un objeto'))",
+            ]
+        else:
+            cuerpo.append(f"{interno}(valor, {ruta}, hallazgos)")
+
+    if cuerpo:
+        lineas.append("else:")
+        lineas += [f"    {linea}" for linea in cuerpo]
+    return lineas
+
+
+def _compilar_validador(esquema: List[Campo]) -> Callable:
+    """
+    Genera y compila una función de Python por cada objeto del esquema
+
+    Las comprobaciones quedan escritas en línea (sin recorrer la declaración
+    en cada validación) y las rutas de los hallazgos solo se arman cuando hay
+    uno, así validar un plan correcto cuesta unas pocas búsquedas por campo.
+    """
+    fuentes: List[str] = []
+    constantes: Dict[str, Any] = {"FALTA": _FALTA, "hallazgo": _hallazgo}
+
+    def compilar(campos: List[Campo]) -> str:
+        nombre_funcion = f"_validar_{len(fuentes)}"
+        fuentes.append("")  # reserva el lugar antes de compilar los objetos anidados
+        indice = len(fuentes) - 1
+        lineas = [f"def {nombre_funcion}(objeto, ruta, hallazgos):", "    obtener = objeto.get"]
+        for campo in campos:
+            lineas += [f"    {linea}" for linea in _codigo_campo(campo, compilar, constantes)]
+        fuentes[indice] = "\n".join(lineas)
+        return nombre_funcion
+
+    raiz = compilar(esquema)
+    espacio = dict(constantes)
+    exec(compile("\n\n".join(fuentes), "<esquema_plan>", "exec"), espacio)
+    return espacio[raiz]
+
+
+_VALIDADOR_PLAN = _compilar_validador(ESQUEMA_PLAN)
+
+
+def validar_plan(plan: Dict) -> Dict:
+    """
+    Valida el plan (estructura completa) contra el esquema declarado
+
+    Returns:
+        {'valido', 'errores', 'advertencias', 'total_errores',
+        'total_advertencias', 'hallazgos'}; 'hallazgos' trae cada problema
+        como {'nivel', 'ruta', 'codigo', 'mensaje'}
+    """
+    hallazgos: List[Dict] = []
+    if isinstance(plan, dict):
+        _VALIDADOR_PLAN(plan, None, hallazgos)
+    else:
+        hallazgos.append(_hallazgo(ERROR, None, "tipo", "debe ser un objeto"))
+
+    errores = [h["mensaje"] for h in hallazgos if h["nivel"] == ERROR]
+    advertencias = [h["mensaje"] for h in hallazgos if h["nivel"] == ADVERTENCIA]
+    return {
+        'valido': len(errores) == 0,
+        'errores': errores,
+        'advertencias': advertencias,
+        'total_errores': len(errores),
+        'total_advertencias': len(advertencias),
+        'hallazgos': hallazgos,
+    }
+
+
+def _describir_codigos(codigos: Codigos) -> str:
+    return ", ".join(f'"{k}"={v}' for k, v in codigos.codigos.items())
+
+
+def _lista_codigos() -> List[str]:
+    return [
+        f"- Campos formativos: {_describir_codigos(CAMPOS_FORMATIVOS)}",
+        f"- Ejes articuladores: {_describir_codigos(EJES_ARTICULADORES)}",
+        f"- tipo de cuentos/canciones: {_describir_codigos(TIPO_RECURSO)}",
+        f"- acceso: {_describir_codigos(ACCESO)}",
+    ]
+
+
+# Sección de formato de salida del prompt (estructura completa, formato original)
+FORMATO_SALIDA_COMPLETO = """
+# FORMATO DE SALIDA REQUERIDO (JSON estricto)
+Genera ÚNICAMENTE un objeto JSON válido con esta estructura exacta.
+
+IMPORTANTE SOBRE EL FORMATO JSON:
+- NO uses saltos de línea dentro de strings (textos entre comillas)
+- Asegúrate de que TODAS las propiedades tengan comas EXCEPTO la última de cada objeto
+- Verifica que todos los corchetes [] y llaves {} estén balanceados
+- NO agregues comentarios dentro del JSON
+- NO uses caracteres especiales sin escapar
+
+{
+  "nombre_plan": "Nombre creativo y atractivo del plan",
+  "grado": "2° Preescolar",
+  "edad_aprox": "4-5 años",
+  "duracion_total": "Tiempo total estimado del plan (ej: 4 semanas)",
+  "campo_formativo_principal": "Campo formativo dominante del plan completo",
+  "ejes_articuladores_generales": ["Lista de ejes que atraviesan todo el plan"],
+  "num_modulos": 6,
+  
+  "modulos": [
+    {
+      "numero": 1,
+      "nombre": "Nombre divertido y atractivo del módulo",
+      "campo_formativo": "Campo formativo específico de este módulo",
+      "ejes_articuladores": ["Lista de ejes que se trabajan en este módulo"],
+      "aprendizaje_esperado": "¿Qué aprenderán los niños? (basado en el plan oficial)",
+      "tiempo_estimado": "Duración del módulo (ej: 1 semana, 3 días)",
+      
+      "actividad_inicio": {
+        "nombre": "Nombre llamativo de la actividad de inicio",
+        "descripcion": "Descripción clara y paso a paso de la actividad motivadora",
+        "duracion": "10-15 minutos",
+        "materiales": ["Lista de materiales específicos y accesibles"],
+        "organizacion": "individual/parejas/equipos/grupo completo"
+      },
+      
+      "actividades_desarrollo": [
+        {
+          "nombre": "Nombre de la actividad principal",
+          "tipo": "juego/arte/exploracion/movimiento/cuento/experimento",
+          "descripcion": "Descripción paso a paso de la actividad lúdica",
+          "organizacion": "individual/parejas/equipos pequeños/grupo completo",
+          "duracion": "15-25 minutos",
+          "materiales": ["Lista de materiales necesarios"],
+          "aspectos_a_observar": "Qué observar del desarrollo de los niños durante la actividad"
+        }
+      ],
+      
+      "actividad_cierre": {
+        "nombre": "Nombre de la actividad de cierre",
+        "descripcion": "Descripción de la actividad para reflexionar sobre lo aprendido",
+        "duracion": "10 minutos",
+        "preguntas_guia": ["Pregunta 1 para los niños", "Pregunta 2", "Pregunta 3"],
+        "materiales": ["Materiales si los requiere"]
+      },
+      
+      "consejos_maestra": "Tips prácticos para la implementación, manejo del grupo y anticipación de dificultades",
+      "variaciones": "Sugerencias concretas para adaptar según el nivel o interés de los niños",
+      "vinculo_familia": "Actividad sencilla y específica que pueden hacer en casa para reforzar el aprendizaje",
+      "evaluacion": "Cómo observar el logro del aprendizaje de forma natural y lúdica (indicadores concretos)"
+    }
+  ],
+  
+  "recursos_educativos": {
+    "materiales_generales": ["Lista consolidada de materiales más usados en el plan"],
+    "cuentos_recomendados": [
+      {
+        "titulo": "Título completo del cuento",
+        "autor": "Nombre del autor (si aplica)",
+        "tipo": "RECURSO REAL o PROPUESTA CREATIVA",
+        "acceso": "GRATUITO o REQUIERE COMPRA",
+        "disponibilidad": "Dónde conseguirlo",
+        "descripcion_breve": "Para qué sirve en el contexto del plan"
+      }
+    ],
+    "canciones_recomendadas": [
+      {
+        "titulo": "Título de la canción",
+        "tipo": "RECURSO REAL o PROPUESTA CREATIVA",
+        "acceso": "GRATUITO o REQUIERE COMPRA",
+        "disponibilidad": "Dónde encontrarla (ej: YouTube, tradicional mexicana)",
+        "uso_sugerido": "En qué momento o actividad usarla"
+      }
+    ],
+    "materiales_digitales": [
+      {
+        "nombre": "Nombre del recurso digital",
+        "tipo": "video/juego/app/plataforma",
+        "acceso": "GRATUITO o REQUIERE COMPRA",
+        "descripcion_breve": "Qué ofrece y cómo usarlo"
+      }
+    ]
+  },
+  
+  "recomendaciones_ambiente": "Sugerencias específicas y prácticas para organizar el espacio del aula",
+  "vinculacion_curricular": {
+    "campo_formativo_principal": "Campo dominante",
+    "campos_secundarios": ["Otros campos que se integran"],
+    "ejes_transversales": ["Ejes articuladores trabajados"],
+    "aprendizajes_clave": ["Lista de aprendizajes esperados principales del plan"]
+  }
+}
+"""
+
+# Sección de formato de salida para el prompt en modo compacto
+FORMATO_SALIDA_COMPACTO = """
+# FORMATO DE SALIDA REQUERIDO (JSON estricto, CLAVES CORTAS)
+Genera ÚNICAMENTE un objeto JSON válido. Para ahorrar espacio usa EXACTAMENTE
+estas claves cortas y códigos (el contenido de los textos sigue en español completo):
+
+CÓDIGOS DE VALORES FIJOS (usa el código, no el texto):
+""" + "\n".join(_lista_codigos()) + """
+Si un campo formativo o eje no está en la lista, escribe su nombre completo.
+
+IMPORTANTE SOBRE EL FORMATO JSON:
+- NO uses saltos de línea dentro de strings
+- NO agregues comentarios ni claves distintas a las indicadas
+- Omite "au" (autor) si no aplica
+
+{
+  "n": "Nombre creativo del plan",
+  "g": "2° Preescolar",
+  "ed": "4-5 años",
+  "dt": "Duración total (ej: 4 semanas)",
+  "cf": "Código del campo formativo dominante",
+  "ej": ["Códigos de ejes que atraviesan todo el plan"],
+  "nm": 6,
+  "m": [
+    {
+      "i": 1,
+      "n": "Nombre divertido del módulo",
+      "cf": "Código del campo formativo del módulo",
+      "ej": ["Códigos de ejes del módulo"],
+      "ae": "Aprendizaje esperado (basado en el plan oficial)",
+      "t": "Duración del módulo",
+      "ai": {"n": "Nombre de la actividad de inicio", "d": "Descripción paso a paso", "t": "10-15 minutos", "mt": ["Materiales"], "o": "individual/parejas/equipos/grupo completo"},
+      "ad": [
+        {"n": "Nombre de la actividad", "tp": "juego/arte/exploracion/movimiento/cuento/experimento", "d": "Descripción paso a paso", "o": "Organización", "t": "15-25 minutos", "mt": ["Materiales"], "ob": "Qué observar del desarrollo de los niños"}
+      ],
+      "ac": {"n": "Nombre de la actividad de cierre", "d": "Descripción", "t": "10 minutos", "pg": ["Preguntas guía"], "mt": ["Materiales"]},
+      "cm": "Consejos para la maestra",
+      "va": "Variaciones para adaptar la actividad",
+      "vf": "Actividad para hacer en casa con la familia",
+      "ev": "Cómo evaluar el logro de forma lúdica"
+    }
+  ],
+  "re": {
+    "mg": ["Materiales más usados en el plan"],
+    "cu": [{"ti": "Título del cuento", "au": "Autor", "tp": "R o P", "ac": "G o C", "di": "Dónde conseguirlo", "d": "Para qué sirve"}],
+    "ca": [{"ti": "Título de la canción", "tp": "R o P", "ac": "G o C", "di": "Dónde encontrarla", "us": "Uso sugerido"}],
+    "md": [{"n": "Nombre del recurso digital", "tp": "video/juego/app/plataforma", "ac": "G o C", "d": "Qué ofrece"}]
+  },
+  "ra": "Recomendaciones para organizar el ambiente del aula",
+  "vc": {"cf": "Código del campo dominante", "cs": ["Códigos de otros campos"], "et": ["Códigos de ejes"], "ak": ["Aprendizajes clave del plan"]}
+}
+"""
@@ -0,0 +1,69 @@
+"""
+División de textos extraídos en fragmentos de tamaño acotado
+Respeta los límites naturales del documento (páginas y párrafos) siempre que puede
+"""
+
+import re
+from typing import List
+
+# Límites de página: el marcador que agrega la extracción de PDFs (PruebaOcr)
+# o el salto de página (\f) que deja la compactación de texto
+PATRON_PAGINA = re.compile(r"\n?--- Página \d+ ---\n|\f")
+
+
+def dividir_en_bloques(texto: str) -> List[str]:
+    """Divide el texto en páginas (si tiene marcadores) y luego en párrafos"""
+    bloques = []
+    for pagina in PATRON_PAGINA.split(texto):
+        bloques.extend(p for p in re.split(r"\n\s*\n", pagina) if p.strip())
+    return bloques
+
+
+def dividir_en_fragmentos(texto: str, max_caracteres: int) -> List[str]:
+    """
+    Agrupa bloques consecutivos en fragmentos de hasta max_caracteres
+
+    Un bloque más largo que el límite se corta por líneas y, si hace falta,
+    por caracteres, para que ningún fragmento lo exceda.
+    """
+    fragmentos: List[str] = []
+    actual: List[str] = []
+    tamano = 0
+
+    def cerrar():
+        nonlocal actual, tamano
+        if actual:
+            fragmentos.append("\n\n".join(actual))
+        actual, tamano = [], 0
+
+    for bloque in dividir_en_bloques(texto):
+        partes = [bloque] if len(bloque) <= max_caracteres else _cortar(bloque, max_caracteres)
+        for parte in partes:
+            if tamano + len(parte) + 2 > max_caracteres:
+                cerrar()
+            actual.append(parte)
+            tamano += len(parte) + 2
+    cerrar()
+
+    return fragmentos
+
+
+def _cortar(bloque: str, max_caracteres: int) -> List[str]:
+    """Corta un bloque demasiado largo por líneas, o por caracteres como último recurso"""
+    partes: List[str] = []
+    actual = ""
+    for linea in bloque.split("\n"):
+        while len(linea) > max_caracteres:
+            if actual:
+                partes.append(actual)
+                actual = ""
+            partes.append(linea[:max_caracteres])
+            linea = linea[max_caracteres:]
+        if len(actual) + len(linea) + 1 > max_caracteres:
+            partes.append(actual)
+            actual = linea
+        else:
+            actual = f"{actual}\n{linea}" if actual else linea
+    if actual:
+        partes.append(actual)
+    return [p for p in partes if p.strip()]
@@ -355,8 +355,8 @@ async function processPlan() {
             formData.append('diagnostico_file', diagnosticoFile);
         }
         
-        // Enviar a la API
-        const response = await fetch(`${API_BASE}/plans/generate`, {
+        // Enviar a la API (streaming: los módulos llegan conforme se generan)
+        const response = await fetch(`${API_BASE}/plans/generate/stream`, {
             method: 'POST',
             headers: {
                 'Authorization': `Bearer ${currentToken}`
@@ -369,7 +369,7 @@ async function processPlan() {
             throw new Error(error.detail || 'Error generando plan');
         }
         
-        const result = await response.json();
+        const result = await readPlanStream(response);
         
         hideLoading();
         
@@ -398,6 +398,53 @@ async function processPlan() {
     }
 }
 
+// Lee los eventos SSE de /plans/generate/stream y devuelve el resultado final
+async function readPlanStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let modulosRecibidos = 0;
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        
+        buffer += decoder.decode(value, { stream: true });
+        
+        // Cada evento termina con una línea en blanco
+        let separador;
+        while ((separador = buffer.indexOf('\n\n')) !== -1) {
+            const bloque = buffer.slice(0, separador);
+            buffer = buffer.slice(separador + 2);
+            
+            let evento = 'message';
+            let datos = '';
+            bloque.split('\n').forEach(linea => {
+                if (linea.startsWith('event:')) evento = linea.slice(6).trim();
+                else if (linea.startsWith('data:')) datos += linea.slice(5).trim();
+            });
+            
+            const payload = datos ? JSON.parse(datos) : {};
+            
+            if (evento === 'inicio') {
+                showLoadingWithProgress('Generando plan con IA...', 'Analizando el plan de estudios');
+            } else if (evento === 'modulo') {
+                modulosRecibidos++;
+                showLoadingWithProgress(
+                    `Módulo ${modulosRecibidos} listo`,
+                    payload.nombre || 'Generando los siguientes módulos...'
+                );
+            } else if (evento === 'plan') {
+                return payload;
+            } else if (evento === 'error') {
+                throw new Error(payload.error || 'Error generando plan');
+            }
+        }
+    }
+    
+    throw new Error('La conexión se cerró antes de recibir el plan');
+}
+
 // ===== CARGA Y VISUALIZACIÓN DE PLANES =====
 
 async function loadPlanes() {
@@ -3,7 +3,6 @@ Módulo mejorado para gestión de archivos en Google Cloud Storage
 Nueva estructura: users/{email}/uploads|processed/{año}/{mes}/archivo
 """
 
-from google.cloud import storage
 from pathlib import Path
 from typing import List, Optional, Dict
 import os
@@ -25,6 +24,9 @@ class GCSStorageManagerV2:
         Args:
             bucket_name: Nombre del bucket en GCS
         """
+        # Importación diferida: google-cloud-storage es pesado de importar
+        from google.cloud import storage
+        
         # Configurar credenciales
         credentials_json_str = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON")
         if credentials_json_str:
@@ -205,6 +207,65 @@ class GCSStorageManagerV2:
                 'error': str(e)
             }
     
+    def obtener_archivo_con_generacion(self, email: str, nombre_archivo: str,
+                                       es_procesado: bool = False) -> Optional[Dict]:
+        """
+        Obtiene el contenido de un archivo junto con su generación en GCS
+
+        La generación identifica la versión leída; se usa después con
+        reemplazar_si_no_cambio para escribir solo si nadie la modificó.
+
+        Returns:
+            Dict con 'contenido', 'path' y 'generation', o None si no existe
+        """
+        try:
+            usuario_normalizado = self._normalizar_email(email)
+            tipo_carpeta = "processed" if es_procesado else "uploads"
+            prefijo = f"users/{usuario_normalizado}/{tipo_carpeta}/"
+
+            for blob in self.bucket.list_blobs(prefix=prefijo):
+                if blob.name.endswith(nombre_archivo):
+                    # Se descarga exactamente la generación listada
+                    contenido = blob.download_as_bytes(if_generation_match=blob.generation)
+                    return {
+                        'contenido': contenido,
+                        'path': blob.name,
+                        'generation': blob.generation
+                    }
+
+            return None
+
+        except Exception as e:
+            print(f"Error obteniendo archivo: {e}")
+            return None
+
+    def reemplazar_si_no_cambio(self, ruta_gcs: str, contenido: bytes, generacion: int,
+                                content_type: str = "application/json") -> Dict:
+        """
+        Reemplaza un archivo solo si sigue en la generación indicada
+
+        La precondición if_generation_match hace la lectura-modificación-escritura
+        atómica: si otra petición lo reescribió mientras tanto, GCS rechaza la
+        escritura y se devuelve 'conflicto': True para que el llamador relea.
+        """
+        try:
+            blob = self.bucket.blob(ruta_gcs)
+            blob.upload_from_string(contenido, content_type=content_type, if_generation_match=generacion)
+            return {
+                'success': True,
+                'path': ruta_gcs,
+                'generation': blob.generation
+            }
+        except Exception as e:
+            conflicto = type(e).__name__ == "PreconditionFailed"
+            if not conflicto:
+                print(f"Error reemplazando archivo: {e}")
+            return {
+                'success': False,
+                'conflicto': conflicto,
+                'error': str(e)
+            }
+
     def listar_archivos(self, email: str, tipo: str = "uploads") -> List[Dict]:
         """
         Lista todos los archivos de un usuario
@@ -365,4 +426,42 @@ class GCSStorageManagerV2:
             
         except Exception as e:
             print(f"Error generando URL: {e}")
-            return None
\ No newline at end of file
+            return None
+    
+    # ========== CACHÉ DE GENERACIÓN ==========
+    
+    def _ruta_cache(self, nombre_cache: str, clave: str) -> str:
+        """
+        Ruta de una entrada de caché compartida (fuera de las carpetas de usuario)
+        
+        Returns:
+            Ruta: cache/{nombre_cache}/{clave}.json
+        """
+        return f"cache/{nombre_cache}/{clave}.json"
+    
+    def leer_cache(self, nombre_cache: str, clave: str) -> Optional[bytes]:
+        """
+        Lee una entrada de caché
+        
+        Returns:
+            Contenido en bytes o None si no existe
+        """
+        try:
+            blob = self.bucket.blob(self._ruta_cache(nombre_cache, clave))
+            return blob.download_as_bytes()
+        except Exception as e:
+            if type(e).__name__ != "NotFound":
+                print(f"Error leyendo caché: {e}")
+            return None
+    
+    def guardar_cache(self, nombre_cache: str, clave: str, contenido: bytes) -> bool:
+        """
+        Guarda (o reemplaza) una entrada de caché
+        """
+        try:
+            blob = self.bucket.blob(self._ruta_cache(nombre_cache, clave))
+            blob.upload_from_string(contenido, content_type="application/json")
+            return True
+        except Exception as e:
+            print(f"Error guardando caché: {e}")
+            return False
@@ -2,19 +2,40 @@
 Servicio de integración con Google Gemini AI para generación de planes de estudio
 Optimizado para segundo grado de preescolar con enfoque lúdico
 Incluye: Campos Formativos, Ejes Articuladores y Recursos Verificados
-Versión mejorada con corrección de errores JSON y retry automático
+Versión mejorada con corrección de errores JSON, reintentos, timeouts y circuit breaker
 """
 
 import os
 import json
+import asyncio
 import logging
 import time
-import re
-from typing import Dict, Optional
-import google.generativeai as genai
+import hashlib
+import copy
+from contextlib import AsyncExitStack, asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, Optional, Tuple, Union
 from dotenv import load_dotenv
-from json_repair import repair_json
-from tenacity import retry, stop_after_attempt, wait_exponential
+from json_stream import ModulosStreamParser
+from json_lenient import cargar_json, reparar_json
+from plan_cache import PlanCache, calcular_clave
+from single_flight import SingleFlight
+from resiliencia import CircuitBreaker, CircuitoAbiertoError, PoliticaResiliencia, es_reintentable
+from gobernador_cuota import CARACTERES_POR_TOKEN, CuotaExcedidaError, GobernadorCuota, estimar_tokens
+from fragmentos import dividir_en_fragmentos
+from recuperacion_curricular import seleccionar_secciones
+from proveedores_llm import (
+    DocumentoAdjunto, PromptMultimodal, RespuestaLLM, crear_proveedor, tokens_de_prompt
+)
+from biblioteca_actividades import (
+    BIBLIOTECA_ACTIVIDADES, BIBLIOTECA_ACTIVIDADES_PATH, BIBLIOTECA_EN_PROMPT, BIBLIOTECA_EN_PROMPT_MODULO,
+    BibliotecaActividades
+)
+from esquema_plan import (
+    CAMPOS_GUION_MODULO, CLAVE_MODULOS_COMPACTA, ESQUEMA_PLAN, FORMATO_SALIDA_COMPACTO,
+    FORMATO_SALIDA_COMPLETO, clave_salida, clave_salida_modulo, compactar_plan, esqueleto_de_plan,
+    esquema_esqueleto, esquema_modulo, esquema_respuesta, expandir_modulo, expandir_plan, validar_plan
+)
 
 load_dotenv()
 
@@ -26,40 +47,211 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     logger.warning("⚠️ GEMINI_API_KEY no configurada")
 
-genai.configure(api_key=GEMINI_API_KEY)
-
 # Configuración del modelo optimizada para preescolar
 MODEL_NAME = "gemini-2.5-flash"
 MAX_OUTPUT_TOKENS = 16000  # Aumentado para planes complejos
 TEMPERATURE = 0.8  # Mayor creatividad para actividades lúdicas
 
+GENERATION_CONFIG = {
+    "temperature": TEMPERATURE,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": MAX_OUTPUT_TOKENS,
+    "response_mime_type": "application/json",  # ⭐ FUERZA JSON VÁLIDO
+}
+
+# Versión del prompt: incrementarla invalida la caché de planes generados
+PROMPT_VERSION = "preescolar-v2"
+
+# Vigencia de los planes cacheados (por defecto 7 días)
+PLAN_CACHE_TTL_SECONDS = int(os.getenv("PLAN_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Máximo de llamadas simultáneas a Gemini por proceso (el resto espera turno)
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+
+# Resiliencia: timeout por intento, presupuesto total, reintentos y circuit breaker
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "120"))
+GEMINI_DEADLINE_SECONDS = float(os.getenv("GEMINI_DEADLINE_SECONDS", "300"))
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "3"))
+GEMINI_BACKOFF_BASE_SECONDS = 2.0
+GEMINI_BACKOFF_MAX_SECONDS = 30.0
+GEMINI_CB_FAILURES = int(os.getenv("GEMINI_CB_FAILURES", "5"))
+GEMINI_CB_COOLDOWN_SECONDS = float(os.getenv("GEMINI_CB_COOLDOWN_SECONDS", "60"))
+
+# Cuota del proyecto en Gemini (solicitudes y tokens por minuto) y fila de espera
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "10"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "250000"))
+GEMINI_QUOTA_MAX_WAIT_SECONDS = float(os.getenv("GEMINI_QUOTA_MAX_WAIT_SECONDS", "60"))
+GEMINI_QUOTA_MAX_QUEUE = int(os.getenv("GEMINI_QUOTA_MAX_QUEUE", "20"))
+# Tokens de salida que se reservan por llamada hasta conocer el uso real
+GEMINI_EXPECTED_OUTPUT_TOKENS = int(os.getenv("GEMINI_EXPECTED_OUTPUT_TOKENS", "8000"))
+
+# Presupuesto de tokens del prompt; las entradas mayores se condensan con map-reduce
+GEMINI_INPUT_TOKEN_BUDGET = int(os.getenv("GEMINI_INPUT_TOKEN_BUDGET", "200000"))
+GEMINI_CHUNK_TOKENS = int(os.getenv("GEMINI_CHUNK_TOKENS", "30000"))
+# Tope de fragmentos por nivel: documentos enormes usan fragmentos más grandes
+# en lugar de más llamadas (cada una consume RPM)
+GEMINI_MAP_MAX_FRAGMENTS = int(os.getenv("GEMINI_MAP_MAX_FRAGMENTS", "8"))
+MAP_REDUCE_MAX_NIVELES = 3
+
+# Recuperación local (BM25): planes más largos que este presupuesto se reducen
+# a sus secciones relevantes antes de cualquier otra cosa
+CURRICULUM_RETRIEVAL = os.getenv("CURRICULUM_RETRIEVAL", "1") == "1"
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "40000"))
+
+# Formato de la respuesta de Gemini: "completo" (claves descriptivas) o
+# "compacto" (claves cortas y códigos, menos tokens de salida); el resultado
+# se expande siempre a la estructura completa
+GEMINI_OUTPUT_SCHEMA = os.getenv("GEMINI_OUTPUT_SCHEMA", "completo")
+ESQUEMA_COMPACTO = GEMINI_OUTPUT_SCHEMA == "compacto"
+
+# Envía el esquema del plan como response_schema: Gemini genera JSON con la
+# estructura correcta por construcción
+GEMINI_RESPONSE_SCHEMA = os.getenv("GEMINI_RESPONSE_SCHEMA", "1") == "1"
+if GEMINI_RESPONSE_SCHEMA:
+    GENERATION_CONFIG["response_schema"] = esquema_respuesta(
+        compacto=ESQUEMA_COMPACTO, referencias=BIBLIOTECA_ACTIVIDADES
+    )
+
+# Respuestas cortadas por max_output_tokens: cuántas llamadas de continuación
+# se hacen para pedir los módulos y secciones que faltaron
+GEMINI_MAX_CONTINUATIONS = int(os.getenv("GEMINI_MAX_CONTINUATIONS", "2"))
+# Secciones posteriores a los módulos: se piden siempre en la continuación
+# porque pudieron quedar a medias
+SECCIONES_FINALES = ["recursos_educativos", "recomendaciones_ambiente", "vinculacion_curricular"]
+
+# Generación en dos fases: primero el esqueleto del plan (guion de cada
+# módulo) y luego el detalle de todos los módulos en llamadas concurrentes
+GEMINI_TWO_PHASE = os.getenv("GEMINI_TWO_PHASE", "0") == "1"
+
+# Configuración de las llamadas de extracción (fase map): texto breve y fiel
+EXTRACTION_CONFIG = {
+    "temperature": 0.2,
+    "max_output_tokens": 4000,
+    "response_mime_type": "text/plain",
+    "response_schema": None,  # anula el esquema del plan de la configuración del modelo
+}
+
+# Enrutamiento por tamaño: las llamadas pequeñas van a un modelo rápido y las
+# grandes al completo (MODEL_NAME); si el nivel elegido está saturado o falla,
+# la llamada se repite en el otro. GEMINI_FAST_MODEL vacío desactiva el rápido
+GEMINI_FAST_MODEL = os.getenv("GEMINI_FAST_MODEL", "gemini-2.5-flash-lite")
+GEMINI_FAST_RPM = int(os.getenv("GEMINI_FAST_RPM", "15"))
+GEMINI_FAST_TPM = int(os.getenv("GEMINI_FAST_TPM", "250000"))
+# Prompts de hasta estos tokens que escriben hasta estos módulos van al rápido
+# (el template solo ocupa ~3,000 tokens)
+GEMINI_FAST_MAX_INPUT_TOKENS = int(os.getenv("GEMINI_FAST_MAX_INPUT_TOKENS", "10000"))
+GEMINI_FAST_MAX_MODULES = int(os.getenv("GEMINI_FAST_MAX_MODULES", "7"))
+# Con esta cantidad de llamadas esperando turno o cuota, el límite de entrada
+# del rápido se multiplica por GEMINI_FAST_QUEUE_FACTOR para descargar la fila
+GEMINI_FAST_QUEUE_DEPTH = int(os.getenv("GEMINI_FAST_QUEUE_DEPTH", "4"))
+GEMINI_FAST_QUEUE_FACTOR = 4
+NIVEL_COMPLETO = "completo"
+NIVEL_RAPIDO = "rapido"
+
+# max_output_tokens según los módulos que escribe cada llamada; medido con
+# plan_representativo: ~1,100 tokens de encabezado y guiones, ~850 por módulo
+MODULOS_POR_PLAN = 7  # máximo que pide el prompt
+TOKENS_SALIDA_ENCABEZADO = 1200
+TOKENS_SALIDA_POR_MODULO = 900
+MARGEN_TOKENS_SALIDA = 2
+MIN_OUTPUT_TOKENS = 4096
+
+# Caché de contexto: las instrucciones fijas del prompt se guardan en el
+# proveedor y cada llamada envía solo los documentos (menos tokens de entrada
+# facturados y menor tiempo al primer token); se renueva al vencer el TTL o si
+# cambia el template
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "1") == "1"
+GEMINI_CONTEXT_CACHE_TTL_SECONDS = float(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+
+# Niveles que atendieron las llamadas de la generación en curso; las tareas
+# de la fase 2 heredan el mismo diccionario (ver _registrar_uso)
+_uso_niveles: ContextVar[Optional[Dict]] = ContextVar("uso_niveles", default=None)
+
+
+class NivelModelo:
+    """Un modelo de Gemini con su propio proveedor, cuota y circuit breaker"""
+    
+    def __init__(self, nombre: str, modelo: str, rpm: int, tpm: int):
+        self.nombre = nombre
+        self.modelo = modelo
+        # Gemini o el proveedor simulado, según LLM_PROVIDER (ver proveedores_llm)
+        self.proveedor = crear_proveedor(modelo, GENERATION_CONFIG, GEMINI_API_KEY)
+        self.resiliencia = PoliticaResiliencia(
+            timeout_intento=GEMINI_TIMEOUT_SECONDS,
+            presupuesto_total=GEMINI_DEADLINE_SECONDS,
+            max_intentos=GEMINI_MAX_ATTEMPTS,
+            backoff_base=GEMINI_BACKOFF_BASE_SECONDS,
+            backoff_maximo=GEMINI_BACKOFF_MAX_SECONDS,
+            circuito=CircuitBreaker(GEMINI_CB_FAILURES, GEMINI_CB_COOLDOWN_SECONDS)
+        )
+        # Cada modelo tiene su propia cuota en Gemini
+        self.gobernador = GobernadorCuota(
+            rpm=rpm,
+            tpm=tpm,
+            espera_maxima=GEMINI_QUOTA_MAX_WAIT_SECONDS,
+            fila_maxima=GEMINI_QUOTA_MAX_QUEUE
+        )
+        self.llamadas = 0
+        self.respaldos = 0  # llamadas que atendió porque el otro nivel falló
+    
+    def estado(self) -> Dict:
+        """Modelo, contadores, resiliencia y cuota del nivel (para /health)"""
+        return {
+            'modelo': self.modelo,
+            'llamadas': self.llamadas,
+            'respaldos': self.respaldos,
+            'proveedor': self.proveedor.estado(),
+            'resiliencia': self.resiliencia.estado(),
+            'cuota': self.gobernador.estado(),
+        }
+
+class _ModulosEmitidos:
+    """
+    Módulos que una generación en streaming ya emitió
+    
+    Quien se une a la generación los recibe todos y espera `cambio` para
+    los siguientes; cada módulo nuevo (y el cierre) activa el evento actual
+    y lo reemplaza.
+    """
+    
+    def __init__(self):
+        self.modulos: list = []
+        self.cambio = asyncio.Event()
+    
+    def _avisar(self) -> None:
+        self.cambio.set()
+        self.cambio = asyncio.Event()
+    
+    def agregar(self, modulo: Dict) -> None:
+        self.modulos.append(modulo)
+        self._avisar()
+    
+    def cerrar(self) -> None:
+        self._avisar()
+
 class GeminiPlanGenerator:
     """Generador de planes de estudio usando Gemini AI - Especializado en Preescolar"""
     
     def __init__(self):
-        self.model = genai.GenerativeModel(
-            model_name=MODEL_NAME,
-            generation_config={
-                "temperature": TEMPERATURE,
-                "top_p": 0.95,
-                "top_k": 40,
-                "max_output_tokens": MAX_OUTPUT_TOKENS,
-                "response_mime_type": "application/json",  # ⭐ FUERZA JSON VÁLIDO
-            }
-        )
+        # El nivel completo siempre existe; el rápido solo si GEMINI_FAST_MODEL está configurado
+        self.niveles = {NIVEL_COMPLETO: NivelModelo(NIVEL_COMPLETO, MODEL_NAME, GEMINI_RPM, GEMINI_TPM)}
+        if GEMINI_FAST_MODEL and GEMINI_FAST_MODEL != MODEL_NAME:
+            self.niveles[NIVEL_RAPIDO] = NivelModelo(NIVEL_RAPIDO, GEMINI_FAST_MODEL, GEMINI_FAST_RPM, GEMINI_FAST_TPM)
+        self._semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+        self.llamadas_en_curso = 0
+        self.llamadas_en_espera = 0
+        self.cache = PlanCache(PLAN_CACHE_TTL_SECONDS)
+        self.vuelos = SingleFlight()
+        # Actividades de planes anteriores que el modelo puede citar por ID
+        self.biblioteca = BibliotecaActividades(BIBLIOTECA_ACTIVIDADES_PATH)
         
-        # Template del prompt optimizado para preescolar
-        self.prompt_template = """
+        # Instrucciones fijas del prompt (rol, marco curricular y formato de
+        # salida): iguales en todas las llamadas, van primero para que el
+        # proveedor las guarde en caché (ver GEMINI_CONTEXT_CACHE)
+        self.instrucciones_template = """
 Eres una educadora especialista en educación preescolar con amplia experiencia en segundo grado (niños de 4-5 años) y profundo conocimiento del Programa de Estudios de Educación Preescolar vigente en México. Tu enfoque pedagógico combina el juego como herramienta principal de aprendizaje con el desarrollo de habilidades socioemocionales, cognitivas y motrices.
 
-# CONTEXTO
-Has recibido los siguientes documentos:
-
-## PLAN DE ESTUDIOS OFICIAL (Documento base):
-{plan_text}
-
-{diagnostico_section}
-
 # MARCO CURRICULAR - ESTRUCTURA ORGANIZATIVA
 
 ## CAMPOS FORMATIVOS (Programa de Educación Preescolar)
@@ -97,7 +289,7 @@ IMPORTANTE: Los ejes articuladores NO reemplazan a los campos formativos, sino q
 1. Analiza el contenido curricular oficial e identifica los aprendizajes esperados
 2. Identifica el CAMPO FORMATIVO principal de cada módulo basándote en el plan oficial
 3. Determina qué EJES ARTICULADORES se integran transversalmente en las actividades
-4. {personalization_instruction}
+4. Adapta las actividades al grupo según las INDICACIONES PARA ESTE GRUPO (al final, después de los documentos)
 5. Diseña actividades LÚDICAS y DIVERTIDAS que integren:
    - Juegos sensoriales y manipulativos
    - Canciones, rimas y cuentos
@@ -156,108 +348,7 @@ EJEMPLO DE FORMATO CORRECTO:
   ]
 }}
 
-# FORMATO DE SALIDA REQUERIDO (JSON estricto)
-Genera ÚNICAMENTE un objeto JSON válido con esta estructura exacta.
-
-IMPORTANTE SOBRE EL FORMATO JSON:
-- NO uses saltos de línea dentro de strings (textos entre comillas)
-- Asegúrate de que TODAS las propiedades tengan comas EXCEPTO la última de cada objeto
-- Verifica que todos los corchetes [] y llaves {{}} estén balanceados
-- NO agregues comentarios dentro del JSON
-- NO uses caracteres especiales sin escapar
-
-{{
-  "nombre_plan": "Nombre creativo y atractivo del plan",
-  "grado": "2° Preescolar",
-  "edad_aprox": "4-5 años",
-  "duracion_total": "Tiempo total estimado del plan (ej: 4 semanas)",
-  "campo_formativo_principal": "Campo formativo dominante del plan completo",
-  "ejes_articuladores_generales": ["Lista de ejes que atraviesan todo el plan"],
-  "num_modulos": 6,
-  
-  "modulos": [
-    {{
-      "numero": 1,
-      "nombre": "Nombre divertido y atractivo del módulo",
-      "campo_formativo": "Campo formativo específico de este módulo",
-      "ejes_articuladores": ["Lista de ejes que se trabajan en este módulo"],
-      "aprendizaje_esperado": "¿Qué aprenderán los niños? (basado en el plan oficial)",
-      "tiempo_estimado": "Duración del módulo (ej: 1 semana, 3 días)",
-      
-      "actividad_inicio": {{
-        "nombre": "Nombre llamativo de la actividad de inicio",
-        "descripcion": "Descripción clara y paso a paso de la actividad motivadora",
-        "duracion": "10-15 minutos",
-        "materiales": ["Lista de materiales específicos y accesibles"],
-        "organizacion": "individual/parejas/equipos/grupo completo"
-      }},
-      
-      "actividades_desarrollo": [
-        {{
-          "nombre": "Nombre de la actividad principal",
-          "tipo": "juego/arte/exploracion/movimiento/cuento/experimento",
-          "descripcion": "Descripción paso a paso de la actividad lúdica",
-          "organizacion": "individual/parejas/equipos pequeños/grupo completo",
-          "duracion": "15-25 minutos",
-          "materiales": ["Lista de materiales necesarios"],
-          "aspectos_a_observar": "Qué observar del desarrollo de los niños durante la actividad"
-        }}
-      ],
-      
-      "actividad_cierre": {{
-        "nombre": "Nombre de la actividad de cierre",
-        "descripcion": "Descripción de la actividad para reflexionar sobre lo aprendido",
-        "duracion": "10 minutos",
-        "preguntas_guia": ["Pregunta 1 para los niños", "Pregunta 2", "Pregunta 3"],
-        "materiales": ["Materiales si los requiere"]
-      }},
-      
-      "consejos_maestra": "Tips prácticos para la implementación, manejo del grupo y anticipación de dificultades",
-      "variaciones": "Sugerencias concretas para adaptar según el nivel o interés de los niños",
-      "vinculo_familia": "Actividad sencilla y específica que pueden hacer en casa para reforzar el aprendizaje",
-      "evaluacion": "Cómo observar el logro del aprendizaje de forma natural y lúdica (indicadores concretos)"
-    }}
-  ],
-  
-  "recursos_educativos": {{
-    "materiales_generales": ["Lista consolidada de materiales más usados en el plan"],
-    "cuentos_recomendados": [
-      {{
-        "titulo": "Título completo del cuento",
-        "autor": "Nombre del autor (si aplica)",
-        "tipo": "RECURSO REAL o PROPUESTA CREATIVA",
-        "acceso": "GRATUITO o REQUIERE COMPRA",
-        "disponibilidad": "Dónde conseguirlo",
-        "descripcion_breve": "Para qué sirve en el contexto del plan"
-      }}
-    ],
-    "canciones_recomendadas": [
-      {{
-        "titulo": "Título de la canción",
-        "tipo": "RECURSO REAL o PROPUESTA CREATIVA",
-        "acceso": "GRATUITO o REQUIERE COMPRA",
-        "disponibilidad": "Dónde encontrarla (ej: YouTube, tradicional mexicana)",
-        "uso_sugerido": "En qué momento o actividad usarla"
-      }}
-    ],
-    "materiales_digitales": [
-      {{
-        "nombre": "Nombre del recurso digital",
-        "tipo": "video/juego/app/plataforma",
-        "acceso": "GRATUITO o REQUIERE COMPRA",
-        "descripcion_breve": "Qué ofrece y cómo usarlo"
-      }}
-    ]
-  }},
-  
-  "recomendaciones_ambiente": "Sugerencias específicas y prácticas para organizar el espacio del aula",
-  "vinculacion_curricular": {{
-    "campo_formativo_principal": "Campo dominante",
-    "campos_secundarios": ["Otros campos que se integran"],
-    "ejes_transversales": ["Ejes articuladores trabajados"],
-    "aprendizajes_clave": ["Lista de aprendizajes esperados principales del plan"]
-  }}
-}}
+{formato_salida}
 
 # CRITERIOS DE CALIDAD
 ✅ Las actividades deben ser DIVERTIDAS y generar ENTUSIASMO
@@ -286,7 +377,6 @@ IMPORTANTE SOBRE EL FORMATO JSON:
 - NO uses markdown (```json), solo el objeto JSON puro
 - Asegúrate de que el JSON sea válido y esté bien formado
 - Genera entre 5 y 7 módulos (uno por semana aprox.)
-- {context_emphasis}
 - Cada módulo debe tener al menos 3-5 actividades de desarrollo variadas
 - El lenguaje debe ser cálido, cercano y motivador
 - SIEMPRE especifica si los recursos son gratuitos o de compra
@@ -294,9 +384,755 @@ IMPORTANTE SOBRE EL FORMATO JSON:
 - Mantén las descripciones BREVES pero ÚTILES (4-5 líneas máximo por descripción)
 - NO uses saltos de línea dentro de strings en el JSON
 """
+        
+        # Parte variable del prompt: los documentos y las indicaciones del grupo
+        self.prompt_template = """
+# CONTEXTO
+Has recibido los siguientes documentos:
+
+## PLAN DE ESTUDIOS OFICIAL (Documento base):
+{plan_text}
+
+{diagnostico_section}
+
+# INDICACIONES PARA ESTE GRUPO
+- {personalization_instruction}
+- {context_emphasis}
+"""
+        
+        # Prompts de la fase map para condensar documentos que no caben en contexto
+        self.prompts_extraccion = {
+            'plan': """
+Eres una especialista en el Programa de Estudios de Educación Preescolar vigente en México.
+A continuación está el fragmento {indice} de {total} de un plan de estudios oficial.
+
+Extrae ÚNICAMENTE el contenido útil para planear actividades de segundo grado de preescolar:
+- Campos formativos y ejes articuladores mencionados
+- Contenidos y Procesos de Desarrollo de Aprendizaje (PDA) / aprendizajes esperados
+- Orientaciones didácticas, sugerencias de evaluación y temas clave
+
+Conserva los nombres y la redacción oficial. Omite índices, créditos, portadas y texto repetido.
+Responde en texto plano con viñetas breves. Si el fragmento no contiene nada relevante, responde "SIN CONTENIDO".
+
+## FRAGMENTO:
+{fragmento}
+""",
+            'diagnostico': """
+Eres una educadora de preescolar. A continuación está el fragmento {indice} de {total} del diagnóstico de un grupo.
+
+Resume en viñetas breves la información útil para personalizar actividades:
+intereses del grupo, niveles de desarrollo observados, necesidades de apoyo,
+características individuales relevantes y dinámicas sociales.
+Si el fragmento no contiene nada relevante, responde "SIN CONTENIDO".
+
+## FRAGMENTO:
+{fragmento}
+""",
+        }
+        
+        if GEMINI_CONTEXT_CACHE:
+            for nivel in self.niveles.values():
+                nivel.proveedor.usar_instrucciones_fijas(self.instrucciones_fijas(), GEMINI_CONTEXT_CACHE_TTL_SECONDS)
+    
+    @asynccontextmanager
+    async def _turno_gemini(self):
+        """
+        Ocupa un turno del límite de concurrencia mientras dure la llamada
+        
+        Limita las llamadas simultáneas a GEMINI_MAX_CONCURRENCY; las demás
+        esperan su turno aquí sin bloquear el event loop.
+        """
+        self.llamadas_en_espera += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.llamadas_en_espera -= 1
+        
+        self.llamadas_en_curso += 1
+        try:
+            yield
+        finally:
+            self.llamadas_en_curso -= 1
+            self._semaphore.release()
+    
+    def _estimar_tokens_llamada(self, prompt, generation_config: Optional[Dict] = None) -> int:
+        """Tokens de entrada estimados más la salida esperada de una llamada"""
+        salida = GEMINI_EXPECTED_OUTPUT_TOKENS
+        if generation_config and 'max_output_tokens' in generation_config:
+            salida = min(salida, generation_config['max_output_tokens'])
+        return tokens_de_prompt(prompt) + salida
+    
+    @staticmethod
+    def _fue_truncada(motivo: Optional[str], texto: str) -> bool:
+        """
+        True si la respuesta se cortó por max_output_tokens
+        
+        Sin finish_reason (respuestas sin candidatos) se deduce del propio
+        JSON: le faltan cierres.
+        """
+        if motivo is not None:
+            return motivo == 'MAX_TOKENS'
+        try:
+            json.loads(texto)
+            return False
+        except json.JSONDecodeError:
+            return 'cierre_faltante' in reparar_json(texto)[1]
+    
+    def _elegir_nivel(self, prompt, modulos: Optional[int]) -> NivelModelo:
+        """
+        Nivel de modelo para una llamada según su tamaño y la fila actual
+        
+        Va al rápido si el prompt no pasa de GEMINI_FAST_MAX_INPUT_TOKENS y la
+        llamada escribe hasta GEMINI_FAST_MAX_MODULES módulos; con la fila en
+        GEMINI_FAST_QUEUE_DEPTH o más, el límite de entrada se multiplica por
+        GEMINI_FAST_QUEUE_FACTOR. Lo demás va al completo.
+        """
+        completo = self.niveles[NIVEL_COMPLETO]
+        rapido = self.niveles.get(NIVEL_RAPIDO)
+        if rapido is None:
+            return completo
+        
+        limite = GEMINI_FAST_MAX_INPUT_TOKENS
+        if self.llamadas_en_espera + completo.gobernador.en_fila >= GEMINI_FAST_QUEUE_DEPTH:
+            limite *= GEMINI_FAST_QUEUE_FACTOR
+        if tokens_de_prompt(prompt) <= limite and (modulos or 0) <= GEMINI_FAST_MAX_MODULES:
+            return rapido
+        return completo
+    
+    def _niveles_candidatos(self, prompt, modulos: Optional[int]) -> list:
+        """El nivel elegido y, detrás, el otro como respaldo"""
+        elegido = self._elegir_nivel(prompt, modulos)
+        return [elegido] + [n for n in self.niveles.values() if n is not elegido]
+    
+    @staticmethod
+    def _amerita_respaldo(error: BaseException) -> bool:
+        """Saturación o caída del nivel (no errores de la solicitud, que fallarían igual en el otro)"""
+        return isinstance(error, (CircuitoAbiertoError, CuotaExcedidaError)) or es_reintentable(error)
+    
+    @staticmethod
+    def _avisar_respaldo(nivel: NivelModelo, respaldo: NivelModelo, error: BaseException) -> None:
+        logger.warning(
+            f"🔀 Nivel {nivel.nombre} ({nivel.modelo}) no disponible ({type(error).__name__}: {error}); "
+            f"se usa {respaldo.nombre} ({respaldo.modelo})"
+        )
+    
+    @staticmethod
+    def _registrar_uso(nivel: NivelModelo, respaldo: bool) -> None:
+        """Cuenta la llamada en el nivel y en la generación en curso"""
+        nivel.llamadas += 1
+        nivel.respaldos += respaldo
+        uso = _uso_niveles.get()
+        if uso is not None:
+            uso['llamadas'][nivel.nombre] = uso['llamadas'].get(nivel.nombre, 0) + 1
+            uso['respaldos'] += respaldo
+    
+    @staticmethod
+    def _iniciar_uso() -> Dict:
+        """Empieza a registrar qué niveles atienden la generación en curso"""
+        uso = {'llamadas': {}, 'respaldos': 0}
+        _uso_niveles.set(uso)
+        return uso
     
-    def _build_prompt(self, plan_text: str, diagnostico_text: Optional[str] = None) -> str:
-        """Construye el prompt optimizado para segundo grado de preescolar"""
+    @staticmethod
+    def _config_llamada(modulos: Optional[int], generation_config: Optional[Dict]) -> Dict:
+        """
+        generation_config de la llamada con max_output_tokens según los módulos
+        que debe escribir (sin `modulos` se deja la configuración tal cual)
+        """
+        if modulos is None:
+            return generation_config or {}
+        estimados = (TOKENS_SALIDA_ENCABEZADO + modulos * TOKENS_SALIDA_POR_MODULO) * MARGEN_TOKENS_SALIDA
+        return {
+            **(generation_config or {}),
+            'max_output_tokens': min(MAX_OUTPUT_TOKENS, max(MIN_OUTPUT_TOKENS, estimados))
+        }
+    
+    async def _generar_contenido(self, prompt, modulos: Optional[int] = None, **kwargs) -> RespuestaLLM:
+        """
+        Llama al proveedor (Gemini) de forma asíncrona
+        
+        El nivel de modelo se elige por tamaño (ver _elegir_nivel) y
+        max_output_tokens por los `modulos` que escribe la llamada. Cada
+        intento pasa primero por el gobernador de cuota (RPM/TPM) del nivel y
+        tiene su propio timeout (sin contar esperas locales); los reintentos,
+        el presupuesto total y el circuit breaker los aplica la resiliencia del
+        nivel. Si el nivel está saturado o falla, se intenta en el otro.
+        """
+        config = self._config_llamada(modulos, kwargs.pop('generation_config', None))
+        if config:
+            kwargs['generation_config'] = config
+        candidatos = self._niveles_candidatos(prompt, modulos)
+        
+        for i, nivel in enumerate(candidatos):
+            async def intento(timeout: float, nivel=nivel):
+                reservados = await nivel.gobernador.admitir(self._estimar_tokens_llamada(prompt, config))
+                try:
+                    async with self._turno_gemini():
+                        response = await asyncio.wait_for(nivel.proveedor.generar(prompt, **kwargs), timeout)
+                except BaseException:
+                    nivel.gobernador.devolver(reservados)
+                    raise
+                nivel.gobernador.conciliar(reservados, response.tokens_usados)
+                return response
+            
+            try:
+                response = await nivel.resiliencia.ejecutar(intento)
+            except Exception as e:
+                if i == len(candidatos) - 1 or not self._amerita_respaldo(e):
+                    raise
+                self._avisar_respaldo(nivel, candidatos[i + 1], e)
+                continue
+            self._registrar_uso(nivel, respaldo=i > 0)
+            return response
+    
+    async def _generar_contenido_stream(
+        self, prompt, estado: Optional[Dict] = None, modulos: Optional[int] = None, **kwargs
+    ) -> AsyncIterator[str]:
+        """
+        Llama a Gemini en streaming y produce los fragmentos de texto según llegan
+        
+        Solo la apertura del stream se reintenta (y, si el nivel elegido está
+        saturado o falla, se abre en el otro); una vez que se enviaron
+        fragmentos al cliente, un fallo (o un fragmento que tarda más que
+        GEMINI_TIMEOUT_SECONDS) termina la generación con error. Si se pasa
+        `estado`, al terminar queda en estado['motivo_fin'] el finish_reason.
+        """
+        config = self._config_llamada(modulos, kwargs.pop('generation_config', None))
+        if config:
+            kwargs['generation_config'] = config
+        candidatos = self._niveles_candidatos(prompt, modulos)
+        
+        for i, nivel in enumerate(candidatos):
+            ultimo = i == len(candidatos) - 1
+            try:
+                reservados = await nivel.gobernador.admitir(self._estimar_tokens_llamada(prompt, config))
+            except CuotaExcedidaError as e:
+                if ultimo:
+                    raise
+                self._avisar_respaldo(nivel, candidatos[i + 1], e)
+                continue
+            
+            # El turno se toma en cada intento de apertura (las esperas entre
+            # reintentos no ocupan un lugar) y el intento que abre el stream
+            # lo conserva hasta terminar de leerlo
+            turno = AsyncExitStack()
+            
+            async def abrir(timeout: float, nivel=nivel):
+                await turno.enter_async_context(self._turno_gemini())
+                try:
+                    return await asyncio.wait_for(nivel.proveedor.generar_stream(prompt, **kwargs), timeout)
+                except BaseException:
+                    await turno.aclose()
+                    raise
+            
+            abierto = False
+            tokens_usados = 0
+            try:
+                try:
+                    response = await nivel.resiliencia.ejecutar(abrir)
+                except Exception as e:
+                    if ultimo or not self._amerita_respaldo(e):
+                        raise
+                    self._avisar_respaldo(nivel, candidatos[i + 1], e)
+                    continue
+                abierto = True
+                self._registrar_uso(nivel, respaldo=i > 0)
+                
+                async with turno:
+                    fragmentos = response.__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(fragmentos.__anext__(), GEMINI_TIMEOUT_SECONDS)
+                        except StopAsyncIteration:
+                            break
+                        except Exception as e:
+                            nivel.resiliencia.registrar_fallo_externo(e)
+                            raise
+                        
+                        # El uso de tokens llega acumulado en los fragmentos
+                        tokens_usados = chunk.tokens_usados or tokens_usados
+                        if estado is not None:
+                            estado['motivo_fin'] = chunk.motivo_fin or estado.get('motivo_fin')
+                        if chunk.texto:
+                            yield chunk.texto
+            finally:
+                # En toda salida (respaldo, error, cliente desconectado) se
+                # ajusta la reserva: al uso real si se conoce, y completa de
+                # vuelta si el stream ni siquiera se abrió
+                if tokens_usados:
+                    nivel.gobernador.conciliar(reservados, tokens_usados)
+                elif not abierto:
+                    nivel.gobernador.devolver(reservados)
+            return
+    
+    @staticmethod
+    def _dividir_parcial(texto: str) -> Tuple[Dict, list]:
+        """
+        Separa una respuesta cortada en encabezado y módulos completos
+        
+        Los módulos se toman con el parser incremental, que solo entrega los
+        que se cerraron; el módulo a medias se descarta y se pide de nuevo.
+        """
+        clave_modulos = clave_salida('modulos', ESQUEMA_COMPACTO)
+        modulos = ModulosStreamParser(array_key=clave_modulos).feed(texto)
+        try:
+            encabezado = json.loads(reparar_json(texto)[0])
+        except json.JSONDecodeError:
+            encabezado = {}
+        if not isinstance(encabezado, dict):
+            encabezado = {}
+        encabezado.pop(clave_modulos, None)
+        return encabezado, modulos
+    
+    def _prompt_continuacion(
+        self, prompt: Union[str, PromptMultimodal], modulos: list, total: Optional[int], claves: list
+    ) -> Union[str, PromptMultimodal]:
+        """Prompt original (con sus documentos adjuntos) más la instrucción de generar solo lo que faltó"""
+        clave_nombre = clave_salida('modulos', ESQUEMA_COMPACTO)
+        nombre_modulo = clave_salida_modulo('nombre', ESQUEMA_COMPACTO)
+        generados = "\n".join(
+            f"{i}. {m.get(nombre_modulo, '') if isinstance(m, dict) else ''}" for i, m in enumerate(modulos, 1)
+        ) or "(ninguno)"
+        if total and len(modulos) >= total:
+            pedido_modulos = f'- NO incluyas "{clave_nombre}": los {total} módulos ya están completos'
+        else:
+            rango = f"del {len(modulos) + 1} al {total}" if total else "que falten para completar entre 5 y 7"
+            pedido_modulos = (
+                f'- "{clave_nombre}": SOLO los módulos {rango}, con el mismo formato, '
+                f'sin repetir los anteriores'
+            )
+        texto = f"""{prompt}
+
+# CONTINUACIÓN DE UNA RESPUESTA CORTADA
+Tu respuesta anterior se cortó por límite de longitud. Ya se generaron estos módulos:
+{generados}
+
+Genera ÚNICAMENTE un objeto JSON con las claves {", ".join(f'"{c}"' for c in claves)}:
+{pedido_modulos}
+- El resto de las claves, para el plan completo
+Mantén las descripciones breves para que la respuesta quepa completa.
+"""
+        return prompt.con_texto(texto) if isinstance(prompt, PromptMultimodal) else texto
+    
+    async def _completar_truncado(self, prompt: Union[str, PromptMultimodal], texto: str) -> Tuple[Dict, int]:
+        """
+        Completa una respuesta cortada por max_output_tokens
+        
+        Conserva el encabezado y los módulos completos de la respuesta parcial
+        y pide en llamadas de continuación solo los módulos y secciones que
+        faltan, hasta GEMINI_MAX_CONTINUATIONS veces.
+        
+        Returns:
+            (plan unido, en el formato de salida configurado; continuaciones hechas)
+        """
+        clave_modulos = clave_salida('modulos', ESQUEMA_COMPACTO)
+        clave_total = clave_salida('num_modulos', ESQUEMA_COMPACTO)
+        clave_numero = clave_salida_modulo('numero', ESQUEMA_COMPACTO)
+        plan, modulos = self._dividir_parcial(texto)
+        continuaciones = 0
+        
+        while continuaciones < GEMINI_MAX_CONTINUATIONS:
+            total = plan.get(clave_total) if isinstance(plan.get(clave_total), int) else None
+            faltan_modulos = not total or len(modulos) < total
+            nombres = [
+                c.nombre for c in ESQUEMA_PLAN
+                if (c.nombre == 'modulos' and faltan_modulos)
+                or c.nombre in SECCIONES_FINALES
+                or (c.nombre != 'modulos' and clave_salida(c.nombre, ESQUEMA_COMPACTO) not in plan)
+            ]
+            claves = [clave_salida(n, ESQUEMA_COMPACTO) for n in nombres]
+            
+            config = {'response_schema': esquema_respuesta(
+                ESQUEMA_COMPACTO, solo=nombres, referencias=BIBLIOTECA_ACTIVIDADES
+            )} \
+                if GEMINI_RESPONSE_SCHEMA else {}
+            continuaciones += 1
+            logger.info(
+                f"✂️ Respuesta cortada con {len(modulos)} módulos completos; "
+                f"continuación {continuaciones}/{GEMINI_MAX_CONTINUATIONS}"
+            )
+            response = await self._generar_contenido(
+                self._prompt_continuacion(prompt, modulos, total, claves),
+                modulos=max((total or MODULOS_POR_PLAN) - len(modulos), 0) if faltan_modulos else 0,
+                generation_config=config
+            )
+            parte_texto = response.texto
+            truncada = self._fue_truncada(response.motivo_fin, parte_texto)
+            
+            if truncada:
+                parte, nuevos = self._dividir_parcial(parte_texto)
+            else:
+                parte, _ = cargar_json(parte_texto)
+                parte = parte if isinstance(parte, dict) else {}
+                nuevos = parte.pop(clave_modulos, None) or []
+            
+            modulos.extend(m for m in nuevos if isinstance(m, dict))
+            plan.update(parte)
+            if not truncada or not (nuevos or parte):
+                break
+        
+        # Numeración continua aunque la continuación haya reiniciado la cuenta
+        for i, modulo in enumerate(modulos, 1):
+            modulo[clave_numero] = i
+        plan[clave_modulos] = modulos
+        plan[clave_total] = len(modulos)
+        return plan, continuaciones
+    
+    def _instruccion_esqueleto(self) -> str:
+        """Fase 1: el plan completo pero con solo el guion de cada módulo"""
+        clave_modulos = clave_salida('modulos', ESQUEMA_COMPACTO)
+        campos = ", ".join(f'"{clave_salida_modulo(c, ESQUEMA_COMPACTO)}"' for c in CAMPOS_GUION_MODULO)
+        return f"""
+
+# FASE 1 DE 2: ESQUELETO DEL PLAN
+Genera el objeto JSON con todas las claves del nivel superior, pero en "{clave_modulos}"
+incluye por cada módulo SOLO {campos}. El detalle de las actividades de cada
+módulo se pedirá después, módulo por módulo.
+"""
+    
+    def _instruccion_modulo(self, esqueleto: Dict, numero: int) -> str:
+        """Fase 2: el detalle de un módulo, con el esqueleto como referencia"""
+        guion = esqueleto[clave_salida('modulos', ESQUEMA_COMPACTO)][numero - 1]
+        nombre = guion.get(clave_salida_modulo('nombre', ESQUEMA_COMPACTO), '')
+        return f"""
+
+# FASE 2 DE 2: DETALLE DEL MÓDULO {numero}
+Este es el esqueleto del plan, ya definido:
+{json.dumps(esqueleto, ensure_ascii=False)}
+
+Genera ÚNICAMENTE el objeto JSON del módulo {numero} ("{nombre}") con todos sus campos,
+en el formato de un elemento de "{clave_salida('modulos', ESQUEMA_COMPACTO)}". Respeta su nombre, campo
+formativo, ejes y aprendizaje esperado, y no repitas actividades de los otros módulos.
+""" + self._seccion_biblioteca_modulo(guion)
+    
+    def _seccion_biblioteca(self, plan_text) -> str:
+        """Actividades de la biblioteca afines al plan curricular (vacío si está desactivada)"""
+        if not BIBLIOTECA_ACTIVIDADES:
+            return ""
+        # Con un documento adjunto no hay texto para comparar: se ofrecen las más usadas
+        consulta = plan_text if isinstance(plan_text, str) else ""
+        return self.biblioteca.seccion_prompt(self.biblioteca.seleccionar(consulta, limite=BIBLIOTECA_EN_PROMPT))
+    
+    def _seccion_biblioteca_modulo(self, guion: Dict) -> str:
+        """Actividades de la biblioteca del mismo campo formativo y ejes que el guion"""
+        if not BIBLIOTECA_ACTIVIDADES:
+            return ""
+        guion = expandir_modulo(dict(guion)) if ESQUEMA_COMPACTO else guion
+        return self.biblioteca.seccion_prompt(self.biblioteca.seleccionar(
+            guion.get('aprendizaje_esperado', ''),
+            campo_formativo=guion.get('campo_formativo'),
+            ejes=guion.get('ejes_articuladores'),
+            limite=BIBLIOTECA_EN_PROMPT_MODULO
+        ))
+    
+    def _expandir_modulo(self, modulo: Dict) -> Dict:
+        """Módulo en formato completo y con las referencias a la biblioteca expandidas"""
+        # Copia: el módulo original se vuelve a expandir (y contar) con el plan completo
+        modulo = expandir_modulo(modulo) if ESQUEMA_COMPACTO else copy.deepcopy(modulo)
+        self.biblioteca.expandir_modulo(modulo, contar=False)
+        return modulo
+    
+    async def _generar_modulo(
+        self, plan_text: str, diagnostico_text: Optional[str], esqueleto: Dict, numero: int
+    ) -> Tuple[int, Dict]:
+        """Genera el detalle de un módulo del esqueleto (fase 2)"""
+        clave_modulos = clave_salida('modulos', ESQUEMA_COMPACTO)
+        guion = esqueleto[clave_modulos][numero - 1]
+        config = {'response_schema': esquema_modulo(ESQUEMA_COMPACTO, referencias=BIBLIOTECA_ACTIVIDADES)} \
+            if GEMINI_RESPONSE_SCHEMA else {}
+        
+        response = await self._generar_contenido(
+            self._build_prompt(plan_text, diagnostico_text, self._instruccion_modulo(esqueleto, numero)),
+            modulos=1,
+            generation_config=config
+        )
+        modulo, reparaciones = cargar_json(response.texto)
+        if reparaciones:
+            logger.warning(f"🔧 Módulo {numero}: JSON reparado {reparaciones}")
+        # Sin response_schema el modelo a veces envuelve el módulo en {"modulos": [...]}
+        if isinstance(modulo, dict) and isinstance(modulo.get(clave_modulos), list) and modulo[clave_modulos]:
+            modulo = modulo[clave_modulos][0]
+        if not isinstance(modulo, dict):
+            raise ValueError(f"El módulo {numero} no es un objeto JSON")
+        
+        # El guion del esqueleto manda sobre lo que el modelo haya reescrito
+        modulo.update(guion)
+        modulo[clave_salida_modulo('numero', ESQUEMA_COMPACTO)] = numero
+        return numero, modulo
+    
+    async def _generar_por_modulos(
+        self, plan_text: str, diagnostico_text: Optional[str]
+    ) -> AsyncIterator[Tuple[str, Dict]]:
+        """
+        Generación en dos fases
+        
+        Una llamada corta produce el esqueleto (encabezado, secciones finales y
+        guion de cada módulo) y luego cada módulo se detalla en su propia
+        llamada, todas a la vez; el semáforo y el gobernador de cuota limitan
+        cuántas corren realmente en paralelo.
+        
+        Produce ('modulo', modulo) según se completa cada uno y al final
+        ('plan', plan) con el plan unido en el formato de salida configurado.
+        """
+        clave_modulos = clave_salida('modulos', ESQUEMA_COMPACTO)
+        config = {'response_schema': esquema_esqueleto(ESQUEMA_COMPACTO)} if GEMINI_RESPONSE_SCHEMA else {}
+        
+        inicio = time.perf_counter()
+        response = await self._generar_contenido(
+            self._build_prompt(plan_text, diagnostico_text, self._instruccion_esqueleto()),
+            modulos=0,
+            generation_config=config
+        )
+        esqueleto, _ = cargar_json(response.texto)
+        if not isinstance(esqueleto, dict) or not esqueleto.get(clave_modulos):
+            raise ValueError("El esqueleto del plan no contiene módulos")
+        total = len(esqueleto[clave_modulos])
+        logger.info(f"🦴 Esqueleto del plan con {total} módulos en {time.perf_counter() - inicio:.1f}s")
+        
+        tareas = [
+            asyncio.create_task(self._generar_modulo(plan_text, diagnostico_text, esqueleto, numero))
+            for numero in range(1, total + 1)
+        ]
+        modulos = [None] * total
+        try:
+            for siguiente in asyncio.as_completed(tareas):
+                numero, modulo = await siguiente
+                modulos[numero - 1] = modulo
+                logger.info(f"🧩 Módulo {numero}/{total} detallado ({time.perf_counter() - inicio:.1f}s)")
+                yield 'modulo', modulo
+        finally:
+            # Si un módulo falla o el cliente se desconecta, no se sigue gastando cuota
+            for tarea in tareas:
+                tarea.cancel()
+        
+        esqueleto[clave_modulos] = modulos
+        esqueleto[clave_salida('num_modulos', ESQUEMA_COMPACTO)] = total
+        yield 'plan', esqueleto
+    
+    async def regenerar_modulo(
+        self,
+        plan_data: Dict,
+        numero: int,
+        plan_text: str,
+        diagnostico_text: Optional[str] = None
+    ) -> Dict:
+        """
+        Regenera un solo módulo de un plan ya generado
+        
+        Es la fase 2 de la generación en dos fases: el esqueleto sale del plan
+        guardado y solo se pide el detalle del módulo indicado, que conserva su
+        nombre, campo formativo, ejes y aprendizaje esperado.
+        
+        Returns:
+            {'success': True, 'modulo': {...}} en formato completo, o error
+        """
+        try:
+            total = len(plan_data.get('modulos') or [])
+            if not 1 <= numero <= total:
+                return {'success': False, 'error': f'El plan no tiene un módulo {numero}'}
+            
+            logger.info(f"♻️ Regenerando el módulo {numero}/{total} con Gemini AI...")
+            inicio = time.perf_counter()
+            plan_text, diagnostico_text, info_entrada = await self._ajustar_a_contexto(plan_text, diagnostico_text)
+            uso = self._iniciar_uso()
+            
+            esqueleto = esqueleto_de_plan(plan_data)
+            if ESQUEMA_COMPACTO:
+                esqueleto = compactar_plan(esqueleto)
+            _, modulo = await self._generar_modulo(plan_text, diagnostico_text, esqueleto, numero)
+            if ESQUEMA_COMPACTO:
+                modulo = expandir_modulo(modulo)
+            biblioteca = self.biblioteca.expandir_modulo(modulo)
+            if BIBLIOTECA_ACTIVIDADES:
+                await asyncio.to_thread(self.biblioteca.agregar_plan, {'modulos': [modulo]})
+            
+            logger.info(f"✅ Módulo {numero} regenerado en {time.perf_counter() - inicio:.1f}s: {modulo.get('nombre', '')}")
+            return {
+                'success': True, 'modulo': modulo, 'entrada': info_entrada,
+                'enrutamiento': uso, 'biblioteca': biblioteca
+            }
+            
+        except (CircuitoAbiertoError, CuotaExcedidaError) as e:
+            logger.error(f"⚡ {e}")
+            return {'success': False, 'error': str(e)}
+        except asyncio.TimeoutError:
+            logger.error("⏱️ Gemini no respondió dentro del tiempo límite")
+            return {'success': False, 'error': 'Gemini no respondió dentro del tiempo límite'}
+        except Exception as e:
+            logger.error(f"❌ Error regenerando el módulo {numero}: {e}")
+            return {'success': False, 'error': f'Error inesperado: {str(e)}'}
+    
+    def _clave_cache(self, plan_text: str, diagnostico_text: Optional[str]) -> str:
+        """Clave de caché: entradas normalizadas, modelo, configuración y versión del prompt"""
+        # El hash del template invalida la caché aunque se olvide subir PROMPT_VERSION
+        huella_template = hashlib.sha256(
+            (self.instrucciones_template + self.prompt_template).encode("utf-8")
+        ).hexdigest()[:12]
+        # Un documento adjunto entra por su tipo y hash
+        return calcular_clave(
+            str(plan_text), None if diagnostico_text is None else str(diagnostico_text), MODEL_NAME, GENERATION_CONFIG,
+            f"{PROMPT_VERSION}:{huella_template}:{GEMINI_OUTPUT_SCHEMA}:{'dos-fases' if GEMINI_TWO_PHASE else 'unica'}"
+        )
+    
+    async def _buscar_en_cache(self, clave: str) -> Optional[Dict]:
+        """Busca un resultado cacheado sin bloquear el event loop"""
+        resultado = await asyncio.to_thread(self.cache.obtener, clave)
+        if resultado is not None:
+            logger.info(f"⚡ Plan recuperado de caché ({clave[:12]})")
+            resultado['desde_cache'] = True
+        return resultado
+    
+    async def _guardar_en_cache(self, clave: str, resultado: Dict) -> None:
+        """Guarda un resultado exitoso en la caché"""
+        if resultado.get('success'):
+            await asyncio.to_thread(self.cache.guardar, clave, resultado)
+            # Solo los planes sin errores de estructura alimentan la biblioteca
+            if BIBLIOTECA_ACTIVIDADES and resultado.get('validacion', {}).get('valido'):
+                await asyncio.to_thread(self.biblioteca.agregar_plan, resultado['plan'])
+    
+    async def contar_tokens(self, texto) -> int:
+        """
+        Cuenta los tokens de un texto (o prompt con documentos) antes de enviarlo
+        
+        Usa la estimación local y solo consulta a la API (count_tokens) cuando
+        el texto está cerca del presupuesto, donde el error de la estimación
+        podría cambiar la decisión.
+        """
+        estimado = tokens_de_prompt(texto)
+        if abs(estimado - GEMINI_INPUT_TOKEN_BUDGET) > GEMINI_INPUT_TOKEN_BUDGET * 0.25:
+            return estimado
+        
+        try:
+            return await asyncio.wait_for(
+                self.niveles[NIVEL_COMPLETO].proveedor.contar_tokens(texto), GEMINI_TIMEOUT_SECONDS
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron contar los tokens con la API, se usa la estimación: {e}")
+            return estimado
+    
+    async def _extraer_fragmento(self, fragmento: str, indice: int, total: int, tipo: str) -> str:
+        """Fase map: extrae el contenido relevante de un fragmento"""
+        prompt = self.prompts_extraccion[tipo].format(fragmento=fragmento, indice=indice, total=total)
+        response = await self._generar_contenido(prompt, generation_config=EXTRACTION_CONFIG)
+        texto = response.texto.strip()
+        return "" if texto.upper().startswith("SIN CONTENIDO") else texto
+    
+    async def _condensar(self, texto: str, tipo: str, objetivo_tokens: int) -> str:
+        """
+        Map-reduce: divide el texto, extrae lo relevante de cada fragmento en
+        paralelo y une los extractos; repite si el resultado sigue sin caber
+        """
+        for nivel in range(1, MAP_REDUCE_MAX_NIVELES + 1):
+            if estimar_tokens(texto) <= objetivo_tokens:
+                break
+            
+            tokens_fragmento = min(
+                max(GEMINI_CHUNK_TOKENS, -(-estimar_tokens(texto) // GEMINI_MAP_MAX_FRAGMENTS)),
+                GEMINI_INPUT_TOKEN_BUDGET
+            )
+            fragmentos = dividir_en_fragmentos(texto, tokens_fragmento * CARACTERES_POR_TOKEN)
+            logger.info(f"🗜️ Condensando {tipo} (nivel {nivel}): {len(fragmentos)} fragmentos en paralelo")
+            
+            resultados = await asyncio.gather(
+                *[self._extraer_fragmento(f, i, len(fragmentos), tipo) for i, f in enumerate(fragmentos, 1)],
+                return_exceptions=True
+            )
+            
+            fallidos = [r for r in resultados if isinstance(r, BaseException)]
+            if len(fallidos) == len(resultados):
+                raise fallidos[0]
+            if fallidos:
+                logger.warning(f"⚠️ {len(fallidos)} fragmentos no se pudieron condensar: {fallidos[0]}")
+            
+            texto = "\n\n".join(r for r in resultados if isinstance(r, str) and r)
+            logger.info(f"✅ {tipo.capitalize()} condensado a ~{estimar_tokens(texto)} tokens")
+        
+        if estimar_tokens(texto) > objetivo_tokens:
+            logger.warning(f"⚠️ El {tipo} sigue excediendo el presupuesto tras {MAP_REDUCE_MAX_NIVELES} niveles; se recorta")
+            texto = texto[:objetivo_tokens * CARACTERES_POR_TOKEN]
+        
+        return texto
+    
+    async def _ajustar_a_contexto(
+        self,
+        plan_text: Union[str, DocumentoAdjunto],
+        diagnostico_text: Optional[Union[str, DocumentoAdjunto]]
+    ):
+        """
+        Reduce el plan a sus secciones relevantes (BM25 local), verifica que el
+        prompt quepa en GEMINI_INPUT_TOKEN_BUDGET y, si no, condensa el plan
+        (y el diagnóstico si ocupa más de un cuarto)
+        
+        Los documentos adjuntos se envían completos: si no caben, se pide usar
+        la extracción de texto.
+        
+        Returns:
+            (plan_text, diagnostico_text, info) con info sobre tokens y condensación
+        """
+        info = {}
+        adjuntos = [d for d in (plan_text, diagnostico_text) if isinstance(d, DocumentoAdjunto)]
+        if adjuntos:
+            info['documentos'] = [
+                {'nombre': d.nombre, 'mime': d.mime, 'paginas': d.paginas, 'tokens_estimados': d.tokens_estimados}
+                for d in adjuntos
+            ]
+        if CURRICULUM_RETRIEVAL and isinstance(plan_text, str):
+            plan_text, info['recuperacion'] = await asyncio.to_thread(
+                seleccionar_secciones, plan_text, RETRIEVAL_TOKEN_BUDGET
+            )
+        
+        tokens_prompt = await self.contar_tokens(self._build_prompt(plan_text, diagnostico_text))
+        info.update({'tokens_entrada': tokens_prompt, 'condensado': False})
+        
+        if tokens_prompt <= GEMINI_INPUT_TOKEN_BUDGET:
+            return plan_text, diagnostico_text, info
+        if adjuntos:
+            raise ValueError(
+                f"Los documentos adjuntos (~{tokens_prompt} tokens) exceden el presupuesto de entrada "
+                f"({GEMINI_INPUT_TOKEN_BUDGET}); genera el plan con document_mode=ocr"
+            )
+        
+        logger.info(f"📐 Prompt de ~{tokens_prompt} tokens excede el presupuesto ({GEMINI_INPUT_TOKEN_BUDGET}); aplicando map-reduce")
+        inicio = time.time()
+        
+        # Tokens del template (instrucciones y formato), sin contar los documentos
+        tokens_fijos = (estimar_tokens(self._build_prompt("", diagnostico_text))
+                        - estimar_tokens(diagnostico_text or ""))
+        disponible = GEMINI_INPUT_TOKEN_BUDGET - tokens_fijos
+        
+        if diagnostico_text and estimar_tokens(diagnostico_text) > disponible // 4:
+            diagnostico_text = await self._condensar(diagnostico_text, 'diagnostico', disponible // 4)
+        
+        plan_text = await self._condensar(
+            plan_text, 'plan', disponible - estimar_tokens(diagnostico_text or "")
+        )
+        
+        info.update({
+            'condensado': True,
+            'tokens_condensados': estimar_tokens(self._build_prompt(plan_text, diagnostico_text)),
+            'tiempo_condensacion': round(time.time() - inicio, 2)
+        })
+        return plan_text, diagnostico_text, info
+    
+    def _build_prompt(
+        self,
+        plan_text: Union[str, DocumentoAdjunto],
+        diagnostico_text: Optional[Union[str, DocumentoAdjunto]] = None,
+        instruccion_fase: str = ""
+    ) -> Union[str, PromptMultimodal]:
+        """
+        Construye el prompt optimizado para segundo grado de preescolar
+        
+        Empieza con las instrucciones fijas y sigue con los documentos;
+        instruccion_fase se agrega al final para pedir solo una parte del plan
+        (generación en dos fases) u ofrecer la biblioteca de actividades. Si el plan o el diagnóstico son documentos
+        adjuntos, el texto los referencia y se devuelve un PromptMultimodal.
+        """
+        adjuntos = [d for d in (plan_text, diagnostico_text) if isinstance(d, DocumentoAdjunto)]
+        if isinstance(plan_text, DocumentoAdjunto):
+            plan_text = self._referencia_adjunto(plan_text, adjuntos)
+        if isinstance(diagnostico_text, DocumentoAdjunto):
+            diagnostico_text = self._referencia_adjunto(diagnostico_text, adjuntos)
         
         if diagnostico_text and diagnostico_text.strip():
             diagnostico_section = f"""
@@ -337,390 +1173,476 @@ No se proporcionó diagnóstico específico del grupo.
             
             context_emphasis = "Las actividades deben ser INCLUSIVAS y ADAPTABLES para cualquier grupo de segundo de preescolar. Incluye siempre 'variaciones' para diferentes niveles. Los recursos recomendados deben ser accesibles y versátiles"
         
-        return self.prompt_template.format(
+        prompt = self.instrucciones_fijas() + self.prompt_template.format(
             plan_text=plan_text,
             diagnostico_section=diagnostico_section,
             personalization_instruction=personalization_instruction,
             context_emphasis=context_emphasis
+        ) + instruccion_fase
+        return PromptMultimodal(prompt, adjuntos) if adjuntos else prompt
+    
+    @staticmethod
+    def _referencia_adjunto(documento: DocumentoAdjunto, adjuntos: list) -> str:
+        """Texto que ocupa el lugar de un documento adjunto en el prompt"""
+        tipo = "PDF" if documento.mime == "application/pdf" else "imagen"
+        return (
+            f"[Documento adjunto {adjuntos.index(documento) + 1} de {len(adjuntos)} ({tipo}): "
+            f"{documento.nombre}. Léelo completo, incluidas tablas, esquemas e imágenes.]"
         )
     
-    def _clean_json_response(self, response_text: str) -> str:
-        """Limpia y repara la respuesta JSON de Gemini con correcciones avanzadas"""
-        response_text = response_text.strip()
-        
-        # Remover bloques de código markdown
-        if response_text.startswith("```"):
-            lines = response_text.split('\n')
-            if lines[0].startswith("```"):
-                lines = lines[1:]
-            if lines and lines[-1].strip() == "```":
-                lines = lines[:-1]
-            response_text = '\n'.join(lines)
-        
-        response_text = response_text.strip()
-        
-        # Buscar el primer { y último }
-        start = response_text.find('{')
-        end = response_text.rfind('}')
-        
-        if start != -1 and end != -1:
-            response_text = response_text[start:end+1]
-        
-        # ⭐ CORRECCIONES AVANZADAS DE FORMATO JSON:
-        
-        # 1. Eliminar comas antes de llaves/corchetes de cierre
-        response_text = re.sub(r',(\s*[}\]])', r'\1', response_text)
-        
-        # 2. Agregar comas faltantes entre propiedades
-        response_text = re.sub(r'"\s*\n\s*"', '",\n"', response_text)
-        
-        # 3. Agregar comas faltantes entre objetos en arrays
-        response_text = re.sub(r'}\s*\n\s*{', '},\n{', response_text)
-        
-        # 4. Agregar comas faltantes entre arrays
-        response_text = re.sub(r']\s*\n\s*\[', '],\n[', response_text)
-        
-        # 5. Reparar saltos de línea dentro de strings (causa común de error)
-        # Esto busca strings que tienen saltos de línea no escapados
-        def fix_multiline_string(match):
-            content = match.group(1) + ' ' + match.group(2)
-            # Reemplazar múltiples espacios por uno solo
-            content = re.sub(r'\s+', ' ', content)
-            return f': "{content}"'
-        
-        response_text = re.sub(
-            r':\s*"([^"]*?)\n([^"]*?)"', 
-            fix_multiline_string, 
-            response_text,
-            flags=re.DOTALL
+    def instrucciones_fijas(self) -> str:
+        """Inicio del prompt que no cambia entre llamadas (el prefijo que se cachea)"""
+        return self.instrucciones_template.format(
+            formato_salida=(FORMATO_SALIDA_COMPACTO if ESQUEMA_COMPACTO else FORMATO_SALIDA_COMPLETO).strip()
         )
-        
-        # 6. Eliminar espacios en blanco excesivos
-        response_text = re.sub(r'\n\s*\n', '\n', response_text)
-        
-        return response_text
     
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10)
-    )
     async def generar_plan(
         self, 
         plan_text: str, 
-        diagnostico_text: Optional[str] = None
+        diagnostico_text: Optional[str] = None,
+        forzar_regeneracion: bool = False
     ) -> Dict:
         """
         Genera un plan de estudio lúdico para preescolar usando Gemini AI
-        Con retry automático y corrección de errores JSON
+        Con caché de resultados, reintentos con timeout y corrección de errores JSON
         
         Args:
-            plan_text: Texto extraído del plan de estudios oficial
-            diagnostico_text: Texto extraído del diagnóstico del grupo (opcional)
+            plan_text: Texto extraído del plan de estudios oficial, o el documento
+                original adjunto (DocumentoAdjunto) en el modo de documentos directos
+            diagnostico_text: Texto extraído del diagnóstico del grupo o su documento (opcional)
+            forzar_regeneracion: Ignora la caché y genera de nuevo (reemplaza la entrada)
         
         Returns:
             Dict con la estructura del plan generado o error
         """
+        clave = self._clave_cache(plan_text, diagnostico_text)
+        
+        if not forzar_regeneracion:
+            resultado = await self._buscar_en_cache(clave)
+            if resultado is not None:
+                return resultado
+        
+        if forzar_regeneracion and self.vuelos.en_curso(clave):
+            # La generación en curso daría el plan anterior: se genera uno propio
+            return await self._generar_y_cachear(clave, plan_text, diagnostico_text)
+        
+        # Llamadas idénticas simultáneas comparten una sola generación
+        return await self.vuelos.ejecutar(
+            clave, lambda: self._generar_y_cachear(clave, plan_text, diagnostico_text)
+        )
+    
+    async def _generar_y_cachear(self, clave: str, plan_text: str, diagnostico_text: Optional[str]) -> Dict:
+        resultado = await self._generar_plan_gemini(plan_text, diagnostico_text)
+        await self._guardar_en_cache(clave, resultado)
+        return resultado
+    
+    async def _generar_plan_gemini(
+        self, 
+        plan_text: str, 
+        diagnostico_text: Optional[str] = None
+    ) -> Dict:
+        """Llamada a Gemini sin caché (ver generar_plan)"""
         try:
             logger.info("🤖 Generando plan de preescolar con Gemini AI...")
             
             # Validar entrada
-            if not plan_text or len(plan_text.strip()) < 100:
+            if not plan_text or (isinstance(plan_text, str) and len(plan_text.strip()) < 100):
                 return {
                     'success': False,
                     'error': 'El plan de estudios debe contener al menos 100 caracteres de texto válido'
                 }
             
-            # Construir prompt
-            prompt = self._build_prompt(plan_text, diagnostico_text)
+            # Construir prompt (condensando entradas que no caben en contexto)
+            plan_text, diagnostico_text, info_entrada = await self._ajustar_a_contexto(plan_text, diagnostico_text)
+            uso = self._iniciar_uso()
+            
+            if GEMINI_TWO_PHASE:
+                logger.info("📤 Enviando solicitudes a Gemini (dos fases)...")
+                async for evento, datos in self._generar_por_modulos(plan_text, diagnostico_text):
+                    if evento == 'plan':
+                        resultado = self._procesar_respuesta(json.dumps(datos, ensure_ascii=False), diagnostico_text, uso)
+                resultado['entrada'] = info_entrada
+                return resultado
+            
+            prompt = self._build_prompt(plan_text, diagnostico_text, self._seccion_biblioteca(plan_text))
             
             # Generar respuesta
             logger.info("📤 Enviando solicitud a Gemini...")
-            response = self.model.generate_content(prompt)
+            response = await self._generar_contenido(prompt, modulos=MODULOS_POR_PLAN)
             
-            if not response or not response.text:
+            if not response.texto:
                 return {
                     'success': False,
                     'error': 'Gemini no generó una respuesta válida'
                 }
             
             logger.info("📥 Respuesta recibida de Gemini")
-            logger.info(f"📏 Longitud de respuesta: {len(response.text)} caracteres")
+            texto = response.texto
+            continuaciones = 0
+            if self._fue_truncada(response.motivo_fin, texto):
+                plan_unido, continuaciones = await self._completar_truncado(prompt, texto)
+                texto = json.dumps(plan_unido, ensure_ascii=False)
             
-            # Limpiar y parsear respuesta
-            cleaned_response = self._clean_json_response(response.text)
-            logger.info(f"📄 Respuesta limpiada (primeros 200 chars): {cleaned_response[:200]}...")
+            resultado = self._procesar_respuesta(texto, diagnostico_text, uso)
+            resultado['entrada'] = info_entrada
+            resultado['continuaciones'] = continuaciones
+            return resultado
             
-            # Intentar parsear JSON
-            plan_data = None
-            try:
-                plan_data = json.loads(cleaned_response)
+        except (CircuitoAbiertoError, CuotaExcedidaError) as e:
+            logger.error(f"⚡ {e}")
+            return {'success': False, 'error': str(e)}
+        except asyncio.TimeoutError:
+            logger.error("⏱️ Gemini no respondió dentro del tiempo límite")
+            return {'success': False, 'error': 'Gemini no respondió dentro del tiempo límite'}
+        except Exception as e:
+            logger.error(f"❌ Error generando plan con Gemini: {e}")
+            import traceback
+            logger.error(f"📋 Traceback: {traceback.format_exc()}")
+            return {
+                'success': False,
+                'error': f'Error inesperado: {str(e)}'
+            }
+    
+    def _modelo_del_plan(self, uso: Optional[Dict]) -> Tuple[str, str]:
+        """Modelo(s) y nivel que escribieron el plan: 'completo', 'rapido' o 'mixto'"""
+        niveles = [n for n in self.niveles if uso and uso['llamadas'].get(n)]
+        if not niveles:
+            return MODEL_NAME, NIVEL_COMPLETO
+        modelos = ", ".join(self.niveles[n].modelo for n in niveles)
+        return modelos, niveles[0] if len(niveles) == 1 else "mixto"
+    
+    def _procesar_respuesta(
+        self, response_text: str, diagnostico_text: Optional[str] = None, uso: Optional[Dict] = None
+    ) -> Dict:
+        """
+        Limpia, parsea y valida el texto JSON devuelto por Gemini
+        
+        `uso` son las llamadas por nivel de la generación (ver _iniciar_uso);
+        el plan registra qué modelo y nivel lo escribieron.
+        """
+        logger.info(f"📏 Longitud de respuesta: {len(response_text)} caracteres")
+        
+        # Parsear respuesta (se repara en un solo recorrido solo si hace falta)
+        plan_data = None
+        try:
+            plan_data, reparaciones = cargar_json(response_text)
+            if reparaciones:
+                logger.warning(f"🔧 JSON reparado: {reparaciones}")
+            else:
                 logger.info("✅ JSON parseado correctamente en primer intento")
-            except json.JSONDecodeError as e:
-                logger.error(f"❌ Error parseando JSON: {e}")
-                logger.error(f"📍 Posición del error: línea {e.lineno}, columna {e.colno}")
-                logger.error(f"🔍 Contexto del error: ...{cleaned_response[max(0, e.pos-50):e.pos+50]}...")
+        except json.JSONDecodeError as e:
+            reparado, reparaciones = reparar_json(response_text)
+            logger.error(f"❌ Error parseando JSON: {e} (reparaciones intentadas: {reparaciones})")
+            logger.error(f"🔍 Contexto del error: ...{reparado[max(0, e.pos-50):e.pos+50]}...")
+            
+            # ⭐ Último recurso: json_repair, si está instalado
+            try:
+                from json_repair import repair_json
+                
+                logger.info("🔧 Intentando reparar JSON automáticamente con json_repair...")
+                plan_data = repair_json(reparado, return_objects=True)
+                reparaciones = {**reparaciones, 'json_repair': 1}
+                logger.info("✅ JSON reparado exitosamente con json_repair")
+            except Exception as repair_error:
+                logger.error(f"❌ Error reparando JSON: {repair_error}")
                 
-                # ⭐ Intentar reparar con json_repair
+                # Guardar respuesta problemática para debugging
+                debug_file = f"debug_gemini_response_{int(time.time())}.json"
                 try:
-                    logger.info("🔧 Intentando reparar JSON automáticamente con json_repair...")
-                    plan_data = repair_json(cleaned_response, return_objects=True)
-                    logger.info("✅ JSON reparado exitosamente con json_repair")
-                except Exception as repair_error:
-                    logger.error(f"❌ Error reparando JSON: {repair_error}")
-                    
-                    # Guardar respuesta problemática para debugging
-                    debug_file = f"debug_gemini_response_{int(time.time())}.json"
-                    try:
-                        with open(debug_file, 'w', encoding='utf-8') as f:
-                            f.write(cleaned_response)
-                        logger.error(f"💾 Respuesta completa guardada en: {debug_file}")
-                    except:
-                        logger.error("❌ No se pudo guardar el archivo de debug")
-                    
-                    return {
-                        'success': False,
-                        'error': f'Error parseando JSON en línea {e.lineno}, columna {e.colno}: {str(e)}',
-                        'error_detail': f'Carácter problemático cerca de: {cleaned_response[max(0, e.pos-30):e.pos+30]}',
-                        'raw_response': cleaned_response[:1000],
-                        'debug_file': debug_file if 'debug_file' in locals() else None
-                    }
-            
-            if not plan_data:
+                    with open(debug_file, 'w', encoding='utf-8') as f:
+                        f.write(response_text)
+                    logger.error(f"💾 Respuesta completa guardada en: {debug_file}")
+                except:
+                    logger.error("❌ No se pudo guardar el archivo de debug")
+                    debug_file = None
+                
                 return {
                     'success': False,
-                    'error': 'No se pudo parsear el JSON después de múltiples intentos'
+                    'error': f'Error parseando JSON en línea {e.lineno}, columna {e.colno}: {str(e)}',
+                    'error_detail': f'Carácter problemático cerca de: {reparado[max(0, e.pos-30):e.pos+30]}',
+                    'raw_response': response_text[:1000],
+                    'debug_file': debug_file
                 }
+        
+        if not plan_data:
+            return {
+                'success': False,
+                'error': 'No se pudo parsear el JSON después de múltiples intentos'
+            }
+        
+        if ESQUEMA_COMPACTO and isinstance(plan_data, dict):
+            plan_data = expandir_plan(plan_data)
+        biblioteca = self.biblioteca.expandir_plan(plan_data) if isinstance(plan_data, dict) else None
+        
+        # Validar estructura básica
+        required_fields = ['nombre_plan', 'modulos']
+        missing_fields = [field for field in required_fields if field not in plan_data]
+        
+        if missing_fields:
+            return {
+                'success': False,
+                'error': f'Faltan campos requeridos en la respuesta: {", ".join(missing_fields)}'
+            }
+        
+        if not isinstance(plan_data['modulos'], list) or len(plan_data['modulos']) == 0:
+            return {
+                'success': False,
+                'error': 'El plan debe contener al menos un módulo'
+            }
+        
+        # Agregar metadata
+        plan_data['generado_con'] = 'Gemini AI - Preescolar Edition'
+        plan_data['modelo'], plan_data['nivel_modelo'] = self._modelo_del_plan(uso)
+        plan_data['tiene_diagnostico'] = bool(diagnostico_text and str(diagnostico_text).strip())
+        plan_data['nivel'] = 'Preescolar 2'
+        plan_data['fecha_generacion'] = time.strftime("%Y-%m-%d %H:%M:%S")
+        
+        # Asegurar num_modulos
+        if 'num_modulos' not in plan_data:
+            plan_data['num_modulos'] = len(plan_data['modulos'])
+        
+        logger.info(f"✅ Plan de preescolar generado exitosamente: {plan_data['nombre_plan']}")
+        logger.info(f"📊 Módulos: {plan_data['num_modulos']}")
+        
+        # Contar actividades totales
+        total_actividades = sum(
+            len(m.get('actividades_desarrollo', [])) for m in plan_data['modulos']
+        )
+        logger.info(f"🎨 Actividades de desarrollo: {total_actividades}")
+        
+        # Log de campos formativos y ejes
+        if 'campo_formativo_principal' in plan_data:
+            logger.info(f"📚 Campo formativo: {plan_data['campo_formativo_principal']}")
+        if 'ejes_articuladores_generales' in plan_data:
+            logger.info(f"🔗 Ejes articuladores: {len(plan_data['ejes_articuladores_generales'])}")
+        
+        # Validar estructura completa
+        validacion = self.validar_plan_estructura(plan_data)
+        if validacion['advertencias']:
+            logger.warning(f"⚠️ Se encontraron {len(validacion['advertencias'])} advertencias en el plan")
+        
+        return {
+            'success': True,
+            'plan': plan_data,
+            'validacion': validacion,
+            'reparaciones_json': reparaciones,
+            'enrutamiento': uso,
+            'biblioteca': biblioteca
+        }
+    
+    async def generar_plan_stream(
+        self,
+        plan_text: str,
+        diagnostico_text: Optional[str] = None,
+        forzar_regeneracion: bool = False
+    ) -> AsyncIterator[Dict]:
+        """
+        Genera el plan en streaming
+        
+        Produce {'evento': 'modulo', 'modulo': {...}} en cuanto cada módulo se
+        completa en la salida de Gemini y, al final, {'evento': 'plan',
+        'resultado': {...}} con el mismo formato que devuelve generar_plan.
+        Si el plan está en caché, los módulos se emiten de inmediato.
+        
+        Como generar_plan, las llamadas idénticas simultáneas comparten una
+        sola generación: quien se une a una en streaming recibe los módulos
+        ya emitidos y luego los siguientes según llegan. Con
+        forzar_regeneracion no se une a una generación en curso.
+        """
+        logger.info("🤖 Generando plan de preescolar con Gemini AI (streaming)...")
+        
+        if not plan_text or (isinstance(plan_text, str) and len(plan_text.strip()) < 100):
+            yield {'evento': 'plan', 'resultado': {
+                'success': False,
+                'error': 'El plan de estudios debe contener al menos 100 caracteres de texto válido'
+            }}
+            return
+        
+        clave = self._clave_cache(plan_text, diagnostico_text)
+        
+        if not forzar_regeneracion:
+            resultado = await self._buscar_en_cache(clave)
+            if resultado is not None:
+                for modulo in resultado['plan']['modulos']:
+                    yield {'evento': 'modulo', 'modulo': modulo}
+                yield {'evento': 'plan', 'resultado': resultado}
+                return
+        
+        eventos = _ModulosEmitidos()
+        fabrica = lambda: self._vuelo_stream(clave, eventos, plan_text, diagnostico_text)
+        if forzar_regeneracion and self.vuelos.en_curso(clave):
+            # Generación propia, fuera del vuelo en curso (que da el plan anterior)
+            tarea = asyncio.ensure_future(fabrica())
+            soltar = tarea.cancel
+        else:
+            # Se registra sin ceder el control: un stream idéntico que llegue
+            # después se une a este vuelo. Si el vuelo no es en streaming
+            # (datos None), los módulos llegan con el plan
+            vuelo = self.vuelos.unirse(clave, fabrica, datos=eventos)
+            eventos = vuelo.datos
+            tarea = vuelo.tarea
+            soltar = lambda: self.vuelos.soltar(clave, vuelo)
+        
+        enviados = 0
+        try:
+            while eventos is not None:
+                for modulo in eventos.modulos[enviados:]:
+                    enviados += 1
+                    yield {'evento': 'modulo', 'modulo': copy.deepcopy(modulo)}
+                if tarea.done():
+                    break
+                cambio = asyncio.ensure_future(eventos.cambio.wait())
+                try:
+                    await asyncio.wait({tarea, cambio}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    cambio.cancel()
+            # shield: dejar este stream no cancela el vuelo que otros esperan
+            resultado = copy.deepcopy(await asyncio.shield(tarea))
+        finally:
+            # Cliente desconectado: deja de esperar (el vuelo se cancela si nadie más lo espera)
+            soltar()
+        
+        if eventos is None:
+            for modulo in resultado.get('plan', {}).get('modulos', []):
+                yield {'evento': 'modulo', 'modulo': modulo}
+        yield {'evento': 'plan', 'resultado': resultado}
+    
+    async def _vuelo_stream(
+        self, clave: str, eventos: "_ModulosEmitidos", plan_text, diagnostico_text
+    ) -> Dict:
+        """Generación en streaming compartida: publica los módulos en `eventos` y devuelve el resultado"""
+        try:
+            return await self._generar_plan_stream_gemini(clave, eventos, plan_text, diagnostico_text)
+        finally:
+            eventos.cerrar()
+    
+    async def _generar_plan_stream_gemini(
+        self, clave: str, eventos: "_ModulosEmitidos", plan_text, diagnostico_text
+    ) -> Dict:
+        """Llamada a Gemini en streaming sin caché ni coalescencia (ver generar_plan_stream)"""
+        try:
+            plan_text, diagnostico_text, info_entrada = await self._ajustar_a_contexto(plan_text, diagnostico_text)
+            uso = self._iniciar_uso()
             
-            # Validar estructura básica
-            required_fields = ['nombre_plan', 'modulos']
-            missing_fields = [field for field in required_fields if field not in plan_data]
+            if GEMINI_TWO_PHASE:
+                logger.info("📤 Enviando solicitudes a Gemini (dos fases)...")
+                async for evento, datos in self._generar_por_modulos(plan_text, diagnostico_text):
+                    if evento == 'modulo':
+                        eventos.agregar(self._expandir_modulo(datos))
+                    else:
+                        resultado = self._procesar_respuesta(json.dumps(datos, ensure_ascii=False), diagnostico_text, uso)
+                resultado['entrada'] = info_entrada
+                await self._guardar_en_cache(clave, resultado)
+                return resultado
             
-            if missing_fields:
-                return {
-                    'success': False,
-                    'error': f'Faltan campos requeridos en la respuesta: {", ".join(missing_fields)}'
-                }
+            prompt = self._build_prompt(plan_text, diagnostico_text, self._seccion_biblioteca(plan_text))
+            parser = ModulosStreamParser(array_key=CLAVE_MODULOS_COMPACTA if ESQUEMA_COMPACTO else "modulos")
+            
+            logger.info("📤 Enviando solicitud a Gemini (streaming)...")
+            estado_stream: Dict = {}
+            async for fragmento in self._generar_contenido_stream(prompt, estado_stream, MODULOS_POR_PLAN):
+                for modulo in parser.feed(fragmento):
+                    modulo = self._expandir_modulo(modulo)
+                    logger.info(f"🧩 Módulo {parser.items_emitted} recibido: {modulo.get('nombre', '')}")
+                    eventos.agregar(modulo)
             
-            if not isinstance(plan_data['modulos'], list) or len(plan_data['modulos']) == 0:
+            if not parser.buffer.strip():
                 return {
                     'success': False,
-                    'error': 'El plan debe contener al menos un módulo'
+                    'error': 'Gemini no generó una respuesta válida'
                 }
             
-            # Agregar metadata
-            plan_data['generado_con'] = 'Gemini AI - Preescolar Edition'
-            plan_data['modelo'] = MODEL_NAME
-            plan_data['tiene_diagnostico'] = bool(diagnostico_text and diagnostico_text.strip())
-            plan_data['nivel'] = 'Preescolar 2'
-            plan_data['fecha_generacion'] = time.strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Asegurar num_modulos
-            if 'num_modulos' not in plan_data:
-                plan_data['num_modulos'] = len(plan_data['modulos'])
-            
-            logger.info(f"✅ Plan de preescolar generado exitosamente: {plan_data['nombre_plan']}")
-            logger.info(f"📊 Módulos: {plan_data['num_modulos']}")
-            
-            # Contar actividades totales
-            total_actividades = sum(
-                len(m.get('actividades_desarrollo', [])) for m in plan_data['modulos']
-            )
-            logger.info(f"🎨 Actividades de desarrollo: {total_actividades}")
-            
-            # Log de campos formativos y ejes
-            if 'campo_formativo_principal' in plan_data:
-                logger.info(f"📚 Campo formativo: {plan_data['campo_formativo_principal']}")
-            if 'ejes_articuladores_generales' in plan_data:
-                logger.info(f"🔗 Ejes articuladores: {len(plan_data['ejes_articuladores_generales'])}")
+            logger.info("📥 Respuesta completa recibida de Gemini")
+            texto = parser.buffer
+            continuaciones = 0
+            if self._fue_truncada(estado_stream.get('motivo_fin'), texto):
+                plan_unido, continuaciones = await self._completar_truncado(prompt, texto)
+                modulos = plan_unido.get(clave_salida('modulos', ESQUEMA_COMPACTO), [])
+                # Los módulos que llegaron completos por el stream ya se enviaron
+                for modulo in modulos[parser.items_emitted:]:
+                    eventos.agregar(self._expandir_modulo(modulo))
+                texto = json.dumps(plan_unido, ensure_ascii=False)
             
-            # Validar estructura completa
-            validacion = self.validar_plan_estructura(plan_data)
-            if validacion['advertencias']:
-                logger.warning(f"⚠️ Se encontraron {len(validacion['advertencias'])} advertencias en el plan")
+            resultado = self._procesar_respuesta(texto, diagnostico_text, uso)
+            resultado['entrada'] = info_entrada
+            resultado['continuaciones'] = continuaciones
+            await self._guardar_en_cache(clave, resultado)
+            return resultado
             
+        except (CircuitoAbiertoError, CuotaExcedidaError) as e:
+            logger.error(f"⚡ {e}")
+            return {'success': False, 'error': str(e)}
+        except asyncio.TimeoutError:
+            logger.error("⏱️ Gemini no respondió dentro del tiempo límite (streaming)")
             return {
-                'success': True,
-                'plan': plan_data,
-                'validacion': validacion
+                'success': False,
+                'error': 'Gemini no respondió dentro del tiempo límite'
             }
-            
         except Exception as e:
-            logger.error(f"❌ Error generando plan con Gemini: {e}")
-            import traceback
-            logger.error(f"📋 Traceback: {traceback.format_exc()}")
+            logger.error(f"❌ Error generando plan con Gemini (streaming): {e}")
             return {
                 'success': False,
                 'error': f'Error inesperado: {str(e)}'
             }
     
     def validar_plan_estructura(self, plan_data: Dict) -> Dict:
-        """Valida que el plan de preescolar tenga la estructura correcta"""
-        errores = []
-        advertencias = []
-        
-        # Validar campos principales
-        if 'nombre_plan' not in plan_data or not plan_data['nombre_plan']:
-            errores.append("Falta el nombre del plan")
-        
-        # Validar campos formativos y ejes articuladores
-        if 'campo_formativo_principal' not in plan_data:
-            advertencias.append("No se especificó el campo formativo principal")
-        
-        if 'ejes_articuladores_generales' not in plan_data:
-            advertencias.append("No se especificaron los ejes articuladores generales")
-        
-        if 'modulos' not in plan_data or not isinstance(plan_data['modulos'], list):
-            errores.append("Falta el array de módulos")
-        elif len(plan_data['modulos']) == 0:
-            errores.append("El plan debe tener al menos un módulo")
-        else:
-            # Validar cada módulo con estructura de preescolar
-            required_module_fields = [
-                'numero', 'nombre', 'campo_formativo', 'ejes_articuladores',
-                'aprendizaje_esperado', 'tiempo_estimado',
-                'actividad_inicio', 'actividades_desarrollo', 'actividad_cierre'
-            ]
-            
-            for idx, modulo in enumerate(plan_data['modulos'], 1):
-                missing = [field for field in required_module_fields if field not in modulo]
-                if missing:
-                    errores.append(f"Módulo {idx} - Faltan campos: {', '.join(missing)}")
-                
-                # Validar campo_formativo
-                if 'campo_formativo' in modulo and not modulo['campo_formativo']:
-                    advertencias.append(f"Módulo {idx} - Campo formativo vacío")
-                
-                # Validar ejes_articuladores
-                if 'ejes_articuladores' in modulo:
-                    if not isinstance(modulo['ejes_articuladores'], list):
-                        errores.append(f"Módulo {idx} - ejes_articuladores debe ser un array")
-                    elif len(modulo['ejes_articuladores']) == 0:
-                        advertencias.append(f"Módulo {idx} - No tiene ejes articuladores especificados")
-                
-                # Validar actividad_inicio
-                if 'actividad_inicio' in modulo:
-                    if not isinstance(modulo['actividad_inicio'], dict):
-                        errores.append(f"Módulo {idx} - actividad_inicio debe ser un objeto")
-                    else:
-                        inicio_required = ['nombre', 'descripcion', 'duracion', 'materiales']
-                        inicio_missing = [f for f in inicio_required if f not in modulo['actividad_inicio']]
-                        if inicio_missing:
-                            errores.append(f"Módulo {idx} - actividad_inicio faltan: {', '.join(inicio_missing)}")
-                
-                # Validar actividades_desarrollo
-                if 'actividades_desarrollo' in modulo:
-                    if not isinstance(modulo['actividades_desarrollo'], list):
-                        errores.append(f"Módulo {idx} - actividades_desarrollo debe ser un array")
-                    elif len(modulo['actividades_desarrollo']) < 2:
-                        advertencias.append(f"Módulo {idx} - Se recomienda tener al menos 2 actividades de desarrollo")
-                    
-                    # Validar estructura de cada actividad de desarrollo
-                    for act_idx, actividad in enumerate(modulo.get('actividades_desarrollo', []), 1):
-                        if not isinstance(actividad, dict):
-                            errores.append(f"Módulo {idx}, Actividad {act_idx} - debe ser un objeto")
-                        else:
-                            act_required = ['nombre', 'tipo', 'descripcion', 'duracion', 'materiales']
-                            act_missing = [f for f in act_required if f not in actividad]
-                            if act_missing:
-                                advertencias.append(f"Módulo {idx}, Actividad {act_idx} - faltan: {', '.join(act_missing)}")
-                
-                # Validar actividad_cierre
-                if 'actividad_cierre' in modulo:
-                    if not isinstance(modulo['actividad_cierre'], dict):
-                        errores.append(f"Módulo {idx} - actividad_cierre debe ser un objeto")
-                    else:
-                        cierre_required = ['nombre', 'descripcion', 'duracion']
-                        cierre_missing = [f for f in cierre_required if f not in modulo['actividad_cierre']]
-                        if cierre_missing:
-                            advertencias.append(f"Módulo {idx} - actividad_cierre faltan: {', '.join(cierre_missing)}")
-                
-                # Validar campos pedagógicos recomendados
-                pedagogicos = ['consejos_maestra', 'variaciones', 'vinculo_familia', 'evaluacion']
-                pedagogicos_missing = [f for f in pedagogicos if f not in modulo]
-                if pedagogicos_missing:
-                    advertencias.append(f"Módulo {idx} - campos pedagógicos faltantes: {', '.join(pedagogicos_missing)}")
-        
-        # Validar recursos educativos
-        if 'recursos_educativos' in plan_data:
-            recursos = plan_data['recursos_educativos']
-            
-            # Validar estructura de cuentos_recomendados
-            if 'cuentos_recomendados' in recursos and isinstance(recursos['cuentos_recomendados'], list):
-                for idx, cuento in enumerate(recursos['cuentos_recomendados'], 1):
-                    if 'titulo' not in cuento:
-                        advertencias.append(f"Cuento {idx} - Falta título completo")
-                    if 'tipo' not in cuento:
-                        advertencias.append(f"Cuento {idx} - No especifica si es REAL o CREATIVO")
-                    elif cuento['tipo'] not in ['RECURSO REAL', 'PROPUESTA CREATIVA']:
-                        advertencias.append(f"Cuento {idx} - tipo debe ser 'RECURSO REAL' o 'PROPUESTA CREATIVA'")
-                    if 'acceso' not in cuento:
-                        advertencias.append(f"Cuento {idx} - No especifica si es GRATUITO o REQUIERE COMPRA")
-                    elif cuento['acceso'] not in ['GRATUITO', 'REQUIERE COMPRA']:
-                        advertencias.append(f"Cuento {idx} - acceso debe ser 'GRATUITO' o 'REQUIERE COMPRA'")
-            
-            # Validar estructura de canciones_recomendadas
-            if 'canciones_recomendadas' in recursos and isinstance(recursos['canciones_recomendadas'], list):
-                for idx, cancion in enumerate(recursos['canciones_recomendadas'], 1):
-                    if 'titulo' not in cancion:
-                        advertencias.append(f"Canción {idx} - Falta título")
-                    if 'acceso' not in cancion:
-                        advertencias.append(f"Canción {idx} - No especifica acceso (GRATUITO/COMPRA)")
-            
-            # Validar materiales digitales
-            if 'materiales_digitales' in recursos and isinstance(recursos['materiales_digitales'], list):
-                for idx, material in enumerate(recursos['materiales_digitales'], 1):
-                    if 'nombre' not in material:
-                        advertencias.append(f"Material digital {idx} - Falta nombre")
-                    if 'acceso' not in material:
-                        advertencias.append(f"Material digital {idx} - No especifica acceso")
-        else:
-            advertencias.append("No se incluyó la sección de recursos_educativos")
+        """Valida que el plan de preescolar tenga la estructura correcta (ver esquema_plan)"""
+        validacion = validar_plan(plan_data)
         
-        # Validar vinculación curricular
-        if 'vinculacion_curricular' not in plan_data:
-            advertencias.append("No se incluyó vinculación curricular (campos y ejes)")
-        else:
-            vinculacion = plan_data['vinculacion_curricular']
-            vinc_required = ['campo_formativo_principal', 'ejes_transversales', 'aprendizajes_clave']
-            vinc_missing = [f for f in vinc_required if f not in vinculacion]
-            if vinc_missing:
-                advertencias.append(f"Vinculación curricular - faltan: {', '.join(vinc_missing)}")
-        
-        # Log de advertencias
-        if advertencias:
-            for adv in advertencias:
-                logger.warning(f"⚠️ {adv}")
-        
-        # Log de errores
-        if errores:
-            for err in errores:
-                logger.error(f"❌ {err}")
+        # Un resumen por plan en lugar de una línea por hallazgo
+        if validacion['errores']:
+            logger.error(
+                f"❌ Plan con {validacion['total_errores']} errores de estructura: "
+                f"{'; '.join(validacion['errores'][:5])}"
+            )
+        if validacion['advertencias']:
+            logger.debug(f"⚠️ Advertencias del plan: {'; '.join(validacion['advertencias'])}")
         
-        return {
-            'valido': len(errores) == 0,
-            'errores': errores,
-            'advertencias': advertencias,
-            'total_errores': len(errores),
-            'total_advertencias': len(advertencias)
-        }
+        return validacion
 
 
-# Instancia global del generador
+# Instancia global del generador (el modelo se crea de forma diferida)
 plan_generator = GeminiPlanGenerator()
 
 
+def obtener_estado_gemini() -> Dict:
+    """Estado actual del cliente de Gemini (para /health y monitoreo)"""
+    return {
+        'modelo': MODEL_NAME,
+        'niveles': {nombre: nivel.estado() for nombre, nivel in plan_generator.niveles.items()},
+        'concurrencia_maxima': GEMINI_MAX_CONCURRENCY,
+        'llamadas_en_curso': plan_generator.llamadas_en_curso,
+        'llamadas_en_espera': plan_generator.llamadas_en_espera,
+        'cache': plan_generator.cache.estado(),
+        'biblioteca': plan_generator.biblioteca.estado(),
+        'coalescencia': plan_generator.vuelos.estado(),
+    }
+
+
+def configurar_cache_planes(almacenamiento) -> None:
+    """
+    Persiste la caché de planes en el almacenamiento indicado
+    
+    Args:
+        almacenamiento: Objeto con leer_cache/guardar_cache (p. ej. GCSStorageManagerV2)
+    """
+    plan_generator.cache.configurar_almacenamiento(almacenamiento)
+
+
 # Función de conveniencia
 async def generar_plan_estudio(
     plan_text: str,
-    diagnostico_text: Optional[str] = None
+    diagnostico_text: Optional[str] = None,
+    forzar_regeneracion: bool = False
 ) -> Dict:
     """
     Función helper para generar un plan de estudio de preescolar
-    Con corrección automática de errores JSON y retry
+    Con corrección automática de errores JSON, reintentos y circuit breaker
     
     Args:
-        plan_text: Texto del plan de estudios oficial
-        diagnostico_text: Texto del diagnóstico del grupo (opcional)
+        plan_text: Texto del plan de estudios oficial o su DocumentoAdjunto
+        diagnostico_text: Texto o documento del diagnóstico del grupo (opcional)
+        forzar_regeneracion: Ignora la caché de planes y genera de nuevo
     
     Returns:
         Dict con el plan generado o error
@@ -742,8 +1664,43 @@ async def generar_plan_estudio(
         >>>         print(f"❌ Errores: {validacion['errores']}")
         >>>         print(f"⚠️ Advertencias: {validacion['advertencias']}")
     """
-    return await plan_generator.generar_plan(plan_text, diagnostico_text)
+    return await plan_generator.generar_plan(plan_text, diagnostico_text, forzar_regeneracion)
+
+
+def generar_plan_estudio_stream(
+    plan_text: str,
+    diagnostico_text: Optional[str] = None,
+    forzar_regeneracion: bool = False
+) -> AsyncIterator[Dict]:
+    """
+    Versión en streaming de generar_plan_estudio
+    
+    Returns:
+        Iterador asíncrono de eventos 'modulo' y un evento final 'plan'
+    """
+    return plan_generator.generar_plan_stream(plan_text, diagnostico_text, forzar_regeneracion)
+
+
 
+async def regenerar_modulo_plan(
+    plan_data: Dict,
+    numero: int,
+    plan_text: str,
+    diagnostico_text: Optional[str] = None
+) -> Dict:
+    """
+    Regenera el módulo `numero` (1..num_modulos) de un plan existente
+    
+    Args:
+        plan_data: Plan guardado (formato completo)
+        numero: Número del módulo a regenerar
+        plan_text: Texto (o documento adjunto) del plan de estudios con que se generó
+        diagnostico_text: Texto o documento del diagnóstico (opcional)
+    
+    Returns:
+        Dict con el módulo nuevo o error (el plan no se modifica)
+    """
+    return await plan_generator.regenerar_modulo(plan_data, numero, plan_text, diagnostico_text)
 
 # Función adicional para validar un plan existente
 # def validar_plan_existente(plan_data: Dict) -> Dict:
@@ -0,0 +1,164 @@
+"""
+Gobernador de cuota de Gemini (solicitudes y tokens por minuto)
+Token buckets del lado del cliente para no exceder el RPM/TPM del proyecto:
+las llamadas que caben se admiten, el resto espera en fila con tiempo acotado
+"""
+
+import asyncio
+import logging
+import math
+import time
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+# Aproximación de caracteres por token para texto en español
+CARACTERES_POR_TOKEN = 4
+
+
+class CuotaExcedidaError(Exception):
+    """La llamada no obtuvo cuota dentro del tiempo de espera permitido"""
+
+
+def estimar_tokens(texto: str) -> int:
+    """Estimación rápida de tokens de un texto (sin llamar a la API)"""
+    return math.ceil(len(texto or "") / CARACTERES_POR_TOKEN)
+
+
+class TokenBucket:
+    """
+    Cubeta que se rellena de forma continua hasta `capacidad` por minuto
+
+    El saldo puede quedar negativo al conciliar con el uso real (deuda), que
+    se paga con el relleno de los segundos siguientes.
+    """
+
+    def __init__(self, por_minuto: float):
+        self.capacidad = float(por_minuto)
+        self.por_segundo = por_minuto / 60.0
+        self.saldo = float(por_minuto)
+        self._ultimo = time.monotonic()
+
+    def _rellenar(self) -> None:
+        ahora = time.monotonic()
+        self.saldo = min(self.capacidad, self.saldo + (ahora - self._ultimo) * self.por_segundo)
+        self._ultimo = ahora
+
+    def espera_para(self, cantidad: float) -> float:
+        """Segundos hasta que haya saldo para `cantidad`"""
+        self._rellenar()
+        faltante = cantidad - self.saldo
+        return max(0.0, faltante / self.por_segundo)
+
+    def consumir(self, cantidad: float) -> None:
+        self._rellenar()
+        self.saldo -= cantidad
+
+    def disponible(self) -> float:
+        self._rellenar()
+        return self.saldo
+
+
+class GobernadorCuota:
+    """
+    Admite llamadas dentro del RPM/TPM configurado
+
+    La fila es FIFO (asyncio.Lock es justo): solo la primera llamada de la fila
+    espera saldo, así una solicitud grande no queda relegada por pequeñas.
+    """
+
+    def __init__(self, rpm: int, tpm: int, espera_maxima: float, fila_maxima: int):
+        self.solicitudes = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.espera_maxima = espera_maxima
+        self.fila_maxima = fila_maxima
+        self._turno = asyncio.Lock()
+        self.en_fila = 0
+        self.admitidas = 0
+        self.rechazadas = 0
+        self.tiempo_espera_total = 0.0
+
+    async def admitir(self, tokens_estimados: int) -> int:
+        """
+        Espera hasta que la llamada quepa en la cuota y la descuenta
+
+        Returns:
+            Tokens reservados (para conciliar después con el uso real)
+
+        Raises:
+            CuotaExcedidaError: fila llena o espera mayor a espera_maxima
+        """
+        # Una solicitud mayor que el TPM completo nunca cabría: se limita a la capacidad
+        reservados = min(tokens_estimados, int(self.tokens.capacidad))
+
+        # Camino rápido: nadie en fila y hay saldo
+        if (not self._turno.locked() and self.solicitudes.espera_para(1) == 0
+                and self.tokens.espera_para(reservados) == 0):
+            self.solicitudes.consumir(1)
+            self.tokens.consumir(reservados)
+            self.admitidas += 1
+            return reservados
+
+        if self.en_fila >= self.fila_maxima:
+            self.rechazadas += 1
+            raise CuotaExcedidaError(
+                "Demasiadas solicitudes a Gemini en espera; intenta de nuevo en unos minutos"
+            )
+
+        inicio = time.monotonic()
+        limite = inicio + self.espera_maxima
+
+        self.en_fila += 1
+        try:
+            try:
+                await asyncio.wait_for(self._turno.acquire(), timeout=max(limite - time.monotonic(), 0.0))
+            except asyncio.TimeoutError:
+                raise self._rechazo(inicio)
+
+            try:
+                espera = max(self.solicitudes.espera_para(1), self.tokens.espera_para(reservados))
+                if time.monotonic() + espera > limite:
+                    raise self._rechazo(inicio)
+                if espera > 0:
+                    logger.info(f"🚦 Cuota de Gemini: esperando {espera:.1f}s ({self.en_fila} en fila)")
+                    await asyncio.sleep(espera)
+
+                self.solicitudes.consumir(1)
+                self.tokens.consumir(reservados)
+            finally:
+                self._turno.release()
+        finally:
+            self.en_fila -= 1
+
+        self.admitidas += 1
+        self.tiempo_espera_total += time.monotonic() - inicio
+        return reservados
+
+    def _rechazo(self, inicio: float) -> CuotaExcedidaError:
+        self.rechazadas += 1
+        logger.warning(f"🚦 Cuota de Gemini agotada: solicitud rechazada tras {time.monotonic() - inicio:.1f}s")
+        return CuotaExcedidaError(
+            "Se alcanzó el límite de uso de Gemini por minuto; intenta de nuevo en unos minutos"
+        )
+
+    def conciliar(self, reservados: int, reales: int) -> None:
+        """Ajusta el saldo de tokens con el uso real reportado por la API"""
+        if reales > 0:
+            self.tokens.consumir(reales - reservados)
+
+    def devolver(self, reservados: int) -> None:
+        """Devuelve la reserva de una llamada que no llegó a generar (la solicitud sí cuenta)"""
+        self.tokens.consumir(-reservados)
+
+    def estado(self) -> Dict:
+        """Presupuesto disponible y profundidad de la fila (para /health)"""
+        return {
+            "rpm": int(self.solicitudes.capacidad),
+            "tpm": int(self.tokens.capacidad),
+            "solicitudes_disponibles": round(self.solicitudes.disponible(), 2),
+            "tokens_disponibles": int(self.tokens.disponible()),
+            "en_fila": self.en_fila,
+            "admitidas": self.admitidas,
+            "rechazadas": self.rechazadas,
+            "espera_promedio_s": round(self.tiempo_espera_total / self.admitidas, 3) if self.admitidas else 0.0,
+        }
@@ -0,0 +1,229 @@
+"""
+Lectura tolerante del JSON que devuelve Gemini
+Un solo recorrido en tiempo lineal que corrige los defectos habituales
+(bloques markdown, saltos de línea sin escapar en strings, comas finales o
+faltantes, comillas internas sin escapar, cierres faltantes por truncamiento)
+y reporta qué reparó
+"""
+
+import json
+import re
+from collections import Counter
+from typing import Any, Dict, Tuple
+
+# Dentro de un string solo interesan comillas, escapes y caracteres de control
+_ESPECIAL_EN_STRING = re.compile(r'["\\\x00-\x1f]')
+_ESPACIOS = re.compile(r"[ \t\r\n]*")
+_LITERAL = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null|True|False|None")
+_LITERALES_PYTHON = {"True": "true", "False": "false", "None": "null"}
+_ESCAPES_CONTROL = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+# Estados del contenedor actual
+_CLAVE = "clave"            # objeto: se espera una clave o '}'
+_DOS_PUNTOS = "dos_puntos"  # objeto: se leyó la clave
+_VALOR = "valor"            # se espera un valor (tras ':' o en un arreglo)
+_COMA = "coma"              # se leyó un valor: se espera ',' o el cierre
+_FIN = "fin"                # la raíz ya se cerró
+
+_CIERRES = {"{": "}", "[": "]"}
+
+
+def _termina_string(texto: str, i: int) -> bool:
+    """
+    Decide si la comilla en texto[i] cierra el string o es una comilla interna
+
+    Cierra si lo siguiente (ignorando espacios) es ',', ':', '}', ']' o el fin;
+    o una comilla/llave en otra línea (miembro siguiente sin coma).
+    """
+    fin_espacios = _ESPACIOS.match(texto, i + 1).end()
+    if fin_espacios >= len(texto):
+        return True
+    siguiente = texto[fin_espacios]
+    if siguiente in ",:}]":
+        return True
+    return siguiente in '"{[' and "\n" in texto[i + 1:fin_espacios]
+
+
+def reparar_json(texto: str) -> Tuple[str, Dict[str, int]]:
+    """
+    Repara el JSON en un solo recorrido
+
+    Cada carácter se examina un número acotado de veces (los espacios tras
+    una comilla interna, dos), así que el costo es lineal en la longitud
+    incluso en respuestas de decenas de KB.
+
+    Returns:
+        (json_reparado, reparaciones) donde reparaciones cuenta cada tipo de
+        corrección aplicada ({} si el texto ya era válido)
+    """
+    reparaciones: Counter = Counter()
+    salida = []
+    pila = []
+    estado = _VALOR
+    # Posición en `salida` de la coma emitida si aún no la siguió ningún valor
+    # (para quitarla si resulta sobrante)
+    ultima_coma = -1
+    n = len(texto)
+
+    inicio = min((p for p in (texto.find("{"), texto.find("[")) if p != -1), default=-1)
+    if inicio == -1:
+        return texto, dict(reparaciones)
+    if texto[:inicio].strip():
+        reparaciones["markdown" if "```" in texto[:inicio] else "texto_previo"] += 1
+    i = inicio
+
+    def emitir_coma_faltante():
+        nonlocal ultima_coma
+        reparaciones["coma_faltante"] += 1
+        salida.append(",")
+        ultima_coma = len(salida) - 1
+
+    while i < n and estado != _FIN:
+        c = texto[i]
+
+        if c in " \t\r\n":
+            fin = _ESPACIOS.match(texto, i).end()
+            salida.append(texto[i:fin])
+            i = fin
+            continue
+
+        if c == '"':
+            if estado == _COMA:
+                emitir_coma_faltante()
+                estado = _CLAVE if pila[-1] == "{" else _VALOR
+            es_clave = estado == _CLAVE
+            ultima_coma = -1
+            salida.append('"')
+            i += 1
+            cerrado = False
+            while i < n:
+                m = _ESPECIAL_EN_STRING.search(texto, i)
+                if m is None:
+                    salida.append(texto[i:])
+                    i = n
+                    break
+                j = m.start()
+                salida.append(texto[i:j])
+                especial = texto[j]
+                if especial == "\\":
+                    if j + 1 < n:
+                        salida.append(texto[j:j + 2])
+                    i = j + 2
+                elif especial == '"':
+                    if _termina_string(texto, j):
+                        salida.append('"')
+                        i = j + 1
+                        cerrado = True
+                        break
+                    reparaciones["comilla_sin_escapar"] += 1
+                    salida.append('\\"')
+                    i = j + 1
+                else:
+                    reparaciones["control_en_string"] += 1
+                    salida.append(_ESCAPES_CONTROL.get(especial, f"\\u{ord(especial):04x}"))
+                    i = j + 1
+            if not cerrado:
+                reparaciones["string_truncado"] += 1
+                salida.append('"')
+            estado = _DOS_PUNTOS if es_clave else _COMA
+            continue
+
+        if c in "{[":
+            if estado == _COMA:
+                emitir_coma_faltante()
+            pila.append(c)
+            salida.append(c)
+            ultima_coma = -1
+            estado = _CLAVE if c == "{" else _VALOR
+            i += 1
+            continue
+
+        if c in "}]":
+            if not pila:
+                break
+            esperado = _CIERRES[pila[-1]]
+            if c != esperado:
+                reparaciones["cierre_incorrecto"] += 1
+            if ultima_coma != -1:
+                reparaciones["coma_final"] += 1
+                salida[ultima_coma] = ""
+            elif estado in (_DOS_PUNTOS, _VALOR) and pila[-1] == "{":
+                reparaciones["valor_faltante"] += 1
+                salida.append("null" if estado == _VALOR else ":null")
+            pila.pop()
+            salida.append(esperado)
+            ultima_coma = -1
+            estado = _COMA if pila else _FIN
+            i += 1
+            continue
+
+        if c == ",":
+            if estado == _COMA:
+                salida.append(",")
+                ultima_coma = len(salida) - 1
+                estado = _CLAVE if pila[-1] == "{" else _VALOR
+            else:
+                reparaciones["coma_sobrante"] += 1
+            i += 1
+            continue
+
+        if c == ":":
+            if estado == _DOS_PUNTOS:
+                salida.append(":")
+                estado = _VALOR
+                ultima_coma = -1
+            else:
+                reparaciones["caracter_inesperado"] += 1
+            i += 1
+            continue
+
+        m = _LITERAL.match(texto, i)
+        if m and estado in (_VALOR, _COMA):
+            if estado == _COMA:
+                emitir_coma_faltante()
+            literal = m.group()
+            if literal in _LITERALES_PYTHON:
+                reparaciones["literal_python"] += 1
+                literal = _LITERALES_PYTHON[literal]
+            salida.append(literal)
+            estado = _COMA
+            ultima_coma = -1
+            i = m.end()
+            continue
+
+        # Comentarios, texto suelto o basura: se descartan
+        reparaciones["caracter_inesperado"] += 1
+        i += 1
+
+    if estado != _FIN:
+        # Respuesta truncada: se completa lo mínimo para que sea JSON válido
+        if pila:
+            if ultima_coma != -1:
+                salida[ultima_coma] = ""
+            elif estado in (_DOS_PUNTOS, _VALOR) and pila[-1] == "{":
+                salida.append("null" if estado == _VALOR else ":null")
+            reparaciones["cierre_faltante"] += len(pila)
+            salida.extend(_CIERRES[a] for a in reversed(pila))
+    elif texto[i:].strip():
+        resto = texto[i:].strip()
+        reparaciones["markdown" if resto.startswith("```") else "texto_posterior"] += 1
+
+    return "".join(salida), dict(reparaciones)
+
+
+def cargar_json(texto: str) -> Tuple[Any, Dict[str, int]]:
+    """
+    Parsea el JSON de una respuesta, reparándolo solo si hace falta
+
+    Returns:
+        (objeto, reparaciones)
+
+    Raises:
+        json.JSONDecodeError: si ni el texto reparado es JSON válido
+    """
+    try:
+        return json.loads(texto), {}
+    except json.JSONDecodeError:
+        pass
+    reparado, reparaciones = reparar_json(texto)
+    return json.loads(reparado), reparaciones
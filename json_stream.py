@@ -0,0 +1,98 @@
+"""
+Parser incremental de JSON para respuestas en streaming de Gemini
+Detecta cada objeto de "modulos" en cuanto se cierra, sin esperar al JSON completo
+"""
+
+import json
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ModulosStreamParser:
+    """
+    Escáner incremental que extrae los objetos de plan["modulos"] a medida que llegan
+
+    Recorre cada carácter una sola vez (tiempo lineal en el total recibido),
+    siguiendo strings, escapes y anidamiento para saber cuándo un objeto del
+    arreglo "modulos" del nivel superior está completo.
+    """
+
+    def __init__(self, array_key: str = "modulos"):
+        self.array_key = array_key
+        self.buffer = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._last_string: Optional[str] = None
+        self._pending_key: Optional[str] = None
+        self._array_depth: Optional[int] = None
+        self._item_start = -1
+        self.items_emitted = 0
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """Agrega texto recibido y devuelve los módulos que se completaron"""
+        self.buffer += chunk
+        completed = []
+        buffer = self.buffer
+
+        for i in range(self._pos, len(buffer)):
+            char = buffer[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    # Solo interesan las claves del objeto raíz
+                    if len(self._stack) == 1:
+                        self._last_string = buffer[self._string_start + 1:i]
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char == ':':
+                if len(self._stack) == 1:
+                    self._pending_key = self._last_string
+            elif char == ',':
+                if len(self._stack) == 1:
+                    self._pending_key = None
+            elif char in '{[':
+                if (char == '[' and len(self._stack) == 1
+                        and self._pending_key == self.array_key and self._array_depth is None):
+                    self._array_depth = len(self._stack) + 1
+                elif char == '{' and self._array_depth is not None and len(self._stack) == self._array_depth:
+                    self._item_start = i
+                self._stack.append(char)
+            elif char in '}]':
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                if (char == '}' and self._array_depth is not None
+                        and len(self._stack) == self._array_depth and self._item_start >= 0):
+                    item = self._parse_item(buffer[self._item_start:i + 1])
+                    self._item_start = -1
+                    if item is not None:
+                        completed.append(item)
+                        self.items_emitted += 1
+                elif char == ']' and self._array_depth is not None and len(self._stack) == self._array_depth - 1:
+                    # Se cerró el arreglo de módulos; no se buscan más
+                    self._array_depth = -1
+
+        self._pos = len(buffer)
+        return completed
+
+    def _parse_item(self, text: str) -> Optional[Dict]:
+        """Parsea un módulo completo; si el JSON parcial es inválido se omite"""
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError as e:
+            logger.warning(f"⚠️ Módulo en streaming con JSON inválido, se enviará en el plan final: {e}")
+            return None
+        return item if isinstance(item, dict) else None
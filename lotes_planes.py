@@ -0,0 +1,177 @@
+"""
+Generación de planes por lotes (un plan de estudios, varios grupos)
+Cada grupo del lote es un elemento que entra a una cola compartida; un número
+fijo de trabajadores la atiende, así un lote grande no satura la cuota ni
+desplaza a las demás solicitudes
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Grupos (diagnósticos) por lote
+LOTE_MAX_GRUPOS = int(os.getenv("LOTE_MAX_GRUPOS", "12"))
+# Trabajadores que generan planes de lotes a la vez (entre todos los lotes)
+LOTE_TRABAJADORES = int(os.getenv("LOTE_TRABAJADORES", "3"))
+# Elementos en cola como máximo; con más, los lotes nuevos se rechazan
+LOTE_MAX_PENDIENTES = int(os.getenv("LOTE_MAX_PENDIENTES", "48"))
+# Tiempo que se conserva el estado de un lote terminado
+LOTE_RETENCION_SEGUNDOS = int(os.getenv("LOTE_RETENCION_SEGUNDOS", str(6 * 3600)))
+
+PENDIENTE = "pendiente"
+GENERANDO = "generando"
+COMPLETADO = "completado"
+ERROR = "error"
+
+
+class ColaLotesLlenaError(Exception):
+    """La cola de lotes no tiene lugar para todos los elementos del lote"""
+
+
+class Lote:
+    """Estado de un lote y de cada uno de sus elementos"""
+
+    def __init__(self, usuario: str, nombres: List[str], procesar: Callable[[int], Awaitable[Dict]]):
+        self.id = f"lote_{uuid.uuid4().hex[:12]}"
+        self.usuario = usuario
+        self.creado = time.time()
+        self.terminado: Optional[float] = None
+        self.procesar = procesar
+        self.elementos = [
+            {'indice': i, 'nombre': nombre, 'estado': PENDIENTE, 'plan_id': None, 'error': None, 'segundos': None}
+            for i, nombre in enumerate(nombres)
+        ]
+
+    @property
+    def pendientes(self) -> int:
+        return sum(e['estado'] in (PENDIENTE, GENERANDO) for e in self.elementos)
+
+    def resumen(self) -> Dict:
+        """Estado del lote para la API"""
+        conteo = {estado: 0 for estado in (PENDIENTE, GENERANDO, COMPLETADO, ERROR)}
+        for elemento in self.elementos:
+            conteo[elemento['estado']] += 1
+        return {
+            'lote_id': self.id,
+            'estado': 'en_curso' if self.pendientes else 'terminado',
+            'total': len(self.elementos),
+            'conteo': conteo,
+            'creado': self.creado,
+            'segundos': round((self.terminado or time.time()) - self.creado, 3),
+            'elementos': [dict(e) for e in self.elementos],
+        }
+
+
+class GestorLotes:
+    """
+    Cola acotada de elementos de lote atendida por `trabajadores` tareas
+
+    Los trabajadores se crean con el primer lote, dentro del event loop del
+    servidor. Cada elemento se procesa con la función del lote, que devuelve
+    {'success', 'plan_id'} o {'success': False, 'error'}; un elemento que
+    falla no detiene a los demás.
+    """
+
+    def __init__(
+        self,
+        trabajadores: int = LOTE_TRABAJADORES,
+        max_pendientes: int = LOTE_MAX_PENDIENTES,
+        retencion_segundos: float = LOTE_RETENCION_SEGUNDOS
+    ):
+        self.trabajadores = max(1, trabajadores)
+        self.max_pendientes = max_pendientes
+        self.retencion_segundos = retencion_segundos
+        self._lotes: Dict[str, Lote] = {}
+        self._cola: Optional[asyncio.Queue] = None
+        self._tareas: List[asyncio.Task] = []
+        self.elementos_completados = 0
+        self.elementos_fallidos = 0
+
+    def _iniciar(self) -> None:
+        if self._tareas and not all(t.done() for t in self._tareas):
+            return
+        self._cola = asyncio.Queue()
+        self._tareas = [asyncio.create_task(self._trabajador(n)) for n in range(self.trabajadores)]
+        logger.info(f"👷 Cola de lotes iniciada con {self.trabajadores} trabajadores")
+
+    def crear(self, usuario: str, nombres: List[str], procesar: Callable[[int], Awaitable[Dict]]) -> Lote:
+        """
+        Registra un lote y encola sus elementos
+
+        Args:
+            nombres: Nombre de cada elemento (p. ej. el archivo de diagnóstico)
+            procesar: Corrutina que genera y guarda el plan del elemento i
+
+        Raises:
+            ColaLotesLlenaError: si la cola no tiene lugar para todo el lote
+        """
+        self._purgar()
+        self._iniciar()
+        en_cola = sum(lote.pendientes for lote in self._lotes.values())
+        if en_cola + len(nombres) > self.max_pendientes:
+            raise ColaLotesLlenaError(
+                f"La cola de lotes está llena ({en_cola} planes pendientes); intenta más tarde"
+            )
+        lote = Lote(usuario, nombres, procesar)
+        self._lotes[lote.id] = lote
+        for elemento in lote.elementos:
+            self._cola.put_nowait((lote, elemento))
+        logger.info(f"📦 Lote {lote.id} con {len(nombres)} planes en cola ({en_cola} pendientes antes)")
+        return lote
+
+    async def _trabajador(self, numero: int) -> None:
+        while True:
+            lote, elemento = await self._cola.get()
+            elemento['estado'] = GENERANDO
+            inicio = time.perf_counter()
+            try:
+                resultado = await lote.procesar(elemento['indice'])
+            except asyncio.CancelledError:
+                elemento.update(estado=ERROR, error='Generación cancelada')
+                raise
+            except Exception as e:
+                logger.error(f"❌ Lote {lote.id}, elemento {elemento['indice']}: {e}", exc_info=True)
+                resultado = {'success': False, 'error': f'Error inesperado: {str(e)}'}
+            finally:
+                elemento['segundos'] = round(time.perf_counter() - inicio, 3)
+                self._cola.task_done()
+
+            if resultado.get('success'):
+                elemento.update(estado=COMPLETADO, plan_id=resultado.get('plan_id'))
+                self.elementos_completados += 1
+            else:
+                elemento.update(estado=ERROR, error=resultado.get('error', 'Error desconocido'))
+                self.elementos_fallidos += 1
+            logger.info(
+                f"📦 Lote {lote.id}: {elemento['nombre']} {elemento['estado']} en {elemento['segundos']:.1f}s "
+                f"({len(lote.elementos) - lote.pendientes}/{len(lote.elementos)})"
+            )
+            if not lote.pendientes:
+                lote.terminado = time.time()
+                lote.procesar = None  # libera los archivos que la función retiene
+
+    def obtener(self, lote_id: str, usuario: str) -> Optional[Lote]:
+        """Lote del usuario, o None si no existe, es de otro usuario o ya se descartó"""
+        self._purgar()
+        lote = self._lotes.get(lote_id)
+        return lote if lote is not None and lote.usuario == usuario else None
+
+    def _purgar(self) -> None:
+        limite = time.time() - self.retencion_segundos
+        for lote_id in [i for i, lote in self._lotes.items() if lote.terminado and lote.terminado < limite]:
+            del self._lotes[lote_id]
+
+    def estado(self) -> Dict:
+        """Métricas de la cola de lotes (para /health)"""
+        return {
+            'trabajadores': self.trabajadores,
+            'lotes': len(self._lotes),
+            'pendientes': sum(lote.pendientes for lote in self._lotes.values()),
+            'completados': self.elementos_completados,
+            'fallidos': self.elementos_fallidos,
+        }
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Header, Query, Request
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
@@ -6,7 +6,9 @@ from pydantic import BaseModel
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
-import pyrebase
+from contextlib import asynccontextmanager
+import asyncio
+import threading
 import os
 import re
 from pathlib import Path
@@ -19,18 +21,27 @@ import io
 import time
 import uuid
 import logging
-from docx import Document
-from docx.shared import Pt, RGBColor, Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
 
 # Importar el módulo OCR
-from PruebaOcr import process_file_to_txt, check_supported_file, get_text_only
+from PruebaOcr import process_file_to_txt_async, check_supported_file, get_text_only_async
 
 # Importar el módulo de Google Cloud Storage mejorado
 from gcs_storage import GCSStorageManagerV2
 
 # Importar el servicio de Gemini AI
-from gemini_service import generar_plan_estudio
+from compactacion_texto import compactar_texto
+from gemini_service import (
+    MODULOS_POR_PLAN, generar_plan_estudio, generar_plan_estudio_stream, regenerar_modulo_plan,
+    obtener_estado_gemini, configurar_cache_planes
+)
+from esquema_plan import validar_plan
+from documentos_directos import (
+    GEMINI_DOCUMENT_MODE, MODOS_DOCUMENTO, VIA_DIRECTO, VIA_SEGUN_TEXTO, VIA_TEXTO,
+    crear_adjunto, elegir_via, parece_escaneado
+)
+from proveedores_llm import DocumentoAdjunto
+from lotes_planes import LOTE_MAX_GRUPOS, ColaLotesLlenaError, GestorLotes
+from trabajos_planes import AlmacenTrabajos, ColaTrabajos, resumen_trabajo
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -39,7 +50,29 @@ logger = logging.getLogger(__name__)
 # Cargar variables de entorno
 load_dotenv()
 
-app = FastAPI(title="ProfeGo API", version="2.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Inicializa los clientes externos en segundo plano al arrancar"""
+    async def precalentar(nombre, cliente):
+        try:
+            await asyncio.to_thread(cliente.get)
+            logger.info(f"✅ Cliente {nombre} inicializado")
+        except Exception as e:
+            logger.error(f"❌ Error inicializando {nombre}: {e}")
+    
+    # No se espera: el servidor acepta peticiones mientras los clientes se crean
+    tareas = [
+        asyncio.create_task(precalentar("Firebase Auth", auth)),
+        asyncio.create_task(precalentar("GCS", gcs_storage)),
+    ]
+    # Los trabajos que quedaron pendientes antes de un reinicio se retoman aquí
+    cola_trabajos.iniciar(_ejecutar_trabajo_plan)
+    yield
+    await cola_trabajos.detener()
+    for tarea in tareas:
+        tarea.cancel()
+
+app = FastAPI(title="ProfeGo API", version="2.0.0", lifespan=lifespan)
 
 # Rate Limiter
 limiter = Limiter(key_func=get_remote_address)
@@ -70,9 +103,15 @@ app.add_middleware(
 
 # Configuración de archivos
 MAX_FILE_SIZE = 80 * 1024 * 1024  # 80MB
+
+# Textos extraídos de cada plan (cache/textos/{plan_id}.json en el bucket)
+CACHE_TEXTOS = "textos"
+# Reintentos al guardar un módulo regenerado si el plan cambió mientras tanto
+MAX_REINTENTOS_ACTUALIZACION = 3
+
 ALLOWED_EXTENSIONS = {
     '.pdf', '.doc', '.docx', '.txt', '.jpg', '.jpeg', 
-    '.png', '.xlsx', '.xls', '.csv', '.json', '.xml'
+    '.png', '.xlsx', '.xls', '.csv', '.json', '.xml', '.odt'
 }
 
 # Obtener directorio base del script
@@ -101,13 +140,51 @@ firebaseConfig = {
     "databaseURL": os.getenv("FIREBASE_DATABASE_URL", "")
 }
 
-firebase = pyrebase.initialize_app(firebaseConfig)
-auth = firebase.auth()
+class LazyClient:
+    """
+    Cliente externo que se crea en el primer uso (o al arrancar vía lifespan)
+    
+    Evita importar pyrebase/google-cloud-storage y abrir conexiones al
+    importar main.py. Los atributos se delegan al cliente real.
+    """
+    
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+    
+    def get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+    
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+def _crear_auth_firebase():
+    import pyrebase
+    return pyrebase.initialize_app(firebaseConfig).auth()
 
-# Google Cloud Storage Manager V2 con nueva estructura
-gcs_storage = GCSStorageManagerV2(
-    bucket_name=os.getenv("GCS_BUCKET_NAME", "bucket-profe-go")
-)
+def _crear_gcs_storage():
+    # Google Cloud Storage Manager V2 con nueva estructura
+    return GCSStorageManagerV2(
+        bucket_name=os.getenv("GCS_BUCKET_NAME", "bucket-profe-go")
+    )
+
+auth = LazyClient(_crear_auth_firebase)
+gcs_storage = LazyClient(_crear_gcs_storage)
+
+# La caché de planes generados se persiste en el mismo bucket
+configurar_cache_planes(gcs_storage)
+
+# Cola de generación por lotes (/api/plans/generate-batch)
+gestor_lotes = GestorLotes()
+
+# Trabajos de generación en segundo plano (/api/plans/jobs), en un almacén local
+almacen_trabajos = AlmacenTrabajos()
+cola_trabajos = ColaTrabajos(almacen_trabajos)
 
 # ---------------- Modelos Pydantic ----------------
 class UserLogin(BaseModel):
@@ -151,6 +228,9 @@ class PlanResponse(BaseModel):
     plan_data: Optional[Dict] = None
     error: Optional[str] = None
     processing_time: Optional[float] = None
+    compactacion: Optional[Dict] = None
+    documentos: Optional[Dict] = None
+    tiempos: Optional[Dict] = None
 
 # ---------------- Utilidades ----------------
 class ProfeGoUtils:
@@ -174,6 +254,7 @@ class ProfeGoUtils:
             '.pdf': "PDF",
             '.jpg': "Imagen", '.jpeg': "Imagen", '.png': "Imagen",
             '.doc': "Word", '.docx': "Word",
+            '.odt': "ODT",
             '.xls': "Excel", '.xlsx': "Excel",
             '.txt': "Texto",
             '.csv': "CSV",
@@ -335,7 +416,7 @@ async def upload_files(
                     if verificacion['supported']:
                         # Procesar archivo
                         nombre_base = Path(file.filename).stem
-                        resultado_conversion = process_file_to_txt(tmp_file_path)
+                        resultado_conversion = await process_file_to_txt_async(tmp_file_path)
                         
                         if resultado_conversion['success']:
                             # Leer el archivo procesado
@@ -591,6 +672,10 @@ def generar_documento_word(plan_data: Dict) -> io.BytesIO:
     """
     Genera un documento Word profesional a partir de los datos del plan
     """
+    from docx import Document
+    from docx.shared import Pt, RGBColor
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    
     doc = Document()
     
     # Configurar estilos del documento
@@ -882,12 +967,311 @@ def generar_documento_word(plan_data: Dict) -> io.BytesIO:
 # RUTAS PARA GENERACIÓN DE PLANES CON IA
 # ============================================================================
 
+async def _leer_archivo(archivo: UploadFile, tipo: str, del_tipo: str) -> bytes:
+    """Valida la extensión y el tamaño de un archivo subido y devuelve su contenido"""
+    if not ProfeGoUtils.validar_extension(archivo.filename):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tipo de archivo no permitido para {tipo}: {archivo.filename}"
+        )
+    
+    contenido = await archivo.read()
+    if len(contenido) > MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"El archivo {del_tipo} excede el límite de 80MB"
+        )
+    return contenido
+
+async def _leer_archivos_plan(plan_file: UploadFile, diagnostico_file: Optional[UploadFile]):
+    """
+    Valida y lee los archivos de una solicitud de generación
+    
+    Returns:
+        (plan_content, diagnostico_content, diagnostico_filename)
+    """
+    plan_content = await _leer_archivo(plan_file, "plan", "del plan")
+    
+    # Validar archivo de diagnóstico (si existe)
+    diagnostico_content = None
+    diagnostico_filename = None
+    
+    if diagnostico_file and diagnostico_file.filename:
+        diagnostico_content = await _leer_archivo(diagnostico_file, "diagnóstico", "de diagnóstico")
+        diagnostico_filename = diagnostico_file.filename
+    
+    logger.info(f"✅ Archivos validados - Plan: {plan_file.filename}, Diagnóstico: {diagnostico_filename or 'No proporcionado'}")
+    
+    return plan_content, diagnostico_content, diagnostico_filename
+
+async def _preparar_entrada(nombre: str, contenido: bytes, modo: str):
+    """
+    Texto extraído de un archivo o, si va directo al modelo, el archivo como
+    documento adjunto (ver documentos_directos.elegir_via)
+    
+    Returns:
+        (entrada, info) con entrada None si no se pudo extraer texto, e info
+        con la vía usada ('texto' o 'directo') y los segundos de la etapa
+    """
+    inicio = time.perf_counter()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=Path(nombre).suffix) as tmp:
+        tmp.write(contenido)
+        tmp_path = tmp.name
+    
+    try:
+        via, paginas = elegir_via(nombre, tmp_path, len(contenido), modo)
+        texto, error = None, None
+        if via != VIA_DIRECTO:
+            resultado = await get_text_only_async(tmp_path)
+            if resultado['success'] and resultado['text']:
+                texto = resultado['text']
+            else:
+                error = resultado.get('error', 'Error desconocido')
+            if via == VIA_SEGUN_TEXTO and parece_escaneado(texto, paginas):
+                logger.info(f"🖼️ {nombre} parece escaneado; se envía directo al modelo")
+                via = VIA_DIRECTO
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    
+    if via == VIA_DIRECTO:
+        adjunto = crear_adjunto(nombre, contenido, paginas)
+        return adjunto, {
+            'via': VIA_DIRECTO,
+            'segundos': round(time.perf_counter() - inicio, 3),
+            'mime': adjunto.mime,
+            'bytes': adjunto.tamano,
+            'paginas': paginas,
+            'tokens_estimados': adjunto.tokens_estimados,
+        }
+    info = {'via': VIA_TEXTO, 'segundos': round(time.perf_counter() - inicio, 3), 'caracteres': len(texto or '')}
+    if error:
+        info['error'] = error
+    return texto, info
+
+async def _extraer_textos_plan(
+    plan_filename: str,
+    plan_content: bytes,
+    diagnostico_filename: Optional[str],
+    diagnostico_content: Optional[bytes],
+    modo: str = "ocr"
+):
+    """
+    Extrae el texto del plan (obligatorio) y del diagnóstico (opcional)
+    
+    Con modo 'directo' o 'auto', los PDF e imágenes que corresponda se
+    devuelven como DocumentoAdjunto para enviarlos al modelo sin OCR.
+    
+    Returns:
+        (plan_text, diagnostico_text, documentos) con documentos = vía y
+        tiempo de cada archivo
+    """
+    logger.info(f"📄 Preparando el plan de estudios (modo {modo})...")
+    
+    plan_text, info_plan = await _preparar_entrada(plan_filename, plan_content, modo)
+    if plan_text is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"No se pudo extraer texto del plan: {info_plan.get('error', 'Error desconocido')}"
+        )
+    if info_plan['via'] == VIA_DIRECTO:
+        logger.info(f"📎 Plan enviado directo al modelo: {plan_filename} ({info_plan['bytes']} bytes)")
+    else:
+        logger.info(f"✅ Texto extraído del plan: {len(plan_text)} caracteres")
+    
+    # Extraer texto del diagnóstico si existe
+    diagnostico_text = None
+    info_diagnostico = None
+    
+    if diagnostico_content:
+        logger.info("📄 Preparando el diagnóstico...")
+        diagnostico_text, info_diagnostico = await _preparar_entrada(
+            diagnostico_filename, diagnostico_content, modo
+        )
+        if diagnostico_text is None:
+            logger.warning(f"⚠️ No se pudo extraer texto del diagnóstico, continuando sin él")
+        elif info_diagnostico['via'] == VIA_DIRECTO:
+            logger.info(f"📎 Diagnóstico enviado directo al modelo: {diagnostico_filename}")
+        else:
+            logger.info(f"✅ Texto extraído del diagnóstico: {len(diagnostico_text)} caracteres")
+    
+    documentos = {'modo': modo, 'plan': info_plan, 'diagnostico': info_diagnostico}
+    return plan_text, diagnostico_text, documentos
+
+async def _compactar_textos_plan(plan_text, diagnostico_text):
+    """
+    Compacta los textos extraídos antes de enviarlos a Gemini
+    
+    Los documentos adjuntos (modo de documentos directos) se envían tal cual.
+    
+    Returns:
+        (plan_text, diagnostico_text, compactacion) con el ahorro obtenido
+    """
+    info_plan = None
+    if isinstance(plan_text, str):
+        plan_text, info_plan = await asyncio.to_thread(compactar_texto, plan_text)
+    
+    info_diagnostico = None
+    if isinstance(diagnostico_text, str) and diagnostico_text:
+        diagnostico_text, info_diagnostico = await asyncio.to_thread(compactar_texto, diagnostico_text)
+    
+    infos = [i for i in (info_plan, info_diagnostico) if i]
+    compactacion = {
+        'plan': info_plan,
+        'diagnostico': info_diagnostico,
+        'caracteres_ahorrados': sum(i['caracteres_originales'] - i['caracteres_compactados'] for i in infos),
+        'tokens_ahorrados': sum(i['tokens_originales'] - i['tokens_compactados'] for i in infos),
+    }
+    ahorro_plan = f"; plan -{info_plan['ahorro_pct']}%" if info_plan else ""
+    logger.info(
+        f"🧹 Compactación: -{compactacion['caracteres_ahorrados']} caracteres "
+        f"(~{compactacion['tokens_ahorrados']} tokens{ahorro_plan})"
+    )
+    return plan_text, diagnostico_text, compactacion
+
+def _guardar_textos_plan(plan_id: str, plan_text: str, diagnostico_text: Optional[str]) -> None:
+    """Guarda los textos extraídos de un plan en la caché del bucket"""
+    contenido = json.dumps(
+        {'plan_text': plan_text, 'diagnostico_text': diagnostico_text}, ensure_ascii=False
+    ).encode('utf-8')
+    if not gcs_storage.guardar_cache(CACHE_TEXTOS, plan_id, contenido):
+        logger.warning(f"⚠️ No se pudieron guardar los textos extraídos de {plan_id}")
+
+async def _obtener_textos_plan(plan_id: str, plan_data: Dict, user_email: str):
+    """
+    Textos extraídos con que se generó un plan
+    
+    Se leen de la caché del bucket; los planes anteriores a esa caché se
+    vuelven a extraer de los archivos originales (una sola vez). Los planes
+    generados con documentos directos vuelven a adjuntar los originales.
+    
+    Returns:
+        (plan_text, diagnostico_text), cada uno texto o DocumentoAdjunto
+    """
+    contenido = await asyncio.to_thread(gcs_storage.leer_cache, CACHE_TEXTOS, plan_id)
+    if contenido:
+        textos = json.loads(contenido.decode('utf-8'))
+        logger.info(f"⚡ Textos extraídos recuperados de caché ({plan_id})")
+        return textos['plan_text'], textos.get('diagnostico_text')
+    
+    originales = plan_data.get('archivos_originales') or {}
+    plan_filename = originales.get('plan')
+    plan_content = plan_filename and await asyncio.to_thread(
+        gcs_storage.obtener_archivo_bytes,
+        email=user_email, nombre_archivo=plan_filename, es_procesado=False
+    )
+    if not plan_content:
+        raise HTTPException(
+            status_code=409,
+            detail="No se encontró el texto ni el archivo original del plan; genera el plan de nuevo"
+        )
+    
+    diagnostico_filename = originales.get('diagnostico')
+    diagnostico_content = diagnostico_filename and await asyncio.to_thread(
+        gcs_storage.obtener_archivo_bytes,
+        email=user_email, nombre_archivo=diagnostico_filename, es_procesado=False
+    )
+    
+    logger.info(f"📄 Textos de {plan_id} no cacheados; extrayendo de los archivos originales")
+    plan_text, diagnostico_text, _ = await _extraer_textos_plan(
+        plan_filename, plan_content, diagnostico_filename, diagnostico_content or None,
+        plan_data.get('modo_documentos', 'ocr')
+    )
+    plan_text, diagnostico_text, _ = await _compactar_textos_plan(plan_text, diagnostico_text)
+    if not _hay_adjuntos(plan_text, diagnostico_text):
+        await asyncio.to_thread(_guardar_textos_plan, plan_id, plan_text, diagnostico_text)
+    return plan_text, diagnostico_text
+
+def _hay_adjuntos(*entradas) -> bool:
+    """True si alguna entrada va al modelo como documento adjunto (no hay texto que cachear)"""
+    return any(isinstance(e, DocumentoAdjunto) for e in entradas)
+
+def _guardar_plan_generado(
+    plan_data: Dict,
+    user_email: str,
+    plan_filename: str,
+    plan_content: bytes,
+    diagnostico_filename: Optional[str],
+    diagnostico_content: Optional[bytes],
+    plan_text: Optional[str] = None,
+    diagnostico_text: Optional[str] = None,
+    modo_documentos: str = "ocr",
+    subir_plan_original: bool = True
+) -> str:
+    """
+    Guarda el plan generado y los archivos originales en GCS
+    
+    Si se pasan los textos extraídos (ya compactados), también se guardan para
+    regenerar módulos sin repetir el OCR. Con documentos adjuntos no hay
+    texto: la regeneración los vuelve a adjuntar según modo_documentos.
+    En un lote, el plan de estudios original se sube una sola vez
+    (subir_plan_original=False en cada grupo).
+    
+    Returns:
+        plan_id asignado
+    """
+    # Generar ID único para el plan
+    plan_id = f"plan_{uuid.uuid4().hex[:12]}_{int(datetime.now().timestamp())}"
+    
+    # Agregar metadata al plan
+    plan_data['plan_id'] = plan_id
+    plan_data['usuario'] = user_email
+    plan_data['fecha_generacion'] = datetime.now().isoformat()
+    plan_data['archivos_originales'] = {
+        'plan': plan_filename,
+        'diagnostico': diagnostico_filename
+    }
+    plan_data['modo_documentos'] = modo_documentos
+    
+    # Guardar plan como JSON en GCS
+    plan_json = json.dumps(plan_data, indent=2, ensure_ascii=False)
+    plan_json_bytes = plan_json.encode('utf-8')
+    
+    resultado_guardado = gcs_storage.subir_archivo_desde_bytes(
+        contenido=plan_json_bytes,
+        email=user_email,
+        nombre_archivo=f"{plan_id}.json",
+        es_procesado=True  # Guardar en carpeta "processed"
+    )
+    
+    if not resultado_guardado['success']:
+        logger.warning(f"⚠️ No se pudo guardar el plan en GCS: {resultado_guardado.get('error')}")
+    else:
+        logger.info(f"✅ Plan guardado en GCS: {resultado_guardado['path']}")
+    
+    if plan_text and not _hay_adjuntos(plan_text, diagnostico_text):
+        _guardar_textos_plan(plan_id, plan_text, diagnostico_text)
+    
+    # ========== GUARDAR ARCHIVOS ORIGINALES ==========
+    
+    # Subir plan original
+    if subir_plan_original:
+        gcs_storage.subir_archivo_desde_bytes(
+            contenido=plan_content,
+            email=user_email,
+            nombre_archivo=plan_filename,
+            es_procesado=False
+        )
+    
+    # Subir diagnóstico si existe
+    if diagnostico_content:
+        gcs_storage.subir_archivo_desde_bytes(
+            contenido=diagnostico_content,
+            email=user_email,
+            nombre_archivo=diagnostico_filename,
+            es_procesado=False
+        )
+    
+    return plan_id
+
 @app.post("/api/plans/generate", response_model=PlanResponse)
-@limiter.limit("5/hour")  # Límite: 5 planes por hora
+@limiter.shared_limit("5/hour", scope="generar_plan")  # Límite: 5 planes por hora entre generate, stream y jobs
 async def generate_plan(
     request: Request,
     plan_file: UploadFile = File(..., description="Archivo del plan de estudios"),
     diagnostico_file: Optional[UploadFile] = File(None, description="Archivo de diagnóstico (opcional)"),
+    force_regenerate: bool = Form(False, description="Ignorar la caché y generar de nuevo"),
+    document_mode: str = Form(GEMINI_DOCUMENT_MODE, description="ocr, directo o auto (PDF e imágenes sin OCR)"),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -895,115 +1279,57 @@ async def generate_plan(
     
     - **plan_file**: Archivo obligatorio con el plan de estudios oficial
     - **diagnostico_file**: Archivo opcional con diagnóstico del grupo
+    - **force_regenerate**: Si es true, ignora la caché y vuelve a generar
+    - **document_mode**: 'ocr' extrae el texto localmente; 'directo' envía los
+      PDF e imágenes a Gemini tal cual; 'auto' envía directo las imágenes y
+      los PDF escaneados (sin capa de texto)
     
     Proceso:
-    1. Extrae texto de los archivos con OCR
-    2. Envía a Gemini AI para análisis y estructuración
+    1. Extrae texto de los archivos con OCR (o los adjunta al prompt)
+    2. Reutiliza un plan cacheado con las mismas entradas o lo genera con Gemini AI
     3. Guarda el plan generado en GCS
-    4. Retorna la estructura completa del plan
+    4. Retorna la estructura completa del plan, con el tiempo de cada etapa
     """
     user_email = current_user["email"]
     start_time = time.time()
+    _validar_modo_documentos(document_mode)
     
     logger.info(f"🎓 Generando plan para usuario: {user_email}")
     
     try:
-        # ========== VALIDACIÓN DE ARCHIVOS ==========
+        tiempos = {}
         
-        # Validar archivo del plan
-        if not ProfeGoUtils.validar_extension(plan_file.filename):
-            raise HTTPException(
-                status_code=400,
-                detail=f"Tipo de archivo no permitido para plan: {plan_file.filename}"
-            )
-        
-        plan_content = await plan_file.read()
-        if len(plan_content) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=400,
-                detail="El archivo del plan excede el límite de 80MB"
-            )
-        
-        # Validar archivo de diagnóstico (si existe)
-        diagnostico_content = None
-        diagnostico_filename = None
-        
-        if diagnostico_file and diagnostico_file.filename:
-            if not ProfeGoUtils.validar_extension(diagnostico_file.filename):
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Tipo de archivo no permitido para diagnóstico: {diagnostico_file.filename}"
-                )
-            
-            diagnostico_content = await diagnostico_file.read()
-            if len(diagnostico_content) > MAX_FILE_SIZE:
-                raise HTTPException(
-                    status_code=400,
-                    detail="El archivo de diagnóstico excede el límite de 80MB"
-                )
-            diagnostico_filename = diagnostico_file.filename
-        
-        logger.info(f"✅ Archivos validados - Plan: {plan_file.filename}, Diagnóstico: {diagnostico_filename or 'No proporcionado'}")
+        # ========== VALIDACIÓN DE ARCHIVOS ==========
         
-        # ========== PROCESAMIENTO OCR ==========
+        inicio_etapa = time.perf_counter()
+        plan_content, diagnostico_content, diagnostico_filename = await _leer_archivos_plan(
+            plan_file, diagnostico_file
+        )
+        tiempos['lectura'] = round(time.perf_counter() - inicio_etapa, 3)
         
-        logger.info("📄 Extrayendo texto del plan de estudios...")
+        # ========== PROCESAMIENTO OCR (O DOCUMENTOS DIRECTOS) ==========
         
-        # Guardar plan temporalmente
-        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(plan_file.filename).suffix) as tmp_plan:
-            tmp_plan.write(plan_content)
-            tmp_plan_path = tmp_plan.name
+        inicio_etapa = time.perf_counter()
+        plan_text, diagnostico_text, documentos = await _extraer_textos_plan(
+            plan_file.filename, plan_content, diagnostico_filename, diagnostico_content, document_mode
+        )
+        tiempos['extraccion'] = round(time.perf_counter() - inicio_etapa, 3)
         
-        try:
-            # Extraer texto del plan
-            plan_result = get_text_only(tmp_plan_path)
-            
-            if not plan_result['success'] or not plan_result['text']:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"No se pudo extraer texto del plan: {plan_result.get('error', 'Error desconocido')}"
-                )
-            
-            plan_text = plan_result['text']
-            logger.info(f"✅ Texto extraído del plan: {len(plan_text)} caracteres")
-            
-            # Extraer texto del diagnóstico si existe
-            diagnostico_text = None
-            
-            if diagnostico_content:
-                logger.info("📄 Extrayendo texto del diagnóstico...")
-                
-                with tempfile.NamedTemporaryFile(delete=False, suffix=Path(diagnostico_filename).suffix) as tmp_diag:
-                    tmp_diag.write(diagnostico_content)
-                    tmp_diag_path = tmp_diag.name
-                
-                try:
-                    diagnostico_result = get_text_only(tmp_diag_path)
-                    
-                    if diagnostico_result['success'] and diagnostico_result['text']:
-                        diagnostico_text = diagnostico_result['text']
-                        logger.info(f"✅ Texto extraído del diagnóstico: {len(diagnostico_text)} caracteres")
-                    else:
-                        logger.warning(f"⚠️ No se pudo extraer texto del diagnóstico, continuando sin él")
-                        diagnostico_text = None
-                
-                finally:
-                    if os.path.exists(tmp_diag_path):
-                        os.remove(tmp_diag_path)
-            
-        finally:
-            # Limpiar archivo temporal del plan
-            if os.path.exists(tmp_plan_path):
-                os.remove(tmp_plan_path)
+        inicio_etapa = time.perf_counter()
+        plan_text, diagnostico_text, compactacion = await _compactar_textos_plan(plan_text, diagnostico_text)
+        tiempos['compactacion'] = round(time.perf_counter() - inicio_etapa, 3)
         
         # ========== GENERACIÓN CON GEMINI ==========
         
         logger.info("🤖 Generando plan con Gemini AI...")
         
+        inicio_etapa = time.perf_counter()
         resultado_gemini = await generar_plan_estudio(
             plan_text=plan_text,
-            diagnostico_text=diagnostico_text
+            diagnostico_text=diagnostico_text,
+            forzar_regeneracion=force_regenerate
         )
+        tiempos['generacion'] = round(time.perf_counter() - inicio_etapa, 3)
         
         if not resultado_gemini['success']:
             raise HTTPException(
@@ -1018,63 +1344,30 @@ async def generate_plan(
         
         # ========== GUARDAR EN GCS ==========
         
-        # Generar ID único para el plan
-        plan_id = f"plan_{uuid.uuid4().hex[:12]}_{int(datetime.now().timestamp())}"
-        
-        # Agregar metadata al plan
-        plan_data['plan_id'] = plan_id
-        plan_data['usuario'] = user_email
-        plan_data['fecha_generacion'] = datetime.now().isoformat()
-        plan_data['archivos_originales'] = {
-            'plan': plan_file.filename,
-            'diagnostico': diagnostico_filename
-        }
-        
-        # Guardar plan como JSON en GCS
-        plan_json = json.dumps(plan_data, indent=2, ensure_ascii=False)
-        plan_json_bytes = plan_json.encode('utf-8')
-        
-        resultado_guardado = gcs_storage.subir_archivo_desde_bytes(
-            contenido=plan_json_bytes,
-            email=user_email,
-            nombre_archivo=f"{plan_id}.json",
-            es_procesado=True  # Guardar en carpeta "processed"
+        inicio_etapa = time.perf_counter()
+        plan_id = await asyncio.to_thread(
+            _guardar_plan_generado,
+            plan_data, user_email,
+            plan_file.filename, plan_content,
+            diagnostico_filename, diagnostico_content,
+            plan_text, diagnostico_text,
+            document_mode
         )
-        
-        if not resultado_guardado['success']:
-            logger.warning(f"⚠️ No se pudo guardar el plan en GCS: {resultado_guardado.get('error')}")
-        else:
-            logger.info(f"✅ Plan guardado en GCS: {resultado_guardado['path']}")
-        
-        # ========== GUARDAR ARCHIVOS ORIGINALES ==========
-        
-        # Subir plan original
-        gcs_storage.subir_archivo_desde_bytes(
-            contenido=plan_content,
-            email=user_email,
-            nombre_archivo=plan_file.filename,
-            es_procesado=False
-        )
-        
-        # Subir diagnóstico si existe
-        if diagnostico_content:
-            gcs_storage.subir_archivo_desde_bytes(
-                contenido=diagnostico_content,
-                email=user_email,
-                nombre_archivo=diagnostico_filename,
-                es_procesado=False
-            )
+        tiempos['guardado'] = round(time.perf_counter() - inicio_etapa, 3)
         
         # ========== RETORNAR RESULTADO ==========
         
         processing_time = time.time() - start_time
-        logger.info(f"⏱️ Tiempo total de procesamiento: {processing_time:.2f} segundos")
+        logger.info(f"⏱️ Tiempo total de procesamiento: {processing_time:.2f} segundos {tiempos}")
         
         return PlanResponse(
             success=True,
             plan_id=plan_id,
             plan_data=plan_data,
-            processing_time=processing_time
+            processing_time=processing_time,
+            compactacion=compactacion,
+            documentos=documentos,
+            tiempos=tiempos
         )
         
     except HTTPException:
@@ -1086,6 +1379,488 @@ async def generate_plan(
             detail=f"Error inesperado generando plan: {str(e)}"
         )
 
+def _validar_modo_documentos(modo: str) -> None:
+    if modo not in MODOS_DOCUMENTO:
+        raise HTTPException(
+            status_code=400,
+            detail=f"document_mode inválido '{modo}'; usa uno de: {', '.join(MODOS_DOCUMENTO)}"
+        )
+
+def _evento_sse(evento: str, datos: Dict) -> str:
+    """Formatea un evento Server-Sent Events"""
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+@app.post("/api/plans/generate/stream")
+@limiter.shared_limit("5/hour", scope="generar_plan")  # Comparte el límite de /api/plans/generate
+async def generate_plan_stream(
+    request: Request,
+    plan_file: UploadFile = File(..., description="Archivo del plan de estudios"),
+    diagnostico_file: Optional[UploadFile] = File(None, description="Archivo de diagnóstico (opcional)"),
+    force_regenerate: bool = Form(False, description="Ignorar la caché y generar de nuevo"),
+    document_mode: str = Form(GEMINI_DOCUMENT_MODE, description="ocr, directo o auto (PDF e imágenes sin OCR)"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Genera un plan de estudio con respuesta en streaming (Server-Sent Events)
+    
+    Acepta los mismos campos que /api/plans/generate.
+    
+    Eventos:
+    - **inicio**: textos extraídos, la generación comenzó
+    - **modulo**: cada módulo en cuanto Gemini termina de escribirlo
+    - **plan**: plan final validado, con plan_id, tiempo de procesamiento y
+      de cada etapa (como /api/plans/generate)
+    - **error**: la generación falló
+    """
+    user_email = current_user["email"]
+    start_time = time.time()
+    
+    _validar_modo_documentos(document_mode)
+    logger.info(f"🎓 Generando plan (streaming) para usuario: {user_email}")
+    
+    # La validación y extracción ocurren antes de abrir el stream, así los
+    # errores de archivos siguen llegando como códigos HTTP normales
+    tiempos = {}
+    inicio_etapa = time.perf_counter()
+    plan_content, diagnostico_content, diagnostico_filename = await _leer_archivos_plan(
+        plan_file, diagnostico_file
+    )
+    tiempos['lectura'] = round(time.perf_counter() - inicio_etapa, 3)
+    
+    inicio_etapa = time.perf_counter()
+    plan_text, diagnostico_text, documentos = await _extraer_textos_plan(
+        plan_file.filename, plan_content, diagnostico_filename, diagnostico_content, document_mode
+    )
+    tiempos['extraccion'] = round(time.perf_counter() - inicio_etapa, 3)
+    
+    inicio_etapa = time.perf_counter()
+    plan_text, diagnostico_text, compactacion = await _compactar_textos_plan(plan_text, diagnostico_text)
+    tiempos['compactacion'] = round(time.perf_counter() - inicio_etapa, 3)
+    
+    async def eventos():
+        yield _evento_sse("inicio", {
+            "mensaje": "Generando plan con IA", "compactacion": compactacion, "documentos": documentos
+        })
+        
+        try:
+            inicio_etapa = time.perf_counter()
+            async for evento in generar_plan_estudio_stream(plan_text, diagnostico_text, force_regenerate):
+                if evento['evento'] == 'modulo':
+                    yield _evento_sse("modulo", evento['modulo'])
+                    continue
+                
+                resultado_gemini = evento['resultado']
+                if not resultado_gemini['success']:
+                    yield _evento_sse("error", {
+                        "error": f"Error generando plan con IA: {resultado_gemini.get('error', 'Error desconocido')}"
+                    })
+                    return
+                
+                tiempos['generacion'] = round(time.perf_counter() - inicio_etapa, 3)
+                
+                plan_data = resultado_gemini['plan']
+                inicio_etapa = time.perf_counter()
+                plan_id = await asyncio.to_thread(
+                    _guardar_plan_generado,
+                    plan_data, user_email,
+                    plan_file.filename, plan_content,
+                    diagnostico_filename, diagnostico_content,
+                    plan_text, diagnostico_text,
+                    document_mode
+                )
+                tiempos['guardado'] = round(time.perf_counter() - inicio_etapa, 3)
+                
+                processing_time = time.time() - start_time
+                logger.info(f"⏱️ Tiempo total de procesamiento (streaming): {processing_time:.2f} segundos {tiempos}")
+                
+                yield _evento_sse("plan", {
+                    "success": True,
+                    "plan_id": plan_id,
+                    "plan_data": plan_data,
+                    "processing_time": processing_time,
+                    "compactacion": compactacion,
+                    "documentos": documentos,
+                    "tiempos": tiempos
+                })
+        except Exception as e:
+            logger.error(f"❌ Error generando plan (streaming): {str(e)}", exc_info=True)
+            yield _evento_sse("error", {"error": f"Error inesperado generando plan: {str(e)}"})
+    
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Evitar buffering en proxies (nginx/Render)
+        }
+    )
+
+
+@app.post("/api/plans/generate-batch", status_code=202)
+@limiter.limit("3/hour")  # Cada lote genera hasta LOTE_MAX_GRUPOS planes
+async def generate_plan_batch(
+    request: Request,
+    plan_file: UploadFile = File(..., description="Archivo del plan de estudios (común a todos los grupos)"),
+    diagnostico_files: List[UploadFile] = File(..., description="Un archivo de diagnóstico por grupo"),
+    force_regenerate: bool = Form(False, description="Ignorar la caché y generar de nuevo"),
+    document_mode: str = Form(GEMINI_DOCUMENT_MODE, description="ocr, directo o auto (PDF e imágenes sin OCR)"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Genera un plan por grupo a partir de un plan de estudios y N diagnósticos
+    
+    - **plan_file**: plan de estudios oficial; se extrae y compacta una sola vez
+    - **diagnostico_files**: un diagnóstico por grupo (hasta LOTE_MAX_GRUPOS)
+    - **force_regenerate** y **document_mode**: como en /api/plans/generate
+    
+    Responde 202 en cuanto el lote está en cola, con el lote_id y el estado de
+    cada grupo. Los planes se generan en la cola compartida de lotes y cada
+    uno se guarda en GCS al terminar; el avance se consulta en
+    GET /api/plans/batches/{lote_id}.
+    """
+    user_email = current_user["email"]
+    _validar_modo_documentos(document_mode)
+    
+    diagnosticos = [d for d in diagnostico_files if d and d.filename]
+    if not diagnosticos:
+        raise HTTPException(status_code=400, detail="El lote necesita al menos un diagnóstico")
+    if len(diagnosticos) > LOTE_MAX_GRUPOS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Un lote admite hasta {LOTE_MAX_GRUPOS} diagnósticos ({len(diagnosticos)} recibidos)"
+        )
+    nombres = [d.filename for d in diagnosticos]
+    if len(set(nombres)) != len(nombres):
+        # Los originales se guardan por nombre: dos iguales se sobrescribirían
+        raise HTTPException(status_code=400, detail="Los diagnósticos del lote deben tener nombres distintos")
+    
+    logger.info(f"📦 Lote de {len(diagnosticos)} planes para usuario: {user_email}")
+    
+    plan_filename = plan_file.filename
+    plan_content, _, _ = await _leer_archivos_plan(plan_file, None)
+    contenidos = [await _leer_archivo(d, "diagnóstico", "de diagnóstico") for d in diagnosticos]
+    
+    # ========== PLAN DE ESTUDIOS: UNA SOLA EXTRACCIÓN PARA TODO EL LOTE ==========
+    
+    plan_text, _, documentos = await _extraer_textos_plan(plan_filename, plan_content, None, None, document_mode)
+    plan_text, _, compactacion = await _compactar_textos_plan(plan_text, None)
+    await asyncio.to_thread(
+        gcs_storage.subir_archivo_desde_bytes,
+        contenido=plan_content, email=user_email, nombre_archivo=plan_filename, es_procesado=False
+    )
+    
+    async def procesar(indice: int) -> Dict:
+        """Extrae el diagnóstico del grupo, genera su plan y lo guarda"""
+        nombre, contenido = nombres[indice], contenidos[indice]
+        contenidos[indice] = None  # el lote no retiene los archivos ya procesados
+        
+        diagnostico_text, info = await _preparar_entrada(nombre, contenido, document_mode)
+        if diagnostico_text is None:
+            return {
+                'success': False,
+                'error': f"No se pudo extraer texto del diagnóstico: {info.get('error', 'Error desconocido')}"
+            }
+        if isinstance(diagnostico_text, str):
+            diagnostico_text, _ = await asyncio.to_thread(compactar_texto, diagnostico_text)
+        
+        resultado_gemini = await generar_plan_estudio(
+            plan_text=plan_text,
+            diagnostico_text=diagnostico_text,
+            forzar_regeneracion=force_regenerate
+        )
+        if not resultado_gemini['success']:
+            return {
+                'success': False,
+                'error': f"Error generando plan con IA: {resultado_gemini.get('error', 'Error desconocido')}"
+            }
+        
+        plan_id = await asyncio.to_thread(
+            _guardar_plan_generado,
+            resultado_gemini['plan'], user_email,
+            plan_filename, plan_content,
+            nombre, contenido,
+            plan_text, diagnostico_text,
+            document_mode,
+            False
+        )
+        return {'success': True, 'plan_id': plan_id}
+    
+    try:
+        lote = gestor_lotes.crear(user_email, nombres, procesar)
+    except ColaLotesLlenaError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    return {
+        "success": True,
+        **lote.resumen(),
+        "compactacion": compactacion,
+        "documentos": documentos
+    }
+
+@app.get("/api/plans/batches/{lote_id}")
+async def get_plan_batch(
+    lote_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Estado de un lote: estado de cada grupo (pendiente, generando, completado
+    o error) con su plan_id en cuanto el plan está guardado
+    """
+    lote = gestor_lotes.obtener(lote_id, current_user["email"])
+    if lote is None:
+        raise HTTPException(status_code=404, detail="Lote no encontrado o ya expirado")
+    return {"success": True, **lote.resumen()}
+
+async def _ejecutar_trabajo_plan(trabajo: Dict, archivos: Dict[str, bytes], avance) -> Dict:
+    """
+    Ejecuta un trabajo de /api/plans/jobs: el mismo proceso que /api/plans/generate
+    
+    Reporta la etapa y el avance (extraccion, compactacion, generacion con
+    los módulos recibidos, guardado) y devuelve el plan_id; el plan completo
+    se consulta en GET /api/plans/{plan_id}.
+    """
+    parametros = trabajo['parametros']
+    user_email = trabajo['usuario']
+    plan_filename = parametros['plan_filename']
+    diagnostico_filename = parametros.get('diagnostico_filename')
+    document_mode = parametros['document_mode']
+    plan_content, diagnostico_content = archivos.get('plan'), archivos.get('diagnostico')
+    if not plan_content:
+        return {'success': False, 'error': 'No se encontraron los archivos de entrada del trabajo'}
+    
+    start_time = time.time()
+    tiempos = {}
+    
+    await avance('extraccion', 5)
+    inicio_etapa = time.perf_counter()
+    try:
+        plan_text, diagnostico_text, documentos = await _extraer_textos_plan(
+            plan_filename, plan_content, diagnostico_filename, diagnostico_content, document_mode
+        )
+    except HTTPException as e:
+        return {'success': False, 'error': e.detail}
+    tiempos['extraccion'] = round(time.perf_counter() - inicio_etapa, 3)
+    
+    await avance('compactacion', 25)
+    inicio_etapa = time.perf_counter()
+    plan_text, diagnostico_text, compactacion = await _compactar_textos_plan(plan_text, diagnostico_text)
+    tiempos['compactacion'] = round(time.perf_counter() - inicio_etapa, 3)
+    
+    # En streaming, cada módulo recibido hace avanzar el progreso de 35 a 90
+    await avance('generacion', 35)
+    inicio_etapa = time.perf_counter()
+    resultado_gemini = None
+    modulos = 0
+    async for evento in generar_plan_estudio_stream(plan_text, diagnostico_text, parametros['force_regenerate']):
+        if evento['evento'] == 'modulo':
+            modulos += 1
+            await avance('generacion', 35 + 55 * min(modulos, MODULOS_POR_PLAN) // MODULOS_POR_PLAN,
+                         {'modulos_recibidos': modulos})
+        else:
+            resultado_gemini = evento['resultado']
+    tiempos['generacion'] = round(time.perf_counter() - inicio_etapa, 3)
+    
+    if not resultado_gemini or not resultado_gemini['success']:
+        error = (resultado_gemini or {}).get('error', 'Error desconocido')
+        return {'success': False, 'error': f'Error generando plan con IA: {error}'}
+    
+    await avance('guardado', 95)
+    inicio_etapa = time.perf_counter()
+    plan_data = resultado_gemini['plan']
+    plan_id = await asyncio.to_thread(
+        _guardar_plan_generado,
+        plan_data, user_email,
+        plan_filename, plan_content,
+        diagnostico_filename, diagnostico_content,
+        plan_text, diagnostico_text,
+        document_mode
+    )
+    tiempos['guardado'] = round(time.perf_counter() - inicio_etapa, 3)
+    
+    processing_time = time.time() - start_time
+    logger.info(f"⏱️ Trabajo {trabajo['id']}: plan {plan_id} en {processing_time:.2f} segundos {tiempos}")
+    return {
+        'success': True,
+        'plan_id': plan_id,
+        'nombre_plan': plan_data.get('nombre_plan'),
+        'processing_time': processing_time,
+        'compactacion': compactacion,
+        'documentos': documentos,
+        'tiempos': tiempos
+    }
+
+@app.post("/api/plans/jobs", status_code=202)
+@limiter.shared_limit("5/hour", scope="generar_plan")  # Comparte el límite de /api/plans/generate
+async def create_plan_job(
+    request: Request,
+    plan_file: UploadFile = File(..., description="Archivo del plan de estudios"),
+    diagnostico_file: Optional[UploadFile] = File(None, description="Archivo de diagnóstico (opcional)"),
+    force_regenerate: bool = Form(False, description="Ignorar la caché y generar de nuevo"),
+    document_mode: str = Form(GEMINI_DOCUMENT_MODE, description="ocr, directo o auto (PDF e imágenes sin OCR)"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Genera un plan como trabajo en segundo plano
+    
+    Acepta los mismos campos que /api/plans/generate, pero responde 202 en
+    cuanto los archivos quedan guardados, con el trabajo_id. La extracción,
+    la generación y el guardado los ejecuta un trabajador; el avance se
+    consulta en GET /api/plans/jobs/{trabajo_id}. Repetir la solicitud con
+    los mismos archivos mientras el trabajo sigue activo devuelve el mismo
+    trabajo (el cliente puede reintentar sin pagar dos generaciones).
+    """
+    user_email = current_user["email"]
+    _validar_modo_documentos(document_mode)
+    
+    plan_content, diagnostico_content, diagnostico_filename = await _leer_archivos_plan(
+        plan_file, diagnostico_file
+    )
+    archivos = {'plan': plan_content}
+    if diagnostico_content:
+        archivos['diagnostico'] = diagnostico_content
+    parametros = {
+        'plan_filename': plan_file.filename,
+        'diagnostico_filename': diagnostico_filename,
+        'document_mode': document_mode,
+        'force_regenerate': force_regenerate,
+    }
+    
+    trabajo, nuevo = await asyncio.to_thread(almacen_trabajos.crear, user_email, parametros, archivos)
+    if nuevo:
+        cola_trabajos.avisar()
+        logger.info(f"📥 Trabajo {trabajo['id']} en cola para usuario: {user_email}")
+    else:
+        logger.info(f"🔗 Solicitud repetida: se devuelve el trabajo activo {trabajo['id']}")
+    
+    return JSONResponse(
+        status_code=202,
+        content={"success": True, "nuevo": nuevo, **resumen_trabajo(trabajo)},
+        headers={"Location": f"/api/plans/jobs/{trabajo['id']}"}
+    )
+
+@app.get("/api/plans/jobs/{trabajo_id}")
+async def get_plan_job(
+    trabajo_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Estado de un trabajo de generación: estado (en_cola, en_proceso,
+    completado o error), etapa, progreso (0-100) y, al terminar, el
+    plan_id o el error
+    """
+    trabajo = await asyncio.to_thread(almacen_trabajos.obtener, trabajo_id, current_user["email"])
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o ya expirado")
+    return {"success": True, **resumen_trabajo(trabajo)}
+
+@app.post("/api/plans/{plan_id}/modules/{numero}/regenerate")
+@limiter.limit("20/hour")
+async def regenerate_plan_module(
+    request: Request,
+    plan_id: str,
+    numero: int,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Regenera un solo módulo de un plan guardado
+    
+    - **plan_id**: Plan a modificar
+    - **numero**: Número del módulo (1..num_modulos)
+    
+    Proceso:
+    1. Lee el plan guardado y los textos extraídos con que se generó (sin OCR)
+    2. Pide a Gemini solo ese módulo, con el esqueleto del plan como contexto
+    3. Reemplaza el módulo en el JSON del plan con una precondición de
+       generación de GCS: si el plan cambió mientras tanto (p. ej. otra
+       regeneración), se relee y se vuelve a aplicar el módulo
+    """
+    user_email = current_user["email"]
+    start_time = time.time()
+    filename = f"{plan_id}.json"
+    
+    logger.info(f"♻️ Regenerando módulo {numero} del plan {plan_id} para usuario: {user_email}")
+    
+    try:
+        archivo = await asyncio.to_thread(
+            gcs_storage.obtener_archivo_con_generacion, user_email, filename, es_procesado=True
+        )
+        if not archivo:
+            raise HTTPException(status_code=404, detail="Plan no encontrado")
+        
+        plan_data = json.loads(archivo['contenido'].decode('utf-8'))
+        total = len(plan_data.get('modulos') or [])
+        if not 1 <= numero <= total:
+            raise HTTPException(
+                status_code=404,
+                detail=f"El plan no tiene un módulo {numero} (tiene {total})"
+            )
+        
+        # ========== GENERACIÓN DEL MÓDULO ==========
+        
+        plan_text, diagnostico_text = await _obtener_textos_plan(plan_id, plan_data, user_email)
+        
+        resultado_gemini = await regenerar_modulo_plan(plan_data, numero, plan_text, diagnostico_text)
+        if not resultado_gemini['success']:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error regenerando módulo con IA: {resultado_gemini.get('error', 'Error desconocido')}"
+            )
+        modulo = resultado_gemini['modulo']
+        
+        # ========== ACTUALIZACIÓN ATÓMICA EN GCS ==========
+        
+        for intento in range(1, MAX_REINTENTOS_ACTUALIZACION + 1):
+            plan_data['modulos'][numero - 1] = modulo
+            plan_data['fecha_modificacion'] = datetime.now().isoformat()
+            contenido = json.dumps(plan_data, indent=2, ensure_ascii=False).encode('utf-8')
+            
+            guardado = await asyncio.to_thread(
+                gcs_storage.reemplazar_si_no_cambio, archivo['path'], contenido, archivo['generation']
+            )
+            if guardado['success']:
+                break
+            if not guardado.get('conflicto'):
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Error guardando el plan: {guardado.get('error', 'Error desconocido')}"
+                )
+            
+            logger.warning(f"🔁 El plan {plan_id} cambió durante la regeneración; reaplicando módulo {numero} (intento {intento})")
+            archivo = await asyncio.to_thread(
+                gcs_storage.obtener_archivo_con_generacion, user_email, filename, es_procesado=True
+            )
+            if not archivo:
+                raise HTTPException(status_code=404, detail="El plan se eliminó durante la regeneración")
+            plan_data = json.loads(archivo['contenido'].decode('utf-8'))
+            if len(plan_data.get('modulos') or []) < numero:
+                raise HTTPException(status_code=409, detail=f"El plan ya no tiene un módulo {numero}")
+        else:
+            raise HTTPException(
+                status_code=409,
+                detail="El plan se modificó repetidamente durante la regeneración; intenta de nuevo"
+            )
+        
+        processing_time = time.time() - start_time
+        logger.info(f"✅ Módulo {numero} del plan {plan_id} actualizado en {processing_time:.2f} segundos")
+        
+        return {
+            'success': True,
+            'plan_id': plan_id,
+            'numero': numero,
+            'modulo': modulo,
+            'plan_data': plan_data,
+            'validacion': validar_plan(plan_data),
+            'processing_time': processing_time
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error regenerando módulo: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error inesperado regenerando módulo: {str(e)}"
+        )
 
 @app.get("/api/plans/list")
 async def list_plans(
@@ -1376,6 +2151,9 @@ async def health_check():
             "frontend_dir": FRONTEND_DIR,
             "frontend_exists": os.path.exists(FRONTEND_DIR),
             "gemini_configured": gemini_configured,
+            "gemini": obtener_estado_gemini(),
+            "lotes": gestor_lotes.estado(),
+            "trabajos": await asyncio.to_thread(cola_trabajos.estado),
             "version": "2.0.0"
         }
     except Exception as e:
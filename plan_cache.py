@@ -0,0 +1,137 @@
+"""
+Caché de resultados de generación de planes
+Evita repetir una generación completa de Gemini cuando llegan las mismas entradas
+(p. ej. la maestra vuelve a pulsar "generar" tras un timeout de la interfaz)
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normalizar_texto(texto: Optional[str]) -> str:
+    """
+    Normaliza un texto para calcular la clave de caché
+
+    Unicode NFC, sin espacios repetidos ni al inicio/fin, para que el mismo
+    documento extraído dos veces produzca la misma clave.
+    """
+    if not texto:
+        return ""
+    texto = unicodedata.normalize("NFC", texto)
+    return re.sub(r"\s+", " ", texto).strip()
+
+
+def calcular_clave(
+    plan_text: str,
+    diagnostico_text: Optional[str],
+    modelo: str,
+    generation_config: Dict[str, Any],
+    version_prompt: str
+) -> str:
+    """SHA-256 de las entradas normalizadas y la configuración de generación"""
+    contenido = json.dumps(
+        {
+            "plan": normalizar_texto(plan_text),
+            "diagnostico": normalizar_texto(diagnostico_text),
+            "modelo": modelo,
+            "config": generation_config,
+            "prompt": version_prompt,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+class PlanCache:
+    """
+    Caché de dos niveles: memoria (LRU) + almacenamiento persistente opcional
+
+    El almacenamiento persistente es cualquier objeto con
+    leer_cache(nombre, clave) -> bytes|None y guardar_cache(nombre, clave, bytes),
+    como GCSStorageManagerV2. Las entradas caducan tras ttl_segundos.
+    """
+
+    NOMBRE = "planes"
+
+    def __init__(self, ttl_segundos: int, max_entradas_memoria: int = 64):
+        self.ttl_segundos = ttl_segundos
+        self.max_entradas_memoria = max_entradas_memoria
+        self.almacenamiento = None
+        self._memoria: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def configurar_almacenamiento(self, almacenamiento) -> None:
+        """Define dónde se persisten las entradas (p. ej. el bucket de GCS)"""
+        self.almacenamiento = almacenamiento
+
+    def _vigente(self, entrada: Dict) -> bool:
+        return time.time() - entrada.get("creado", 0) < self.ttl_segundos
+
+    def _guardar_en_memoria(self, clave: str, entrada: Dict) -> None:
+        with self._lock:
+            self._memoria[clave] = entrada
+            self._memoria.move_to_end(clave)
+            while len(self._memoria) > self.max_entradas_memoria:
+                self._memoria.popitem(last=False)
+
+    def obtener(self, clave: str) -> Optional[Dict]:
+        """
+        Devuelve una copia del resultado cacheado o None si no existe o caducó
+
+        Es síncrono (puede leer de GCS); desde código async usar asyncio.to_thread.
+        """
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is not None:
+                self._memoria.move_to_end(clave)
+
+        if entrada is None and self.almacenamiento is not None:
+            try:
+                contenido = self.almacenamiento.leer_cache(self.NOMBRE, clave)
+                if contenido:
+                    entrada = json.loads(contenido)
+                    self._guardar_en_memoria(clave, entrada)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo leer la caché persistente: {e}")
+
+        if entrada is None or not self._vigente(entrada):
+            self.fallos += 1
+            return None
+
+        self.aciertos += 1
+        return copy.deepcopy(entrada["resultado"])
+
+    def guardar(self, clave: str, resultado: Dict) -> None:
+        """Guarda un resultado exitoso en memoria y en el almacenamiento persistente"""
+        entrada = {"clave": clave, "creado": time.time(), "resultado": copy.deepcopy(resultado)}
+        self._guardar_en_memoria(clave, entrada)
+
+        if self.almacenamiento is not None:
+            try:
+                contenido = json.dumps(entrada, ensure_ascii=False).encode("utf-8")
+                self.almacenamiento.guardar_cache(self.NOMBRE, clave, contenido)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo guardar la caché persistente: {e}")
+
+    def estado(self) -> Dict:
+        """Métricas de la caché (para /health)"""
+        return {
+            "ttl_segundos": self.ttl_segundos,
+            "entradas_memoria": len(self._memoria),
+            "persistente": self.almacenamiento is not None,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+        }
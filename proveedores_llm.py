@@ -0,0 +1,817 @@
+"""
+Proveedores del modelo de lenguaje usado para generar planes
+ProveedorGemini llama a Google Gemini; ProveedorSimulado reproduce respuestas
+grabadas sin red ni cuota (pruebas de carga, benchmarks y desarrollo sin API key)
+Se elige con LLM_PROVIDER=gemini|simulado
+Ambos admiten caché de contexto de las instrucciones fijas (CacheContexto) y
+prompts multimodales con los documentos originales adjuntos (PromptMultimodal)
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from esquema_plan import (
+    CLAVE_MODULOS_COMPACTA, CLAVE_REFERENCIA, FORMATO_SALIDA_COMPACTO, compactar_modulo, compactar_plan,
+    esqueleto_de_plan, expandir_plan
+)
+from gobernador_cuota import CARACTERES_POR_TOKEN, estimar_tokens
+
+logger = logging.getLogger(__name__)
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+
+# Si se define, ProveedorGemini guarda cada respuesta en esta carpeta para
+# reproducirla después con el proveedor simulado
+LLM_GRABAR_DIR = os.getenv("LLM_GRABAR_DIR", "")
+
+# Proveedor simulado: respuestas grabadas, latencia y fallos inyectados
+LLM_SIMULADO_RESPUESTAS_DIR = os.getenv("LLM_SIMULADO_RESPUESTAS_DIR", "muestras/respuestas")
+LLM_SIMULADO_PRIMER_TOKEN_MS = float(os.getenv("LLM_SIMULADO_PRIMER_TOKEN_MS", "800"))
+LLM_SIMULADO_MS_POR_TOKEN = float(os.getenv("LLM_SIMULADO_MS_POR_TOKEN", "5"))
+LLM_SIMULADO_TOKENS_POR_FRAGMENTO = int(os.getenv("LLM_SIMULADO_TOKENS_POR_FRAGMENTO", "40"))
+# Fracción de respuestas cortadas por longitud (finish_reason MAX_TOKENS)
+LLM_SIMULADO_TRUNCAR = float(os.getenv("LLM_SIMULADO_TRUNCAR", "0"))
+# Fracción de llamadas que fallan con un error 503 reintentable
+LLM_SIMULADO_ERRORES = float(os.getenv("LLM_SIMULADO_ERRORES", "0"))
+LLM_SIMULADO_SEMILLA = int(os.getenv("LLM_SIMULADO_SEMILLA", "42"))
+# Costo de procesar cada token de entrada: lo que se ahorra del primer token
+# por cada token que llega de la caché de contexto
+LLM_SIMULADO_MS_POR_TOKEN_ENTRADA = float(os.getenv("LLM_SIMULADO_MS_POR_TOKEN_ENTRADA", "0.1"))
+# Tiempo de subir cada MB de un documento con la File API
+LLM_SIMULADO_MS_POR_MB_SUBIDA = float(os.getenv("LLM_SIMULADO_MS_POR_MB_SUBIDA", "150"))
+
+# Documentos adjuntos: hasta este tamaño van dentro de la solicitud; los
+# mayores se suben antes con la File API (Gemini limita la solicitud a 20MB)
+LLM_INLINE_MAX_BYTES = int(float(os.getenv("LLM_INLINE_MAX_MB", "15")) * 1024 * 1024)
+# Los archivos subidos duran 48 h en Gemini; se reutilizan un poco menos
+VIGENCIA_ARCHIVOS_SEGUNDOS = 46 * 3600
+
+# Tokens que cobra Gemini por documento: 258 por página de PDF o por imagen
+# (las imágenes grandes se dividen en mosaicos de 768 px; se estiman 4)
+TOKENS_POR_PAGINA_PDF = 258
+TOKENS_POR_IMAGEN = 4 * 258
+
+# Marcadores de los prompts de gemini_service, para saber qué parte del plan se pide
+_FASE_ESQUELETO = re.compile(r"# FASE 1 DE 2")
+_FASE_MODULO = re.compile(r"# FASE 2 DE 2: DETALLE DEL MÓDULO (\d+)")
+_CONTINUACION = re.compile(r"# CONTINUACIÓN DE UNA RESPUESTA CORTADA")
+_RANGO_CONTINUACION = re.compile(r"SOLO los módulos del (\d+) al (\d+)")
+_EXTRACCION = re.compile(r'responde "SIN CONTENIDO"')
+_MARCA_COMPACTO = FORMATO_SALIDA_COMPACTO.strip().splitlines()[0]
+# Actividades ofrecidas por la biblioteca: "- ID [momento] nombre — campo: ..."
+_ACTIVIDAD_BIBLIOTECA = re.compile(r"^- (A[0-9a-f]{6}) \[[a-z]+\] (.+?) — ", re.MULTILINE)
+
+
+class RespuestaLLM:
+    """Respuesta (o fragmento de un stream) normalizada de cualquier proveedor"""
+
+    __slots__ = ("texto", "motivo_fin", "tokens_usados", "tokens_cacheados")
+
+    def __init__(self, texto: str, motivo_fin: Optional[str] = None, tokens_usados: int = 0,
+                 tokens_cacheados: int = 0):
+        self.texto = texto
+        # 'STOP', 'MAX_TOKENS', ... o None si el proveedor no lo reporta
+        self.motivo_fin = motivo_fin
+        self.tokens_usados = tokens_usados
+        # Tokens de entrada que vinieron de la caché de contexto (se facturan con descuento)
+        self.tokens_cacheados = tokens_cacheados
+
+
+class ErrorSimulado(Exception):
+    """Fallo inyectado por el proveedor simulado (reintentable, como un 503 de Gemini)"""
+
+    def __init__(self, mensaje: str, code: int = 503):
+        super().__init__(mensaje)
+        self.code = code
+
+
+class DocumentoAdjunto:
+    """
+    Archivo original (PDF o imagen) que se envía al modelo tal cual, sin OCR
+
+    str() da una referencia corta (tipo y hash) para claves de caché y logs.
+    """
+
+    __slots__ = ("datos", "mime", "nombre", "paginas", "huella")
+
+    def __init__(self, datos: bytes, mime: str, nombre: str, paginas: Optional[int] = None):
+        self.datos = datos
+        self.mime = mime
+        self.nombre = nombre
+        self.paginas = paginas
+        self.huella = hashlib.sha256(datos).hexdigest()
+
+    @property
+    def tamano(self) -> int:
+        return len(self.datos)
+
+    @property
+    def tokens_estimados(self) -> int:
+        if self.mime == "application/pdf":
+            return TOKENS_POR_PAGINA_PDF * (self.paginas or 1)
+        return TOKENS_POR_IMAGEN
+
+    def __str__(self) -> str:
+        return f"documento:{self.mime}:{self.huella[:16]}"
+
+
+class PromptMultimodal:
+    """
+    Prompt de texto con documentos adjuntos (se envían antes del texto)
+
+    str() da solo el texto, así que clasificar el prompt, buscar las
+    instrucciones fijas o agregar una continuación funcionan igual que con
+    un prompt de texto; con_texto conserva los documentos.
+    """
+
+    __slots__ = ("texto", "documentos")
+
+    def __init__(self, texto: str, documentos: List[DocumentoAdjunto]):
+        self.texto = texto
+        self.documentos = documentos
+
+    def con_texto(self, texto: str) -> "PromptMultimodal":
+        return PromptMultimodal(texto, self.documentos)
+
+    def __str__(self) -> str:
+        return self.texto
+
+
+def documentos_de(prompt) -> List[DocumentoAdjunto]:
+    """Documentos adjuntos de un prompt ([] si es solo texto)"""
+    return prompt.documentos if isinstance(prompt, PromptMultimodal) else []
+
+
+def tokens_de_prompt(prompt) -> int:
+    """Tokens estimados de un prompt, incluidos sus documentos adjuntos"""
+    return estimar_tokens(str(prompt)) + sum(d.tokens_estimados for d in documentos_de(prompt))
+
+
+def tipo_de_prompt(prompt: str) -> str:
+    """Clasifica un prompt: plan, esqueleto, modulo, continuacion o extraccion"""
+    if _CONTINUACION.search(prompt):
+        return "continuacion"
+    if _FASE_MODULO.search(prompt):
+        return "modulo"
+    if _FASE_ESQUELETO.search(prompt):
+        return "esqueleto"
+    if _EXTRACCION.search(prompt):
+        return "extraccion"
+    return "plan"
+
+
+def clave_prompt(prompt) -> str:
+    """SHA-256 del prompt y sus documentos (identifica una respuesta grabada)"""
+    contenido = str(prompt) + "".join(d.huella for d in documentos_de(prompt))
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+class CacheContexto:
+    """
+    Caché de contexto del inicio fijo de los prompts (las instrucciones)
+
+    El recurso lo crea el proveedor con `crear(instrucciones, ttl)` en la
+    primera llamada y se vuelve a crear cuando vence (un poco antes que en el
+    proveedor). Si la creación falla, las llamadas envían el prompt completo
+    y se reintenta más tarde.
+    """
+
+    MARGEN_SEGUNDOS = 60
+    REINTENTO_SEGUNDOS = 300
+
+    def __init__(self, instrucciones: str, ttl: float, crear: Callable[[str, float], Awaitable[Any]]):
+        self.instrucciones = instrucciones
+        self.ttl = ttl
+        self.huella = clave_prompt(instrucciones)[:12]
+        self._crear = crear
+        self._recurso = None
+        self._vence = 0.0
+        self._reintentar_en = 0.0
+        self._lock = asyncio.Lock()
+        self.creadas = 0
+        self.fallos_creacion = 0
+        self.aciertos = 0
+        self.envios_completos = 0
+        self.tokens_cacheados = 0
+
+    def _vigente(self) -> bool:
+        return self._recurso is not None and time.monotonic() < self._vence
+
+    async def _obtener(self) -> Any:
+        """Recurso vigente, creándolo si hace falta (una sola creación a la vez); None si falla"""
+        if self._vigente():
+            return self._recurso
+        if time.monotonic() < self._reintentar_en:
+            return None
+        async with self._lock:
+            if self._vigente():
+                return self._recurso
+            try:
+                self._recurso = await self._crear(self.instrucciones, self.ttl)
+            except Exception as e:
+                self._recurso = None
+                self.fallos_creacion += 1
+                self._reintentar_en = time.monotonic() + min(self.ttl, self.REINTENTO_SEGUNDOS)
+                logger.warning(f"⚠️ No se pudo crear la caché de contexto; se envía el prompt completo: {e}")
+                return None
+            self.creadas += 1
+            self._vence = time.monotonic() + max(self.ttl - self.MARGEN_SEGUNDOS, self.ttl / 2)
+            logger.info(
+                f"🗄️ Caché de contexto {self.huella} creada "
+                f"(~{estimar_tokens(self.instrucciones)} tokens, {self.ttl:.0f}s)"
+            )
+            return self._recurso
+
+    async def preparar(self, prompt) -> Tuple[Any, Any]:
+        """
+        (recurso, contenido a enviar) para un prompt
+
+        Si el prompt empieza con las instrucciones y hay caché, el contenido
+        es solo el resto; si no, (None, prompt completo).
+        """
+        if not (isinstance(prompt, (str, PromptMultimodal)) and str(prompt).startswith(self.instrucciones)):
+            return None, prompt
+        recurso = await self._obtener()
+        if recurso is None:
+            self.envios_completos += 1
+            return None, prompt
+        self.aciertos += 1
+        resto = str(prompt)[len(self.instrucciones):]
+        return recurso, prompt.con_texto(resto) if isinstance(prompt, PromptMultimodal) else resto
+
+    def invalidar(self) -> None:
+        """El proveedor ya no tiene la caché (venció o se borró): la próxima llamada la crea"""
+        self._recurso = None
+        self._vence = 0.0
+
+    def estado(self) -> Dict:
+        return {
+            "huella": self.huella,
+            "vigente": self._vigente(),
+            "creadas": self.creadas,
+            "fallos_creacion": self.fallos_creacion,
+            "aciertos": self.aciertos,
+            "envios_completos": self.envios_completos,
+            "tokens_cacheados": self.tokens_cacheados,
+        }
+
+
+class ProveedorLLM:
+    """
+    Interfaz de un proveedor de modelo de lenguaje
+
+    generar y generar_stream reciben el prompt y los argumentos de
+    generate_content (generation_config); generar_stream devuelve, ya
+    abierto, un iterador de fragmentos RespuestaLLM. Con
+    usar_instrucciones_fijas, los prompts que empiezan con esas
+    instrucciones las toman de la caché de contexto (_crear_cache). El
+    prompt puede ser un PromptMultimodal: sus documentos hasta
+    LLM_INLINE_MAX_BYTES van en la solicitud y los mayores se suben antes.
+    """
+
+    nombre = "base"
+    cache_contexto: Optional[CacheContexto] = None
+    documentos_en_linea = 0
+    documentos_subidos = 0
+
+    def usar_instrucciones_fijas(self, instrucciones: str, ttl: float) -> None:
+        """Guarda el inicio común de los prompts en caché de contexto durante `ttl` segundos"""
+        if self.cache_contexto is None or self.cache_contexto.instrucciones != instrucciones:
+            self.cache_contexto = CacheContexto(instrucciones, ttl, self._crear_cache)
+
+    async def _crear_cache(self, instrucciones: str, ttl: float) -> Any:
+        raise NotImplementedError
+
+    async def _preparar(self, prompt) -> Tuple[Any, Any]:
+        """(recurso de caché o None, contenido a enviar)"""
+        if self.cache_contexto is None:
+            return None, prompt
+        return await self.cache_contexto.preparar(prompt)
+
+    def _registrar_cacheados(self, respuesta: RespuestaLLM) -> None:
+        if self.cache_contexto is not None:
+            self.cache_contexto.tokens_cacheados += respuesta.tokens_cacheados
+
+    def _estado_cache(self) -> Dict:
+        estado = {"documentos": {"en_linea": self.documentos_en_linea, "subidos": self.documentos_subidos}}
+        if self.cache_contexto:
+            estado["cache_contexto"] = self.cache_contexto.estado()
+        return estado
+
+    async def generar(self, prompt, **kwargs) -> RespuestaLLM:
+        raise NotImplementedError
+
+    async def generar_stream(self, prompt, **kwargs) -> AsyncIterator[RespuestaLLM]:
+        raise NotImplementedError
+
+    async def contar_tokens(self, texto) -> int:
+        return tokens_de_prompt(texto)
+
+    def estado(self) -> Dict:
+        """Datos del proveedor (para /health)"""
+        return {"nombre": self.nombre, **self._estado_cache()}
+
+
+class ProveedorGemini(ProveedorLLM):
+    """Google Gemini con la API asíncrona de google.generativeai"""
+
+    nombre = "gemini"
+
+    def __init__(self, modelo: str, generation_config: Dict, api_key: Optional[str],
+                 dir_grabacion: str = ""):
+        self.modelo = modelo
+        self.generation_config = generation_config
+        self.api_key = api_key
+        self.dir_grabacion = dir_grabacion
+        self._model = None
+        # Archivos subidos con la File API por hash: (archivo, vence)
+        self._archivos: Dict[str, Tuple[Any, float]] = {}
+        self._lock_subidas = asyncio.Lock()
+
+    @property
+    def model(self):
+        """
+        Modelo de Gemini, creado en la primera generación
+
+        El SDK tarda cientos de milisegundos en importarse, así que no se carga
+        al importar este módulo (arranque en frío del servidor).
+        """
+        if self._model is None:
+            import google.generativeai as genai
+            genai.configure(api_key=self.api_key)
+            self._model = genai.GenerativeModel(
+                model_name=self.modelo,
+                generation_config=self.generation_config
+            )
+        return self._model
+
+    @staticmethod
+    def _texto(response) -> str:
+        try:
+            return response.text or ""
+        except ValueError:
+            # Respuestas o fragmentos sin partes de texto (p. ej. solo finish_reason)
+            return ""
+
+    @staticmethod
+    def _motivo_fin(response) -> Optional[str]:
+        """finish_reason del primer candidato ('STOP', 'MAX_TOKENS', ...) o None"""
+        try:
+            motivo = response.candidates[0].finish_reason
+        except (AttributeError, IndexError, TypeError):
+            return None
+        nombre = getattr(motivo, 'name', None) or (str(motivo) if motivo else None)
+        return None if nombre == 'FINISH_REASON_UNSPECIFIED' else nombre
+
+    @staticmethod
+    def _tokens_usados(response) -> Tuple[int, int]:
+        """Tokens totales y cacheados reportados por Gemini (0 si la respuesta no los incluye)"""
+        uso = getattr(response, 'usage_metadata', None)
+        return (getattr(uso, 'total_token_count', 0) or 0), (getattr(uso, 'cached_content_token_count', 0) or 0)
+
+    def _normalizar(self, response) -> RespuestaLLM:
+        return RespuestaLLM(self._texto(response), self._motivo_fin(response), *self._tokens_usados(response))
+
+    async def _crear_cache(self, instrucciones: str, ttl: float):
+        """Registra las instrucciones como CachedContent y devuelve un modelo que las usa"""
+        def crear():
+            import datetime
+            import google.generativeai as genai
+            from google.generativeai import caching
+            self.model  # configura la API key
+            cache = caching.CachedContent.create(
+                model=self.modelo,
+                display_name=f"profego-{clave_prompt(instrucciones)[:12]}",
+                system_instruction=instrucciones,
+                ttl=datetime.timedelta(seconds=ttl)
+            )
+            return genai.GenerativeModel.from_cached_content(cache, generation_config=self.generation_config)
+
+        return await asyncio.to_thread(crear)
+
+    @staticmethod
+    def _cache_perdida(error: BaseException) -> bool:
+        """Gemini ya no tiene la caché (venció o se borró antes de lo previsto)"""
+        return getattr(error, "code", None) in (403, 404) and "cache" in str(error).lower()
+
+    async def _subir(self, documento: DocumentoAdjunto):
+        """Sube un documento con la File API (una vez por contenido) y espera a que esté listo"""
+        async with self._lock_subidas:
+            subido = self._archivos.get(documento.huella)
+            if subido is not None and time.monotonic() < subido[1]:
+                return subido[0]
+
+            def subir():
+                import io
+                import google.generativeai as genai
+                self.model  # configura la API key
+                archivo = genai.upload_file(
+                    io.BytesIO(documento.datos), mime_type=documento.mime, display_name=documento.nombre
+                )
+                while archivo.state.name == "PROCESSING":
+                    time.sleep(1)
+                    archivo = genai.get_file(archivo.name)
+                if archivo.state.name != "ACTIVE":
+                    raise ValueError(f"Gemini no pudo procesar el documento {documento.nombre} ({archivo.state.name})")
+                return archivo
+
+            inicio = time.perf_counter()
+            archivo = await asyncio.to_thread(subir)
+            self._archivos[documento.huella] = (archivo, time.monotonic() + VIGENCIA_ARCHIVOS_SEGUNDOS)
+            self.documentos_subidos += 1
+            logger.info(
+                f"📤 Documento {documento.nombre} subido a Gemini "
+                f"({documento.tamano / 1024 / 1024:.1f}MB, {time.perf_counter() - inicio:.1f}s)"
+            )
+            return archivo
+
+    async def _contenido(self, prompt):
+        """Contenido para generate_content: los documentos (en línea o subidos) y luego el texto"""
+        if not isinstance(prompt, PromptMultimodal):
+            return prompt
+        partes = []
+        for documento in prompt.documentos:
+            if documento.tamano <= LLM_INLINE_MAX_BYTES:
+                self.documentos_en_linea += 1
+                partes.append({"mime_type": documento.mime, "data": documento.datos})
+            else:
+                partes.append(await self._subir(documento))
+        return partes + [prompt.texto]
+
+    async def _llamar(self, prompt, **kwargs):
+        """generate_content con las instrucciones desde la caché de contexto si está disponible"""
+        modelo, contenido = await self._preparar(prompt)
+        if modelo is None:
+            return await self.model.generate_content_async(await self._contenido(prompt), **kwargs)
+        try:
+            return await modelo.generate_content_async(await self._contenido(contenido), **kwargs)
+        except Exception as e:
+            if not self._cache_perdida(e):
+                raise
+            logger.warning(f"⚠️ La caché de contexto ya no existe en Gemini; se envía el prompt completo: {e}")
+            self.cache_contexto.invalidar()
+            return await self.model.generate_content_async(await self._contenido(prompt), **kwargs)
+
+    def _grabar(self, prompt, respuesta: RespuestaLLM) -> None:
+        """Guarda la respuesta para el proveedor simulado (si LLM_GRABAR_DIR está definido)"""
+        if not self.dir_grabacion:
+            return
+        clave = clave_prompt(prompt)
+        tipo = tipo_de_prompt(str(prompt))
+        try:
+            carpeta = Path(self.dir_grabacion)
+            carpeta.mkdir(parents=True, exist_ok=True)
+            (carpeta / f"{tipo}_{clave[:16]}.json").write_text(json.dumps({
+                "clave": clave,
+                "tipo": tipo,
+                "texto": respuesta.texto,
+                "motivo_fin": respuesta.motivo_fin,
+                "tokens_usados": respuesta.tokens_usados,
+            }, ensure_ascii=False), encoding="utf-8")
+        except OSError as e:
+            logger.warning(f"⚠️ No se pudo grabar la respuesta de Gemini: {e}")
+
+    async def generar(self, prompt, **kwargs) -> RespuestaLLM:
+        respuesta = self._normalizar(await self._llamar(prompt, **kwargs))
+        self._registrar_cacheados(respuesta)
+        self._grabar(prompt, respuesta)
+        return respuesta
+
+    async def generar_stream(self, prompt, **kwargs) -> AsyncIterator[RespuestaLLM]:
+        response = await self._llamar(prompt, stream=True, **kwargs)
+        return self._fragmentos(prompt, response)
+
+    async def _fragmentos(self, prompt, response) -> AsyncIterator[RespuestaLLM]:
+        partes: List[str] = []
+        ultimo = RespuestaLLM("")
+        async for chunk in response:
+            ultimo = self._normalizar(chunk)
+            partes.append(ultimo.texto)
+            yield ultimo
+        self._registrar_cacheados(ultimo)
+        self._grabar(prompt, RespuestaLLM("".join(partes), ultimo.motivo_fin, ultimo.tokens_usados))
+
+    async def contar_tokens(self, texto) -> int:
+        if documentos_de(texto):
+            # Contar con la API obligaría a subir los documentos grandes solo para eso
+            return tokens_de_prompt(texto)
+        return (await self.model.count_tokens_async(texto)).total_tokens
+
+    def estado(self) -> Dict:
+        return {
+            "nombre": self.nombre,
+            "modelo": self.modelo,
+            "grabando": bool(self.dir_grabacion),
+            **self._estado_cache(),
+        }
+
+
+def _citar_biblioteca(plan: Dict, ofrecidas: Dict[str, str]) -> Dict:
+    """Copia del plan con {"ref": ID} en cada actividad que la biblioteca ofreció por nombre"""
+    plan = copy.deepcopy(plan)
+
+    def citar(actividad):
+        if isinstance(actividad, dict) and actividad.get("nombre") in ofrecidas:
+            return {CLAVE_REFERENCIA: ofrecidas[actividad["nombre"]]}
+        return actividad
+
+    for modulo in plan.get("modulos", []):
+        for campo in ("actividad_inicio", "actividad_cierre"):
+            if campo in modulo:
+                modulo[campo] = citar(modulo[campo])
+        if isinstance(modulo.get("actividades_desarrollo"), list):
+            modulo["actividades_desarrollo"] = [citar(a) for a in modulo["actividades_desarrollo"]]
+    return plan
+
+
+class ProveedorSimulado(ProveedorLLM):
+    """
+    Proveedor determinista que reproduce respuestas grabadas sin red
+
+    Para cada prompt busca, en orden: la grabación exacta (misma clave), una
+    grabación del mismo tipo (elegida por la clave) o una respuesta derivada
+    del plan base (la parte pedida: esqueleto, un módulo, lo que faltó...),
+    en formato compacto si el prompt lo pide; las actividades que el prompt
+    ofrece de la biblioteca se citan por ID.
+
+    La carpeta de respuestas admite grabaciones de ProveedorGemini y planes
+    JSON crudos (se usan como planes base). Sin carpeta se usa un plan
+    representativo de 6 módulos.
+
+    La latencia es primer_token_ms más ms_por_token por token de salida,
+    multiplicada por `escala`; en streaming los fragmentos llegan cada
+    tokens_por_fragmento tokens. Con caché de contexto, el primer token llega
+    ms_por_token_entrada antes por cada token cacheado; los documentos
+    adjuntos lo retrasan ms_por_token_entrada por cada uno de sus tokens, y
+    los que no caben en la solicitud, ms_por_mb_subida por MB la primera vez
+    que se suben. Con `truncar` y `errores` una fracción de
+    las llamadas se corta por longitud o falla con 503 (secuencia fija por
+    `semilla`).
+    """
+
+    nombre = "simulado"
+
+    def __init__(
+        self,
+        dir_respuestas: Optional[str] = None,
+        primer_token_ms: float = LLM_SIMULADO_PRIMER_TOKEN_MS,
+        ms_por_token: float = LLM_SIMULADO_MS_POR_TOKEN,
+        tokens_por_fragmento: int = LLM_SIMULADO_TOKENS_POR_FRAGMENTO,
+        truncar: float = LLM_SIMULADO_TRUNCAR,
+        errores: float = LLM_SIMULADO_ERRORES,
+        semilla: int = LLM_SIMULADO_SEMILLA,
+        escala: float = 1.0,
+        planes_base: Optional[List[Dict]] = None,
+        ms_por_token_entrada: float = LLM_SIMULADO_MS_POR_TOKEN_ENTRADA,
+        ms_por_mb_subida: float = LLM_SIMULADO_MS_POR_MB_SUBIDA
+    ):
+        self.primer_token_ms = primer_token_ms
+        self.ms_por_token = ms_por_token
+        self.ms_por_token_entrada = ms_por_token_entrada
+        self.ms_por_mb_subida = ms_por_mb_subida
+        self._subidos: set = set()
+        self.tokens_por_fragmento = max(1, tokens_por_fragmento)
+        self.truncar = truncar
+        self.errores = errores
+        self.escala = escala
+        self._azar = random.Random(semilla)
+        self._por_clave: Dict[str, Dict] = {}
+        self._por_tipo: Dict[str, List[Dict]] = {}
+        self.planes_base = list(planes_base or [])
+        if dir_respuestas:
+            self._cargar(Path(dir_respuestas))
+        if not self.planes_base:
+            self.planes_base = [plan_representativo()]
+
+        self.llamadas = 0
+        self.errores_inyectados = 0
+        self.truncadas = 0
+        self.tokens_salida = 0
+
+    def _cargar(self, carpeta: Path) -> None:
+        for ruta in sorted(carpeta.glob("*.json")):
+            try:
+                contenido = json.loads(ruta.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"⚠️ Respuesta grabada ilegible {ruta.name}: {e}")
+                continue
+            if isinstance(contenido, dict) and "texto" in contenido and "tipo" in contenido:
+                self._por_clave[contenido.get("clave", "")] = contenido
+                self._por_tipo.setdefault(contenido["tipo"], []).append(contenido)
+            elif isinstance(contenido, dict) and (contenido.get("modulos") or contenido.get(CLAVE_MODULOS_COMPACTA)):
+                self.planes_base.append(expandir_plan(contenido))
+        logger.info(
+            f"🎭 Proveedor simulado: {len(self._por_clave)} grabaciones, "
+            f"{len(self.planes_base)} planes base ({carpeta})"
+        )
+
+    def _derivar(self, prompt: str, tipo: str, clave: str) -> str:
+        """Respuesta construida a partir de un plan base"""
+        if tipo == "extraccion":
+            fragmento = prompt.rsplit("## FRAGMENTO:", 1)[-1].strip()
+            return fragmento[:max(200, len(fragmento) // 4)]
+
+        plan = self.planes_base[int(clave, 16) % len(self.planes_base)]
+        compacto = _MARCA_COMPACTO in prompt
+        ofrecidas = {nombre: id_actividad for id_actividad, nombre in _ACTIVIDAD_BIBLIOTECA.findall(prompt)}
+        if ofrecidas:
+            plan = _citar_biblioteca(plan, ofrecidas)
+        modulos = plan.get("modulos", [])
+
+        if tipo == "modulo":
+            numero = int(_FASE_MODULO.search(prompt).group(1))
+            modulo = modulos[(numero - 1) % len(modulos)]
+            return json.dumps(compactar_modulo(modulo) if compacto else modulo, ensure_ascii=False)
+
+        if tipo == "esqueleto":
+            respuesta = esqueleto_de_plan(plan)
+        elif tipo == "continuacion":
+            rango = _RANGO_CONTINUACION.search(prompt)
+            respuesta = {k: v for k, v in plan.items() if k != "modulos"}
+            if rango:
+                respuesta["modulos"] = modulos[int(rango.group(1)) - 1:int(rango.group(2))]
+        else:
+            respuesta = plan
+        return json.dumps(compactar_plan(respuesta) if compacto else respuesta, ensure_ascii=False)
+
+    def _responder(self, prompt) -> RespuestaLLM:
+        """Elige la respuesta del prompt y aplica los fallos inyectados"""
+        self.llamadas += 1
+        if self._azar.random() < self.errores:
+            self.errores_inyectados += 1
+            raise ErrorSimulado("503 Servicio no disponible (error simulado)")
+
+        clave = clave_prompt(prompt)
+        tokens_entrada = tokens_de_prompt(prompt)
+        prompt = str(prompt)
+        tipo = tipo_de_prompt(prompt)
+        grabada = self._por_clave.get(clave)
+        if grabada is None and self._por_tipo.get(tipo):
+            candidatas = self._por_tipo[tipo]
+            grabada = candidatas[int(clave, 16) % len(candidatas)]
+        if grabada is not None:
+            texto, motivo = grabada["texto"], grabada.get("motivo_fin") or "STOP"
+        else:
+            texto, motivo = self._derivar(prompt, tipo, clave), "STOP"
+
+        if tipo != "extraccion" and self._azar.random() < self.truncar:
+            self.truncadas += 1
+            texto = texto[:int(len(texto) * self._azar.uniform(0.3, 0.8))]
+            motivo = "MAX_TOKENS"
+
+        self.tokens_salida += estimar_tokens(texto)
+        return RespuestaLLM(texto, motivo, tokens_entrada + estimar_tokens(texto))
+
+    async def _esperar(self, ms: float) -> None:
+        await asyncio.sleep(ms * self.escala / 1000)
+
+    async def _crear_cache(self, instrucciones: str, ttl: float) -> str:
+        # Crear la caché cuesta procesar las instrucciones una vez
+        await self._esperar(estimar_tokens(instrucciones) * self.ms_por_token_entrada)
+        return f"cachedContents/simulado-{clave_prompt(instrucciones)[:12]}"
+
+    async def _adjuntar(self, prompt) -> float:
+        """Milisegundos que agregan los documentos del prompt (subida y procesamiento)"""
+        ms = 0.0
+        for documento in documentos_de(prompt):
+            if documento.tamano <= LLM_INLINE_MAX_BYTES:
+                self.documentos_en_linea += 1
+            elif documento.huella not in self._subidos:
+                await self._esperar(documento.tamano / 1024 / 1024 * self.ms_por_mb_subida)
+                self._subidos.add(documento.huella)
+                self.documentos_subidos += 1
+            ms += documento.tokens_estimados * self.ms_por_token_entrada
+        return ms
+
+    async def _responder_con_cache(self, prompt) -> Tuple[RespuestaLLM, float]:
+        """Respuesta y milisegundos hasta el primer token, descontando lo cacheado"""
+        recurso, _ = await self._preparar(prompt)
+        ms_documentos = await self._adjuntar(prompt)
+        respuesta = self._responder(prompt)
+        if recurso is not None:
+            respuesta.tokens_cacheados = estimar_tokens(self.cache_contexto.instrucciones)
+            self._registrar_cacheados(respuesta)
+        ahorro = respuesta.tokens_cacheados * self.ms_por_token_entrada
+        return respuesta, max(self.primer_token_ms - ahorro, 0.0) + ms_documentos
+
+    async def generar(self, prompt, **kwargs) -> RespuestaLLM:
+        respuesta, primer_token = await self._responder_con_cache(prompt)
+        await self._esperar(primer_token + estimar_tokens(respuesta.texto) * self.ms_por_token)
+        return respuesta
+
+    async def generar_stream(self, prompt, **kwargs) -> AsyncIterator[RespuestaLLM]:
+        respuesta, primer_token = await self._responder_con_cache(prompt)
+        await self._esperar(primer_token)
+        return self._fragmentos(respuesta)
+
+    async def _fragmentos(self, respuesta: RespuestaLLM) -> AsyncIterator[RespuestaLLM]:
+        tamano = self.tokens_por_fragmento * CARACTERES_POR_TOKEN
+        texto = respuesta.texto
+        for inicio in range(0, len(texto), tamano):
+            await self._esperar(self.tokens_por_fragmento * self.ms_por_token)
+            yield RespuestaLLM(texto[inicio:inicio + tamano])
+        # Como Gemini, el último fragmento trae el finish_reason y el uso de tokens
+        yield RespuestaLLM("", respuesta.motivo_fin, respuesta.tokens_usados, respuesta.tokens_cacheados)
+
+    def estado(self) -> Dict:
+        return {
+            "nombre": self.nombre,
+            "grabaciones": len(self._por_clave),
+            "llamadas": self.llamadas,
+            "errores_inyectados": self.errores_inyectados,
+            "truncadas": self.truncadas,
+            **self._estado_cache(),
+        }
+
+
+def crear_proveedor(modelo: str, generation_config: Dict, api_key: Optional[str]) -> ProveedorLLM:
+    """Proveedor configurado en LLM_PROVIDER (gemini por defecto)"""
+    if LLM_PROVIDER == "simulado":
+        logger.warning("🎭 LLM_PROVIDER=simulado: los planes se generan con respuestas grabadas, sin Gemini")
+        return ProveedorSimulado(LLM_SIMULADO_RESPUESTAS_DIR)
+    if LLM_PROVIDER != "gemini":
+        logger.warning(f"⚠️ LLM_PROVIDER desconocido '{LLM_PROVIDER}'; se usa gemini")
+    return ProveedorGemini(modelo, generation_config, api_key, LLM_GRABAR_DIR)
+
+
+def plan_representativo(modulos: int = 6, actividades: int = 4) -> Dict:
+    """Plan con la forma y longitud de textos de una respuesta real de Gemini"""
+    descripcion = (
+        "Sentados en círculo, la maestra muestra la caja y pide a cada niño que meta "
+        "la mano, describa lo que siente y adivine el objeto antes de sacarlo."
+    )
+
+    def actividad(nombre, **extra):
+        return {
+            "nombre": nombre,
+            "descripcion": descripcion,
+            "duracion": "15-20 minutos",
+            "materiales": ["Caja de cartón", "Objetos de texturas variadas", "Pañuelo"],
+            "organizacion": "grupo completo",
+            **extra,
+        }
+
+    return {
+        "nombre_plan": "Exploradores del mundo que nos rodea",
+        "grado": "2° Preescolar",
+        "edad_aprox": "4-5 años",
+        "duracion_total": f"{modulos} semanas",
+        "campo_formativo_principal": "Lenguaje y Comunicación",
+        "ejes_articuladores_generales": ["Inclusión", "Pensamiento Crítico", "Vida Saludable"],
+        "num_modulos": modulos,
+        "modulos": [{
+            "numero": n,
+            "nombre": f"Módulo {n}: La caja de los sentidos",
+            "campo_formativo": "Exploración y Comprensión del Mundo Natural y Social",
+            "ejes_articuladores": ["Inclusión", "Pensamiento Crítico"],
+            "aprendizaje_esperado": "Describe características de objetos usando sus sentidos y comparte sus hallazgos",
+            "tiempo_estimado": "1 semana",
+            "actividad_inicio": actividad("La caja misteriosa"),
+            "actividades_desarrollo": [
+                actividad(f"Estación sensorial {a}", tipo="exploracion",
+                          aspectos_a_observar="Vocabulario que usa para describir y si espera su turno")
+                for a in range(1, actividades + 1)
+            ],
+            "actividad_cierre": actividad(
+                "¿Qué descubrimos hoy?",
+                preguntas_guia=["¿Qué fue lo más suave?", "¿Qué te sorprendió?", "¿Cómo lo supiste?"]
+            ),
+            "consejos_maestra": "Prepare los objetos con anticipación y evite piezas pequeñas.",
+            "variaciones": "Para niños que necesitan apoyo, reduzca a dos objetos con contrastes marcados.",
+            "vinculo_familia": "Buscar en casa tres objetos suaves y tres ásperos y platicarlo en clase.",
+            "evaluacion": "Registrar si usa al menos dos adjetivos para describir un objeto.",
+        } for n in range(1, modulos + 1)],
+        "recursos_educativos": {
+            "materiales_generales": ["Cajas", "Telas", "Pinturas", "Papel kraft"],
+            "cuentos_recomendados": [{
+                "titulo": "El monstruo de colores", "autor": "Anna Llenas",
+                "tipo": "RECURSO REAL", "acceso": "REQUIERE COMPRA",
+                "disponibilidad": "Disponible en librerías",
+                "descripcion_breve": "Libro sobre emociones básicas",
+            }] * 3,
+            "canciones_recomendadas": [{
+                "titulo": "Los cinco sentidos", "tipo": "PROPUESTA CREATIVA", "acceso": "GRATUITO",
+                "disponibilidad": "Canción inventada para el plan", "uso_sugerido": "Al iniciar la jornada",
+            }] * 3,
+            "materiales_digitales": [{
+                "nombre": "Portal de recursos educativos", "tipo": "plataforma", "acceso": "GRATUITO",
+                "descripcion_breve": "Videos cortos sobre el cuerpo humano",
+            }] * 2,
+        },
+        "recomendaciones_ambiente": "Rincones de exploración con materiales al alcance de los niños.",
+        "vinculacion_curricular": {
+            "campo_formativo_principal": "Lenguaje y Comunicación",
+            "campos_secundarios": ["Pensamiento Matemático", "Artes"],
+            "ejes_transversales": ["Inclusión", "Vida Saludable"],
+            "aprendizajes_clave": ["Describe objetos", "Comparte hallazgos"],
+        },
+    }
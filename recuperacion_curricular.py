@@ -0,0 +1,192 @@
+"""
+Recuperación local (BM25) de las secciones relevantes del plan de estudios
+Selecciona, sin red, las secciones sobre segundo de preescolar y los campos
+formativos dentro de un presupuesto de tokens, para no enviar el documento completo
+"""
+
+import logging
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from fragmentos import dividir_en_fragmentos
+from gobernador_cuota import CARACTERES_POR_TOKEN, estimar_tokens
+
+logger = logging.getLogger(__name__)
+
+# Tamaño de cada sección indexada (respeta páginas y párrafos)
+SECCION_CARACTERES = 3000
+
+# Parámetros estándar de BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Consulta base: grado objetivo y vocabulario curricular
+CONSULTA_GRADO = (
+    "preescolar segundo grado 2° niñas niños 4 5 años educación preescolar "
+    "aprendizajes esperados procesos de desarrollo de aprendizaje PDA contenidos "
+    "orientaciones didácticas sugerencias de evaluación juego"
+)
+
+CAMPOS_FORMATIVOS = [
+    "Lenguajes",
+    "Saberes y Pensamiento Científico",
+    "Ética, Naturaleza y Sociedades",
+    "De lo Humano y lo Comunitario",
+    "Lenguaje y Comunicación",
+    "Pensamiento Matemático",
+    "Exploración y Comprensión del Mundo Natural y Social",
+    "Artes",
+    "Educación Física",
+]
+
+EJES_ARTICULADORES = [
+    "Inclusión",
+    "Pensamiento Crítico",
+    "Interculturalidad Crítica",
+    "Igualdad de Género",
+    "Vida Saludable",
+    "Apropiación de las Culturas a través de la Lectura y la Escritura",
+    "Artes y Experiencias Estéticas",
+]
+
+# Secciones de otros grados/niveles sin mención del grado objetivo se penalizan
+PATRON_OTROS_GRADOS = re.compile(
+    r"\b(primer|tercer|cuarto|quinto|sexto)\s+grado\b|\b(1|3)°|\bprimaria\b|\bsecundaria\b",
+    re.IGNORECASE
+)
+PATRON_GRADO_OBJETIVO = re.compile(r"\bsegundo\s+grado\b|\b2°|\bsegundo de preescolar\b", re.IGNORECASE)
+PENALIZACION_OTRO_GRADO = 0.5
+
+STOPWORDS = {
+    "para", "como", "con", "las", "los", "del", "por", "una", "uno", "que", "sus",
+    "este", "esta", "estos", "estas", "entre", "sobre", "desde", "hasta", "cada",
+    "más", "mas", "sin", "son", "ser", "han", "hay", "les", "nos", "también", "tambien",
+    "donde", "cuando", "asi", "así", "otros", "otras", "todo", "toda", "todos", "todas",
+}
+
+
+def _sin_acentos(texto: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFD", texto) if unicodedata.category(c) != "Mn")
+
+
+def tokenizar(texto: str) -> List[str]:
+    """Minúsculas, sin acentos, sin stopwords y con un singular aproximado"""
+    terminos = []
+    for palabra in re.findall(r"\w+", _sin_acentos(texto.lower())):
+        if len(palabra) < 3 or palabra in STOPWORDS:
+            if not palabra.isdigit():
+                continue
+        if len(palabra) > 4 and palabra.endswith("es"):
+            palabra = palabra[:-2]
+        elif len(palabra) > 3 and palabra.endswith("s"):
+            palabra = palabra[:-1]
+        terminos.append(palabra)
+    return terminos
+
+
+class IndiceBM25:
+    """Índice BM25 en memoria sobre una lista de documentos (secciones)"""
+
+    def __init__(self, documentos: List[str]):
+        self.documentos = documentos
+        self.frecuencias = [Counter(tokenizar(d)) for d in documentos]
+        self.longitudes = [sum(f.values()) for f in self.frecuencias]
+        self.longitud_media = (sum(self.longitudes) / len(self.longitudes)) if documentos else 0.0
+
+        documentos_por_termino: Counter = Counter()
+        for frecuencia in self.frecuencias:
+            documentos_por_termino.update(frecuencia.keys())
+
+        total = len(documentos)
+        self.idf = {
+            termino: math.log(1 + (total - n + 0.5) / (n + 0.5))
+            for termino, n in documentos_por_termino.items()
+        }
+
+    def puntuar(self, consulta: str) -> List[float]:
+        """Puntaje BM25 de cada documento para la consulta"""
+        terminos = Counter(tokenizar(consulta))
+        puntajes = []
+        for frecuencia, longitud in zip(self.frecuencias, self.longitudes):
+            normalizacion = BM25_K1 * (1 - BM25_B + BM25_B * longitud / (self.longitud_media or 1))
+            puntaje = 0.0
+            for termino, peso in terminos.items():
+                tf = frecuencia.get(termino)
+                if tf:
+                    puntaje += peso * self.idf[termino] * tf * (BM25_K1 + 1) / (tf + normalizacion)
+            puntajes.append(puntaje)
+        return puntajes
+
+
+def construir_consulta(campos_formativos: Optional[List[str]] = None, extra: str = "") -> str:
+    """Consulta de recuperación: grado objetivo + campos formativos + ejes articuladores"""
+    campos = campos_formativos or CAMPOS_FORMATIVOS
+    return " ".join([CONSULTA_GRADO, *campos, *EJES_ARTICULADORES, extra])
+
+
+def seleccionar_secciones(
+    texto: str,
+    presupuesto_tokens: int,
+    campos_formativos: Optional[List[str]] = None,
+    consulta_extra: str = ""
+) -> Tuple[str, Dict]:
+    """
+    Selecciona las secciones más relevantes del texto dentro del presupuesto
+
+    Las secciones elegidas se devuelven en su orden original para conservar
+    el hilo del documento.
+
+    Returns:
+        (texto_seleccionado, info) con conteos de secciones y tokens
+    """
+    tokens_originales = estimar_tokens(texto)
+    info = {
+        "aplicada": False,
+        "tokens_originales": tokens_originales,
+        "tokens_seleccionados": tokens_originales,
+    }
+
+    if tokens_originales <= presupuesto_tokens:
+        return texto, info
+
+    secciones = dividir_en_fragmentos(texto, SECCION_CARACTERES)
+    indice = IndiceBM25(secciones)
+    puntajes = indice.puntuar(construir_consulta(campos_formativos, consulta_extra))
+
+    for i, seccion in enumerate(secciones):
+        if PATRON_OTROS_GRADOS.search(seccion) and not PATRON_GRADO_OBJETIVO.search(seccion):
+            puntajes[i] *= PENALIZACION_OTRO_GRADO
+
+    orden = sorted(range(len(secciones)), key=lambda i: puntajes[i], reverse=True)
+    elegidas = []
+    usados = 0
+    for i in orden:
+        if puntajes[i] <= 0:
+            break
+        tokens = estimar_tokens(secciones[i])
+        if usados + tokens > presupuesto_tokens:
+            continue
+        elegidas.append(i)
+        usados += tokens
+
+    if not elegidas:
+        # Sin coincidencias léxicas: se conserva el inicio del documento
+        logger.warning("⚠️ La recuperación no encontró secciones relevantes; se usa el inicio del documento")
+        seleccionado = texto[:presupuesto_tokens * CARACTERES_POR_TOKEN]
+    else:
+        seleccionado = "\n\n".join(secciones[i] for i in sorted(elegidas))
+
+    info.update({
+        "aplicada": True,
+        "secciones_totales": len(secciones),
+        "secciones_seleccionadas": len(elegidas),
+        "tokens_seleccionados": estimar_tokens(seleccionado),
+    })
+    logger.info(
+        f"🔎 Recuperación BM25: {len(elegidas)}/{len(secciones)} secciones, "
+        f"~{tokens_originales} → ~{info['tokens_seleccionados']} tokens"
+    )
+    return seleccionado, info
@@ -0,0 +1,235 @@
+"""
+Política de resiliencia para llamadas a servicios externos (Gemini)
+Timeout por intento, reintentos con backoff exponencial con jitter (respetando
+Retry-After), presupuesto total de tiempo y circuit breaker, con contadores
+"""
+
+import asyncio
+import logging
+import random
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Códigos HTTP que justifican reintentar (cuota agotada y errores del servidor)
+CODIGOS_REINTENTABLES = {408, 429, 500, 502, 503, 504}
+
+
+class CircuitoAbiertoError(Exception):
+    """El circuit breaker está abierto: se falla rápido sin llamar al servicio"""
+
+
+def es_reintentable(error: BaseException) -> bool:
+    """True para timeouts, 429 y errores 5xx; False para errores del cliente (400, 403...)"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    codigo = getattr(error, "code", None)
+    if isinstance(codigo, int):
+        return codigo in CODIGOS_REINTENTABLES
+    return False
+
+
+def obtener_retry_after(error: BaseException) -> Optional[float]:
+    """
+    Segundos de espera indicados por el servidor, si los hay
+
+    Busca la cabecera Retry-After de la respuesta HTTP y, en errores gRPC de
+    Google, el campo retry_delay que viene en el detalle del error.
+    """
+    respuesta = getattr(error, "response", None)
+    cabeceras = getattr(respuesta, "headers", None)
+    if cabeceras:
+        valor = cabeceras.get("Retry-After") or cabeceras.get("retry-after")
+        try:
+            return float(valor) if valor is not None else None
+        except ValueError:
+            pass
+
+    coincidencia = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", str(error))
+    if coincidencia:
+        return float(coincidencia.group(1))
+    return None
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker de tres estados: cerrado, abierto y semiabierto
+
+    Tras `umbral_fallos` fallos consecutivos se abre y rechaza llamadas durante
+    `enfriamiento` segundos; luego deja pasar una llamada de prueba (semiabierto)
+    que lo cierra si tiene éxito o lo vuelve a abrir si falla.
+    """
+
+    def __init__(self, umbral_fallos: int, enfriamiento: float):
+        self.umbral_fallos = umbral_fallos
+        self.enfriamiento = enfriamiento
+        self.estado = "cerrado"
+        self.fallos_consecutivos = 0
+        self.abierto_desde = 0.0
+        self.aperturas = 0
+        self._prueba_en_curso = False
+
+    def permitir(self) -> bool:
+        """Indica si se puede llamar al servicio ahora"""
+        if self.estado == "cerrado":
+            return True
+        if self.estado == "abierto" and time.monotonic() - self.abierto_desde >= self.enfriamiento:
+            self.estado = "semiabierto"
+            self._prueba_en_curso = False
+        if self.estado == "semiabierto" and not self._prueba_en_curso:
+            self._prueba_en_curso = True
+            return True
+        return False
+
+    def registrar_exito(self) -> None:
+        if self.estado != "cerrado":
+            logger.info("✅ Circuit breaker cerrado: el servicio respondió")
+        self.estado = "cerrado"
+        self.fallos_consecutivos = 0
+        self._prueba_en_curso = False
+
+    def liberar_prueba(self) -> None:
+        """La llamada de prueba terminó sin resultado (p. ej. fue cancelada)"""
+        self._prueba_en_curso = False
+
+    def registrar_fallo(self) -> None:
+        self.fallos_consecutivos += 1
+        self._prueba_en_curso = False
+        if self.estado == "semiabierto" or self.fallos_consecutivos >= self.umbral_fallos:
+            if self.estado != "abierto":
+                self.aperturas += 1
+                logger.warning(
+                    f"⚡ Circuit breaker abierto tras {self.fallos_consecutivos} fallos; "
+                    f"se falla rápido durante {self.enfriamiento:.0f}s"
+                )
+            self.estado = "abierto"
+            self.abierto_desde = time.monotonic()
+
+
+class PoliticaResiliencia:
+    """
+    Ejecuta una llamada asíncrona con timeout, reintentos y circuit breaker
+
+    La llamada recibe el timeout del intento como argumento para aplicarlo
+    solo a la operación remota (no a la espera en colas locales).
+    """
+
+    def __init__(
+        self,
+        timeout_intento: float,
+        presupuesto_total: float,
+        max_intentos: int,
+        backoff_base: float,
+        backoff_maximo: float,
+        circuito: CircuitBreaker
+    ):
+        self.timeout_intento = timeout_intento
+        self.presupuesto_total = presupuesto_total
+        self.max_intentos = max_intentos
+        self.backoff_base = backoff_base
+        self.backoff_maximo = backoff_maximo
+        self.circuito = circuito
+        self.contadores = {
+            "llamadas": 0,
+            "intentos": 0,
+            "reintentos": 0,
+            "exitos": 0,
+            "timeouts": 0,
+            "errores_reintentables": 0,
+            "errores_no_reintentables": 0,
+            "rechazadas_por_circuito": 0,
+            "presupuesto_agotado": 0,
+        }
+
+    def _espera_backoff(self, intento: int, error: BaseException) -> float:
+        """Backoff exponencial con jitter completo; Retry-After tiene prioridad"""
+        retry_after = obtener_retry_after(error)
+        if retry_after is not None:
+            return retry_after
+        limite = min(self.backoff_maximo, self.backoff_base * (2 ** (intento - 1)))
+        return random.uniform(0, limite)
+
+    def registrar_fallo_externo(self, error: BaseException) -> None:
+        """Registra un fallo ocurrido fuera de ejecutar (p. ej. a mitad de un stream)"""
+        if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+            self.contadores["timeouts"] += 1
+        if es_reintentable(error):
+            self.contadores["errores_reintentables"] += 1
+            self.circuito.registrar_fallo()
+        else:
+            self.contadores["errores_no_reintentables"] += 1
+            if getattr(error, "code", None) is not None:
+                # El servicio respondió (el error es de la solicitud): no cuenta como caída
+                self.circuito.registrar_exito()
+            else:
+                # Error local (p. ej. cuota del cliente): no dice nada del servicio
+                self.circuito.liberar_prueba()
+
+    async def ejecutar(self, llamada: Callable[[float], Awaitable[Any]]) -> Any:
+        """
+        Ejecuta `llamada(timeout)` aplicando la política
+
+        Raises:
+            CircuitoAbiertoError: si el circuito está abierto
+            La última excepción del servicio si se agotan intentos o presupuesto
+        """
+        self.contadores["llamadas"] += 1
+        inicio = time.monotonic()
+        intento = 0
+
+        while True:
+            if not self.circuito.permitir():
+                self.contadores["rechazadas_por_circuito"] += 1
+                raise CircuitoAbiertoError(
+                    "Gemini no está disponible temporalmente (circuit breaker abierto)"
+                )
+
+            intento += 1
+            self.contadores["intentos"] += 1
+            restante = self.presupuesto_total - (time.monotonic() - inicio)
+            timeout = min(self.timeout_intento, max(restante, 0.0))
+
+            try:
+                resultado = await llamada(timeout)
+            except asyncio.CancelledError:
+                # La cancelación no es culpa del servicio: liberar la prueba del circuito
+                self.circuito.liberar_prueba()
+                raise
+            except Exception as e:
+                self.registrar_fallo_externo(e)
+                if not es_reintentable(e):
+                    raise
+
+                if intento >= self.max_intentos:
+                    logger.error(f"❌ Gemini falló tras {intento} intentos: {e}")
+                    raise
+
+                espera = self._espera_backoff(intento, e)
+                restante = self.presupuesto_total - (time.monotonic() - inicio)
+                if espera >= restante:
+                    self.contadores["presupuesto_agotado"] += 1
+                    logger.error(f"❌ Sin presupuesto de tiempo para reintentar ({restante:.1f}s restantes)")
+                    raise
+
+                self.contadores["reintentos"] += 1
+                logger.warning(
+                    f"🔁 Intento {intento}/{self.max_intentos} falló ({type(e).__name__}: {e}); "
+                    f"reintentando en {espera:.1f}s"
+                )
+                await asyncio.sleep(espera)
+                continue
+
+            self.circuito.registrar_exito()
+            self.contadores["exitos"] += 1
+            return resultado
+
+    def estado(self) -> Dict:
+        """Contadores y estado del circuito (para /health)"""
+        return {
+            **self.contadores,
+            "circuito": self.circuito.estado,
+            "aperturas_circuito": self.circuito.aperturas,
+            "fallos_consecutivos": self.circuito.fallos_consecutivos,
+        }
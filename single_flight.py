@@ -0,0 +1,105 @@
+"""
+Coalescencia de llamadas concurrentes idénticas (single-flight)
+Las llamadas con la misma clave que llegan mientras otra está en curso esperan
+la misma tarea compartida en lugar de repetir el trabajo
+"""
+
+import asyncio
+import copy
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class _Vuelo:
+    """Tarea compartida, número de llamadas que la esperan y datos que el líder comparte"""
+
+    def __init__(self, tarea: "asyncio.Future", datos: Any = None):
+        self.tarea = tarea
+        self.esperando = 0
+        self.datos = datos
+
+
+class SingleFlight:
+    """
+    Ejecuta una sola vez cada clave en curso y reparte el resultado
+
+    La tarea compartida solo se cancela cuando todas las llamadas que la
+    esperaban se fueron (p. ej. todos los clientes cerraron la conexión).
+    Cada llamada recibe su propia copia del resultado, porque los endpoints
+    modifican el plan (plan_id, usuario) antes de guardarlo.
+    """
+
+    def __init__(self):
+        self._vuelos: Dict[str, _Vuelo] = {}
+        self.lideres = 0
+        self.coalescidas = 0
+        self.canceladas = 0
+
+    def en_curso(self, clave: str) -> bool:
+        return clave in self._vuelos
+
+    def unirse(self, clave: str, fabrica: Callable[[], Awaitable[Any]], datos: Any = None) -> _Vuelo:
+        """
+        Se suma a la tarea en curso para la clave o la inicia, sin ceder el control
+
+        La tarea queda registrada y contada como esperada antes de volver, así
+        que una llamada idéntica que llegue después siempre se une a ella.
+        Quien se une debe llamar a soltar() al terminar de esperarla.
+
+        Args:
+            clave: Identificador de la llamada (hash de las entradas)
+            fabrica: Función que crea la corrutina a ejecutar si no hay tarea en curso
+            datos: Lo que el líder comparte con quienes se unen (solo si inicia la tarea)
+        """
+        vuelo = self._vuelos.get(clave)
+        if vuelo is None:
+            vuelo = _Vuelo(asyncio.ensure_future(fabrica()), datos)
+            self._vuelos[clave] = vuelo
+            vuelo.tarea.add_done_callback(lambda _: self._retirar(clave, vuelo))
+            self.lideres += 1
+        else:
+            self.coalescidas += 1
+            logger.info(f"🔗 Llamada coalescida con una generación en curso ({clave[:12]})")
+        vuelo.esperando += 1
+        return vuelo
+
+    def soltar(self, clave: str, vuelo: _Vuelo) -> None:
+        """Deja de esperar la tarea; la cancela si nadie más la espera"""
+        vuelo.esperando -= 1
+        if vuelo.esperando == 0 and not vuelo.tarea.done():
+            logger.info(f"🛑 Generación cancelada: ya nadie la espera ({clave[:12]})")
+            vuelo.tarea.cancel()
+            self.canceladas += 1
+            self._retirar(clave, vuelo)
+
+    async def ejecutar(self, clave: str, fabrica: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Espera el resultado de la tarea en curso para la clave o inicia una nueva
+
+        Args:
+            clave: Identificador de la llamada (hash de las entradas)
+            fabrica: Función que crea la corrutina a ejecutar si no hay tarea en curso
+        """
+        vuelo = self.unirse(clave, fabrica)
+        try:
+            # shield: cancelar a una llamada no cancela la tarea compartida
+            resultado = await asyncio.shield(vuelo.tarea)
+        finally:
+            self.soltar(clave, vuelo)
+
+        return copy.deepcopy(resultado)
+
+    def _retirar(self, clave: str, vuelo: _Vuelo) -> None:
+        if self._vuelos.get(clave) is vuelo:
+            del self._vuelos[clave]
+
+    def estado(self) -> Dict:
+        """Métricas de coalescencia (para /health)"""
+        return {
+            "en_curso": len(self._vuelos),
+            "lideres": self.lideres,
+            "coalescidas": self.coalescidas,
+            "canceladas": self.canceladas,
+        }
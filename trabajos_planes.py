@@ -0,0 +1,452 @@
+"""
+Trabajos de generación de planes en segundo plano
+La solicitud solo guarda las entradas y responde con el ID del trabajo; los
+trabajadores ejecutan la generación y registran etapa y avance en un almacén
+local durable (SQLite más los archivos de entrada en disco), así un trabajo
+sobrevive al reinicio del proceso que lo estaba ejecutando
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Carpeta del almacén: trabajos.sqlite3 y una subcarpeta de entradas por trabajo
+TRABAJOS_DIR = os.getenv("TRABAJOS_DIR", "cache/trabajos")
+# Trabajadores de este proceso (0 = solo recibe trabajos, otro proceso los ejecuta)
+TRABAJOS_TRABAJADORES = int(os.getenv("TRABAJOS_TRABAJADORES", "2"))
+# Cada trabajador en curso renueva su latido; sin latido durante
+# TRABAJOS_VENCIMIENTO_SEGUNDOS el trabajo se considera abandonado y vuelve a la cola
+TRABAJOS_LATIDO_SEGUNDOS = float(os.getenv("TRABAJOS_LATIDO_SEGUNDOS", "10"))
+TRABAJOS_VENCIMIENTO_SEGUNDOS = float(os.getenv("TRABAJOS_VENCIMIENTO_SEGUNDOS", "60"))
+# Ejecuciones interrumpidas permitidas antes de marcar el trabajo como error
+TRABAJOS_MAX_INTENTOS = int(os.getenv("TRABAJOS_MAX_INTENTOS", "3"))
+# Tiempo que se conserva un trabajo terminado
+TRABAJOS_RETENCION_SEGUNDOS = int(os.getenv("TRABAJOS_RETENCION_SEGUNDOS", str(24 * 3600)))
+# Con la cola vacía, cada cuánto se revisa el almacén (trabajos de otros procesos)
+TRABAJOS_SONDEO_SEGUNDOS = float(os.getenv("TRABAJOS_SONDEO_SEGUNDOS", "2"))
+
+EN_COLA = "en_cola"
+EN_PROCESO = "en_proceso"
+COMPLETADO = "completado"
+ERROR = "error"
+ACTIVOS = (EN_COLA, EN_PROCESO)
+
+_ESQUEMA_SQL = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id TEXT PRIMARY KEY,
+    usuario TEXT NOT NULL,
+    huella TEXT NOT NULL,
+    parametros TEXT NOT NULL,
+    estado TEXT NOT NULL,
+    etapa TEXT NOT NULL,
+    progreso INTEGER NOT NULL DEFAULT 0,
+    detalle TEXT,
+    resultado TEXT,
+    error TEXT,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    propietario TEXT,
+    latido REAL,
+    creado REAL NOT NULL,
+    actualizado REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS trabajos_cola ON trabajos (estado, creado);
+CREATE INDEX IF NOT EXISTS trabajos_huella ON trabajos (usuario, huella);
+"""
+
+# Avance que la función del trabajo reporta: (etapa, progreso 0-100, detalle)
+Avance = Callable[..., Awaitable[None]]
+
+
+def huella_entradas(parametros: Dict, archivos: Dict[str, bytes]) -> str:
+    """Hash de parámetros y archivos: la misma solicitud repetida da la misma huella"""
+    h = hashlib.sha256(json.dumps(parametros, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    for clave in sorted(archivos):
+        h.update(clave.encode("utf-8"))
+        h.update(hashlib.sha256(archivos[clave]).digest())
+    return h.hexdigest()
+
+
+class AlmacenTrabajos:
+    """
+    Trabajos en SQLite y sus archivos de entrada en disco
+
+    Cada operación abre su propia conexión (se llama desde hilos con
+    asyncio.to_thread) y las que eligen un trabajo usan BEGIN IMMEDIATE,
+    así varios procesos pueden compartir el mismo archivo sin tomar dos
+    veces el mismo trabajo. Solo el propietario de un trabajo en proceso
+    puede actualizarlo.
+    """
+
+    def __init__(
+        self,
+        directorio: str = TRABAJOS_DIR,
+        vencimiento_segundos: float = TRABAJOS_VENCIMIENTO_SEGUNDOS,
+        max_intentos: int = TRABAJOS_MAX_INTENTOS,
+        retencion_segundos: float = TRABAJOS_RETENCION_SEGUNDOS
+    ):
+        self.directorio = Path(directorio)
+        self.ruta_db = self.directorio / "trabajos.sqlite3"
+        self.vencimiento_segundos = vencimiento_segundos
+        self.max_intentos = max_intentos
+        self.retencion_segundos = retencion_segundos
+        self._inicializado = False
+
+    def _conectar(self) -> sqlite3.Connection:
+        if not self._inicializado:
+            self.directorio.mkdir(parents=True, exist_ok=True)
+        conexion = sqlite3.connect(self.ruta_db, timeout=30, isolation_level=None)
+        conexion.row_factory = sqlite3.Row
+        if not self._inicializado:
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.executescript(_ESQUEMA_SQL)
+            self._inicializado = True
+        return conexion
+
+    def _entradas(self, trabajo_id: str) -> Path:
+        return self.directorio / "entradas" / trabajo_id
+
+    @staticmethod
+    def _a_dict(fila: sqlite3.Row) -> Dict:
+        trabajo = dict(fila)
+        for clave in ("parametros", "resultado", "detalle"):
+            if trabajo.get(clave):
+                trabajo[clave] = json.loads(trabajo[clave])
+        return trabajo
+
+    # ------------------------------------------------------------------
+    # Alta y consulta
+    # ------------------------------------------------------------------
+    def crear(self, usuario: str, parametros: Dict, archivos: Dict[str, bytes]) -> Tuple[Dict, bool]:
+        """
+        Guarda las entradas y encola el trabajo
+
+        Si el usuario ya tiene un trabajo activo con las mismas entradas (un
+        reintento del cliente), devuelve ese en lugar de crear otro.
+
+        Returns:
+            (trabajo, nuevo)
+        """
+        huella = huella_entradas(parametros, archivos)
+        self.purgar()
+        conexion = self._conectar()
+        try:
+            existente = conexion.execute(
+                "SELECT * FROM trabajos WHERE usuario = ? AND huella = ? AND estado IN (?, ?) "
+                "ORDER BY creado DESC LIMIT 1",
+                (usuario, huella, *ACTIVOS)
+            ).fetchone()
+            if existente is not None:
+                return self._a_dict(existente), False
+
+            trabajo_id = f"trabajo_{uuid.uuid4().hex[:16]}"
+            carpeta = self._entradas(trabajo_id)
+            carpeta.mkdir(parents=True, exist_ok=True)
+            for clave, contenido in archivos.items():
+                temporal = carpeta / f"{clave}.tmp"
+                with open(temporal, "wb") as f:
+                    f.write(contenido)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temporal, carpeta / clave)
+
+            ahora = time.time()
+            conexion.execute(
+                "INSERT INTO trabajos (id, usuario, huella, parametros, estado, etapa, creado, actualizado) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (trabajo_id, usuario, huella, json.dumps(parametros, ensure_ascii=False),
+                 EN_COLA, EN_COLA, ahora, ahora)
+            )
+            return self.obtener(trabajo_id, conexion=conexion), True
+        finally:
+            conexion.close()
+
+    def obtener(self, trabajo_id: str, usuario: Optional[str] = None,
+                conexion: Optional[sqlite3.Connection] = None) -> Optional[Dict]:
+        """Trabajo por ID (None si no existe o, con usuario, si es de otro)"""
+        propia = conexion is None
+        conexion = conexion or self._conectar()
+        try:
+            fila = conexion.execute("SELECT * FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+        finally:
+            if propia:
+                conexion.close()
+        if fila is None or (usuario is not None and fila["usuario"] != usuario):
+            return None
+        return self._a_dict(fila)
+
+    def leer_archivos(self, trabajo_id: str) -> Dict[str, bytes]:
+        carpeta = self._entradas(trabajo_id)
+        if not carpeta.exists():
+            return {}
+        return {ruta.name: ruta.read_bytes() for ruta in carpeta.iterdir() if ruta.suffix != ".tmp"}
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida de un trabajo
+    # ------------------------------------------------------------------
+    def tomar(self, propietario: str) -> Optional[Dict]:
+        """
+        Asigna al propietario el trabajo en cola más antiguo
+
+        Antes devuelve a la cola los trabajos en proceso cuyo latido venció
+        (su proceso se reinició o murió), o los marca como error si ya se
+        interrumpieron max_intentos veces. `intentos` cuenta solo esas
+        interrupciones: tomar un trabajo o liberarlo al apagar no lo cambia.
+        """
+        ahora = time.time()
+        conexion = self._conectar()
+        try:
+            conexion.execute("BEGIN IMMEDIATE")
+            vencido = ahora - self.vencimiento_segundos
+            for fila in conexion.execute(
+                "SELECT id, intentos FROM trabajos WHERE estado = ? AND latido < ?", (EN_PROCESO, vencido)
+            ).fetchall():
+                interrupciones = fila["intentos"] + 1
+                if interrupciones >= self.max_intentos:
+                    conexion.execute(
+                        "UPDATE trabajos SET estado = ?, error = ?, intentos = ?, propietario = NULL, "
+                        "actualizado = ? WHERE id = ?",
+                        (ERROR, f"El trabajo se interrumpió {interrupciones} veces", interrupciones, ahora, fila["id"])
+                    )
+                    logger.error(f"❌ Trabajo {fila['id']} abandonado tras {interrupciones} interrupciones")
+                else:
+                    conexion.execute(
+                        "UPDATE trabajos SET estado = ?, etapa = ?, intentos = ?, propietario = NULL, "
+                        "actualizado = ? WHERE id = ?",
+                        (EN_COLA, EN_COLA, interrupciones, ahora, fila["id"])
+                    )
+                    logger.warning(f"♻️ Trabajo {fila['id']} sin latido; vuelve a la cola")
+
+            fila = conexion.execute(
+                "SELECT id FROM trabajos WHERE estado = ? ORDER BY creado LIMIT 1", (EN_COLA,)
+            ).fetchone()
+            if fila is not None:
+                conexion.execute(
+                    "UPDATE trabajos SET estado = ?, propietario = ?, latido = ?, actualizado = ? WHERE id = ?",
+                    (EN_PROCESO, propietario, ahora, ahora, fila["id"])
+                )
+            conexion.execute("COMMIT")
+            return self.obtener(fila["id"], conexion=conexion) if fila is not None else None
+        except Exception:
+            if conexion.in_transaction:
+                conexion.execute("ROLLBACK")
+            raise
+        finally:
+            conexion.close()
+
+    def _actualizar_propio(self, trabajo_id: str, propietario: str, campos: Dict) -> bool:
+        campos = {**campos, "actualizado": time.time()}
+        asignaciones = ", ".join(f"{c} = ?" for c in campos)
+        conexion = self._conectar()
+        try:
+            cursor = conexion.execute(
+                f"UPDATE trabajos SET {asignaciones} WHERE id = ? AND propietario = ? AND estado = ?",
+                (*campos.values(), trabajo_id, propietario, EN_PROCESO)
+            )
+            return cursor.rowcount == 1
+        finally:
+            conexion.close()
+
+    def avanzar(self, trabajo_id: str, propietario: str, etapa: str, progreso: int,
+                detalle: Optional[Dict] = None) -> bool:
+        """Registra etapa y avance (también renueva el latido); False si el trabajo ya no es suyo"""
+        return self._actualizar_propio(trabajo_id, propietario, {
+            "etapa": etapa, "progreso": progreso, "latido": time.time(),
+            "detalle": json.dumps(detalle, ensure_ascii=False) if detalle else None,
+        })
+
+    def latido(self, trabajo_id: str, propietario: str) -> bool:
+        return self._actualizar_propio(trabajo_id, propietario, {"latido": time.time()})
+
+    def terminar(self, trabajo_id: str, propietario: str, resultado: Dict) -> bool:
+        """Guarda el resultado ({'success': ...}) y borra los archivos de entrada"""
+        if resultado.get("success"):
+            campos = {"estado": COMPLETADO, "etapa": "terminado", "progreso": 100,
+                      "resultado": json.dumps(resultado, ensure_ascii=False)}
+        else:
+            campos = {"estado": ERROR, "error": resultado.get("error", "Error desconocido")}
+        if not self._actualizar_propio(trabajo_id, propietario, {**campos, "propietario": None}):
+            return False
+        shutil.rmtree(self._entradas(trabajo_id), ignore_errors=True)
+        return True
+
+    def liberar(self, trabajo_id: str, propietario: str) -> bool:
+        """Devuelve a la cola un trabajo interrumpido a propósito (apagado del servidor)"""
+        return self._actualizar_propio(trabajo_id, propietario, {
+            "estado": EN_COLA, "etapa": EN_COLA, "propietario": None
+        })
+
+    def purgar(self) -> int:
+        """Borra los trabajos terminados más antiguos que la retención"""
+        limite = time.time() - self.retencion_segundos
+        conexion = self._conectar()
+        try:
+            ids = [f["id"] for f in conexion.execute(
+                "SELECT id FROM trabajos WHERE estado IN (?, ?) AND actualizado < ?", (COMPLETADO, ERROR, limite)
+            ).fetchall()]
+            conexion.executemany("DELETE FROM trabajos WHERE id = ?", [(i,) for i in ids])
+        finally:
+            conexion.close()
+        for trabajo_id in ids:
+            shutil.rmtree(self._entradas(trabajo_id), ignore_errors=True)
+        return len(ids)
+
+    def estado(self) -> Dict:
+        """Trabajos por estado (para /health)"""
+        conexion = self._conectar()
+        try:
+            conteo = dict(conexion.execute("SELECT estado, COUNT(*) FROM trabajos GROUP BY estado").fetchall())
+        finally:
+            conexion.close()
+        return {estado: conteo.get(estado, 0) for estado in (EN_COLA, EN_PROCESO, COMPLETADO, ERROR)}
+
+
+def resumen_trabajo(trabajo: Dict) -> Dict:
+    """Estado de un trabajo para la API (sin usuario, huella ni propietario)"""
+    return {
+        "trabajo_id": trabajo["id"],
+        "estado": trabajo["estado"],
+        "etapa": trabajo["etapa"],
+        "progreso": trabajo["progreso"],
+        "detalle": trabajo.get("detalle"),
+        "intentos": trabajo["intentos"],
+        "creado": trabajo["creado"],
+        "actualizado": trabajo["actualizado"],
+        "resultado": trabajo.get("resultado"),
+        "error": trabajo.get("error"),
+    }
+
+
+class ColaTrabajos:
+    """
+    Trabajadores asíncronos que toman trabajos del almacén y los ejecutan
+
+    `procesar(trabajo, archivos, avance)` ejecuta el trabajo y devuelve
+    {'success': True, ...} o {'success': False, 'error'}; con avance(etapa,
+    progreso, detalle) registra por dónde va. Mientras corre, el trabajador
+    renueva el latido cada TRABAJOS_LATIDO_SEGUNDOS; si pierde el trabajo
+    (otro proceso lo dio por abandonado) lo cancela.
+    """
+
+    def __init__(
+        self,
+        almacen: AlmacenTrabajos,
+        trabajadores: int = TRABAJOS_TRABAJADORES,
+        latido_segundos: float = TRABAJOS_LATIDO_SEGUNDOS,
+        sondeo_segundos: float = TRABAJOS_SONDEO_SEGUNDOS
+    ):
+        self.almacen = almacen
+        self.trabajadores = trabajadores
+        self.latido_segundos = latido_segundos
+        self.sondeo_segundos = sondeo_segundos
+        self._prefijo = f"{socket.gethostname()}-{os.getpid()}"
+        self._tareas: List[asyncio.Task] = []
+        self._aviso: Optional[asyncio.Event] = None
+        self.completados = 0
+        self.fallidos = 0
+
+    def iniciar(self, procesar: Callable[[Dict, Dict[str, bytes], Avance], Awaitable[Dict]]) -> None:
+        """Crea los trabajadores en el event loop actual (lifespan del servidor)"""
+        if self.trabajadores <= 0 or self._tareas:
+            return
+        self._aviso = asyncio.Event()
+        self._tareas = [
+            asyncio.create_task(self._trabajador(f"{self._prefijo}-{n}", procesar))
+            for n in range(self.trabajadores)
+        ]
+        logger.info(f"👷 {self.trabajadores} trabajadores de generación ({self.almacen.ruta_db})")
+
+    async def detener(self) -> None:
+        """Cancela los trabajadores; sus trabajos en curso vuelven a la cola"""
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+
+    def avisar(self) -> None:
+        """Despierta a un trabajador en espera (hay un trabajo nuevo)"""
+        if self._aviso is not None:
+            self._aviso.set()
+
+    async def _esperar_aviso(self) -> None:
+        try:
+            await asyncio.wait_for(self._aviso.wait(), timeout=self.sondeo_segundos)
+        except asyncio.TimeoutError:
+            pass
+        self._aviso.clear()
+
+    async def _trabajador(self, propietario: str, procesar) -> None:
+        while True:
+            try:
+                trabajo = await asyncio.to_thread(self.almacen.tomar, propietario)
+            except sqlite3.Error as e:
+                logger.error(f"❌ Almacén de trabajos no disponible: {e}")
+                trabajo = None
+            if trabajo is None:
+                await self._esperar_aviso()
+                continue
+            await self._ejecutar(trabajo, propietario, procesar)
+
+    async def _ejecutar(self, trabajo: Dict, propietario: str, procesar) -> None:
+        trabajo_id = trabajo["id"]
+        logger.info(f"⚙️ Trabajo {trabajo_id} tomado por {propietario} (intento {trabajo['intentos'] + 1})")
+
+        async def avance(etapa: str, progreso: int, detalle: Optional[Dict] = None) -> None:
+            await asyncio.to_thread(self.almacen.avanzar, trabajo_id, propietario, etapa, progreso, detalle)
+
+        archivos = await asyncio.to_thread(self.almacen.leer_archivos, trabajo_id)
+        tarea = asyncio.create_task(procesar(trabajo, archivos, avance))
+        try:
+            while True:
+                hechas, _ = await asyncio.wait({tarea}, timeout=self.latido_segundos)
+                if hechas:
+                    break
+                if not await asyncio.to_thread(self.almacen.latido, trabajo_id, propietario):
+                    logger.warning(f"⚠️ El trabajo {trabajo_id} ya no pertenece a {propietario}; se cancela")
+                    tarea.cancel()
+                    await asyncio.wait({tarea})
+                    return
+        except asyncio.CancelledError:
+            # Se canceló el trabajador (apagado del servidor): el trabajo
+            # vuelve a la cola para otro proceso
+            tarea.cancel()
+            await asyncio.wait({tarea})
+            await asyncio.to_thread(self.almacen.liberar, trabajo_id, propietario)
+            logger.info(f"⏸️ Trabajo {trabajo_id} devuelto a la cola")
+            raise
+
+        try:
+            resultado = tarea.result()
+        except asyncio.CancelledError:
+            # Cancelación interna de la generación, no del trabajador
+            logger.error(f"❌ Trabajo {trabajo_id}: la generación se canceló")
+            resultado = {'success': False, 'error': 'La generación se canceló'}
+        except Exception as e:
+            logger.error(f"❌ Trabajo {trabajo_id}: {e}", exc_info=True)
+            resultado = {'success': False, 'error': f'Error inesperado: {str(e)}'}
+
+        if await asyncio.to_thread(self.almacen.terminar, trabajo_id, propietario, resultado):
+            if resultado.get('success'):
+                self.completados += 1
+            else:
+                self.fallidos += 1
+            logger.info(f"{'✅' if resultado.get('success') else '❌'} Trabajo {trabajo_id} terminado")
+
+    def estado(self) -> Dict:
+        """Métricas de los trabajos (para /health)"""
+        return {
+            "trabajadores": len(self._tareas),
+            "completados": self.completados,
+            "fallidos": self.fallidos,
+            **self.almacen.estado(),
+        }